@@ -6,24 +6,69 @@ import qrcode
 from io import BytesIO
 import base64
 from datetime import datetime, date, timedelta
+from functools import lru_cache
+import hashlib
 import json
+import os
 import secrets
 
+import qr_cache
+import qr_tokens
+
 
 # ──────────────────────────────────────────────
 #  QR Code Generation
 # ──────────────────────────────────────────────
 
-def generate_qr_code(data, size=10, add_logo=False):
-    """
-    Generate QR code for appointment check-in.
-    Returns base64-encoded image string.
-    
-    Args:
-        data: QR code data string
-        size: Box size for QR code
-        add_logo: If True, adds favicon logo in center
-    """
+LOGO_PATH = os.path.join(os.path.dirname(__file__), 'static', 'favicon.ico')
+LOGO_SCALE = 0.12   # Logo width as a share of the QR width (small for scanner compatibility)
+LOGO_PADDING = 4    # White padding around the logo
+
+
+@lru_cache(maxsize=1)
+def _logo_source():
+    """(decoded favicon, content fingerprint), or (None, None) if it cannot be read."""
+    if not os.path.exists(LOGO_PATH):
+        return None, None
+    try:
+        from PIL import Image
+        with open(LOGO_PATH, 'rb') as fh:
+            raw = fh.read()
+        logo = Image.open(BytesIO(raw))
+        logo.load()
+        return logo, hashlib.sha256(raw).hexdigest()[:12]
+    except Exception as e:
+        print(f"Warning: Could not load QR logo: {e}")
+        return None, None
+
+
+@lru_cache(maxsize=16)
+def _logo_tile(logo_size):
+    """The logo resized to ``logo_size`` on its padded white box, built once per size."""
+    from PIL import Image
+
+    logo, _ = _logo_source()
+    # Resize logo (handle different Pillow versions)
+    try:
+        logo = logo.resize((logo_size, logo_size), Image.Resampling.LANCZOS)
+    except AttributeError:
+        logo = logo.resize((logo_size, logo_size), Image.LANCZOS)
+
+    # Flatten onto white if it has transparency
+    if logo.mode == 'RGBA':
+        flat = Image.new('RGB', (logo_size, logo_size), 'white')
+        flat.paste(logo, (0, 0), logo)
+        logo = flat
+    elif logo.mode != 'RGB':
+        logo = logo.convert('RGB')
+
+    bg_size = logo_size + LOGO_PADDING * 2
+    tile = Image.new('RGB', (bg_size, bg_size), 'white')
+    tile.paste(logo, (LOGO_PADDING, LOGO_PADDING))
+    return tile
+
+
+def _make_qr(data, size):
     qr = qrcode.QRCode(
         version=1,
         error_correction=qrcode.constants.ERROR_CORRECT_H,  # High error correction for logo overlay
@@ -32,79 +77,124 @@ def generate_qr_code(data, size=10, add_logo=False):
     )
     qr.add_data(data)
     qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-    
+    return qr
+
+
+def _render_qr_png(data, size, add_logo):
+    img = _make_qr(data, size).make_image(fill_color="black", back_color="white")
+
     # Add logo in center if requested
     if add_logo:
+        img = img.convert('RGB')
         try:
-            from PIL import Image, ImageDraw
-            import os
-            
-            # Get favicon path
-            logo_path = os.path.join(os.path.dirname(__file__), 'static', 'favicon.ico')
-            
-            if os.path.exists(logo_path):
-                logo = Image.open(logo_path)
-                
-                # Calculate logo size (12% of QR code - smaller for better scanner compatibility)
-                qr_width, qr_height = img.size
-                logo_size = int(qr_width * 0.12)
-                padding = 4  # White padding around logo
-                
-                # Resize logo (handle different Pillow versions)
-                try:
-                    logo = logo.resize((logo_size, logo_size), Image.Resampling.LANCZOS)
-                except AttributeError:
-                    logo = logo.resize((logo_size, logo_size), Image.LANCZOS)
-                
-                # Convert logo to RGB if needed (in case it's RGBA)
-                if logo.mode != 'RGB':
-                    logo_bg = Image.new('RGB', (logo_size, logo_size), 'white')
-                    if logo.mode == 'RGBA':
-                        logo_bg.paste(logo, (0, 0), logo)
-                    else:
-                        logo = logo.convert('RGB')
-                        logo_bg = logo
-                    logo = logo_bg
-                
-                # Create white background box (slightly larger than logo for padding)
-                bg_size = logo_size + padding * 2
-                logo_bg_box = Image.new('RGB', (bg_size, bg_size), 'white')
-                logo_bg_box.paste(logo, (padding, padding))
-                
-                # Calculate position (center)
-                logo_pos = ((qr_width - bg_size) // 2, (qr_height - bg_size) // 2)
-                
-                # Paste logo with white background
-                img.paste(logo_bg_box, logo_pos)
+            qr_width, qr_height = img.size
+            tile = _logo_tile(int(qr_width * LOGO_SCALE))
+            img.paste(tile, ((qr_width - tile.width) // 2, (qr_height - tile.height) // 2))
         except Exception as e:
             # If logo fails, continue without it
             print(f"Warning: Could not add logo to QR code: {e}")
-    
-    # Convert to base64
+    # Without a logo the image stays 1-bit, which is about 2.5x smaller than RGB
+
     buffer = BytesIO()
-    img.save(buffer, format='PNG')
-    buffer.seek(0)
-    img_base64 = base64.b64encode(buffer.read()).decode()
+    img.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def _render_qr_svg(data, size):
+    """SVG with one path segment per horizontal run of dark modules."""
+    matrix = _make_qr(data, size).get_matrix()  # Includes the quiet-zone border
+    modules = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < modules:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < modules and row[x]:
+                x += 1
+            runs.append(f'M{start} {y}h{x - start}v1h-{x - start}z')
+    pixels = modules * size
+    return (
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{pixels}" height="{pixels}" '
+        f'viewBox="0 0 {modules} {modules}" shape-rendering="crispEdges">'
+        f'<rect width="{modules}" height="{modules}" fill="#fff"/>'
+        f'<path d="{"".join(runs)}" fill="#000"/></svg>'
+    ).encode()
+
+
+def render_qr_png(data, size=10, add_logo=False):
+    """PNG bytes of the QR code for ``data``, served from the QR image cache when rendered before."""
+    logo = _logo_source()[1] if add_logo else None  # No readable logo renders (and caches) plain
+    return qr_cache.cache.get_or_render(
+        qr_cache.key(data, size, logo),
+        lambda: _render_qr_png(data, size, logo is not None)
+    )
+
+
+def render_qr_svg(data, size=10):
+    """SVG bytes of the (logo-free) QR code for ``data``, cached like ``render_qr_png``."""
+    return qr_cache.cache.get_or_render(
+        qr_cache.key(data, size, fmt='svg'),
+        lambda: _render_qr_svg(data, size)
+    )
+
+
+QR_IMAGE_TYPES = {'png': 'image/png', 'svg': 'image/svg+xml'}
+
+
+def qr_image_key(data):
+    """
+    URL key for the image of ``data``: changes whenever the payload does, so
+    image URLs can be cached as immutable without exposing the token itself.
+    """
+    return hashlib.sha256(data.encode()).hexdigest()[:24]
+
+
+def qr_image_response(data, fmt):
+    """Flask response serving the check-in QR for ``data`` as ``fmt`` ('png' or 'svg')."""
+    from flask import Response
+
+    body = render_qr_png(data) if fmt == 'png' else render_qr_svg(data)
+    response = Response(body, mimetype=QR_IMAGE_TYPES[fmt])
+    # The URL carries the payload hash, so its content never changes; private: it is a check-in credential
+    response.cache_control.private = True
+    response.cache_control.max_age = 31536000
+    response.cache_control.immutable = True
+    return response
+
+
+def generate_qr_code(data, size=10, add_logo=False):
+    """
+    Generate QR code for appointment check-in.
+    Returns base64-encoded image string.
     
+    Args:
+        data: QR code data string
+        size: Box size for QR code
+        add_logo: If True, adds favicon logo in center
+    """
+    img_base64 = base64.b64encode(render_qr_png(data, size, add_logo)).decode()
     return f'data:image/png;base64,{img_base64}'
 
 
+def appointment_qr_payload(appointment_id):
+    """Signed token encoded in an appointment's check-in QR."""
+    return qr_tokens.issue(qr_tokens.APPOINTMENT, appointment_id)
+
+
+def reservation_qr_payload(reservation_id):
+    """Signed token encoded in a medicine reservation's pickup QR."""
+    return qr_tokens.issue(qr_tokens.RESERVATION, reservation_id)
+
+
 def generate_appointment_qr(appointment_id):
     """Generate QR code for appointment check-in with ISUFST logo."""
-    # Create secure token
+    # Stored on the extension row; only legacy JSON QR codes are checked against it
     token = secrets.token_urlsafe(32)
     
-    # QR data includes appointment ID and token (30 days expiration for consistency)
-    qr_data = json.dumps({
-        'type': 'appointment_checkin',
-        'appointment_id': appointment_id,
-        'token': token,
-        'expires': (datetime.now() + timedelta(days=30)).isoformat()
-    })
-    
-    qr_image = generate_qr_code(qr_data, add_logo=True)  # Add branded logo
+    qr_image = generate_qr_code(appointment_qr_payload(appointment_id), add_logo=True)  # Add branded logo
     
     return qr_image, token
 
@@ -113,14 +203,7 @@ def generate_reservation_qr(reservation_id):
     """Generate QR code for medicine reservation check-in."""
     token = secrets.token_urlsafe(32)
 
-    qr_data = json.dumps({
-        'type': 'medicine_reservation',
-        'reservation_id': reservation_id,
-        'token': token,
-        'expires': (datetime.now() + timedelta(days=30)).isoformat()
-    })
-
-    qr_image = generate_qr_code(qr_data, add_logo=True)
+    qr_image = generate_qr_code(reservation_qr_payload(reservation_id), add_logo=True)
 
     return qr_image, token
 
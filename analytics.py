@@ -2,15 +2,18 @@
 Analytics & Reporting Dashboard for ISUFST CareHub.
 Comprehensive analytics for administration and decision-making.
 """
-from flask import Blueprint, render_template, jsonify, request
+from flask import Blueprint, render_template, jsonify, request, send_file, current_app
 from flask_login import login_required
 from rbac import require_permission, Permission
-from models import db, Appointment, ClinicVisit, Inventory, MedicineReservation, User, Queue, StudentProfile
+from models import db, Appointment, ClinicVisit, Inventory, MedicineReservation, User, Queue, StudentProfile, local_today
 from models_extended import VisitFeedback, AppointmentExtended
 from datetime import datetime, timedelta, date, timezone
 from sqlalchemy import func, desc, extract
 from collections import defaultdict
+import io
 import json
+import reorder
+import stock_ledger
 
 analytics = Blueprint('analytics', __name__, url_prefix='/analytics')
 
@@ -28,7 +31,7 @@ def index():
 @require_permission(Permission.VIEW_ANALYTICS)
 def overview():
     """Get overview statistics."""
-    today = date.today()
+    today = local_today()
     this_month_start = today.replace(day=1)
     
     # Today's stats
@@ -47,7 +50,7 @@ def overview():
     ).count()
     
     monthly_visits = ClinicVisit.query.filter(
-        func.date(ClinicVisit.visit_date) >= this_month_start
+        ClinicVisit.visit_day >= this_month_start
     ).count()
     
     # Active reservations
@@ -185,24 +188,38 @@ def student_demographics():
 @login_required
 @require_permission(Permission.VIEW_ANALYTICS)
 def inventory_consumption():
-    """Track medicine consumption patterns."""
+    """Track medicine consumption patterns (units dispensed, from the stock ledger)."""
     days = int(request.args.get('days', 30))
     limit = int(request.args.get('limit', 10))
-    end_date = date.today()
+    end_date = local_today()
     start_date = end_date - timedelta(days=days)
     
-    # Get reservation data as proxy for consumption
-    results = db.session.query(
-        MedicineReservation.medicine_name,
-        func.count(MedicineReservation.id).label('count')
-    ).filter(
-        func.date(MedicineReservation.reserved_at) >= start_date,
-        MedicineReservation.status.in_(['Claimed', 'Ready'])
-    ).group_by(MedicineReservation.medicine_name).order_by(desc('count')).limit(limit).all()
-    
-    return jsonify([
-        {'medicine_name': r[0], 'count': r[1]} for r in results
-    ])
+    results = stock_ledger.consumption(start_date, end_date, limit=limit)
+    stock = reorder.stock_status(name for name, _, _ in results)
+    
+    return jsonify([{
+        'medicine_name': name,
+        'count': units,
+        'dispenses': dispenses,
+        'on_hand': stock.get(name, {}).get('on_hand', 0),
+        'days_remaining': stock.get(name, {}).get('days_remaining'),
+        'reorder_point': stock.get(name, {}).get('reorder_point')
+    } for name, units, dispenses in results])
+
+
+@analytics.route('/api/stock-forecast')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def stock_forecast():
+    """Days of stock remaining per medicine at forecast demand, soonest to run out first."""
+    stock = reorder.stock_status()
+    rows = sorted(
+        ({'medicine_name': name, **entry} for name, entry in stock.items()),
+        key=lambda row: (row['days_remaining'] is None, row['days_remaining'] or 0, row['medicine_name'])
+    )
+    if request.args.get('low') == 'true':
+        rows = [row for row in rows if row['low']]
+    return jsonify(rows)
 
 
 @analytics.route('/api/satisfaction-trend')
@@ -211,16 +228,16 @@ def inventory_consumption():
 def satisfaction_trend():
     """Track satisfaction ratings over time."""
     days = int(request.args.get('days', 30))
-    end_date = date.today()
+    end_date = local_today()
     start_date = end_date - timedelta(days=days)
     
     results = db.session.query(
-        func.date(VisitFeedback.submitted_at).label('date'),
+        VisitFeedback.submitted_day,
         func.avg(VisitFeedback.rating).label('avg_rating'),
         func.count(VisitFeedback.id).label('count')
     ).filter(
-        func.date(VisitFeedback.submitted_at) >= start_date
-    ).group_by('date').order_by('date').all()
+        VisitFeedback.submitted_day >= start_date
+    ).group_by(VisitFeedback.submitted_day).order_by(VisitFeedback.submitted_day).all()
     
     # Fill in missing dates
     date_ratings = {r[0]: float(r[1]) for r in results}
@@ -292,6 +309,145 @@ def no_show_rate():
     })
 
 
+@analytics.route('/api/symptom-clusters')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def symptom_clusters():
+    """Current per-symptom window counts vs. baseline from the outbreak detector."""
+    from outbreak import detector
+    limit = int(request.args.get('limit', 10))
+    return jsonify(detector.snapshot(limit=limit))
+
+
+def _range_args(default_days=30):
+    """Parse ?days= or ?start=&end= into an inclusive local date range."""
+    end = request.args.get('end')
+    start = request.args.get('start')
+    if start and end:
+        return datetime.strptime(start, '%Y-%m-%d').date(), datetime.strptime(end, '%Y-%m-%d').date()
+    days = int(request.args.get('days', default_days))
+    end_date = local_today()
+    return end_date - timedelta(days=days), end_date
+
+
+@analytics.route('/api/wait-times')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def wait_times():
+    """Daily p50/p90 wait and service time, merged from hourly rollups."""
+    from visit_metrics import summarize, describe
+    start_date, end_date = _range_args()
+    by_day = summarize(start_date, end_date, group_by='day')
+    overall = summarize(start_date, end_date)
+
+    labels = []
+    series = defaultdict(list)
+    current = start_date
+    while current <= end_date:
+        labels.append(current.strftime('%b %d'))
+        stats = describe(by_day[current]) if current in by_day else {}
+        for key in ('wait_p50', 'wait_p90', 'service_p50', 'service_p90'):
+            series[key].append(stats.get(key))
+        current += timedelta(days=1)
+
+    return jsonify({
+        'labels': labels,
+        **series,
+        'summary': describe(overall[None]),
+    })
+
+
+@analytics.route('/api/wait-times/by-hour')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def wait_times_by_hour():
+    """p50/p90 wait and service time by local hour of day."""
+    from visit_metrics import summarize, describe
+    start_date, end_date = _range_args()
+    by_hour = summarize(start_date, end_date, group_by='hour',
+                        service_type=request.args.get('service_type'))
+
+    hours = list(range(8, 18))
+    stats = [describe(by_hour[h]) if h in by_hour else {} for h in hours]
+    return jsonify({
+        'labels': [f'{h:02d}:00' for h in hours],
+        'wait_p50': [s.get('wait_p50') for s in stats],
+        'wait_p90': [s.get('wait_p90') for s in stats],
+        'service_p50': [s.get('service_p50') for s in stats],
+        'service_p90': [s.get('service_p90') for s in stats],
+    })
+
+
+@analytics.route('/api/wait-times/by-service')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def wait_times_by_service():
+    """Per-service p50/p90 times and distinct patients served."""
+    from visit_metrics import summarize, describe
+    start_date, end_date = _range_args()
+    by_service = summarize(start_date, end_date, group_by='service_type')
+    return jsonify([
+        {'service_type': service, **describe(group)}
+        for service, group in sorted(by_service.items())
+    ])
+
+
+@analytics.route('/reports')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def monthly_reports():
+    """Status of the monthly report for each of the last twelve closed months."""
+    from models_extended import MonthlyReport
+    from monthly_report import previous_month
+    months = [previous_month()]
+    while len(months) < 12:
+        months.append(previous_month(months[-1]))
+    stored = {
+        r.month: r for r in MonthlyReport.query.with_entities(
+            MonthlyReport.month, MonthlyReport.status, MonthlyReport.generated_at
+        ).filter(MonthlyReport.month >= months[-1])
+    }
+    return jsonify([{
+        'month': m.strftime('%Y-%m'),
+        'label': m.strftime('%B %Y'),
+        'status': stored[m].status if m in stored else 'not_generated',
+        'generated_at': stored[m].generated_at.isoformat() if m in stored and stored[m].generated_at else None,
+    } for m in months])
+
+
+@analytics.route('/reports/<month>.pdf')
+@login_required
+@require_permission(Permission.VIEW_ANALYTICS)
+def monthly_report_pdf(month):
+    """Serve a stored monthly report; schedules the one-time render if missing."""
+    from monthly_report import parse_month, is_closed, request_report
+    try:
+        month_date = parse_month(month)
+    except ValueError:
+        return jsonify({'error': 'Month must be YYYY-MM'}), 400
+    if not is_closed(month_date):
+        return jsonify({'error': 'Reports are available once the month has ended'}), 400
+
+    report = request_report(current_app._get_current_object(), month_date)
+    if report is None or report.status != 'ready':
+        status = report.status if report is not None else 'rendering'
+        return jsonify({'status': status, 'error': report.error if report is not None else None}), 202
+
+    # A closed month's report never changes
+    response = send_file(
+        io.BytesIO(report.pdf_data),
+        mimetype='application/pdf',
+        download_name=f'clinic-report-{month}.pdf',
+        etag=report.pdf_sha256,
+        conditional=True,
+        max_age=31536000,
+    )
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    return response
+
+
 @analytics.route('/export/report')
 @login_required
 @require_permission(Permission.VIEW_ANALYTICS)
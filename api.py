@@ -2,13 +2,16 @@
 REST API v1 for ISUFST CareHub.
 Provides JSON API for mobile app and third-party integrations.
 """
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, jsonify, request, make_response
 from flask_login import login_required, current_user
 from werkzeug.security import check_password_hash
-from models import db, User, Appointment, ClinicVisit, Inventory, MedicineReservation, Notification, Queue
+from models import db, User, Appointment, ClinicVisit, MedicineReservation, Notification, Queue, local_today
 from models_extended import VisitFeedback, HealthCertificate
 from datetime import datetime, date, time
 from functools import wraps
+import medicine_listing
+import reorder
+import stock_holds
 
 api_v1 = Blueprint('api_v1', __name__, url_prefix='/api/v1')
 
@@ -125,7 +128,7 @@ def admin_dashboard_stats():
     
     # Today's patients
     today_patients = ClinicVisit.query.filter(
-        ClinicVisit.visit_date == date.today()
+        ClinicVisit.visit_day == local_today()
     ).count()
     
     # Today's appointments
@@ -133,10 +136,8 @@ def admin_dashboard_stats():
         Appointment.appointment_date == date.today()
     ).count()
     
-    # Low stock
-    low_stock_count = Inventory.query.filter(
-        Inventory.quantity < 10
-    ).count()
+    # Low stock: medicines at or below their reorder point
+    low_stock_count = len(reorder.low_stock_names())
     
     # Pending reservations
     pending_reservations_count = MedicineReservation.query.filter_by(
@@ -337,18 +338,20 @@ def get_medical_records():
 @api_v1.route('/medicines', methods=['GET'])
 @api_required
 def get_medicines():
-    """Get available medicines."""
-    medicines = Inventory.query.filter(
-        Inventory.category == 'Medicine',
-        Inventory.quantity > 0
-    ).all()
-    
-    return jsonify([{
-        'id': med.id,
-        'name': med.name,
-        'quantity': med.quantity,
-        'expiry_date': med.expiry_date.isoformat() if med.expiry_date else None
-    } for med in medicines])
+    """Get available medicines, one entry per catalog medicine."""
+    listing = medicine_listing.current()
+    if request.if_none_match.contains(listing.etag):
+        return medicine_listing.revalidate(make_response('', 304), listing.etag)
+
+    response = jsonify([{
+        'id': med['id'],
+        'name': med['name'],
+        'quantity': med['available'],
+        'expiry_date': med['nearest_expiry'].isoformat(),
+        'expiring_soon': med['expiring_soon'],
+        'batches': med['batches']
+    } for med in listing.rows])
+    return medicine_listing.revalidate(response, listing.etag)
 
 
 @api_v1.route('/reservations', methods=['GET'])
@@ -379,20 +382,23 @@ def create_reservation():
     
     if not data.get('medicine_name') or not data.get('quantity'):
         return jsonify({'error': 'medicine_name and quantity required'}), 400
-    
-    reservation = MedicineReservation(
-        student_id=current_user.id,
-        medicine_name=data['medicine_name'],
-        quantity=data['quantity'],
-        status='Reserved'
-    )
-    
-    db.session.add(reservation)
+    try:
+        quantity = int(data['quantity'])
+        if quantity <= 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return jsonify({'error': 'quantity must be a positive integer'}), 400
+    
+    reservation, available = stock_holds.place_hold(current_user.id, data['medicine_name'], quantity)
+    if reservation is None:
+        return jsonify({'error': f'Only {available} units available', 'available': available}), 409
+    hold_expires_at = reservation.hold_expires_at.isoformat()
     db.session.commit()
     
     return jsonify({
         'success': True,
-        'reservation_id': reservation.id
+        'reservation_id': reservation.id,
+        'hold_expires_at': hold_expires_at
     }), 201
 
 
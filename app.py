@@ -15,8 +15,14 @@ login_manager = LoginManager()
 csrf = CSRFProtect()
 
 
-def create_app(config_name=None):
-    """Application factory for ISUFST CareHub."""
+def create_app(config_name=None, serve=False):
+    """
+    Application factory for ISUFST CareHub.
+
+    ``serve`` is set only by the process that serves requests (gunicorn,
+    ``python app.py``): it starts the notification outbox workers, which
+    one-off scripts that build the app must not run.
+    """
     if config_name is None:
         config_name = os.environ.get('FLASK_CONFIG', 'default')
 
@@ -46,6 +52,22 @@ def create_app(config_name=None):
 
     # Ensure extended models are registered for migrations
     import models_extended  # noqa: F401
+    # Register wait/service time rollup hooks
+    import visit_metrics  # noqa: F401
+    # Keep full-text search documents in sync on write
+    import search_index  # noqa: F401
+    # Link batches and reservations to the medicine catalog
+    import medicine_catalog  # noqa: F401
+    # Record every stock change in the medicine ledger
+    import stock_ledger  # noqa: F401
+    # Keep expiry buckets and their counts in step with inventory writes
+    import expiry_index  # noqa: F401
+    # Drop the cached student medicine listing when stock or holds change
+    import medicine_listing  # noqa: F401
+    # Revoke check-in QR tokens of cancelled bookings
+    import qr_tokens  # noqa: F401
+    # Drop cached certificate verifications when certificates change
+    import certificate_verify  # noqa: F401
 
     # Handle CSRF errors gracefully for JSON API requests
     @app.errorhandler(CSRFError)
@@ -82,6 +104,7 @@ def create_app(config_name=None):
     from symptom_screening import symptom_screening
     from chatbot import chatbot
     from certificates import certificates
+    from kiosk import kiosk
     
     app.register_blueprint(auth)
     app.register_blueprint(appointments)
@@ -98,13 +121,26 @@ def create_app(config_name=None):
     app.register_blueprint(symptom_screening)
     app.register_blueprint(chatbot)
     app.register_blueprint(certificates)
+    app.register_blueprint(kiosk)
     
     # Initialize SocketIO
     queue_socketio.init_app(app, cors_allowed_origins="*")
     
     # Initialize notification service
     from notification_service import init_notification_service
-    init_notification_service(app)
+    init_notification_service(app, start_workers=serve)
+    
+    # Initialize outbreak detection (warms sliding windows from recent cases)
+    from outbreak import init_outbreak_detector
+    init_outbreak_detector(app)
+
+    # Load the in-memory student autocomplete index
+    from student_directory import init_student_directory
+    init_student_directory(app)
+
+    # Size the rendered QR image cache
+    from qr_cache import init_qr_cache
+    init_qr_cache(app)
     
     # Initialize scheduler
     from scheduler import init_scheduler
@@ -170,9 +206,11 @@ def create_app(config_name=None):
     def admin():
         """Admin dashboard with real data"""
         from flask import render_template, abort
-        from models import Queue, Inventory, Appointment, ClinicVisit, MedicineReservation, User
+        from models import Queue, Appointment, ClinicVisit, MedicineReservation, User, local_today
         from utils import get_next_patient
         from datetime import date
+        import expiry_index
+        import reorder
 
         if current_user.role not in ['admin', 'nurse']:
             abort(403)
@@ -180,24 +218,16 @@ def create_app(config_name=None):
         next_patient = get_next_patient()
         queue_count = Queue.query.filter_by(status='Waiting').count()
         today_patients = ClinicVisit.query.filter(
-            ClinicVisit.visit_date == date.today()
+            ClinicVisit.visit_day == local_today()
         ).count()
         today_appointments = Appointment.query.filter(
             Appointment.appointment_date == date.today()
         ).count()
 
-        expiring_items = []
-        all_items = Inventory.query.filter(
-            Inventory.category == 'Medicine',
-            Inventory.quantity > 0
-        ).order_by(Inventory.expiry_date.asc()).limit(10).all()
-        for item in all_items:
-            if item.is_expiring_soon():
-                expiring_items.append(item)
-
-        low_stock_count = Inventory.query.filter(
-            Inventory.quantity < 10
-        ).count()
+        expiring_items = expiry_index.batches(expiry_index.EXPIRING_SOON, limit=5)
+        expiry_counts = expiry_index.counts()
+
+        low_stock_count = len(reorder.low_stock_names())
 
         # Appointments for today
         todays_appts = Appointment.query.filter(
@@ -218,7 +248,8 @@ def create_app(config_name=None):
             queue_count=queue_count,
             today_patients=today_patients,
             today_appointments=today_appointments,
-            expiring_items=expiring_items[:5],
+            expiring_items=expiring_items,
+            expiry_counts=expiry_counts,
             low_stock_count=low_stock_count,
             todays_appts=todays_appts,
             pending_reservations=pending_reservations,
@@ -238,5 +269,5 @@ def create_app(config_name=None):
 
 # -- Entry point ----------------------------------
 if __name__ == '__main__':
-    application = create_app()
+    application = create_app(serve=True)
     application.run(debug=True, port=5000)
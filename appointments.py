@@ -10,8 +10,10 @@ import json
 from models import db, Appointment, User, LogbookEntry
 from models_extended import AppointmentExtended
 from utils import check_availability
-from advanced_utils import generate_appointment_qr
+from advanced_utils import generate_appointment_qr, appointment_qr_payload, qr_image_key, qr_image_response
 from sqlalchemy import func
+from sqlalchemy.orm import joinedload
+import qr_tokens
 
 appointments = Blueprint('appointments', __name__, url_prefix='/appointments')
 
@@ -388,10 +390,8 @@ def admin_update_status(appointment_id):
                 logbook_entry.check_out_time = datetime.now(timezone.utc)
                 logbook_entry.status = 'Completed'
         
-        db.session.commit()
-        
-        # Send notification to student
-        from notifications import create_notification
+        # Notify the student in the same transaction; the email goes out via the outbox
+        from notification_service import create_notification, email_user
         status_messages = {
             'Confirmed': ('Appointment Confirmed ✅', f'Your {appointment.service_type} appointment on {appointment.appointment_date.strftime("%b %d, %Y")} at {appointment.start_time.strftime("%I:%M %p")} has been confirmed.'),
             'Completed': ('Appointment Completed', f'Your {appointment.service_type} appointment has been marked as completed. Thank you for visiting!'),
@@ -401,11 +401,13 @@ def admin_update_status(appointment_id):
         title, message = status_messages.get(new_status, ('Status Update', f'Your appointment status changed to {new_status}.'))
         create_notification(
             user_id=appointment.student_id,
-            notif_type='appointment_update',
+            type='appointment_update',
             title=title,
             message=message,
             link='/appointments/my'
         )
+        email_user(appointment.student, title, message)
+        db.session.commit()
         
         # Return JSON success if request expects JSON
         if request.headers.get('Accept') == 'application/json':
@@ -463,36 +465,35 @@ def admin_assign_doctor(appointment_id):
     return redirect(url_for('appointments.admin_list'))
 
 
-@appointments.route('/api/get-qr/<int:appointment_id>')
-@login_required
-def get_qr_code(appointment_id):
-    """Get QR code image for appointment."""
-    from advanced_utils import generate_qr_code
-    import json
-    
+def _appointment_qr_data(appointment_id):
+    """(check-in QR payload, None) for an appointment the user may see, or (None, error response)."""
     appointment = Appointment.query.get_or_404(appointment_id)
     
     # Verify access - student can only view their own
     if current_user.role == 'student' and appointment.student_id != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
-    
-    # Get extension with QR token
-    ext = AppointmentExtended.query.filter_by(appointment_id=appointment_id).first()
-    if not ext or not ext.qr_code:
-        return jsonify({'error': 'QR code not available'}), 404
-    
-    # Regenerate QR image from token
-    qr_data = json.dumps({
-        'type': 'appointment_checkin',
-        'appointment_id': appointment_id,
-        'token': ext.qr_code,
-        'expires': (datetime.now() + timedelta(days=30)).isoformat()
-    })
+        return None, (jsonify({'error': 'Unauthorized'}), 403)
     
-    qr_image = generate_qr_code(qr_data, add_logo=False)  # No logo for better scanner compatibility
+    # Never sign for a cancelled booking: its revocation only outlives tokens issued before it
+    if appointment.status == 'Cancelled':
+        return None, (jsonify({'error': 'QR code not available'}), 404)
+    
+    return appointment_qr_payload(appointment_id), None
+
+
+@appointments.route('/api/get-qr/<int:appointment_id>')
+@login_required
+def get_qr_code(appointment_id):
+    """Get QR code image URLs for appointment."""
+    qr_data, error = _appointment_qr_data(appointment_id)
+    if error:
+        return error
+    appointment = Appointment.query.get(appointment_id)
+    key = qr_image_key(qr_data)
     
     return jsonify({
-        'qr_image': qr_image,
+        # No logo for better scanner compatibility
+        'qr_url': url_for('appointments.qr_image', appointment_id=appointment_id, key=key, fmt='png'),
+        'qr_svg_url': url_for('appointments.qr_image', appointment_id=appointment_id, key=key, fmt='svg'),
         'appointment': {
             'id': appointment.id,
             'service_type': appointment.service_type,
@@ -502,15 +503,62 @@ def get_qr_code(appointment_id):
     })
 
 
+@appointments.route('/api/qr/<int:appointment_id>/<key>.<any(png, svg):fmt>')
+@login_required
+def qr_image(appointment_id, key, fmt):
+    """Check-in QR image; the URL changes with the payload, so it is cached as immutable."""
+    qr_data, error = _appointment_qr_data(appointment_id)
+    if error:
+        return error
+    current_key = qr_image_key(qr_data)
+    if key != current_key:
+        # Token or expiry moved on since the URL was handed out
+        return redirect(url_for('appointments.qr_image', appointment_id=appointment_id, key=current_key, fmt=fmt))
+    return qr_image_response(qr_data, fmt)
+
+
+def _legacy_qr_appointment(qr_data_json):
+    """
+    (appointment id, None) for a JSON check-in QR issued before signed
+    tokens, checked against the extension row's token; or (None, error response).
+    """
+    try:
+        qr_data = json.loads(qr_data_json)
+    except json.JSONDecodeError as e:
+        return None, (jsonify({'error': f'Invalid JSON in QR data: {str(e)}'}), 400)
+    
+    # Validate required fields
+    if 'expires' not in qr_data:
+        return None, (jsonify({'error': 'QR code missing expiration date'}), 400)
+    if 'appointment_id' not in qr_data:
+        return None, (jsonify({'error': 'QR code missing appointment ID'}), 400)
+    if 'token' not in qr_data:
+        return None, (jsonify({'error': 'QR code missing token'}), 400)
+    
+    # Check expiration (use naive datetime for comparison - all in local/server time)
+    expires = datetime.fromisoformat(qr_data['expires'])
+    if expires.tzinfo:
+        expires = expires.replace(tzinfo=None)
+    if datetime.now() > expires:
+        return None, (jsonify({'error': f'QR code expired on {expires.strftime("%B %d, %Y at %I:%M %p")}'}), 400)
+    
+    # Verify token
+    ext = AppointmentExtended.query.filter_by(appointment_id=qr_data['appointment_id']).first()
+    if not ext:
+        return None, (jsonify({'error': 'Appointment has no QR code generated'}), 400)
+    if not ext.qr_code:
+        return None, (jsonify({'error': 'Appointment QR code is empty'}), 400)
+    if ext.qr_code != qr_data['token']:
+        return None, (jsonify({'error': 'Invalid QR code token (does not match)'}), 400)
+    return qr_data['appointment_id'], None
+
+
 @appointments.route('/api/verify-qr', methods=['POST'])
 @login_required
 @require_staff
 def verify_qr():
     """Verify QR code and return student info for check-in."""
     try:
-        import json as json_module
-        from models import ClinicVisit
-        
         data = request.get_json(force=True, silent=True)
         if not data:
             return jsonify({'error': 'No JSON data received'}), 400
@@ -520,46 +568,24 @@ def verify_qr():
         if not qr_data_json:
             return jsonify({'error': 'QR data required'}), 400
         
-        try:
-            qr_data = json_module.loads(qr_data_json)
-        except json_module.JSONDecodeError as e:
-            return jsonify({'error': f'Invalid JSON in QR data: {str(e)}'}), 400
-        
-        # Validate required fields
-        if 'expires' not in qr_data:
-            return jsonify({'error': 'QR code missing expiration date'}), 400
-        if 'appointment_id' not in qr_data:
-            return jsonify({'error': 'QR code missing appointment ID'}), 400
-        if 'token' not in qr_data:
-            return jsonify({'error': 'QR code missing token'}), 400
-        
-        # Check expiration (use naive datetime for comparison - all in local/server time)
-        expires = datetime.fromisoformat(qr_data['expires'])
-        # Remove timezone info if present for comparison
-        if expires.tzinfo:
-            expires = expires.replace(tzinfo=None)
-        
-        now = datetime.now()
-        print(f"[QR DEBUG] Now: {now}, Expires: {expires}, Diff: {expires - now}")
-        
-        if now > expires:
-            return jsonify({'error': f'QR code expired on {expires.strftime("%B %d, %Y at %I:%M %p")}'}), 400
-        
-        # Get appointment
-        appointment_id = qr_data['appointment_id']
-        appointment = Appointment.query.get(appointment_id)
+        if qr_tokens.is_token(qr_data_json):
+            # Signed token: verified without touching the database
+            try:
+                appointment_id = qr_tokens.check(qr_data_json, qr_tokens.APPOINTMENT).object_id
+            except qr_tokens.InvalidToken as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            appointment_id, error = _legacy_qr_appointment(qr_data_json)
+            if error:
+                return error
+        
+        # One read for what the nurse needs to see
+        appointment = Appointment.query.options(
+            joinedload(Appointment.student).joinedload(User.student_profile)
+        ).get(appointment_id)
         if not appointment:
             return jsonify({'error': f'Appointment #{appointment_id} not found'}), 404
         
-        # Verify token
-        ext = AppointmentExtended.query.filter_by(appointment_id=appointment_id).first()
-        if not ext:
-            return jsonify({'error': 'Appointment has no QR code generated'}), 400
-        if not ext.qr_code:
-            return jsonify({'error': 'Appointment QR code is empty'}), 400
-        if ext.qr_code != qr_data['token']:
-            return jsonify({'error': 'Invalid QR code token (does not match)'}), 400
-        
         # Check if appointment date is within reasonable range (±7 days for flexibility)
         date_diff = (appointment.appointment_date - date.today()).days
         print(f"[QR DEBUG] Appointment date: {appointment.appointment_date}, Today: {date.today()}, Diff: {date_diff} days")
@@ -0,0 +1,59 @@
+"""
+Microbenchmark for the in-memory student autocomplete index.
+
+Loads synthetic students straight into a StudentDirectory (no database) and
+times prefix, multi-word, student-number and misspelled lookups.
+
+Usage:
+    python bench_autocomplete.py [students]      (default 50000)
+"""
+import random
+import statistics
+import sys
+import time
+
+from student_directory import StudentDirectory
+
+FIRST = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Angel', 'John', 'Kristine', 'Paolo', 'Jasmine',
+         'Carlo', 'Nicole', 'Miguel', 'Patricia', 'Rafael', 'Camille', 'Gabriel', 'Andrea', 'Joshua',
+         'Princess', 'Christian', 'Angelica', 'Justin', 'Mary Joy', 'Kenneth', 'Rhea', 'Vincent', 'Lea']
+SYLLABLES = ['ba', 'ca', 'da', 'ga', 'la', 'ma', 'na', 'pa', 'sa', 'ta', 'yo', 'lo', 'rio', 'tan', 'nes',
+             'gon', 'cruz', 'man', 'bal', 'lan', 'do', 'no', 'so', 'gan', 'ro', 'vi', 'le', 'mi']
+QUERIES = ['ma', 'mari', 'maria sa', 'joshua', 'mria', 'chirstian', 'angleica tan', '2023-0', '20230123', 'zzzz']
+
+
+def synthetic(count, seed=11):
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        first = rng.choice(FIRST)
+        last = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).title()
+        yield {
+            'id': i, 'first_name': first, 'last_name': last, 'name': f'{first} {last}',
+            'email': f'{first}.{last}{i % 97}@isufst.edu.ph'.replace(' ', '').lower(),
+            'student_id': f'{2019 + i % 6}-{i:05d}', 'course': 'BSIT', 'year_level': 1 + i % 4,
+        }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    directory = StudentDirectory()
+    started = time.perf_counter()
+    for student in synthetic(count):
+        directory.put(student)
+    print(f'Indexed {count:,} students ({directory.vocabulary_size:,} distinct tokens) '
+          f'in {time.perf_counter() - started:.2f}s\n')
+
+    print(f'{"query":<16}{"p50 ms":>9}{"p95 ms":>9}  top result')
+    for query in QUERIES:
+        samples = []
+        for _ in range(200):
+            started = time.perf_counter()
+            results = directory.search(query, limit=10)
+            samples.append((time.perf_counter() - started) * 1000)
+        samples.sort()
+        top = results[0]['name'] if results else '-'
+        print(f'{query:<16}{statistics.median(samples):>9.3f}{samples[189]:>9.3f}  {top}')
+
+
+if __name__ == '__main__':
+    main()
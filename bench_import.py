@@ -0,0 +1,93 @@
+"""
+Throughput benchmark for the bulk inventory import.
+
+Writes a synthetic delivery sheet (a few bad rows included) to a temp CSV
+and imports it into a throwaway SQLite database twice: first as new
+batches, then again as a stock count replacing them. Reports rows/s and
+peak Python memory, which should stay flat however long the file is.
+
+Usage:
+    python bench_import.py [rows]      (default 10000)
+"""
+import csv
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import timedelta
+
+from flask import Flask
+from sqlalchemy import func
+
+from models import db, Inventory, local_today
+from models_extended import StockMovement, ExpiryBucketCount, SearchDocument  # noqa: F401  (registers the tables)
+import inventory_import
+import stock_ledger
+
+MEDICINES = ['Paracetamol', 'Amoxicillin', 'Mefenamic Acid', 'Cetirizine', 'Loperamide', 'Salbutamol',
+             'Ibuprofen', 'Losartan', 'Metformin', 'Omeprazole', 'Ascorbic Acid', 'Ferrous Sulfate']
+BAD_EVERY = 997
+
+
+def write_sheet(path, rows, seed=7):
+    rng = random.Random(seed)
+    today = local_today()
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Name', 'Batch No', 'Qty', 'Expiry Date', 'Category'])
+        for i in range(rows):
+            expiry = today + timedelta(days=rng.randint(1, 900))
+            quantity = rng.randint(1, 500)
+            if i % BAD_EVERY == BAD_EVERY - 1:
+                quantity = 'lots'
+            writer.writerow([rng.choice(MEDICINES), f'LOT-{i:06d}', quantity, expiry.isoformat(), 'Medicine'])
+
+
+def run_import(path, mode):
+    with open(path, 'rb') as f:
+        return inventory_import.import_batches(f, os.path.basename(path), mode=mode)
+
+
+def peak_memory(path, mode):
+    """Peak Python memory of one import (traced separately: tracing slows it down)."""
+    tracemalloc.start()
+    run_import(path, mode)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    workdir = tempfile.mkdtemp()
+    sheet = os.path.join(workdir, 'delivery.csv')
+    write_sheet(sheet, rows)
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(workdir, 'bench_import.db')}"
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        print(f'{rows} rows, {os.path.getsize(sheet) / 1024:.0f} KiB CSV, chunks of {inventory_import.CHUNK_SIZE}')
+        for mode in (inventory_import.ADD, inventory_import.REPLACE):
+            started = time.perf_counter()
+            result = run_import(sheet, mode)
+            elapsed = time.perf_counter() - started
+            print(f'  {mode:<8} {elapsed:6.2f}s  {result["rows"] / elapsed:7.0f} rows/s  '
+                  f'inserted {result["inserted"]}, updated {result["updated"]}, skipped {result["error_count"]}')
+        print(f'  peak Python memory of an import: {peak_memory(sheet, inventory_import.REPLACE) / 1024 / 1024:.1f} MiB')
+
+        batches = db.session.query(func.count(Inventory.id), func.sum(Inventory.quantity)).one()
+        ledger = db.session.query(func.coalesce(func.sum(StockMovement.quantity), 0)).scalar()
+        levels = sum(stock_ledger.on_hand_by_medicine().values())
+        print(f'  {batches[0]} batches, {batches[1]} units; ledger {ledger}, levels {levels}')
+        if not batches[1] == ledger == levels:
+            print('❌ Ledger does not match the imported batches')
+            sys.exit(1)
+        print('✅ Ledger and stock levels match the imported batches')
+
+
+if __name__ == '__main__':
+    main()
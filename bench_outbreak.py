@@ -0,0 +1,90 @@
+"""
+Benchmark for the streaming outbreak detector.
+
+Feeds one year of synthetic symptom screenings (with an injected flu wave and
+a dengue-like fever spike) through SymptomClusterDetector and compares the
+per-insert cost with naively rescanning the window + baseline on each insert.
+
+Usage:
+    python bench_outbreak.py [screenings_per_day]
+"""
+import random
+import sys
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from outbreak import SymptomClusterDetector
+
+BACKGROUND = [
+    'headache', 'fatigue', 'cough', 'sore throat', 'runny nose', 'fever',
+    'abdominal pain', 'diarrhea', 'dizziness', 'back pain', 'stress', 'toothache',
+]
+FLU = ['fever', 'cough', 'sore throat', 'fatigue', 'chills']
+DENGUE = ['fever', 'headache', 'rash', 'joint pain', 'muscle pain']
+
+
+def synthetic_year(per_day, seed=42):
+    """Yield (day, symptoms) for 365 days of screenings."""
+    rng = random.Random(seed)
+    start = date(2025, 6, 1)
+    for offset in range(365):
+        day = start + timedelta(days=offset)
+        count = rng.randint(int(per_day * 0.6), int(per_day * 1.4))
+        # Flu wave in September, dengue spike in late July
+        flu = 120 <= offset < 130
+        dengue = 55 <= offset < 60
+        for _ in range(count):
+            if flu and rng.random() < 0.45:
+                symptoms = rng.sample(FLU, 3)
+            elif dengue and rng.random() < 0.35:
+                symptoms = rng.sample(DENGUE, 3)
+            else:
+                symptoms = rng.sample(BACKGROUND, rng.randint(1, 3))
+            yield day, symptoms
+
+
+def naive_rescan(events, window_days, baseline_days):
+    """Per insert, recount the full window and baseline from the raw history."""
+    history = []
+    for day, symptoms in events:
+        history.append((day, symptoms))
+        window_start = day - timedelta(days=window_days - 1)
+        baseline_start = window_start - timedelta(days=baseline_days)
+        window, baseline = Counter(), Counter()
+        for d, s in reversed(history):
+            if d < baseline_start:
+                break
+            (window if d >= window_start else baseline).update(s)
+
+
+def main():
+    per_day = int(sys.argv[1]) if len(sys.argv) > 1 else 40
+    events = list(synthetic_year(per_day))
+    print(f'{len(events):,} screenings over 365 days (~{per_day}/day)')
+
+    detector = SymptomClusterDetector()
+    alerts = []
+    started = time.perf_counter()
+    for day, symptoms in events:
+        alerts.extend(detector.record(symptoms, day))
+    elapsed = time.perf_counter() - started
+    print(f'streaming detector: {elapsed * 1000:8.1f} ms total, '
+          f'{elapsed / len(events) * 1e6:6.2f} us/insert')
+
+    # The naive approach is quadratic-ish; sample the first 60 days to keep it short
+    sample = [e for e in events if e[0] < events[0][0] + timedelta(days=60)]
+    started = time.perf_counter()
+    naive_rescan(sample, detector.window_days, detector.baseline_days)
+    naive = time.perf_counter() - started
+    print(f'naive rescan (first 60 days): {naive * 1000:8.1f} ms total, '
+          f'{naive / len(sample) * 1e6:6.2f} us/insert')
+
+    print(f'{len(alerts)} alerts:')
+    for alert in alerts:
+        print(f"  {alert['day']}  {alert['symptom']:<14} observed={alert['observed']:<4} "
+              f"expected={alert['expected']}")
+
+
+if __name__ == '__main__':
+    main()
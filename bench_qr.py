@@ -0,0 +1,77 @@
+"""
+Microbenchmark for check-in QR rendering and the QR image cache.
+
+Times cold renders (cache bypassed), warm hits from memory, disk-tier hits
+in a fresh cache over the same directory, and a mixed workload over more
+payloads than the memory budget holds, reporting the cache counters.
+
+Usage:
+    python bench_qr.py [payloads]      (default 200)
+"""
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import advanced_utils
+import qr_cache
+import qr_tokens
+
+
+def payloads(count):
+    key = secrets.token_bytes(32)
+    expires_on = date.today() + timedelta(days=qr_tokens.VALID_DAYS)
+    for i in range(1, count + 1):
+        yield qr_tokens.encode(qr_tokens.APPOINTMENT, i, expires_on, 0, key)
+
+
+def timed(fn, items):
+    samples = []
+    for item in items:
+        started = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(label, samples):
+    samples = sorted(samples)
+    p95 = samples[int(len(samples) * 0.95) - 1]
+    print(f'{label:<28}{statistics.median(samples):>9.3f}{p95:>9.3f}')
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    data = list(payloads(count))
+    print(f'{"render":<28}{"p50 ms":>9}{"p95 ms":>9}')
+
+    for add_logo in (False, True):
+        tag = 'logo' if add_logo else 'plain'
+        report(f'cold ({tag}, no cache)', timed(lambda d: advanced_utils._render_qr_png(d, 10, add_logo), data))
+        qr_cache.cache = qr_cache.QRImageCache()
+        timed(lambda d: advanced_utils.generate_qr_code(d, add_logo=add_logo), data)
+        report(f'warm ({tag}, memory hit)', timed(lambda d: advanced_utils.generate_qr_code(d, add_logo=add_logo), data))
+
+    with tempfile.TemporaryDirectory() as directory:
+        qr_cache.cache = qr_cache.QRImageCache(directory=directory)
+        timed(lambda d: advanced_utils.render_qr_png(d), data)
+        qr_cache.cache = qr_cache.QRImageCache(directory=directory)  # Another worker: empty memory tier
+        report('disk hit (new process)', timed(lambda d: advanced_utils.render_qr_png(d), data))
+
+    # Skewed reopen pattern (recent appointments are opened most) with room
+    # for a quarter of the images in memory
+    image_size = len(advanced_utils.render_qr_png(data[0]))
+    qr_cache.cache = qr_cache.QRImageCache(max_bytes=image_size * count // 4)
+    rng = random.Random(7)
+    mixed = [data[int(count * rng.random() ** 3)] for _ in range(count * 5)]
+    report('mixed (25% fits)', timed(lambda d: advanced_utils.render_qr_png(d), mixed))
+    print()
+    for name, value in qr_cache.cache.stats().items():
+        print(f'  {name:<16}{value}')
+
+
+if __name__ == '__main__':
+    main()
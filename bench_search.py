@@ -0,0 +1,145 @@
+"""
+Latency benchmark for the full-text search index.
+
+Builds a throwaway SQLite database with synthetic students and clinic
+visits, indexes it, and compares the old LIKE '%q%' queries from search.py
+with the FTS-backed ones. The synthetic vocabulary is tiny, so most queries
+hit tens of thousands of rows - the worst case for ranked search; the rare
+and no-match terms show the selective case.
+
+Usage:
+    python bench_search.py [students] [visits]      (default 50000 500000)
+"""
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+
+from flask import Flask
+from sqlalchemy import func, insert, or_
+
+from models import db, User, StudentProfile, ClinicVisit, Inventory
+from models_extended import SearchDocument  # noqa: F401  (registers the table)
+import search_index
+
+FIRST = ['Juan', 'Maria', 'Jose', 'Ana', 'Mark', 'Angel', 'John', 'Kristine', 'Paolo', 'Jasmine',
+         'Carlo', 'Nicole', 'Miguel', 'Patricia', 'Rafael', 'Camille', 'Gabriel', 'Andrea']
+LAST = ['Dela Cruz', 'Santos', 'Reyes', 'Garcia', 'Mendoza', 'Torres', 'Villanueva', 'Gonzales',
+        'Ramos', 'Aquino', 'Castillo', 'Bautista', 'Navarro', 'Salazar', 'Padilla', 'Magbanua']
+COURSES = ['BSIT', 'BS Fisheries', 'BS Marine Biology', 'BSED', 'BS Criminology', 'BS Hospitality']
+COMPLAINTS = ['headache', 'fever', 'cough', 'stomach ache', 'toothache', 'dizziness', 'sore throat',
+              'rash', 'back pain', 'cut on finger', 'allergy', 'asthma attack', 'menstrual cramps']
+DIAGNOSES = ['Tension headache', 'Migraine', 'Upper respiratory infection', 'Gastritis', 'Dental caries',
+             'Hypertension', 'Allergic rhinitis', 'Acute gastroenteritis', 'Dysmenorrhea', 'Laceration',
+             'Influenza-like illness', 'Muscle strain', 'Contact dermatitis', 'Bronchial asthma']
+
+QUERIES = {
+    'patient': ['dela cruz', 'mari', 'santos jose', '2023-01234'],
+    'visit': ['migraine', 'respiratory', 'asthma', 'dengue', 'leptospirosis', 'tuberculosis'],
+}
+
+
+def build(students, visits, seed=7):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    users, profiles = [], []
+    for i in range(1, students + 1):
+        first, last = rng.choice(FIRST), rng.choice(LAST)
+        users.append({'id': i, 'email': f'{first}.{last}.{i}@isufst.edu.ph'.replace(' ', '').lower(),
+                      'password_hash': 'x', 'first_name': first, 'last_name': last, 'role': 'student'})
+        profiles.append({'user_id': i, 'student_id_number': f'{2019 + i % 6}-{i:05d}',
+                         'course': rng.choice(COURSES), 'year_level': rng.randint(1, 4)})
+    db.session.execute(insert(User), users)
+    db.session.execute(insert(StudentProfile), profiles)
+
+    batch = []
+    for i in range(1, visits + 1):
+        roll = rng.random()
+        # A few rare diagnoses so selective queries are represented too
+        diagnosis = 'Leptospirosis' if roll < 0.0002 else 'Dengue fever' if roll < 0.002 else rng.choice(DIAGNOSES)
+        batch.append({'id': i, 'student_id': rng.randint(1, students),
+                      'visit_date': now - timedelta(minutes=rng.randint(0, 60 * 24 * 730)),
+                      'chief_complaint': rng.choice(COMPLAINTS), 'diagnosis': diagnosis,
+                      'treatment': 'Advised rest and hydration', 'status': 'completed'})
+        if len(batch) == 50000:
+            db.session.execute(insert(ClinicVisit), batch)
+            batch = []
+    if batch:
+        db.session.execute(insert(ClinicVisit), batch)
+    db.session.commit()
+
+
+def old_patients(q):
+    q = q.lower()
+    return User.query.join(StudentProfile, StudentProfile.user_id == User.id).filter(
+        User.role == 'student',
+        or_(
+            func.lower(User.first_name).contains(q),
+            func.lower(User.last_name).contains(q),
+            func.lower(User.email).contains(q),
+            func.lower(StudentProfile.student_id_number).contains(q),
+        )
+    ).limit(20).all()
+
+
+def old_visits(q):
+    return ClinicVisit.query.filter(
+        func.lower(ClinicVisit.diagnosis).contains(q.lower())
+    ).order_by(ClinicVisit.visit_date.desc()).limit(50).all()
+
+
+def fts_patients(q):
+    ranked = search_index.match(search_index.PATIENT, q, limit=20).subquery()
+    return User.query.join(ranked, ranked.c.entity_id == User.id).order_by(
+        ranked.c.rank.desc(), User.id
+    ).limit(20).all()
+
+
+def fts_visits(q):
+    ranked = search_index.match(search_index.VISIT, q, limit=50).subquery()
+    return ClinicVisit.query.join(ranked, ranked.c.entity_id == ClinicVisit.id).order_by(
+        ranked.c.rank.desc(), ClinicVisit.visit_date.desc()
+    ).limit(50).all()
+
+
+def timed(fn, q, repeat):
+    samples = []
+    for _ in range(repeat):
+        db.session.expunge_all()
+        started = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    visits = int(sys.argv[2]) if len(sys.argv) > 2 else 500000
+    path = os.path.join(tempfile.mkdtemp(), 'bench_search.db')
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f'sqlite:///{path}'
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        started = time.perf_counter()
+        build(students, visits)
+        print(f'Built {students:,} students / {visits:,} visits in {time.perf_counter() - started:.1f}s')
+        started = time.perf_counter()
+        search_index.rebuild_index((search_index.PATIENT, search_index.VISIT))
+        print(f'Indexed in {time.perf_counter() - started:.1f}s\n')
+
+        print(f'{"query":<24}{"LIKE p50":>10}{"p95":>9}{"FTS p50":>10}{"p95":>9}   (ms)')
+        for kind, old, new in (('patient', old_patients, fts_patients), ('visit', old_visits, fts_visits)):
+            for q in QUERIES[kind]:
+                like = timed(old, q, 15)
+                fts = timed(new, q, 15)
+                print(f'{kind + ": " + q:<24}{like[0]:>10.2f}{like[1]:>9.2f}{fts[0]:>10.2f}{fts[1]:>9.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+"""
+Certificate numbering and bulk issuance for ISUFST CareHub.
+
+Certificate numbers (HC-<year>-<number>) are taken from a per-year
+CertificateSequence row with one atomic upsert, so concurrent issuers never
+hand out the same number. Bulk issuance creates a batch of certificates in
+one transaction; the batch's ZIP is streamed while its PDFs render across a
+process pool, with only a few PDFs in memory at a time. Rendered PDFs go to
+the same content-addressed storage as single downloads.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy.orm import joinedload
+
+from models import db, User, StudentProfile, local_today, upsert
+from models_extended import HealthCertificate, CertificateSequence
+import certificate_pdf
+
+MAX_BATCH = 1000
+DEFAULT_RENDER_WORKERS = min(4, os.cpu_count() or 1)
+IN_FLIGHT_PER_WORKER = 2  # Renders queued ahead of the ZIP writer, per worker
+
+_render_pool = None
+_render_workers = 0
+_pool_lock = threading.Lock()
+
+
+# ──────────────────────────────────────────────
+#  Numbering
+# ──────────────────────────────────────────────
+
+def _highest_issued(year):
+    """Highest number already issued for ``year``, for years the sequence has not seen yet."""
+    prefix = f'HC-{year}-'
+    highest = 0
+    for (number,) in db.session.query(HealthCertificate.certificate_number).filter(
+        HealthCertificate.certificate_number.like(f'{prefix}%')
+    ):
+        suffix = number[len(prefix):]
+        if suffix.isdigit():
+            highest = max(highest, int(suffix))
+    return highest
+
+
+def allocate_numbers(count, year=None):
+    """
+    ``count`` consecutive certificate numbers for ``year`` (default: this
+    local year). The sequence row stays locked until the caller commits.
+    """
+    year = year or local_today().year
+    known = db.session.query(CertificateSequence.last_number).filter_by(year=year).scalar() is not None
+    seed = 0 if known else _highest_issued(year)
+    last = upsert(db.session, CertificateSequence, {'year': year}, {'last_number': seed + count},
+                  {'last_number': CertificateSequence.last_number + count}, returning=CertificateSequence.last_number)
+    return [f'HC-{year}-{number:04d}' for number in range(last - count + 1, last + 1)]
+
+
+# ──────────────────────────────────────────────
+#  Bulk Issuance
+# ──────────────────────────────────────────────
+
+def parse_student_numbers(text):
+    """Student ID numbers from pasted text or a CSV (first column), in order, without repeats."""
+    numbers = []
+    for line in (text or '').splitlines():
+        if any(delimiter in line for delimiter in ',;\t'):
+            parts = [line.replace(';', ',').replace('\t', ',').split(',')[0]]
+        else:
+            parts = line.split()
+        for part in parts:
+            part = part.strip().strip('"')
+            if part and part not in numbers:
+                numbers.append(part)
+    return numbers
+
+
+def issue_batch(student_numbers, issued_by, purpose, medical_findings, valid_months):
+    """
+    Issue one certificate per known student ID number in one transaction.
+    Returns (batch id, certificates, unknown student numbers).
+    """
+    students = {
+        profile.student_id_number: user for user, profile in db.session.query(User, StudentProfile).join(
+            StudentProfile, StudentProfile.user_id == User.id
+        ).filter(
+            StudentProfile.student_id_number.in_(student_numbers),
+            User.role == 'student'
+        )
+    }
+    unknown = [number for number in student_numbers if number not in students]
+    found = [students[number] for number in student_numbers if number in students]
+    if not found:
+        return None, [], unknown
+
+    batch_id = uuid.uuid4().hex
+    valid_until = local_today() + timedelta(days=valid_months * 30)
+    certificates = [
+        HealthCertificate(
+            student_id=student.id,
+            issued_by=issued_by,
+            certificate_number=number,
+            purpose=purpose,
+            medical_findings=medical_findings or 'General health check completed. No significant findings.',
+            valid_until=valid_until,
+            batch_id=batch_id
+        )
+        for student, number in zip(found, allocate_numbers(len(found)))
+    ]
+    db.session.add_all(certificates)
+    db.session.commit()
+    return batch_id, certificates, unknown
+
+
+def batch_certificates(batch_id):
+    return HealthCertificate.query.options(
+        joinedload(HealthCertificate.student).joinedload(User.student_profile),
+        joinedload(HealthCertificate.issuer)
+    ).filter_by(batch_id=batch_id).order_by(HealthCertificate.certificate_number).all()
+
+
+# ──────────────────────────────────────────────
+#  Rendering / ZIP
+# ──────────────────────────────────────────────
+
+def _get_render_pool():
+    """Spawned worker processes for reportlab; sized by CERTIFICATE_RENDER_WORKERS."""
+    global _render_pool, _render_workers
+    with _pool_lock:
+        if _render_pool is None:
+            _render_workers = max(int(current_app.config.get('CERTIFICATE_RENDER_WORKERS', DEFAULT_RENDER_WORKERS)), 1)
+            _render_pool = ProcessPoolExecutor(max_workers=_render_workers,
+                                               mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_render_pool.shutdown, wait=False)
+        return _render_pool
+
+
+def _render_all(certificates):
+    """
+    Yield (certificate, PDF bytes) in order, rendering missing PDFs in the
+    pool with a bounded number in flight and storing them as they arrive.
+    """
+    directory = certificate_pdf.storage_dir()
+    pool = _get_render_pool()
+    window = _render_workers * IN_FLIGHT_PER_WORKER
+    pending = deque()
+    todo = iter(certificates)
+
+    def submit_next():
+        cert = next(todo, None)
+        if cert is None:
+            return False
+        data, signature = certificate_pdf.render_args(cert)
+        name = certificate_pdf.pdf_name(data)
+        stored = os.path.exists(os.path.join(directory, name))
+        pending.append((cert, name, None if stored else pool.submit(certificate_pdf.render, data, signature)))
+        return True
+
+    while len(pending) < window and submit_next():
+        pass
+    while pending:
+        cert, name, future = pending.popleft()
+        submit_next()
+        if future is None:
+            with open(os.path.join(directory, name), 'rb') as fh:
+                pdf = fh.read()
+            certificate_pdf.store(cert, name)
+        else:
+            pdf = future.result()
+            certificate_pdf.store(cert, name, pdf)
+        yield cert, pdf
+
+
+class _ZipSink:
+    """Write-only file for ZipFile that hands its bytes to the caller as they are written."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(certificates):
+    """Yield a ZIP of the certificates' PDFs chunk by chunk (PDFs are already compressed: stored as-is)."""
+    sink = _ZipSink()
+    with zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for cert, pdf in _render_all(certificates):
+            archive.writestr(f'Health_Certificate_{cert.certificate_number}.pdf', pdf)
+            yield sink.drain()
+    db.session.commit()  # New pdf_path values
+    yield sink.drain()
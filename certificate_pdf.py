@@ -0,0 +1,395 @@
+"""
+Health certificate PDFs for ISUFST CareHub.
+
+A certificate PDF depends only on the certificate, the student's profile,
+the issuer's name and signature, and the verification URL printed as a QR
+code. Those inputs are hashed, and the rendered
+PDF is stored once under that hash (CERTIFICATE_PDF_DIR, default
+instance/certificates); ``HealthCertificate.pdf_path`` names the current
+file. Downloads are served from storage and only re-rendered when an input
+changes. Styles and logo images are built once per process.
+"""
+import base64
+import hashlib
+import io
+import json
+import os
+import tempfile
+from functools import lru_cache
+
+from flask import current_app
+from reportlab import rl_config
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_LEFT
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import inch
+from reportlab.lib.utils import ImageReader
+from reportlab.graphics.barcode.qr import QrCodeWidget
+from reportlab.graphics.shapes import Drawing
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Flowable
+
+from models import db
+import certificate_verify
+
+RENDER_VERSION = 2  # Bump when the layout changes, so stored PDFs are re-rendered
+IMAGES_DIR = os.path.join(os.path.dirname(__file__), 'static', 'images')
+LOGOS = ('isufst-logo.png', 'bayan.png', 'gcl.png', 'heart.png')
+
+# Store image streams as plain binary: without reportlab's C accelerator,
+# ASCII85-encoding the logos dominated the render time
+rl_config.useA85 = 0
+
+
+# ──────────────────────────────────────────────
+#  Static Parts
+# ──────────────────────────────────────────────
+
+class _Logo(Flowable):
+    """Draws a shared, already-decoded ImageReader (platypus Image re-reads its file per build)."""
+
+    def __init__(self, reader, width, height):
+        super().__init__()
+        self.reader = reader
+        self.width = width
+        self.height = height
+
+    def wrap(self, available_width, available_height):
+        return self.width, self.height
+
+    def draw(self):
+        self.canv.drawImage(self.reader, 0, 0, self.width, self.height, mask='auto')
+
+
+@lru_cache(maxsize=None)
+def _logo_reader(name):
+    """Decoded logo, or None if the file is missing or unreadable."""
+    path = os.path.join(IMAGES_DIR, name)
+    try:
+        reader = ImageReader(path)
+        reader.getRGBData()  # Decode now, once
+        return reader
+    except Exception as e:
+        print(f'Warning: Could not load certificate logo {name}: {e}')
+        return None
+
+
+def _logo(name, width, height):
+    reader = _logo_reader(name)
+    return _Logo(reader, width, height) if reader else ''
+
+
+@lru_cache(maxsize=1)
+def _logo_fingerprint():
+    """Size and mtime of every logo file, so replacing a logo re-renders certificates."""
+    parts = []
+    for name in LOGOS:
+        try:
+            stat = os.stat(os.path.join(IMAGES_DIR, name))
+            parts.append(f'{name}:{stat.st_size}:{int(stat.st_mtime)}')
+        except OSError:
+            parts.append(f'{name}:missing')
+    return ','.join(parts)
+
+
+@lru_cache(maxsize=1)
+def _styles():
+    styles = getSampleStyleSheet()
+    return {
+        'normal': styles['Normal'],
+        'heading': ParagraphStyle(
+            'SectionHeading',
+            parent=styles['Heading2'],
+            fontSize=11,
+            textColor=colors.HexColor('#1e293b'),
+            spaceAfter=6,
+            spaceBefore=8,
+            fontName='Helvetica-Bold'
+        ),
+        'header': ParagraphStyle(
+            'HeaderCenter',
+            parent=styles['Normal'],
+            fontSize=11,
+            alignment=TA_CENTER,
+            textColor=colors.HexColor('#1e293b'),
+            leading=14,
+            fontName='Helvetica-Bold'
+        ),
+        'verification': ParagraphStyle(
+            'Verification',
+            parent=styles['Normal'],
+            fontSize=8,
+            textColor=colors.HexColor('#64748b'),
+            alignment=TA_CENTER,
+            leading=10
+        ),
+        'title': ParagraphStyle(
+            'CareHubTitle',
+            parent=styles['Normal'],
+            fontSize=20,
+            alignment=TA_CENTER,
+            textColor=colors.HexColor('#2563eb'),
+            fontName='Helvetica-Bold',
+            spaceAfter=6
+        ),
+        'core_values': ParagraphStyle(
+            'CoreValues',
+            parent=styles['Normal'],
+            fontSize=9,
+            textColor=colors.HexColor('#1e293b'),
+            alignment=TA_LEFT,
+            fontName='Helvetica-Bold'
+        ),
+    }
+
+
+def _header():
+    styles = _styles()
+    header_text = Paragraph("<b>ILOILO STATE UNIVERSITY OF FISHERIES SCIENCE AND TECHNOLOGY</b>", styles['header'])
+    header_table = Table(
+        [[_logo('isufst-logo.png', 1*inch, 0.65*inch), header_text, _logo('bayan.png', 0.65*inch, 0.65*inch)]],
+        colWidths=[1*inch, 5.5*inch, 1*inch]
+    )
+    header_table.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+        ('ALIGN', (1, 0), (1, 0), 'CENTER'),
+        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
+    ]))
+    return [
+        header_table,
+        Spacer(1, 0.1*inch),
+        Paragraph(
+            "This is an official health certificate issued by Iloilo State University of Fisheries Science and Technology Health Services.<br/>"
+            "For verification, please contact the clinic at clinic@isufst.edu.ph",
+            styles['verification']
+        ),
+        Spacer(1, 0.15*inch),
+        Paragraph("<font size=20 color='#2563eb'><b>CareHub Health Certificate</b></font>", styles['title']),
+        Spacer(1, 0.2*inch),
+    ]
+
+
+def _footer():
+    core_values_text = Paragraph(
+        "<b>Integrity</b> . <b>Social Justice</b> . <b>Discipline</b> . <b>Academic Excellence</b>",
+        _styles()['core_values']
+    )
+    heart_logo = _logo('heart.png', 1*inch, 0.65*inch)
+    gcl_logo = _logo('gcl.png', 1*inch, 0.65*inch)
+    # Combine logos in a nested table (heart first, then GCL)
+    if gcl_logo and heart_logo:
+        logos_cell = Table([[heart_logo, gcl_logo]], colWidths=[1.1*inch, 1.1*inch])
+        logos_cell.setStyle(TableStyle([
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ]))
+    else:
+        logos_cell = heart_logo or gcl_logo
+    footer_table = Table([[core_values_text, logos_cell]], colWidths=[4*inch, 2.5*inch])
+    footer_table.setStyle(TableStyle([
+        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
+        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
+    ]))
+    return [footer_table]
+
+
+def _verification_qr(url, size=1.1*inch):
+    """Vector QR of the public verification URL, captioned."""
+    widget = QrCodeWidget(url, barLevel='M')
+    x1, y1, x2, y2 = widget.getBounds()
+    drawing = Drawing(size, size, transform=[size / (x2 - x1), 0, 0, size / (y2 - y1), 0, 0])
+    drawing.add(widget)
+    table = Table([[drawing], [Paragraph('Scan to verify', _styles()['verification'])]], colWidths=[size + 0.2*inch])
+    table.setStyle(TableStyle([
+        ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+        ('TOPPADDING', (0, 0), (-1, -1), 0),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 0),
+    ]))
+    return table
+
+
+# ──────────────────────────────────────────────
+#  Rendering
+# ──────────────────────────────────────────────
+
+def inputs(cert):
+    """Everything the PDF shows, as plain values; the signature image by hash."""
+    student = cert.student
+    profile = student.student_profile
+    issuer = cert.issuer
+    signature = issuer.signature_data if issuer.signature_data and issuer.signature_data.startswith('data:image') else None
+    if profile and profile.course:
+        year = profile.year_level
+        course = f"{profile.course} - {year}{['st','nd','rd','th'][min(year-1,3) if year else 3]} Year"
+    else:
+        course = 'N/A'
+    return {
+        'version': RENDER_VERSION,
+        'logos': _logo_fingerprint(),
+        'certificate_number': cert.certificate_number,
+        'issued_on': cert.issued_at.strftime('%B %d, %Y'),
+        'valid_until': cert.valid_until.strftime('%B %d, %Y') if cert.valid_until else 'N/A',
+        'student_name': student.full_name,
+        'student_id': profile.student_id_number if profile else 'N/A',
+        'course': course,
+        'blood_type': profile.blood_type if profile and profile.blood_type else 'Not on record',
+        'findings': cert.medical_findings or "General health check completed. No significant medical findings.",
+        'purpose': cert.purpose or "General purpose",
+        'issuer_name': issuer.full_name,
+        'signature': hashlib.sha256(signature.encode()).hexdigest() if signature else None,
+        'verify_url': certificate_verify.verify_url(cert),
+    }
+
+
+def fingerprint(data):
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def render(data, signature_data=None):
+    """PDF bytes for ``inputs`` ``data``; ``signature_data`` is the issuer's data-URI signature."""
+    styles = _styles()
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.4*inch, bottomMargin=0.5*inch)
+    elements = _header()
+
+    cert_table = Table([
+        ['Certificate No:', data['certificate_number'], 'Date Issued:', data['issued_on']],
+        ['Valid Until:', data['valid_until'], '', ''],
+    ], colWidths=[1.5*inch, 2*inch, 1.5*inch, 2*inch])
+    cert_table.setStyle(TableStyle([
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#64748b')),
+        ('TEXTCOLOR', (2, 0), (2, -1), colors.HexColor('#64748b')),
+        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+    ]))
+    elements.append(cert_table)
+    elements.append(Spacer(1, 0.1*inch))
+
+    # Student Information
+    elements.append(Paragraph("STUDENT INFORMATION", styles['heading']))
+    student_table = Table([
+        ['Name:', data['student_name']],
+        ['Student ID:', data['student_id']],
+        ['Course & Year:', data['course']],
+        ['Blood Type:', data['blood_type']],
+    ], colWidths=[1.5*inch, 5*inch])
+    student_table.setStyle(TableStyle([
+        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#64748b')),
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (-1, -1), 10),
+        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
+        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
+    ]))
+    elements.append(student_table)
+    elements.append(Spacer(1, 0.1*inch))
+
+    elements.append(Paragraph("MEDICAL FINDINGS", styles['heading']))
+    elements.append(Paragraph(data['findings'], styles['normal']))
+    elements.append(Spacer(1, 0.1*inch))
+
+    elements.append(Paragraph("PURPOSE", styles['heading']))
+    elements.append(Paragraph(data['purpose'], styles['normal']))
+    elements.append(Spacer(1, 0.2*inch))
+
+    # Signature Section: the issuer's digital signature if they have one, else a line
+    signature = '_'*40
+    if signature_data:
+        try:
+            sig_bytes = base64.b64decode(signature_data.split(',')[1])
+            signature = _Logo(ImageReader(io.BytesIO(sig_bytes)), 2*inch, 0.8*inch)
+        except Exception:
+            pass  # Fall back to the line if the signature cannot be parsed
+    sig_table = Table([
+        ['', _verification_qr(data['verify_url'])],
+        [signature, ''],
+        [f"{data['issuer_name']}, RN", ''],
+        ['Issued by:', ''],
+        ['ISUFST Dingle Campus Health Services', ''],
+    ], colWidths=[3*inch, 3*inch])
+    sig_table.setStyle(TableStyle([
+        ('FONTNAME', (0, 0), (0, -1), 'Helvetica'),
+        ('FONTSIZE', (0, 0), (0, -1), 10),
+        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+        ('TEXTCOLOR', (0, 3), (0, 3), colors.HexColor('#64748b')),
+        ('FONTSIZE', (0, 3), (0, 4), 8),
+        ('SPAN', (1, 0), (1, -1)),
+        ('ALIGN', (1, 0), (1, -1), 'RIGHT'),
+        ('VALIGN', (1, 0), (1, -1), 'MIDDLE'),
+    ]))
+    elements.append(sig_table)
+
+    # Push footer toward bottom
+    elements.append(Spacer(1, 0.3*inch))
+    elements.extend(_footer())
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+# ──────────────────────────────────────────────
+#  Storage
+# ──────────────────────────────────────────────
+
+def storage_dir():
+    directory = current_app.config.get('CERTIFICATE_PDF_DIR') or os.path.join(current_app.instance_path, 'certificates')
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+
+def _write(path, pdf):
+    # Write then rename, so a concurrent download never reads half a file
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+    with os.fdopen(fd, 'wb') as fh:
+        fh.write(pdf)
+    os.replace(temp_path, path)
+
+
+def discard(cert):
+    """Remove a certificate's stored PDF (when the certificate is deleted)."""
+    if cert.pdf_path:
+        try:
+            os.remove(os.path.join(storage_dir(), cert.pdf_path))
+        except OSError:
+            pass
+
+
+def render_args(cert):
+    """(inputs, signature data): what ``render`` needs, picklable for a worker process."""
+    data = inputs(cert)
+    return data, (cert.issuer.signature_data if data['signature'] else None)
+
+
+def pdf_name(data):
+    return f'{fingerprint(data)}.pdf'
+
+
+def store(cert, name, pdf=None):
+    """
+    Make ``name`` the certificate's stored PDF, writing ``pdf`` first if
+    given. Removes a file rendered from since-changed inputs; the caller
+    commits the new ``pdf_path``.
+    """
+    if pdf is not None:
+        _write(os.path.join(storage_dir(), name), pdf)
+    if cert.pdf_path != name:
+        discard(cert)
+        cert.pdf_path = name
+
+
+def stored_pdf(cert):
+    """
+    Path of the certificate's PDF for its current inputs, rendering and
+    storing it first if needed. Commits when ``pdf_path`` moves.
+    """
+    data, signature = render_args(cert)
+    name = pdf_name(data)
+    path = os.path.join(storage_dir(), name)
+    moved = cert.pdf_path != name
+    store(cert, name, None if os.path.exists(path) else render(data, signature))
+    if moved:
+        db.session.commit()
+    return path
@@ -0,0 +1,224 @@
+"""
+Public health certificate verification for ISUFST CareHub.
+
+Employers verify a certificate by its number (HC-<year>-<number>) or by
+the signed token in the QR printed on the PDF. Lookups go through a
+read-through cache that also remembers misses, so repeated scans and
+number scraping are answered from memory:
+
+    found        POSITIVE_TTL seconds
+    not found    NEGATIVE_TTL seconds
+
+A number above its year's certificate sequence is rejected without a
+query, and a malformed number or a token with a bad signature never
+reaches the cache. Commits that touch a certificate drop its entries in
+this process; other processes catch up within the TTLs.
+
+A number alone only confirms the certificate and a masked name, since
+numbers are sequential. The signed token also shows the full name and
+purpose.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from flask import url_for
+from sqlalchemy import inspect
+from sqlalchemy.orm import joinedload
+
+from models import db, local_today
+from models_extended import HealthCertificate, CertificateSequence
+import qr_tokens
+
+POSITIVE_TTL = 300
+NEGATIVE_TTL = 60
+SEQUENCE_TTL = 60
+MAX_ENTRIES = 10000
+
+NUMBER_PATTERN = re.compile(r'^HC-(\d{4})-(\d{1,9})$')
+
+
+class _TTLCache:
+    """LRU of (expires at, value) with separate lifetimes for hits and misses."""
+
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self.max_entries = max_entries
+        self.hits = self.negative_hits = self.misses = 0
+
+    def get(self, key):
+        """(True, value) for a live entry (value None: cached miss), else (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                self.misses += 1
+                return False, None
+            self._entries.move_to_end(key)
+            if entry[1] is None:
+                self.negative_hits += 1
+            else:
+                self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, value):
+        ttl = POSITIVE_TTL if value is not None else NEGATIVE_TTL
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+            }
+
+
+cache = _TTLCache()
+_sequences = (0.0, {})  # (valid until, {year: last number issued})
+
+
+# ──────────────────────────────────────────────
+#  Lookups
+# ──────────────────────────────────────────────
+
+def _mask(name):
+    """'Juan Dela Cruz' -> 'J*** D*** C***'."""
+    return ' '.join(f'{part[0]}***' for part in name.split() if part)
+
+
+def _record(cert):
+    return {
+        'id': cert.id,
+        'certificate_number': cert.certificate_number,
+        'student_name': cert.student.full_name,
+        'purpose': cert.purpose,
+        'issued_on': cert.issued_at.date(),
+        'valid_until': cert.valid_until,
+    }
+
+
+def _read_through(key, load):
+    found, record = cache.get(key)
+    if found:
+        return record
+    cert = load()
+    record = _record(cert) if cert is not None else None
+    cache.put(key, record)
+    if record is not None:
+        # Either way of asking finds the same entry next time
+        cache.put(('id', record['id']), record)
+        cache.put(('number', record['certificate_number']), record)
+    return record
+
+
+def _issued_upto(year):
+    """Last number issued for ``year`` per its sequence (None: no sequence row), refreshed every SEQUENCE_TTL."""
+    global _sequences
+    valid_until, sequences = _sequences
+    if valid_until <= time.monotonic():
+        sequences = dict(db.session.query(CertificateSequence.year, CertificateSequence.last_number).all())
+        _sequences = (time.monotonic() + SEQUENCE_TTL, sequences)
+    return sequences.get(year)
+
+
+def _query():
+    return HealthCertificate.query.options(joinedload(HealthCertificate.student))
+
+
+def by_number(number):
+    """Cached record for a certificate number, or None."""
+    number = (number or '').strip().upper()
+    match = NUMBER_PATTERN.match(number)
+    if not match:
+        return None
+    issued = _issued_upto(int(match.group(1)))
+    if issued is not None and int(match.group(2)) > issued:
+        return None  # Not issued yet: no query, nothing to cache
+    return _read_through(('number', number), lambda: _query().filter_by(certificate_number=number).first())
+
+
+def by_token(token):
+    """Cached record for a signed certificate token, or None (also for forged or foreign tokens)."""
+    try:
+        claims = qr_tokens.authenticate(token, qr_tokens.signing_keys())
+    except qr_tokens.InvalidToken:
+        return None
+    if claims.kind != qr_tokens.CERTIFICATE:
+        return None
+    return _read_through(('id', claims.object_id), lambda: _query().filter_by(id=claims.object_id).first())
+
+
+def token_for(cert):
+    """Signed token identifying ``cert``, printed on its PDF."""
+    # Verification ignores the token's expiry (an expired certificate is still reported), so any day fits
+    return qr_tokens.issue(qr_tokens.CERTIFICATE, cert.id, cert.valid_until or cert.issued_at.date() + timedelta(days=3650))
+
+
+def verify_url(cert):
+    return url_for('certificates.verify_token', token=token_for(cert), _external=True)
+
+
+def result(record, full=False, today=None):
+    """Public verification result for a record (None: not found)."""
+    if record is None:
+        return {'valid': False, 'status': 'not_found', 'message': 'No certificate found with these details.'}
+    today = today or local_today()
+    expired = record['valid_until'] is not None and record['valid_until'] < today
+    response = {
+        'valid': not expired,
+        'status': 'expired' if expired else 'valid',
+        'message': (f'This certificate expired on {record["valid_until"].strftime("%B %d, %Y")}.' if expired
+                    else 'This is a genuine certificate issued by ISUFST Health Services.'),
+        'certificate_number': record['certificate_number'],
+        'issued_on': record['issued_on'].isoformat(),
+        'valid_until': record['valid_until'].isoformat() if record['valid_until'] else None,
+        'student_name': record['student_name'] if full else _mask(record['student_name']),
+    }
+    if full:
+        response['purpose'] = record['purpose']
+    return response
+
+
+# ──────────────────────────────────────────────
+#  Write Hooks
+# ──────────────────────────────────────────────
+
+@db.event.listens_for(HealthCertificate, 'after_insert')
+@db.event.listens_for(HealthCertificate, 'after_update')
+@db.event.listens_for(HealthCertificate, 'after_delete')
+def _certificate_written(mapper, connection, cert):
+    keys = [('id', cert.id), ('number', cert.certificate_number)]
+    history = inspect(cert).attrs.certificate_number.history
+    keys.extend(('number', number) for number in history.deleted or ())
+    inspect(cert).session.info.setdefault('certificate_verify_dirty', set()).update(keys)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _apply_changes(session):
+    global _sequences
+    keys = session.info.pop('certificate_verify_dirty', None)
+    if keys:
+        cache.discard(*keys)
+        _sequences = (0.0, {})  # New numbers may have been issued
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop('certificate_verify_dirty', None)
@@ -2,22 +2,16 @@
 Health Certificate Management for ISUFST CareHub.
 Handles certificate issuance, viewing, and PDF generation.
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, send_file, Response, stream_with_context, make_response
 from flask_login import login_required, current_user
 from models import db, User, ClinicVisit, StudentProfile
 from models_extended import HealthCertificate
+from student_directory import search_students as search_students_index
 from datetime import datetime, timezone, date, timedelta
 from functools import wraps
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.lib.units import inch
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.enums import TA_CENTER, TA_LEFT
-from reportlab.lib.utils import ImageReader
-import os
-import io
-import base64
+import certificate_bulk
+import certificate_pdf
+import certificate_verify
 
 certificates = Blueprint('certificates', __name__, url_prefix='/certificates')
 
@@ -40,7 +34,12 @@ def admin_certificates():
     """Admin page to manage certificates."""
     # Get all issued certificates
     certs = HealthCertificate.query.order_by(HealthCertificate.issued_at.desc()).all()
-    return render_template('admin_certificates.html', certificates=certs, today=date.today())
+    batch = None
+    batch_id = request.args.get('batch')
+    if batch_id:
+        count = HealthCertificate.query.filter_by(batch_id=batch_id).count()
+        batch = {'id': batch_id, 'count': count} if count else None
+    return render_template('admin_certificates.html', certificates=certs, today=date.today(), batch=batch)
 
 
 @certificates.route('/admin/issue', methods=['GET', 'POST'])
@@ -65,9 +64,8 @@ def issue_certificate():
             flash('Invalid student selected.', 'error')
             return redirect(url_for('certificates.issue_certificate'))
         
-        # Generate certificate number
-        last_cert = HealthCertificate.query.order_by(HealthCertificate.id.desc()).first()
-        cert_number = f"HC-{date.today().year}-{(last_cert.id + 1) if last_cert else 1:04d}"
+        # Next number from the year's sequence (safe under concurrent issuance)
+        cert_number = certificate_bulk.allocate_numbers(1)[0]
         
         # Create certificate
         certificate = HealthCertificate(
@@ -96,6 +94,58 @@ def issue_certificate():
     return render_template('issue_certificate.html', recent_visits=recent_visits)
 
 
+@certificates.route('/admin/bulk', methods=['GET', 'POST'])
+@login_required
+@require_staff
+def bulk_issue():
+    """Issue the same certificate to a list of students."""
+    if request.method == 'POST':
+        text = request.form.get('student_numbers', '')
+        upload = request.files.get('student_file')
+        if upload and upload.filename:
+            text += '\n' + upload.read().decode('utf-8-sig', errors='replace')
+        student_numbers = certificate_bulk.parse_student_numbers(text)
+        purpose = request.form.get('purpose')
+        valid_months = request.form.get('valid_months', type=int, default=3)
+
+        if not student_numbers or not purpose:
+            flash('Students and purpose are required.', 'error')
+            return redirect(url_for('certificates.bulk_issue'))
+        if len(student_numbers) > certificate_bulk.MAX_BATCH:
+            flash(f'At most {certificate_bulk.MAX_BATCH} students per batch.', 'error')
+            return redirect(url_for('certificates.bulk_issue'))
+
+        batch_id, certs, unknown = certificate_bulk.issue_batch(
+            student_numbers, current_user.id, purpose, request.form.get('medical_findings'), valid_months
+        )
+        if unknown:
+            shown = ', '.join(unknown[:10]) + (f' and {len(unknown) - 10} more' if len(unknown) > 10 else '')
+            flash(f'No student found for: {shown}', 'warning')
+        if not certs:
+            return redirect(url_for('certificates.bulk_issue'))
+
+        flash(f'{len(certs)} certificates issued ({certs[0].certificate_number} to {certs[-1].certificate_number}).', 'success')
+        return redirect(url_for('certificates.admin_certificates', batch=batch_id))
+
+    return render_template('bulk_certificates.html', max_batch=certificate_bulk.MAX_BATCH)
+
+
+@certificates.route('/admin/batches/<batch_id>.zip')
+@login_required
+@require_staff
+def batch_zip(batch_id):
+    """ZIP of a batch's PDFs, streamed while they render."""
+    certs = certificate_bulk.batch_certificates(batch_id)
+    if not certs:
+        flash('Certificate batch not found.', 'error')
+        return redirect(url_for('certificates.admin_certificates'))
+    return Response(
+        stream_with_context(certificate_bulk.stream_zip(certs)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=Health_Certificates_{certs[0].certificate_number}.zip'}
+    )
+
+
 @certificates.route('/api/search-students')
 @login_required
 @require_staff
@@ -106,30 +156,33 @@ def search_students_api():
         return jsonify([])
     
     # Search by name or student ID
-    students = User.query.join(StudentProfile).filter(
-        User.role == 'student',
-        db.or_(
-            User.first_name.ilike(f'%{query}%'),
-            User.last_name.ilike(f'%{query}%'),
-            StudentProfile.student_id_number.ilike(f'%{query}%')
-        )
-    ).limit(10).all()
+    students = search_students_index(query, limit=10)
+    
+    # Latest completed visit per student, in one query
+    latest_visits = {}
+    if students:
+        latest = db.session.query(
+            ClinicVisit.student_id,
+            db.func.max(ClinicVisit.visit_date).label('visit_date')
+        ).filter(
+            ClinicVisit.student_id.in_([s['id'] for s in students]),
+            ClinicVisit.status == 'completed'
+        ).group_by(ClinicVisit.student_id).subquery()
+        for visit in ClinicVisit.query.join(latest, db.and_(
+            ClinicVisit.student_id == latest.c.student_id,
+            ClinicVisit.visit_date == latest.c.visit_date
+        )).filter(ClinicVisit.status == 'completed'):
+            latest_visits[visit.student_id] = visit
     
     results = []
     for student in students:
-        profile = student.student_profile
-        # Get latest completed visit
-        latest_visit = ClinicVisit.query.filter_by(
-            student_id=student.id,
-            status='completed'
-        ).order_by(ClinicVisit.visit_date.desc()).first()
-        
+        latest_visit = latest_visits.get(student['id'])
         results.append({
-            'id': student.id,
-            'name': student.full_name,
-            'student_id': profile.student_id_number if profile else 'N/A',
-            'course': profile.course if profile else 'N/A',
-            'year_level': profile.year_level if profile else None,
+            'id': student['id'],
+            'name': student['name'],
+            'student_id': student['student_id'] or 'N/A',
+            'course': student['course'] or 'N/A',
+            'year_level': student['year_level'],
             'latest_visit': {
                 'id': latest_visit.id,
                 'date': latest_visit.visit_date.strftime('%b %d, %Y'),
@@ -141,6 +194,43 @@ def search_students_api():
     return jsonify(results)
 
 
+# ═══════════ PUBLIC VERIFICATION ═══════════
+def _verification_response(body):
+    response = make_response(body)
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    return response
+
+
+@certificates.route('/verify')
+def verify_page():
+    """Public page: check a certificate by its number."""
+    number = request.args.get('number', '').strip()
+    result = certificate_verify.result(certificate_verify.by_number(number)) if number else None
+    return _verification_response(render_template('verify_certificate.html', number=number, result=result))
+
+
+@certificates.route('/verify/<token>')
+def verify_token(token):
+    """Public page opened by the QR code printed on a certificate."""
+    result = certificate_verify.result(certificate_verify.by_token(token), full=True)
+    return _verification_response(render_template('verify_certificate.html', number='', result=result))
+
+
+@certificates.route('/api/verify')
+def verify_api():
+    """Public API: ?number=HC-YYYY-NNNN or ?token=<QR token>."""
+    token = request.args.get('token', '').strip()
+    number = request.args.get('number', '').strip()
+    if token:
+        result = certificate_verify.result(certificate_verify.by_token(token), full=True)
+    elif number:
+        result = certificate_verify.result(certificate_verify.by_number(number))
+    else:
+        return jsonify({'error': 'number or token required'}), 400
+    return _verification_response(jsonify(result))
+
+
 @certificates.route('/view/<int:cert_id>')
 @login_required
 def view_certificate(cert_id):
@@ -158,7 +248,7 @@ def view_certificate(cert_id):
 @certificates.route('/download/<int:cert_id>')
 @login_required
 def download_certificate(cert_id):
-    """Generate and download PDF certificate."""
+    """Download the certificate PDF."""
     cert = HealthCertificate.query.get_or_404(cert_id)
     
     # Check permissions
@@ -166,297 +256,9 @@ def download_certificate(cert_id):
         flash('You can only download your own certificates.', 'error')
         return redirect(url_for('patient_dashboard.index'))
     
-    # Generate PDF
-    buffer = io.BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.4*inch, bottomMargin=0.5*inch)
-    
-    # Container for elements
-    elements = []
-    styles = getSampleStyleSheet()
-    
-    # Custom styles
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#1e40af'),
-        spaceAfter=4,
-        alignment=TA_CENTER,
-        fontName='Helvetica-Bold'
-    )
-    
-    subtitle_style = ParagraphStyle(
-        'CustomSubtitle',
-        parent=styles['Normal'],
-        fontSize=10,
-        textColor=colors.HexColor('#64748b'),
-        spaceAfter=12,
-        alignment=TA_CENTER
-    )
-    
-    heading_style = ParagraphStyle(
-        'SectionHeading',
-        parent=styles['Heading2'],
-        fontSize=11,
-        textColor=colors.HexColor('#1e293b'),
-        spaceAfter=6,
-        spaceBefore=8,
-        fontName='Helvetica-Bold'
-    )
-    
-    # Professional Header with Logos
-    header_elements = []
-    
-    # ISUFST Logo (left)
-    isufst_logo_path = os.path.join('static', 'images', 'isufst-logo.png')
-    isufst_logo = None
-    if os.path.exists(isufst_logo_path):
-        try:
-            isufst_logo = Image(isufst_logo_path, width=1*inch, height=0.65*inch)
-        except:
-            isufst_logo = ''
-    else:
-        isufst_logo = ''
-    
-    # Center Text - University Name Only
-    header_text = Paragraph(
-        "<b>ILOILO STATE UNIVERSITY OF FISHERIES SCIENCE AND TECHNOLOGY</b>",
-        ParagraphStyle(
-            'HeaderCenter',
-            parent=styles['Normal'],
-            fontSize=11,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#1e293b'),
-            leading=14,
-            fontName='Helvetica-Bold'
-        )
-    )
-    
-    # Bagong Pilipinas Logo (right)
-    bayan_logo_path = os.path.join('static', 'images', 'bayan.png')
-    bayan_logo = None
-    if os.path.exists(bayan_logo_path):
-        try:
-            bayan_logo = Image(bayan_logo_path, width=0.65*inch, height=0.65*inch)
-        except:
-            bayan_logo = ''
-    else:
-        bayan_logo = ''
-    
-    # Create header table
-    header_data = [[isufst_logo, header_text, bayan_logo]]
-    header_table = Table(header_data, colWidths=[1*inch, 5.5*inch, 1*inch])
-    header_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-        ('ALIGN', (1, 0), (1, 0), 'CENTER'),
-        ('ALIGN', (2, 0), (2, 0), 'RIGHT'),
-    ]))
-    elements.append(header_table)
-    elements.append(Spacer(1, 0.1*inch))
-    
-    # Verification text under university name
-    verification_text = Paragraph(
-        "This is an official health certificate issued by Iloilo State University of Fisheries Science and Technology Health Services.<br/>"
-        "For verification, please contact the clinic at clinic@isufst.edu.ph",
-        ParagraphStyle(
-            'Verification',
-            parent=styles['Normal'],
-            fontSize=8,
-            textColor=colors.HexColor('#64748b'),
-            alignment=TA_CENTER,
-            leading=10
-        )
-    )
-    elements.append(verification_text)
-    elements.append(Spacer(1, 0.15*inch))
-    
-    # CareHub Health Certificate Title
-    carehub_title = Paragraph(
-        "<font size=20 color='#2563eb'><b>CareHub Health Certificate</b></font>",
-        ParagraphStyle(
-            'CareHubTitle',
-            parent=styles['Normal'],
-            fontSize=20,
-            alignment=TA_CENTER,
-            textColor=colors.HexColor('#2563eb'),
-            fontName='Helvetica-Bold',
-            spaceAfter=6
-        )
-    )
-    elements.append(carehub_title)
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Certificate details table
-    student = cert.student
-    profile = student.student_profile
-    
-    cert_info = [
-        ['Certificate No:', cert.certificate_number, 'Date Issued:', cert.issued_at.strftime('%B %d, %Y')],
-        ['Valid Until:', cert.valid_until.strftime('%B %d, %Y') if cert.valid_until else 'N/A', '', ''],
-    ]
-    
-    cert_table = Table(cert_info, colWidths=[1.5*inch, 2*inch, 1.5*inch, 2*inch])
-    cert_table.setStyle(TableStyle([
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#64748b')),
-        ('TEXTCOLOR', (2, 0), (2, -1), colors.HexColor('#64748b')),
-        ('FONTNAME', (0, 0), (-1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-    ]))
-    elements.append(cert_table)
-    elements.append(Spacer(1, 0.1*inch))
-    
-    # Student Information
-    elements.append(Paragraph("STUDENT INFORMATION", heading_style))
-    student_info = [
-        ['Name:', student.full_name],
-        ['Student ID:', profile.student_id_number if profile else 'N/A'],
-        ['Course & Year:', f"{profile.course} - {profile.year_level}{['st','nd','rd','th'][min(profile.year_level-1,3) if profile.year_level else 3]} Year" if profile and profile.course else 'N/A'],
-        ['Blood Type:', profile.blood_type if profile and profile.blood_type else 'Not on record'],
-    ]
-    
-    student_table = Table(student_info, colWidths=[1.5*inch, 5*inch])
-    student_table.setStyle(TableStyle([
-        ('TEXTCOLOR', (0, 0), (0, -1), colors.HexColor('#64748b')),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 6),
-        ('VALIGN', (0, 0), (-1, -1), 'TOP'),
-    ]))
-    elements.append(student_table)
-    elements.append(Spacer(1, 0.1*inch))
-    
-    # Medical Findings
-    elements.append(Paragraph("MEDICAL FINDINGS", heading_style))
-    findings_text = cert.medical_findings or "General health check completed. No significant medical findings."
-    elements.append(Paragraph(findings_text, styles['Normal']))
-    elements.append(Spacer(1, 0.1*inch))
-    
-    # Purpose
-    elements.append(Paragraph("PURPOSE", heading_style))
-    elements.append(Paragraph(cert.purpose or "General purpose", styles['Normal']))
-    elements.append(Spacer(1, 0.2*inch))
-    
-    # Signature Section
-    issuer = cert.issuer
-    
-    # If issuer has a digital signature, use it
-    if issuer.signature_data and issuer.signature_data.startswith('data:image'):
-        try:
-            # Extract base64 data
-            sig_base64 = issuer.signature_data.split(',')[1]
-            sig_bytes = base64.b64decode(sig_base64)
-            sig_image = Image(io.BytesIO(sig_bytes), width=2*inch, height=0.8*inch)
-            
-            sig_data = [
-                ['', ''],
-                [sig_image, ''],
-                [f"{issuer.full_name}, RN", ''],
-                ['Issued by:', ''],
-                ['ISUFST Dingle Campus Health Services', ''],
-            ]
-        except:
-            # Fallback if signature parsing fails
-            sig_data = [
-                ['', ''],
-                ['_'*40, ''],
-                [f"{issuer.full_name}, RN", ''],
-                ['Issued by:', ''],
-                ['ISUFST Dingle Campus Health Services', ''],
-            ]
-    else:
-        # No signature - use line
-        sig_data = [
-            ['', ''],
-            ['_'*40, ''],
-            [f"{issuer.full_name}, RN", ''],
-            ['Issued by:', ''],
-            ['ISUFST Dingle Campus Health Services', ''],
-        ]
-    
-    sig_table = Table(sig_data, colWidths=[3*inch, 3*inch])
-    sig_table.setStyle(TableStyle([
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (0, -1), 10),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('TEXTCOLOR', (0, 3), (0, 3), colors.HexColor('#64748b')),
-        ('FONTSIZE', (0, 3), (0, 4), 8),
-    ]))
-    elements.append(sig_table)
-    
-    # Push footer toward bottom
-    elements.append(Spacer(1, 0.3*inch))
-    
-    # Footer with Core Values and Accreditation Logo
-    
-    # Core values text
-    core_values_text = Paragraph(
-        "<b>Integrity</b> . <b>Social Justice</b> . <b>Discipline</b> . <b>Academic Excellence</b>",
-        ParagraphStyle(
-            'CoreValues',
-            parent=styles['Normal'],
-            fontSize=9,
-            textColor=colors.HexColor('#1e293b'),
-            alignment=TA_LEFT,
-            fontName='Helvetica-Bold'
-        )
-    )
-    
-    # Accreditation logos (GCL and Heart)
-    gcl_logo_path = os.path.join('static', 'images', 'gcl.png')
-    heart_logo_path = os.path.join('static', 'images', 'heart.png')
-    
-    gcl_logo = None
-    if os.path.exists(gcl_logo_path):
-        try:
-            gcl_logo = Image(gcl_logo_path, width=1*inch, height=0.65*inch)
-        except:
-            gcl_logo = ''
-    else:
-        gcl_logo = ''
-    
-    heart_logo = None
-    if os.path.exists(heart_logo_path):
-        try:
-            heart_logo = Image(heart_logo_path, width=1*inch, height=0.65*inch)
-        except:
-            heart_logo = ''
-    else:
-        heart_logo = ''
-    
-    # Combine logos in a nested table (heart first, then GCL)
-    if gcl_logo and heart_logo:
-        logos_table = Table([[heart_logo, gcl_logo]], colWidths=[1.1*inch, 1.1*inch])
-        logos_table.setStyle(TableStyle([
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        logos_cell = logos_table
-    elif heart_logo:
-        logos_cell = heart_logo
-    elif gcl_logo:
-        logos_cell = gcl_logo
-    else:
-        logos_cell = ''
-    
-    # Create footer table
-    footer_data = [[core_values_text, logos_cell]]
-    footer_table = Table(footer_data, colWidths=[4*inch, 2.5*inch])
-    footer_table.setStyle(TableStyle([
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('ALIGN', (0, 0), (0, 0), 'LEFT'),
-        ('ALIGN', (1, 0), (1, 0), 'RIGHT'),
-    ]))
-    elements.append(footer_table)
-    
-    # Build PDF
-    doc.build(elements)
-    buffer.seek(0)
-    
+    # Served from storage; rendered only when the certificate's inputs change
     return send_file(
-        buffer,
+        certificate_pdf.stored_pdf(cert),
         mimetype='application/pdf',
         as_attachment=True,
         download_name=f'Health_Certificate_{cert.certificate_number}.pdf'
@@ -477,6 +279,7 @@ def delete_certificate(cert_id):
     
     db.session.delete(cert)
     db.session.commit()
+    certificate_pdf.discard(cert)
     
     flash(f'Certificate {cert_number} deleted successfully.', 'success')
     return redirect(url_for('certificates.admin_certificates'))
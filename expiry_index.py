@@ -0,0 +1,211 @@
+"""
+Expiry bucket index for ISUFST CareHub.
+
+Every medicine batch in stock carries an expiry bucket on its Inventory row
+(expired, within 7 days, within 30 days, within 90 days; NULL beyond that or
+when empty), and ExpiryBucketCount keeps batches / units per bucket. Buckets
+are set on every Inventory write and re-rolled daily as dates move, so
+expiry counts are a one-row read and expiry lists are an index range scan
+instead of loading batches and checking them in Python.
+"""
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import func, inspect, select, tuple_
+
+from models import db, Inventory, local_today, upsert, value_before_flush as _before
+from models_extended import ExpiryBucketCount
+
+EXPIRED = 'expired'
+WEEK = '7d'
+MONTH = '30d'
+QUARTER = '90d'
+# bucket -> last day (days from today) it covers; expired is anything before today
+HORIZONS = {WEEK: 7, MONTH: 30, QUARTER: 90}
+BUCKETS = (EXPIRED, WEEK, MONTH, QUARTER)
+# What Inventory.is_expiring_soon() calls expiring: within the next 30 days
+EXPIRING_SOON = (WEEK, MONTH)
+
+
+def bucket_for(expiry_date, quantity, category, today=None):
+    """Expiry bucket of a batch, or None if it is not medicine in stock or expires later."""
+    if category != 'Medicine' or not quantity or quantity <= 0 or expiry_date is None:
+        return None
+    today = today or local_today()
+    if expiry_date < today:
+        return EXPIRED
+    days = (expiry_date - today).days
+    for bucket in (WEEK, MONTH, QUARTER):
+        if days <= HORIZONS[bucket]:
+            return bucket
+    return None
+
+
+def _bucket_expression(today):
+    """SQL twin of ``bucket_for`` over the inventory columns."""
+    return sa.case(
+        (sa.or_(Inventory.category != 'Medicine', Inventory.quantity <= 0), None),
+        (Inventory.expiry_date < today, EXPIRED),
+        *[(Inventory.expiry_date <= today + timedelta(days=HORIZONS[b]), b) for b in (WEEK, MONTH, QUARTER)],
+        else_=None
+    )
+
+
+# ──────────────────────────────────────────────
+#  Write Hooks
+# ──────────────────────────────────────────────
+
+def _count(batch, bucket, batches, units):
+    session = inspect(batch).session
+    if session is None or bucket is None:
+        return
+    delta = session.info.setdefault('expiry_deltas', {}).setdefault(bucket, [0, 0])
+    delta[0] += batches
+    delta[1] += units
+
+
+@db.event.listens_for(Inventory.quantity, 'set', active_history=True)
+@db.event.listens_for(Inventory.expiry_bucket, 'set', active_history=True)
+def _keep_history(target, value, oldvalue, initiator):
+    pass
+
+
+@db.event.listens_for(Inventory, 'before_insert')
+@db.event.listens_for(Inventory, 'before_update')
+def _set_bucket(mapper, connection, batch):
+    bucket = bucket_for(batch.expiry_date, batch.quantity, batch.category)
+    if batch.expiry_bucket != bucket:
+        batch.expiry_bucket = bucket
+
+
+@db.event.listens_for(Inventory, 'after_insert')
+def _batch_added(mapper, connection, batch):
+    _count(batch, batch.expiry_bucket, 1, batch.quantity)
+
+
+@db.event.listens_for(Inventory, 'after_update')
+def _batch_changed(mapper, connection, batch):
+    _count(batch, _before(batch, 'expiry_bucket'), -1, -(_before(batch, 'quantity') or 0))
+    _count(batch, batch.expiry_bucket, 1, batch.quantity)
+
+
+@db.event.listens_for(Inventory, 'after_delete')
+def _batch_removed(mapper, connection, batch):
+    _count(batch, _before(batch, 'expiry_bucket'), -1, -(_before(batch, 'quantity') or 0))
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def _apply_deltas(session, flush_context):
+    deltas = session.info.pop('expiry_deltas', None)
+    if deltas:
+        apply_deltas(session, deltas)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_deltas(session):
+    session.info.pop('expiry_deltas', None)
+
+
+def apply_deltas(session, deltas):
+    """Add {bucket: [batches, units]} to the bucket counts (for writes that bypass the ORM)."""
+    now = datetime.now(timezone.utc)
+    # Buckets in a fixed order so concurrent writers lock counts alike
+    for bucket in sorted(deltas):
+        batches, units = deltas[bucket]
+        if not batches and not units:
+            continue
+        upsert(session, ExpiryBucketCount, {'bucket': bucket},
+               {'batches': batches, 'units': units, 'updated_at': now},
+               {'batches': ExpiryBucketCount.batches + batches, 'units': ExpiryBucketCount.units + units,
+                'updated_at': now})
+
+
+# ──────────────────────────────────────────────
+#  Daily Roll
+# ──────────────────────────────────────────────
+
+def roll(today=None):
+    """
+    Move batches into the buckets for ``today`` and recount every bucket.
+
+    Run daily just after local midnight (and safe to run any time, e.g. to
+    repair counts after a bulk SQL change). Returns {bucket: (batches, units)}.
+    """
+    today = today or local_today()
+    session = db.session
+    bucket = _bucket_expression(today)
+    # Only batches already bucketed or now inside the 90-day horizon can change
+    session.execute(
+        sa.update(Inventory).where(
+            sa.or_(
+                Inventory.expiry_bucket.isnot(None),
+                Inventory.expiry_date <= today + timedelta(days=HORIZONS[QUARTER])
+            ),
+            Inventory.expiry_bucket.is_distinct_from(bucket)
+        ).values(expiry_bucket=bucket).execution_options(synchronize_session=False)
+    )
+    # Writers add to the counts after changing their batch, so with the
+    # counts locked the recount sees every batch whose delta it overwrites
+    session.execute(select(ExpiryBucketCount.bucket).with_for_update()).all()
+    totals = {
+        row.expiry_bucket: (row.batches, int(row.units or 0)) for row in session.execute(
+            select(Inventory.expiry_bucket, func.count().label('batches'), func.sum(Inventory.quantity).label('units'))
+            .where(Inventory.expiry_bucket.isnot(None))
+            .group_by(Inventory.expiry_bucket)
+        )
+    }
+    now = datetime.now(timezone.utc)
+    existing = set(session.execute(select(ExpiryBucketCount.bucket)).scalars())
+    for name in BUCKETS:
+        batches, units = totals.get(name, (0, 0))
+        values = dict(batches=batches, units=units, as_of=today, updated_at=now)
+        if name in existing:
+            session.execute(sa.update(ExpiryBucketCount).where(ExpiryBucketCount.bucket == name).values(**values))
+        else:
+            session.execute(sa.insert(ExpiryBucketCount).values(bucket=name, **values))
+    session.commit()
+    return {name: totals.get(name, (0, 0)) for name in BUCKETS}
+
+
+def roll_job(app):
+    """Scheduler entry point for ``roll``."""
+    with app.app_context():
+        counts = roll()
+        print('[SCHEDULER] Rolled expiry buckets: ' + ', '.join(f'{b} {n}' for b, (n, _) in counts.items()))
+
+
+# ──────────────────────────────────────────────
+#  Reads
+# ──────────────────────────────────────────────
+
+def counts():
+    """{bucket: {'batches': n, 'units': n}} for every bucket."""
+    rows = {row.bucket: row for row in ExpiryBucketCount.query.all()}
+    return {
+        name: {
+            'batches': rows[name].batches if name in rows else 0,
+            'units': rows[name].units if name in rows else 0,
+        }
+        for name in BUCKETS
+    }
+
+
+def batch_count(buckets=EXPIRING_SOON):
+    """Number of batches in ``buckets``."""
+    return db.session.query(func.coalesce(func.sum(ExpiryBucketCount.batches), 0)).filter(
+        ExpiryBucketCount.bucket.in_(list(buckets))
+    ).scalar()
+
+
+def batches(buckets=EXPIRING_SOON, limit=50, after=None):
+    """
+    Batches in ``buckets``, soonest expiry first. Page with ``after``, the
+    (expiry_date, id) of the last batch of the previous page.
+    """
+    query = Inventory.query.filter(Inventory.expiry_bucket.in_(list(buckets)))
+    if after is not None:
+        query = query.filter(tuple_(Inventory.expiry_date, Inventory.id) > tuple(after))
+    query = query.order_by(Inventory.expiry_date, Inventory.id)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
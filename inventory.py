@@ -5,7 +5,14 @@ Handles medicine and equipment inventory CRUD operations.
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
 from flask_login import login_required, current_user
 from datetime import datetime, date
-from models import db, Inventory
+from sqlalchemy import func
+from models import db, Inventory, Medicine
+import expiry_index
+import inventory_import
+import medicine_catalog
+import reorder
+import stock_ledger
+from utils import dispense_prescription
 
 inventory = Blueprint('inventory', __name__, url_prefix='/inventory')
 
@@ -22,13 +29,26 @@ def require_staff(f):
     return decorated_function
 
 
+def _catalog_name(name, category):
+    """The catalog spelling a medicine name will be saved under (unchanged if it is new)."""
+    if category != 'Medicine':
+        return name
+    found = medicine_catalog.lookup([name]).get(name)
+    return found[1] if found else name
+
+
+def _render_form(item):
+    return render_template('inventory_form.html', item=item,
+                           catalog_names=[name for name, in db.session.query(Medicine.name).order_by(Medicine.name)])
+
+
 @inventory.route('/')
 @login_required
 @require_staff
 def list_inventory():
     """List all inventory items."""
     items = Inventory.query.order_by(Inventory.expiry_date.asc()).all()
-    return render_template('inventory.html', items=items)
+    return render_template('inventory.html', items=items, stock=reorder.stock_status())
 
 
 @inventory.route('/add', methods=['GET', 'POST'])
@@ -47,6 +67,10 @@ def add():
         if expiry_date_str:
             expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
         
+        if Inventory.query.filter_by(name=_catalog_name(name, category), batch_number=batch_number).first():
+            flash(f'Batch {batch_number} of {name} already exists. Edit it instead.', 'error')
+            return _render_form(None)
+        
         item = Inventory(
             name=name,
             batch_number=batch_number,
@@ -54,13 +78,14 @@ def add():
             quantity=quantity,
             expiry_date=expiry_date
         )
-        db.session.add(item)
+        with stock_ledger.movement(stock_ledger.RECEIPT, user_id=current_user.id):
+            db.session.add(item)
         db.session.commit()
         
-        flash(f'{name} added to inventory.', 'success')
+        flash(f'{item.name} added to inventory.', 'success')
         return redirect(url_for('inventory.list_inventory'))
     
-    return render_template('inventory_form.html', item=None)
+    return _render_form(None)
 
 
 @inventory.route('/<int:item_id>/edit', methods=['GET', 'POST'])
@@ -71,21 +96,31 @@ def edit(item_id):
     item = Inventory.query.get_or_404(item_id)
     
     if request.method == 'POST':
-        item.name = request.form.get('name')
-        item.batch_number = request.form.get('batch_number')
-        item.category = request.form.get('category')
-        item.quantity = int(request.form.get('quantity'))
+        name, batch_number = request.form.get('name'), request.form.get('batch_number')
+        duplicate = Inventory.query.filter(
+            Inventory.name == _catalog_name(name, request.form.get('category')),
+            Inventory.batch_number == batch_number, Inventory.id != item.id
+        ).first()
+        if duplicate:
+            flash(f'Batch {batch_number} of {name} already exists.', 'error')
+            return _render_form(item)
         
-        expiry_date_str = request.form.get('expiry_date')
-        if expiry_date_str:
-            item.expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
+        with stock_ledger.movement(user_id=current_user.id, note='Edited in inventory'):
+            item.name = name
+            item.batch_number = batch_number
+            item.category = request.form.get('category')
+            item.quantity = int(request.form.get('quantity'))
+            
+            expiry_date_str = request.form.get('expiry_date')
+            if expiry_date_str:
+                item.expiry_date = datetime.strptime(expiry_date_str, '%Y-%m-%d').date()
         
         db.session.commit()
         
         flash(f'{item.name} updated successfully.', 'success')
         return redirect(url_for('inventory.list_inventory'))
     
-    return render_template('inventory_form.html', item=item)
+    return _render_form(item)
 
 
 @inventory.route('/<int:item_id>/delete', methods=['POST'])
@@ -95,23 +130,165 @@ def delete(item_id):
     """Delete an inventory item."""
     item = Inventory.query.get_or_404(item_id)
     
-    db.session.delete(item)
+    with stock_ledger.movement(user_id=current_user.id, note='Batch deleted'):
+        db.session.delete(item)
     db.session.commit()
     
     flash(f'{item.name} deleted from inventory.', 'success')
     return redirect(url_for('inventory.list_inventory'))
 
 
+@inventory.route('/import', methods=['GET', 'POST'])
+@login_required
+@require_staff
+def bulk_import():
+    """Import many batches at once from a CSV/XLSX delivery sheet."""
+    result = None
+    if request.method == 'POST':
+        upload = request.files.get('file')
+        if not upload or not upload.filename:
+            flash('Choose a CSV or XLSX file to import.', 'error')
+            return redirect(url_for('inventory.bulk_import'))
+        
+        try:
+            result = inventory_import.import_batches(
+                upload.stream, upload.filename,
+                mode=request.form.get('mode', inventory_import.ADD),
+                user_id=current_user.id
+            )
+        except (inventory_import.InventoryImportError, ValueError) as e:
+            flash(str(e), 'error')
+            return redirect(url_for('inventory.bulk_import'))
+        
+        written = result['inserted'] + result['updated']
+        if result['error_count']:
+            flash(f'Imported {written} batch(es); {result["error_count"]} row(s) had errors and were skipped.', 'warning')
+        else:
+            flash(f'Imported {written} batch(es).', 'success')
+    
+    return render_template('inventory_import.html', result=result)
+
+
+@inventory.route('/catalog')
+@login_required
+@require_staff
+def catalog():
+    """Medicine catalog: canonical names, their spellings, generics and possible duplicates."""
+    medicines = Medicine.query.order_by(Medicine.name).all()
+    batch_counts = dict(
+        db.session.query(Inventory.medicine_id, func.count(Inventory.id))
+        .filter(Inventory.medicine_id.isnot(None)).group_by(Inventory.medicine_id).all()
+    )
+    return render_template('inventory_catalog.html', medicines=medicines, batch_counts=batch_counts,
+                           near_matches=medicine_catalog.near_matches(medicines))
+
+
+@inventory.route('/catalog/<int:medicine_id>', methods=['POST'])
+@login_required
+@require_staff
+def update_catalog(medicine_id):
+    """Add a spelling to a catalog medicine or set which generic it is a brand of."""
+    medicine = Medicine.query.get_or_404(medicine_id)
+    alias = (request.form.get('alias') or '').strip()
+    if alias and not medicine_catalog.add_alias(medicine, alias):
+        flash(f'"{alias}" already names another medicine; merge the two if they are the same.', 'error')
+        return redirect(url_for('inventory.catalog'))
+    
+    if 'generic_id' in request.form:
+        generic_id = request.form.get('generic_id', type=int)
+        try:
+            medicine_catalog.set_generic(medicine, Medicine.query.get(generic_id) if generic_id else None)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('inventory.catalog'))
+    
+    db.session.commit()
+    flash(f'{medicine.name} updated.', 'success')
+    return redirect(url_for('inventory.catalog'))
+
+
+@inventory.route('/catalog/<int:medicine_id>/merge', methods=['POST'])
+@login_required
+@require_staff
+def merge_catalog(medicine_id):
+    """Fold a duplicate catalog medicine into the one it really is."""
+    duplicate = Medicine.query.get_or_404(medicine_id)
+    survivor = Medicine.query.get_or_404(request.form.get('into_id', type=int))
+    name = duplicate.name
+    try:
+        medicine_catalog.merge(survivor, duplicate, user_id=current_user.id)
+    except ValueError as e:
+        flash(str(e), 'error')
+        return redirect(url_for('inventory.catalog'))
+    
+    db.session.commit()
+    flash(f'{name} merged into {survivor.name}.', 'success')
+    return redirect(url_for('inventory.catalog'))
+
+
 # API Endpoints
 @inventory.route('/api/expiring', methods=['GET'])
 @login_required
 def api_expiring():
-    """Get count of items expiring soon."""
-    expiring_items = Inventory.query.filter(
-        Inventory.category == 'Medicine',
-        Inventory.quantity > 0
-    ).all()
-    
-    count = sum(1 for item in expiring_items if item.is_expiring_soon())
-    
-    return jsonify({'count': count})
+    """
+    Count of batches expiring soon, counts per expiry bucket and a page of
+    batches. ``bucket`` (repeatable) picks the buckets listed (default: the
+    next 30 days); pass ``cursor`` from the previous page to continue.
+    """
+    buckets = request.args.getlist('bucket') or list(expiry_index.EXPIRING_SOON)
+    unknown = [b for b in buckets if b not in expiry_index.BUCKETS]
+    if unknown:
+        return jsonify({'error': f'Unknown bucket: {", ".join(unknown)}'}), 400
+    limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            day, item_id = cursor.split(':')
+            after = (date.fromisoformat(day), int(item_id))
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+
+    items = expiry_index.batches(buckets, limit=limit + 1, after=after)
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        next_cursor = f'{items[-1].expiry_date.isoformat()}:{items[-1].id}'
+
+    counts = expiry_index.counts()
+    return jsonify({
+        'count': sum(counts[b]['batches'] for b in expiry_index.EXPIRING_SOON),
+        'buckets': counts,
+        'items': [{
+            'id': item.id,
+            'name': item.name,
+            'batch_number': item.batch_number,
+            'quantity': item.quantity,
+            'expiry_date': item.expiry_date.isoformat(),
+            'bucket': item.expiry_bucket,
+        } for item in items],
+        'next_cursor': next_cursor,
+    })
+
+
+@inventory.route('/api/dispense', methods=['POST'])
+@login_required
+@require_staff
+def api_dispense():
+    """
+    Dispense a whole prescription FIFO in one transaction.
+
+    Body: {"items": [{"medicine_name": "Paracetamol", "quantity": 10}, ...],
+           "reference": "visit:12"}. Returns the allocation plan, or 409 with
+    the shortages if any item cannot be filled (nothing is dispensed then).
+    """
+    data = request.get_json(silent=True) or {}
+    try:
+        items = [(str(item['medicine_name']).strip(), int(item['quantity'])) for item in data.get('items') or []]
+        result = dispense_prescription(items, reference=data.get('reference'), user_id=current_user.id)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'Invalid prescription: {e}'}), 400
+    if not result['success']:
+        db.session.rollback()  # Release the batch locks
+    return jsonify(result), 200 if result['success'] else 409
@@ -0,0 +1,283 @@
+"""
+Bulk inventory import for ISUFST CareHub.
+
+Reads a CSV or XLSX delivery sheet row by row, validates each row, and
+upserts batches on (name, batch_number) in chunks: one multi-row INSERT ...
+ON CONFLICT per chunk, committed as it goes, so memory stays bounded however
+long the file is. Bad rows are reported with their line number and skipped.
+
+Chunks are written with Core statements, which bypass the ORM write hooks,
+so the import links the medicine catalog and feeds the stock ledger, expiry
+buckets and search index itself.
+
+Columns (header names are case-insensitive; aliases in HEADER_ALIASES):
+    name, batch_number, quantity, expiry_date[, category]
+"""
+import csv
+import io
+from datetime import date, datetime, timezone
+
+from sqlalchemy import select, tuple_
+
+from models import db, Inventory, dialect_insert, local_today
+import expiry_index
+import medicine_catalog
+import medicine_listing
+import search_index
+import stock_ledger
+from utils import sqlite_write_lock
+
+CHUNK_SIZE = 500
+MAX_REPORTED_ERRORS = 200
+
+# Stock from the file is added to what a batch already holds (a delivery),
+# or replaces it (a stock count)
+ADD = 'add'
+REPLACE = 'replace'
+
+CATEGORIES = ('Medicine', 'Equipment')
+REQUIRED = ('name', 'batch_number', 'quantity', 'expiry_date')
+HEADER_ALIASES = {
+    'name': 'name', 'medicine': 'name', 'medicine_name': 'name', 'item': 'name', 'item_name': 'name',
+    'batch_number': 'batch_number', 'batch': 'batch_number', 'batch_no': 'batch_number', 'lot': 'batch_number',
+    'lot_number': 'batch_number',
+    'quantity': 'quantity', 'qty': 'quantity',
+    'expiry_date': 'expiry_date', 'expiry': 'expiry_date', 'expiration': 'expiry_date',
+    'expiration_date': 'expiry_date', 'exp_date': 'expiry_date',
+    'category': 'category', 'type': 'category',
+}
+DATE_FORMATS = ('%Y-%m-%d', '%m/%d/%Y', '%m/%d/%y', '%d-%b-%Y', '%b %d, %Y')
+
+
+class InventoryImportError(ValueError):
+    """The file as a whole cannot be imported (bad format or header)."""
+
+
+def _openpyxl():
+    try:
+        import openpyxl
+    except ImportError:
+        raise InventoryImportError('XLSX import needs openpyxl (pip install openpyxl); upload a CSV instead')
+    return openpyxl
+
+
+# ──────────────────────────────────────────────
+#  Reading
+# ──────────────────────────────────────────────
+
+def _header(cells):
+    columns = [HEADER_ALIASES.get(str(c or '').strip().lower().replace(' ', '_').replace('.', '')) for c in cells]
+    missing = [c for c in REQUIRED if c not in columns]
+    if missing:
+        raise InventoryImportError(f'Missing column(s): {", ".join(missing)}')
+    return columns
+
+
+def _csv_rows(stream):
+    lines = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    try:
+        reader = csv.reader(lines)
+        columns = _header(next(reader, []))
+        for line, cells in enumerate(reader, start=2):
+            if any(c.strip() for c in cells):
+                yield line, dict(zip(columns, cells))
+    finally:
+        lines.detach()  # Leave the upload's stream open for its owner
+
+
+def _xlsx_rows(stream):
+    workbook = _openpyxl().load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        columns = _header(next(rows, ()))
+        for line, cells in enumerate(rows, start=2):
+            if any(c not in (None, '') for c in cells):
+                yield line, dict(zip(columns, cells))
+    finally:
+        workbook.close()
+
+
+def read_rows(stream, filename):
+    """Yield (line number, {column: raw value}) from a CSV or XLSX stream."""
+    if filename.lower().endswith('.xlsx'):
+        return _xlsx_rows(stream)
+    if filename.lower().endswith(('.csv', '.txt')):
+        return _csv_rows(stream)
+    raise InventoryImportError('Upload a .csv or .xlsx file')
+
+
+# ──────────────────────────────────────────────
+#  Validation
+# ──────────────────────────────────────────────
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    value = str(value or '').strip()
+    for fmt in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, fmt).date()
+        except ValueError:
+            continue
+    raise ValueError(f'Unrecognized expiry date "{value}" (use YYYY-MM-DD)')
+
+
+def validate(raw, today):
+    """Clean batch values from one raw row; raises ValueError with a readable message."""
+    name = str(raw.get('name') or '').strip()
+    batch_number = str(raw.get('batch_number') or '').strip()
+    if not name:
+        raise ValueError('Name is required')
+    if len(name) > 120:
+        raise ValueError('Name is longer than 120 characters')
+    if not batch_number:
+        raise ValueError('Batch number is required')
+    if len(batch_number) > 64:
+        raise ValueError('Batch number is longer than 64 characters')
+
+    quantity = raw.get('quantity')
+    try:
+        quantity = float(str(quantity).strip().replace(',', ''))
+    except ValueError:
+        raise ValueError(f'Quantity "{quantity}" is not a number')
+    if not quantity.is_integer() or quantity < 0:
+        raise ValueError('Quantity must be a whole number, 0 or more')
+
+    expiry_date = _parse_date(raw.get('expiry_date'))
+    category = str(raw.get('category') or 'Medicine').strip().title()
+    if category not in CATEGORIES:
+        raise ValueError(f'Category must be one of {", ".join(CATEGORIES)}')
+    if category == 'Medicine' and expiry_date < today:
+        raise ValueError(f'Batch already expired on {expiry_date.isoformat()}')
+    return {'name': name, 'batch_number': batch_number, 'quantity': int(quantity),
+            'expiry_date': expiry_date, 'category': category}
+
+
+# ──────────────────────────────────────────────
+#  Writing
+# ──────────────────────────────────────────────
+
+def _merge(rows, row, mode):
+    key = (row['name'], row['batch_number'])
+    if key in rows and mode == ADD:
+        # The same batch twice in one delivery: both quantities arrived
+        row['quantity'] += rows[key]['quantity']
+    rows[key] = row
+
+
+def _link_catalog(chunk, mode):
+    """Re-key a chunk by canonical catalog names (medicines only); spellings of one batch merge."""
+    connection = db.session.connection()
+    resolved, linked = {}, {}
+    for row in chunk.values():
+        if row['category'] == 'Medicine':
+            if row['name'] not in resolved:
+                resolved[row['name']] = medicine_catalog.resolve(connection, row['name'])
+            row['medicine_id'], row['name'] = resolved[row['name']]
+        else:
+            row['medicine_id'] = None
+        _merge(linked, row, mode)
+    return linked
+
+
+def _upsert_chunk(chunk, mode, user_id, note, stats):
+    """Write one chunk of validated rows ({(name, batch_number): values}) and commit it."""
+    session = db.session
+    today = local_today()
+    now = datetime.now(timezone.utc)
+    chunk = _link_catalog(chunk, mode)
+
+    existing_query = select(
+        Inventory.name, Inventory.batch_number, Inventory.quantity, Inventory.expiry_bucket
+    ).where(tuple_(Inventory.name, Inventory.batch_number).in_(list(chunk)))
+    if not sqlite_write_lock(session):
+        existing_query = existing_query.with_for_update()
+    existing = {(row.name, row.batch_number): row for row in session.execute(existing_query)}
+
+    values, deltas = [], {}
+    for key, row in chunk.items():
+        old = existing.get(key)
+        quantity = row['quantity'] + (old.quantity if old is not None and mode == ADD else 0)
+        bucket = expiry_index.bucket_for(row['expiry_date'], quantity, row['category'], today)
+        values.append(dict(row, quantity=quantity, expiry_bucket=bucket, created_at=now))
+        if old is not None and old.expiry_bucket:
+            delta = deltas.setdefault(old.expiry_bucket, [0, 0])
+            delta[0] -= 1
+            delta[1] -= old.quantity
+        if bucket:
+            delta = deltas.setdefault(bucket, [0, 0])
+            delta[0] += 1
+            delta[1] += quantity
+
+    # One cached statement run over the chunk: SQLAlchemy sends it as
+    # multi-row INSERT ... VALUES batches ("insertmanyvalues") with RETURNING
+    table = Inventory.__table__
+    statement = dialect_insert(session.get_bind())(table)
+    statement = statement.on_conflict_do_update(
+        index_elements=['name', 'batch_number'],
+        set_={column: statement.excluded[column]
+              for column in ('medicine_id', 'quantity', 'expiry_date', 'category', 'expiry_bucket')}
+    ).returning(table.c.id, table.c.name, table.c.batch_number)
+    ids = {
+        (name, batch_number): batch_id
+        for batch_id, name, batch_number in session.connection().execute(statement, values)
+    }
+
+    movements = []
+    for row in values:
+        key = (row['name'], row['batch_number'])
+        old = existing.get(key)
+        change = row['quantity'] - (old.quantity if old is not None else 0)
+        if change:
+            movements.append(dict(
+                kind=stock_ledger.RECEIPT if mode == ADD or old is None else stock_ledger.ADJUST,
+                reference='import', user_id=user_id, note=note,
+                medicine_name=row['name'], medicine_id=row['medicine_id'],
+                inventory_id=ids[key], batch_number=row['batch_number'],
+                quantity=change,
+            ))
+    if movements:
+        stock_ledger.apply_movements(session, movements)
+    expiry_index.apply_deltas(session, deltas)
+    search_index.reindex(session, search_index.INVENTORY, ids.values())
+    medicine_listing.mark_changed(session)
+    session.commit()
+
+    stats['inserted'] += len(chunk) - len(existing)
+    stats['updated'] += len(existing)
+
+
+def import_batches(stream, filename, mode=ADD, user_id=None):
+    """
+    Import inventory batches from an uploaded CSV/XLSX stream.
+
+    Returns {'rows', 'inserted', 'updated', 'error_count', 'errors'} where
+    errors lists the first MAX_REPORTED_ERRORS as {'line', 'error'}. Raises
+    InventoryImportError if the file cannot be read at all. Each chunk is committed
+    on its own, so a failure part-way keeps the chunks already written.
+    """
+    if mode not in (ADD, REPLACE):
+        raise ValueError(f'Unknown import mode: {mode}')
+    today = local_today()
+    stats = {'rows': 0, 'inserted': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+    note = f'Imported from {filename}'[:255]
+    chunk = {}
+
+    for line, raw in read_rows(stream, filename):
+        stats['rows'] += 1
+        try:
+            row = validate(raw, today)
+        except ValueError as e:
+            stats['error_count'] += 1
+            if len(stats['errors']) < MAX_REPORTED_ERRORS:
+                stats['errors'].append({'line': line, 'error': str(e)})
+            continue
+        _merge(chunk, row, mode)
+        if len(chunk) >= CHUNK_SIZE:
+            _upsert_chunk(chunk, mode, user_id, note, stats)
+            chunk = {}
+    if chunk:
+        _upsert_chunk(chunk, mode, user_id, note, stats)
+    return stats
@@ -0,0 +1,253 @@
+"""
+Kiosk check-in lane for ISUFST CareHub.
+
+A staff-signed-in kiosk scans appointment QR codes and, in one request and
+one transaction, verifies the signed token, creates the LogbookEntry and
+adds the student to the Queue; the queue display is broadcast once per
+request. Scans captured while the kiosk is offline are kept on the device
+and uploaded as a batch later: every scan carries a kiosk-generated scan
+id, so uploading the same scan twice applies it once, and an appointment
+already checked in today is reported as a duplicate instead of queued again.
+"""
+from datetime import datetime, timedelta, timezone
+from functools import wraps
+
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
+from flask_login import login_required, current_user
+from sqlalchemy.orm import joinedload
+
+from models import db, Appointment, LogbookEntry, Queue, User, local_date
+from models_extended import KioskScan
+import qr_tokens
+from utils import sqlite_write_lock
+
+kiosk = Blueprint('kiosk', __name__, url_prefix='/kiosk')
+
+MAX_BATCH = 200
+CHECKIN_WINDOW_DAYS = 7                 # Same window as the logbook's QR check-in
+MAX_OFFLINE_AGE = timedelta(hours=24)   # Older offline scans are refused rather than back-dated
+CLOCK_SKEW = timedelta(minutes=5)
+
+CHECKED_IN = 'checked_in'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+
+def require_staff(f):
+    """Decorator to require nurse or admin role."""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if current_user.role not in ['nurse', 'admin']:
+            if request.is_json:
+                return jsonify({'error': 'Staff only'}), 403
+            flash('Access denied. Staff only.', 'error')
+            return redirect(url_for('index'))
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+# ──────────────────────────────────────────────
+#  Check-In
+# ──────────────────────────────────────────────
+
+def _scanned_at(value, now):
+    """Scan time from the kiosk's ISO timestamp, or None if it cannot be used."""
+    if not value:
+        return now
+    try:
+        scanned = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if scanned.tzinfo is None:
+        scanned = scanned.replace(tzinfo=timezone.utc)
+    if scanned > now + CLOCK_SKEW or scanned < now - MAX_OFFLINE_AGE:
+        return None
+    return min(scanned, now)
+
+
+def _lock_check_ins(appointment_query):
+    """
+    Appointments locked against concurrent kiosks until commit, so two
+    kiosks scanning the same student cannot both check them in.
+    """
+    if sqlite_write_lock():
+        return appointment_query.all()
+    return appointment_query.order_by(Appointment.id).with_for_update(of=Appointment).all()
+
+
+def _student_info(student):
+    profile = student.student_profile
+    return {
+        'id': student.id,
+        'name': f'{student.first_name} {student.last_name}',
+        'student_id': profile.student_id_number if profile else 'N/A',
+    }
+
+
+def check_in_scans(scans, staff_id):
+    """
+    Apply kiosk scans ([{'scan_id', 'qr_data', 'scanned_at'}]) in one
+    transaction; returns one result dict per scan, in order.
+    """
+    now = datetime.now(timezone.utc)
+    results = [None] * len(scans)
+    accepted = []  # (index, scan id, appointment id, scanned at)
+
+    # Tokens are checked by signature alone, against the day of the scan
+    for index, scan in enumerate(scans):
+        scan_id = str(scan.get('scan_id') or '').strip()[:64]
+        scanned_at = _scanned_at(scan.get('scanned_at'), now)
+        if not scan_id:
+            results[index] = {'status': REJECTED, 'message': 'Scan id required'}
+            continue
+        if scanned_at is None:
+            results[index] = {'scan_id': scan_id, 'status': REJECTED, 'message': 'Scan time is missing or too old'}
+            continue
+        try:
+            claims = qr_tokens.check(str(scan.get('qr_data') or ''), today=local_date(scanned_at))
+        except qr_tokens.InvalidToken as e:
+            results[index] = {'scan_id': scan_id, 'status': REJECTED, 'message': str(e)}
+            continue
+        if claims.kind != qr_tokens.APPOINTMENT:
+            message = ('Medicine pickups are handled at the pharmacy counter'
+                       if claims.kind == qr_tokens.RESERVATION else 'Not an appointment check-in code')
+            results[index] = {'scan_id': scan_id, 'status': REJECTED, 'message': message}
+            continue
+        accepted.append((index, scan_id, claims.object_id, scanned_at))
+
+    if not accepted:
+        return results
+
+    appointments = {
+        appointment.id: appointment for appointment in _lock_check_ins(
+            Appointment.query.options(joinedload(Appointment.student).joinedload(User.student_profile))
+            .filter(Appointment.id.in_({appointment_id for _, _, appointment_id, _ in accepted}))
+        )
+    }
+    applied = {
+        row.scan_id: row for row in KioskScan.query.filter(
+            KioskScan.scan_id.in_([scan_id for _, scan_id, _, _ in accepted])
+        )
+    }
+    scan_days = {local_date(scanned_at) for _, _, _, scanned_at in accepted}
+    checked_in = {
+        (entry.appointment_id, entry.check_in_day): entry for entry in LogbookEntry.query.filter(
+            LogbookEntry.appointment_id.in_(list(appointments)),
+            LogbookEntry.check_in_day.in_(scan_days)
+        )
+    }
+
+    new_entries, recorded = [], []  # recorded: (scan id, logbook entry, outcome, scanned at)
+    for index, scan_id, appointment_id, scanned_at in accepted:
+        appointment = appointments.get(appointment_id)
+        if appointment is None:
+            results[index] = {'scan_id': scan_id, 'status': REJECTED,
+                              'message': f'Appointment #{appointment_id} not found'}
+            continue
+        student = _student_info(appointment.student)
+        if scan_id in applied:
+            # Re-upload of a scan that was already applied
+            results[index] = {'scan_id': scan_id, 'status': DUPLICATE, 'student': student,
+                              'message': 'Scan already recorded'}
+            continue
+
+        day = local_date(scanned_at)
+        if appointment.status in ('Cancelled', 'Completed'):
+            results[index] = {'scan_id': scan_id, 'status': REJECTED, 'student': student,
+                              'message': f'Appointment is {appointment.status}'}
+            continue
+        if abs((appointment.appointment_date - day).days) > CHECKIN_WINDOW_DAYS:
+            results[index] = {'scan_id': scan_id, 'status': REJECTED, 'student': student,
+                              'message': f'Appointment is for {appointment.appointment_date.strftime("%B %d, %Y")}'}
+            continue
+
+        applied[scan_id] = True
+        existing = checked_in.get((appointment.id, day))
+        if existing is not None:
+            # Scanned twice, on this kiosk or another: one check-in per appointment per day
+            recorded.append((scan_id, existing, DUPLICATE, scanned_at))
+            results[index] = {'scan_id': scan_id, 'status': DUPLICATE, 'student': student,
+                              'message': 'Already checked in today'}
+            continue
+
+        entry = LogbookEntry(
+            student_id=appointment.student_id,
+            student_name=student['name'],
+            student_number=student['student_id'] if student['student_id'] != 'N/A' else '',
+            purpose=appointment.service_type or 'Walk-in',
+            appointment_id=appointment.id,
+            attending_staff_id=staff_id,
+            check_in_time=scanned_at,
+            notes='Kiosk check-in',
+            status='Checked In'
+        )
+        # Queue by actual arrival, so offline scans keep their place
+        queued = Queue(student_name=student['name'], severity_score=3, arrival_time=scanned_at, status='Waiting')
+        db.session.add_all([entry, queued])
+        checked_in[(appointment.id, day)] = entry
+        recorded.append((scan_id, entry, CHECKED_IN, scanned_at))
+        new_entries.append((index, scan_id, entry, queued, student))
+
+    if recorded:
+        db.session.flush()  # Ids for the new entries
+        db.session.add_all([
+            KioskScan(scan_id=scan_id, logbook_entry_id=entry.id, outcome=outcome,
+                      scanned_at=scanned_at, kiosk_user_id=staff_id)
+            for scan_id, entry, outcome, scanned_at in recorded
+        ])
+    for index, scan_id, entry, queued, student in new_entries:
+        results[index] = {'scan_id': scan_id, 'status': CHECKED_IN, 'student': student,
+                          'logbook_entry_id': entry.id, 'queue_id': queued.id,
+                          'message': f'Welcome, {student["name"]}'}
+    db.session.commit()
+
+    if new_entries:
+        from queue_display import broadcast_queue_update
+        broadcast_queue_update()
+    return results
+
+
+# ──────────────────────────────────────────────
+#  Routes
+# ──────────────────────────────────────────────
+
+@kiosk.route('/')
+@login_required
+@require_staff
+def kiosk_page():
+    """Full-screen check-in kiosk."""
+    return render_template('kiosk.html', max_batch=MAX_BATCH)
+
+
+@kiosk.route('/api/check-in', methods=['POST'])
+@login_required
+@require_staff
+def check_in():
+    """
+    Check in one scan ({scan_id, qr_data, scanned_at}) or a batch
+    ({scans: [...]}, e.g. uploaded after the kiosk was offline).
+    """
+    data = request.get_json(force=True, silent=True)
+    if not data:
+        return jsonify({'error': 'No JSON data received'}), 400
+    scans = data.get('scans') if 'scans' in data else [data]
+    if not isinstance(scans, list) or not all(isinstance(scan, dict) for scan in scans):
+        return jsonify({'error': 'scans must be a list of objects'}), 400
+    if len(scans) > MAX_BATCH:
+        return jsonify({'error': f'At most {MAX_BATCH} scans per request'}), 413
+
+    try:
+        results = check_in_scans(scans, current_user.id)
+    except Exception as e:
+        db.session.rollback()
+        import traceback
+        print("=" * 80)
+        print("ERROR in kiosk check_in endpoint:")
+        print(traceback.format_exc())
+        print("=" * 80)
+        return jsonify({'error': f'Server error: {str(e)}'}), 500
+
+    counts = {CHECKED_IN: 0, DUPLICATE: 0, REJECTED: 0}
+    for result in results:
+        counts[result['status']] += 1
+    return jsonify({'success': True, 'results': results, 'counts': counts})
@@ -5,7 +5,9 @@ Digital clinic logbook for tracking student visits.
 from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, Response
 from flask_login import login_required, current_user
 from datetime import datetime, date, timezone, timedelta
-from models import db, LogbookEntry, User, Appointment
+from models import db, LogbookEntry, User, Appointment, local_today
+from student_directory import search_students as search_students_index
+from collections import defaultdict
 from functools import wraps
 import csv
 import io
@@ -29,17 +31,18 @@ def require_staff(f):
 @require_staff
 def admin_logbook():
     """Admin logbook view with filtering."""
-    filter_date = request.args.get('date', date.today().strftime('%Y-%m-%d'))
+    today = local_today()
+    filter_date = request.args.get('date', today.strftime('%Y-%m-%d'))
     filter_purpose = request.args.get('purpose', 'all')
     search = request.args.get('search', '')
     
     try:
         filter_date_obj = datetime.strptime(filter_date, '%Y-%m-%d').date()
     except ValueError:
-        filter_date_obj = date.today()
+        filter_date_obj = today
     
     query = LogbookEntry.query.filter(
-        db.func.date(LogbookEntry.check_in_time) == filter_date_obj
+        LogbookEntry.check_in_day == filter_date_obj
     )
     
     if filter_purpose != 'all':
@@ -57,16 +60,16 @@ def admin_logbook():
     
     # Stats for today
     today_total = LogbookEntry.query.filter(
-        db.func.date(LogbookEntry.check_in_time) == date.today()
+        LogbookEntry.check_in_day == today
     ).count()
     
     checked_in = LogbookEntry.query.filter(
-        db.func.date(LogbookEntry.check_in_time) == date.today(),
+        LogbookEntry.check_in_day == today,
         LogbookEntry.status == 'Checked In'
     ).count()
     
     completed_today = LogbookEntry.query.filter(
-        db.func.date(LogbookEntry.check_in_time) == date.today(),
+        LogbookEntry.check_in_day == today,
         LogbookEntry.status == 'Completed'
     ).count()
     
@@ -149,35 +152,28 @@ def search_students():
     if len(query) < 2:
         return jsonify([])
     
-    students = User.query.filter(
-        User.role == 'student',
-        db.or_(
-            (User.first_name + ' ' + User.last_name).ilike(f'%{query}%'),
-            User.email.ilike(f'%{query}%')
-        )
-    ).limit(10).all()
-    
-    # Get today's appointments for each student
-    results = []
-    for s in students:
-        today_appts = Appointment.query.filter(
-            Appointment.student_id == s.id,
-            Appointment.appointment_date == date.today(),
+    students = search_students_index(query, limit=10)
+    
+    # Today's appointments for all matches in one query
+    today_appts = defaultdict(list)
+    if students:
+        for a in Appointment.query.filter(
+            Appointment.student_id.in_([s['id'] for s in students]),
+            Appointment.appointment_date == local_today(),
             Appointment.status.in_(['Pending', 'Confirmed'])
-        ).all()
-        
-        results.append({
-            'id': s.id,
-            'name': f'{s.first_name} {s.last_name}',
-            'email': s.email,
-            'appointments': [{
-                'id': a.id,
-                'service': a.service_type,
-                'time': a.start_time.strftime('%I:%M %p')
-            } for a in today_appts]
-        })
-    
-    return jsonify(results)
+        ).order_by(Appointment.start_time):
+            today_appts[a.student_id].append(a)
+    
+    return jsonify([{
+        'id': s['id'],
+        'name': s['name'],
+        'email': s['email'],
+        'appointments': [{
+            'id': a.id,
+            'service': a.service_type,
+            'time': a.start_time.strftime('%I:%M %p')
+        } for a in today_appts[s['id']]]
+    } for s in students])
 
 
 @logbook.route('/admin/export')
@@ -185,18 +181,19 @@ def search_students():
 @require_staff
 def export_csv():
     """Export logbook entries to CSV."""
-    start_date = request.args.get('start', date.today().strftime('%Y-%m-%d'))
-    end_date = request.args.get('end', date.today().strftime('%Y-%m-%d'))
+    today = local_today()
+    start_date = request.args.get('start', today.strftime('%Y-%m-%d'))
+    end_date = request.args.get('end', today.strftime('%Y-%m-%d'))
     
     try:
         start = datetime.strptime(start_date, '%Y-%m-%d').date()
         end = datetime.strptime(end_date, '%Y-%m-%d').date()
     except ValueError:
-        start = end = date.today()
+        start = end = today
     
     entries = LogbookEntry.query.filter(
-        db.func.date(LogbookEntry.check_in_time) >= start,
-        db.func.date(LogbookEntry.check_in_time) <= end
+        LogbookEntry.check_in_day >= start,
+        LogbookEntry.check_in_day <= end
     ).order_by(LogbookEntry.check_in_time.asc()).all()
     
     output = io.StringIO()
@@ -205,7 +202,7 @@ def export_csv():
     
     for e in entries:
         writer.writerow([
-            e.check_in_time.strftime('%Y-%m-%d') if e.check_in_time else '',
+            e.check_in_day.strftime('%Y-%m-%d') if e.check_in_day else '',
             e.student_name,
             e.student_number or '',
             e.purpose,
@@ -0,0 +1,279 @@
+"""
+Medicine catalog for ISUFST CareHub.
+
+Free-text medicine names are resolved to one canonical Medicine row, so
+"Paracetamol 500mg Tab", "paracetamol 500 MG tablet" and "PARACETAMOL
+TABLET 500mg" stop splitting stock, reservations and consumption.
+Matching goes:
+
+  1. exact normalized spelling (every spelling seen is a MedicineAlias),
+  2. same base name, dosage form and strengths in another spelling
+     ("500mg paracetamol tabs"), when exactly one catalog entry fits,
+
+and otherwise a new catalog entry is created. A spelling that leaves out
+the strength or the form is never guessed onto an entry that has one
+(syrup and tablets are different stock); the catalog page lists such
+near-matches and staff merge the entries that are one medicine. Medicine batches and reservations are linked
+(and their names set to the canonical spelling) on every write, so stock
+joins and groupings run on integer keys.
+"""
+import difflib
+import re
+import unicodedata
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import inspect, select
+
+from models import db, Inventory, Medicine, MedicineAlias, MedicineReservation, dialect_insert, upsert
+
+STRENGTH = re.compile(r'^\d+(\.\d+)?(mg|g|mcg|ug|ml|l|iu|%)(/\d*(\.\d+)?(mg|g|ml|l)?)?$')
+DOSAGE_FORMS = {  # Spelling -> form
+    'tab': 'tablet', 'tabs': 'tablet', 'tablet': 'tablet', 'tablets': 'tablet',
+    'cap': 'capsule', 'caps': 'capsule', 'capsule': 'capsule', 'capsules': 'capsule',
+    'syr': 'syrup', 'syrup': 'syrup', 'susp': 'suspension', 'suspension': 'suspension',
+    'drops': 'drops', 'cream': 'cream', 'ointment': 'ointment', 'oint': 'ointment', 'gel': 'gel',
+    'inhaler': 'inhaler', 'neb': 'nebule', 'sachet': 'sachet', 'amp': 'ampule', 'ampule': 'ampule',
+    'vial': 'vial', 'inj': 'injection', 'injection': 'injection', 'solution': 'solution',
+    'soln': 'solution', 'lozenge': 'lozenge', 'lozenges': 'lozenge',
+}
+NEAR_MATCH_CUTOFF = 0.85  # Base names this similar are listed by near_matches
+
+
+# ──────────────────────────────────────────────
+#  Normalizing
+# ──────────────────────────────────────────────
+
+def normalize(name):
+    """Lowercase, accent-free, single-spaced spelling with strengths written as '500mg'."""
+    text = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode().lower()
+    text = re.sub(r'(\d)\s+(mg|g|mcg|ug|ml|l|iu|%)\b', r'\1\2', text)
+    text = re.sub(r'[^a-z0-9.%/]+', ' ', text)
+    return ' '.join(text.split())
+
+
+def strengths(normalized):
+    return frozenset(token for token in normalized.split() if STRENGTH.match(token))
+
+
+def base_name(normalized):
+    """``normalized`` without strengths and dosage forms ('paracetamol 500mg tab' -> 'paracetamol')."""
+    tokens = [t for t in normalized.split() if not STRENGTH.match(t) and t not in DOSAGE_FORMS]
+    return ' '.join(tokens) or normalized
+
+
+def dosage_forms(normalized):
+    return frozenset(DOSAGE_FORMS[token] for token in normalized.split() if token in DOSAGE_FORMS)
+
+
+def compatible(a, b):
+    """Whether two normalized spellings of one base name name the same product: same forms and strengths."""
+    return dosage_forms(a) == dosage_forms(b) and strengths(a) == strengths(b)
+
+
+# ──────────────────────────────────────────────
+#  Resolving
+# ──────────────────────────────────────────────
+# These take a Connection so the write hooks can use them mid-flush.
+
+def _insert(connection, model, **values):
+    insert = dialect_insert(connection)
+    if insert is not None:
+        connection.execute(insert(model).values(**values).on_conflict_do_nothing())
+    else:
+        connection.execute(model.__table__.insert().values(**values))
+
+
+def _find(connection, normalized):
+    medicine_id = connection.execute(
+        select(MedicineAlias.medicine_id).where(MedicineAlias.alias == normalized)
+    ).scalar()
+    if medicine_id is not None:
+        return medicine_id
+    candidates = [
+        medicine_id for medicine_id, spelling in connection.execute(
+            select(Medicine.id, Medicine.normalized_name).where(Medicine.base_name == base_name(normalized))
+        ) if compatible(normalized, spelling)
+    ]
+    if len(candidates) != 1:
+        return None
+    # Remember the spelling so the next lookup is exact
+    _insert(connection, MedicineAlias, alias=normalized, medicine_id=candidates[0],
+            created_at=datetime.now(timezone.utc))
+    return candidates[0]
+
+
+def find(connection, name):
+    """(medicine id, canonical name) for ``name``, or None if it is not in the catalog."""
+    normalized = normalize(name)
+    if not normalized:
+        return None
+    medicine_id = _find(connection, normalized)
+    if medicine_id is None:
+        return None
+    return tuple(connection.execute(select(Medicine.id, Medicine.name).where(Medicine.id == medicine_id)).one())
+
+
+def resolve(connection, name):
+    """(medicine id, canonical name) for ``name``, adding it to the catalog if it is new."""
+    found = find(connection, name)
+    if found is not None:
+        return found
+    normalized = normalize(name)
+    if not normalized:
+        raise ValueError('Medicine name is required')
+    now = datetime.now(timezone.utc)
+    display = ' '.join(str(name).split())[:120]
+    _insert(connection, Medicine, name=display, normalized_name=normalized,
+            base_name=base_name(normalized), created_at=now)
+    # Read back rather than RETURNING: a concurrent writer may have added it first
+    medicine_id = connection.execute(
+        select(Medicine.id).where(Medicine.normalized_name == normalized)
+    ).scalar_one()
+    _insert(connection, MedicineAlias, alias=normalized, medicine_id=medicine_id, created_at=now)
+    return tuple(connection.execute(select(Medicine.id, Medicine.name).where(Medicine.id == medicine_id)).one())
+
+
+def lookup(names):
+    """{name: (medicine id, canonical name)} for the ``names`` found in the catalog."""
+    connection = db.session.connection()
+    found = {}
+    for name in set(names):
+        match = find(connection, name)
+        if match is not None:
+            found[name] = match
+    return found
+
+
+# ──────────────────────────────────────────────
+#  Write Hooks
+# ──────────────────────────────────────────────
+
+def _name_changed(instance, attr):
+    return inspect(instance).attrs[attr].history.has_changes()
+
+
+@db.event.listens_for(Inventory, 'before_insert')
+@db.event.listens_for(Inventory, 'before_update')
+def _link_batch(mapper, connection, batch):
+    if batch.category != 'Medicine':
+        batch.medicine_id = None
+    elif batch.medicine_id is None or _name_changed(batch, 'name') or _name_changed(batch, 'category'):
+        batch.medicine_id, batch.name = resolve(connection, batch.name)
+
+
+@db.event.listens_for(MedicineReservation, 'before_insert')
+@db.event.listens_for(MedicineReservation, 'before_update')
+def _link_reservation(mapper, connection, reservation):
+    if reservation.medicine_id is None or _name_changed(reservation, 'medicine_name'):
+        reservation.medicine_id, reservation.medicine_name = resolve(connection, reservation.medicine_name)
+
+
+# ──────────────────────────────────────────────
+#  Catalog Maintenance
+# ──────────────────────────────────────────────
+
+def add_alias(medicine, spelling):
+    """Make ``spelling`` resolve to ``medicine``; returns False if it already names another one."""
+    normalized = normalize(spelling)
+    if not normalized:
+        return False
+    existing = MedicineAlias.query.filter_by(alias=normalized).first()
+    if existing is not None:
+        return existing.medicine_id == medicine.id
+    db.session.add(MedicineAlias(alias=normalized, medicine_id=medicine.id))
+    return True
+
+
+def set_generic(brand, generic):
+    """Record ``brand`` as a brand of ``generic`` (None clears it)."""
+    if generic is not None and (generic.id == brand.id or generic.generic_id == brand.id):
+        raise ValueError('A medicine cannot be its own generic')
+    brand.generic_id = generic.id if generic is not None else None
+
+
+def near_matches(medicines):
+    """
+    Pairs of ``medicines`` that may be one medicine under two entries: the
+    same (or a NEAR_MATCH_CUTOFF-similar) base name, where one spelling
+    leaves out the form or strength the other has ("paracetamol" and
+    "Paracetamol 500mg"). Listed for staff to merge; never merged unasked.
+    """
+    def may_be_same(a, b):
+        one, other = a.normalized_name, b.normalized_name
+        return all(x == y or not x or not y for x, y in ((dosage_forms(one), dosage_forms(other)),
+                                                         (strengths(one), strengths(other))))
+
+    by_base = {}
+    for medicine in medicines:
+        by_base.setdefault(medicine.base_name, []).append(medicine)
+    bases = sorted(by_base)
+    pairs = []
+    for index, base in enumerate(bases):
+        group = by_base[base]
+        candidates = [(a, b) for i, a in enumerate(group) for b in group[i + 1:]]
+        for close in difflib.get_close_matches(base, bases[index + 1:], n=3, cutoff=NEAR_MATCH_CUTOFF):
+            candidates.extend((a, b) for a in group for b in by_base[close])
+        pairs.extend(pair for pair in candidates if may_be_same(*pair))
+    return pairs
+
+
+def merge(survivor, duplicate, user_id=None):
+    """
+    Fold ``duplicate`` into ``survivor`` when two catalog entries are one
+    medicine. Its batches move to the survivor (a batch number both have
+    becomes one batch), as do its reservations, ledger rows, stock level and
+    spellings; then the duplicate is deleted. The caller commits.
+    """
+    # Imported here: both import this module
+    import stock_ledger
+    from utils import sqlite_write_lock
+    from models_extended import ReorderPoint, StockLevel, StockMovement
+
+    if survivor.id == duplicate.id:
+        raise ValueError('Pick two different medicines to merge')
+    session = db.session
+    query = Inventory.query.filter(Inventory.medicine_id.in_([survivor.id, duplicate.id])).order_by(Inventory.id)
+    if not sqlite_write_lock(session):
+        query = query.with_for_update()
+    batches = query.populate_existing().all()
+    kept = {batch.batch_number: batch for batch in batches if batch.medicine_id == survivor.id}
+    moved = [batch for batch in batches if batch.medicine_id == duplicate.id]
+    for batch in moved:
+        if batch.batch_number in kept:
+            # The ledger rows of a batch folded into the survivor's follow it
+            session.execute(sa.update(StockMovement).where(StockMovement.inventory_id == batch.id)
+                            .values(inventory_id=kept[batch.batch_number].id))
+
+    with stock_ledger.movement(stock_ledger.ADJUST, reference=f'medicine-merge:{duplicate.id}', user_id=user_id,
+                               note=f'Merged {duplicate.name} into {survivor.name}'):
+        for batch in moved:
+            same = kept.get(batch.batch_number)
+            if same is None:
+                batch.name = survivor.name  # _link_batch relinks it
+            else:
+                same.quantity += batch.quantity
+                same.expiry_date = min(same.expiry_date, batch.expiry_date)
+                session.delete(batch)
+        for reservation in MedicineReservation.query.filter_by(medicine_id=duplicate.id):
+            reservation.medicine_name = survivor.name
+
+    session.execute(sa.update(StockMovement).where(StockMovement.medicine_id == duplicate.id)
+                    .values(medicine_id=survivor.id, medicine_name=survivor.name))
+    # Moving the batches emptied the duplicate's level unless it had drifted; keep any remainder
+    leftover = session.execute(select(StockLevel.on_hand).where(StockLevel.medicine_id == duplicate.id)).scalar()
+    if leftover:
+        upsert(session, StockLevel, {'medicine_id': survivor.id}, {'on_hand': leftover},
+               {'on_hand': StockLevel.on_hand + leftover})
+    session.execute(sa.delete(StockLevel).where(StockLevel.medicine_id == duplicate.id))
+    session.execute(sa.delete(ReorderPoint).where(ReorderPoint.medicine_name == duplicate.name))
+
+    session.execute(sa.update(MedicineAlias).where(MedicineAlias.medicine_id == duplicate.id)
+                    .values(medicine_id=survivor.id))
+    session.execute(sa.update(Medicine).where(Medicine.generic_id == duplicate.id, Medicine.id != survivor.id)
+                    .values(generic_id=survivor.id))
+    if survivor.generic_id in (None, duplicate.id):
+        survivor.generic_id = duplicate.generic_id if duplicate.generic_id != survivor.id else None
+    session.expire(survivor, ['aliases', 'brands'])
+    session.expire(duplicate, ['aliases', 'brands'])
+    session.delete(duplicate)
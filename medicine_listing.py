@@ -0,0 +1,201 @@
+"""
+Cached student medicine listing for ISUFST CareHub.
+
+The medicines page and ``GET /api/v1/medicines`` show one row per catalog
+medicine: available-to-promise units (unexpired stock minus live holds),
+nearest expiry and batch count. The rows are built with one grouped query
+and kept in process until a commit touches inventory, reservations or the
+catalog, the next live hold lapses, the local day turns over, or
+MAX_AGE_SECONDS pass (to pick up writes made by other worker processes).
+Each build carries an ETag so unchanged pages are answered with 304.
+"""
+import hashlib
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import func, inspect
+
+from models import db, Inventory, Medicine, MedicineAlias, MedicineReservation, CLINIC_TZ, local_today
+
+MAX_AGE_SECONDS = 30
+EXPIRING_DAYS = 30
+RESERVED = 'Reserved'  # stock_holds.RESERVED; not imported to keep this module free of utils
+
+WATCHED_TABLES = frozenset(
+    model.__table__.name for model in (Inventory, MedicineReservation, Medicine, MedicineAlias)
+)
+
+
+class Listing:
+    """One build of the listing: ``rows`` (list of dicts), ``etag`` and ``built_at``."""
+
+    def __init__(self, rows, valid_until):
+        self.rows = rows
+        self.valid_until = valid_until
+        self.built_at = datetime.now(timezone.utc)
+        payload = json.dumps(rows, default=str, sort_keys=True).encode()
+        self.etag = hashlib.sha1(payload).hexdigest()
+
+    def is_fresh(self):
+        return time.monotonic() < self.valid_until
+
+
+_lock = threading.Lock()
+_listing = None
+_generation = 0  # Bumped on every invalidation, so a build racing a commit is not kept
+
+
+# ──────────────────────────────────────────────
+#  Building
+# ──────────────────────────────────────────────
+
+def _next_midnight_seconds(now):
+    local = now.astimezone(CLINIC_TZ)
+    midnight = datetime.combine(local.date() + timedelta(days=1), datetime.min.time(), tzinfo=CLINIC_TZ)
+    return (midnight - local).total_seconds()
+
+
+def _build():
+    now = datetime.now(timezone.utc)
+    today = local_today()
+    stock = db.session.query(
+        Inventory.medicine_id.label('medicine_id'),
+        func.sum(Inventory.quantity).label('units'),
+        func.min(Inventory.expiry_date).label('nearest_expiry'),
+        func.count(Inventory.id).label('batches'),
+    ).filter(
+        Inventory.medicine_id.isnot(None),
+        Inventory.quantity > 0,
+        Inventory.expiry_date >= today
+    ).group_by(Inventory.medicine_id).subquery()
+    held = db.session.query(
+        MedicineReservation.medicine_id.label('medicine_id'),
+        func.sum(MedicineReservation.quantity).label('units'),
+        func.min(MedicineReservation.hold_expires_at).label('next_lapse'),
+    ).filter(
+        MedicineReservation.status == RESERVED,
+        MedicineReservation.hold_expires_at > now
+    ).group_by(MedicineReservation.medicine_id).subquery()
+
+    query = db.session.query(
+        Medicine.id, Medicine.name, stock.c.units, stock.c.nearest_expiry, stock.c.batches,
+        func.coalesce(held.c.units, 0), held.c.next_lapse
+    ).join(stock, stock.c.medicine_id == Medicine.id).outerjoin(
+        held, held.c.medicine_id == Medicine.id
+    ).order_by(Medicine.name)
+
+    rows, next_lapse = [], None
+    for medicine_id, name, units, nearest_expiry, batches, held_units, lapse in query:
+        rows.append({
+            'id': medicine_id,
+            'name': name,
+            'available': max(int(units) - int(held_units), 0),
+            'on_hand': int(units),
+            'nearest_expiry': nearest_expiry,
+            'expiring_soon': (nearest_expiry - today).days <= EXPIRING_DAYS,
+            'batches': batches,
+        })
+        if lapse is not None:
+            if lapse.tzinfo is None:  # SQLite hands back naive UTC
+                lapse = lapse.replace(tzinfo=timezone.utc)
+            next_lapse = lapse if next_lapse is None else min(next_lapse, lapse)
+
+    # A lapsing hold frees units and midnight expires batches, both without a write
+    ttl = min(MAX_AGE_SECONDS, _next_midnight_seconds(now))
+    if next_lapse is not None:
+        ttl = min(ttl, max((next_lapse - now).total_seconds(), 0))
+    return Listing(rows, time.monotonic() + ttl)
+
+
+def current():
+    """The current Listing, rebuilt if a write or the clock has made it stale."""
+    global _listing
+    listing = _listing
+    if listing is not None and listing.is_fresh():
+        return listing
+    generation = _generation
+    listing = _build()
+    with _lock:
+        if generation == _generation:
+            _listing = listing
+    return listing
+
+
+def invalidate():
+    """Drop the cached listing; the next read rebuilds it."""
+    global _listing, _generation
+    with _lock:
+        _generation += 1
+        _listing = None
+
+
+# ──────────────────────────────────────────────
+#  Write Hooks
+# ──────────────────────────────────────────────
+
+def mark_changed(session):
+    """Invalidate the listing when ``session`` commits (for writes that bypass the ORM)."""
+    session.info['medicine_listing_dirty'] = True
+
+
+def _mark(instance):
+    session = inspect(instance).session
+    if session is not None:
+        mark_changed(session)
+
+
+@db.event.listens_for(Inventory, 'after_insert')
+@db.event.listens_for(Inventory, 'after_update')
+@db.event.listens_for(Inventory, 'after_delete')
+@db.event.listens_for(MedicineReservation, 'after_insert')
+@db.event.listens_for(MedicineReservation, 'after_update')
+@db.event.listens_for(MedicineReservation, 'after_delete')
+@db.event.listens_for(Medicine, 'after_insert')
+@db.event.listens_for(Medicine, 'after_update')
+@db.event.listens_for(Medicine, 'after_delete')
+def _row_written(mapper, connection, instance):
+    _mark(instance)
+
+
+@db.event.listens_for(db.session, 'do_orm_execute')
+def _statement_executed(orm_execute_state):
+    """Bulk UPDATE/DELETE/INSERT through the session (hold claims, the expiry sweep)."""
+    if not (orm_execute_state.is_update or orm_execute_state.is_delete or orm_execute_state.is_insert):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if isinstance(table, sa.Table) and table.name in WATCHED_TABLES:
+        mark_changed(orm_execute_state.session)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _apply_changes(session):
+    if session.info.pop('medicine_listing_dirty', None):
+        invalidate()
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop('medicine_listing_dirty', None)
+
+
+# ──────────────────────────────────────────────
+#  HTTP Helpers
+# ──────────────────────────────────────────────
+
+def page_etag(listing, *parts):
+    """ETag for a page showing ``listing`` plus per-viewer ``parts`` (user, CSRF token...)."""
+    digest = hashlib.sha1(listing.etag.encode())
+    for part in parts:
+        digest.update(b'\0' + str(part).encode())
+    return digest.hexdigest()
+
+
+def revalidate(response, etag):
+    """Mark ``response`` private and revalidated on every view under ``etag``."""
+    response.set_etag(etag)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
@@ -0,0 +1,69 @@
+"""Add local-day bucket columns for sargable date filters
+
+Revision ID: 3b9f2c7d41e8
+Revises: e0cc48ea8fdc
+Create Date: 2026-10-19 09:12:44.512306
+
+"""
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9f2c7d41e8'
+down_revision = 'e0cc48ea8fdc'
+branch_labels = None
+depends_on = None
+
+# (table, source timestamp column, local-day column)
+BUCKETS = [
+    ('clinic_visits', 'visit_date', 'visit_day'),
+    ('logbook_entries', 'check_in_time', 'check_in_day'),
+    ('medicine_reservations', 'reserved_at', 'reserved_day'),
+    ('visit_feedback', 'submitted_at', 'submitted_day'),
+    ('queues', 'arrival_time', 'arrival_day'),
+]
+
+CLINIC_TZ = ZoneInfo('Asia/Manila')
+
+
+def _backfill(table, source, target):
+    bind = op.get_bind()
+    if bind.dialect.name == 'postgresql':
+        op.execute(
+            f"UPDATE {table} SET {target} = ({source} AT TIME ZONE 'Asia/Manila')::date "
+            f"WHERE {source} IS NOT NULL"
+        )
+        return
+
+    # SQLite has no timezone database; convert in Python
+    rows = bind.execute(sa.text(
+        f'SELECT id, {source} FROM {table} WHERE {source} IS NOT NULL'
+    )).fetchall()
+    updates = []
+    for row_id, value in rows:
+        if isinstance(value, str):
+            value = datetime.fromisoformat(value)
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        updates.append({'id': row_id, 'day': value.astimezone(CLINIC_TZ).date().isoformat()})
+    if updates:
+        bind.execute(sa.text(f'UPDATE {table} SET {target} = :day WHERE id = :id'), updates)
+
+
+def upgrade():
+    for table, source, target in BUCKETS:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column(target, sa.Date(), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table}_{target}'), [target], unique=False)
+        _backfill(table, source, target)
+
+
+def downgrade():
+    for table, source, target in reversed(BUCKETS):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_{target}'))
+            batch_op.drop_column(target)
@@ -0,0 +1,78 @@
+"""Add inventory expiry buckets and per-bucket counts
+
+Revision ID: 4c8e2b7a1f63
+Revises: 9e4a7c1b3d58
+Create Date: 2026-10-19 20:12:37.604118
+
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4c8e2b7a1f63'
+down_revision = '9e4a7c1b3d58'
+branch_labels = None
+depends_on = None
+
+BUCKETS = (('7d', 7), ('30d', 30), ('90d', 90))
+
+
+def _bucket(expiry_date, today):
+    if expiry_date < today:
+        return 'expired'
+    days = (expiry_date - today).days
+    for bucket, horizon in BUCKETS:
+        if days <= horizon:
+            return bucket
+    return None
+
+
+def upgrade():
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('expiry_bucket', sa.String(length=10), nullable=True))
+        batch_op.create_index('ix_inventory_expiry_bucket', ['expiry_bucket', 'expiry_date', 'id'], unique=False)
+
+    expiry_bucket_counts = op.create_table('expiry_bucket_counts',
+    sa.Column('bucket', sa.String(length=10), nullable=False),
+    sa.Column('batches', sa.Integer(), nullable=False),
+    sa.Column('units', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('bucket')
+    )
+
+    # Bucket the medicine currently in stock
+    now = datetime.now(timezone.utc)
+    today = now.astimezone(ZoneInfo('Asia/Manila')).date()
+    inventory = sa.table('inventory',
+        sa.column('id', sa.Integer), sa.column('expiry_date', sa.Date), sa.column('quantity', sa.Integer),
+        sa.column('category', sa.String), sa.column('expiry_bucket', sa.String))
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(inventory.c.id, inventory.c.expiry_date, inventory.c.quantity)
+        .where(inventory.c.category == 'Medicine', inventory.c.quantity > 0, inventory.c.expiry_date.isnot(None))
+    ).all()
+    totals = defaultdict(lambda: [0, 0])
+    for batch_id, expiry_date, quantity in rows:
+        bucket = _bucket(expiry_date, today)
+        if bucket is None:
+            continue
+        bind.execute(inventory.update().where(inventory.c.id == batch_id).values(expiry_bucket=bucket))
+        totals[bucket][0] += 1
+        totals[bucket][1] += quantity
+    op.bulk_insert(expiry_bucket_counts, [
+        {'bucket': bucket, 'batches': totals[bucket][0], 'units': totals[bucket][1], 'as_of': today, 'updated_at': now}
+        for bucket in ('expired', '7d', '30d', '90d')
+    ])
+
+
+def downgrade():
+    op.drop_table('expiry_bucket_counts')
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.drop_index('ix_inventory_expiry_bucket')
+        batch_op.drop_column('expiry_bucket')
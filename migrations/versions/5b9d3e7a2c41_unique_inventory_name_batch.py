@@ -0,0 +1,40 @@
+"""Make inventory batches unique per (name, batch_number)
+
+Revision ID: 5b9d3e7a2c41
+Revises: e28b6d4f0a17
+Create Date: 2026-10-19 23:12:40.512837
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b9d3e7a2c41'
+down_revision = 'e28b6d4f0a17'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Existing duplicates keep their stock; all but the oldest row of each
+    # (name, batch_number) get the row id appended to the batch number
+    inventory = sa.table('inventory',
+        sa.column('id', sa.Integer), sa.column('name', sa.String), sa.column('batch_number', sa.String))
+    bind = op.get_bind()
+    first = sa.select(sa.func.min(inventory.c.id)).group_by(inventory.c.name, inventory.c.batch_number)
+    rows = bind.execute(
+        sa.select(inventory.c.id, inventory.c.batch_number).where(inventory.c.id.notin_(first))
+    ).all()
+    for batch_id, batch_number in rows:
+        bind.execute(inventory.update().where(inventory.c.id == batch_id).values(
+            batch_number=f'{batch_number}-{batch_id}'
+        ))
+
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_inventory_name_batch', ['name', 'batch_number'])
+
+
+def downgrade():
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_inventory_name_batch', type_='unique')
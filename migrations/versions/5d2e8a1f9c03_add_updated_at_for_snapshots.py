@@ -0,0 +1,41 @@
+"""Add updated_at change-tracking columns for snapshot exports
+
+Revision ID: 5d2e8a1f9c03
+Revises: 8c41d0a9e7f2
+Create Date: 2026-10-19 13:05:27.830114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5d2e8a1f9c03'
+down_revision = '8c41d0a9e7f2'
+branch_labels = None
+depends_on = None
+
+# (table, timestamp used to backfill updated_at)
+TABLES = [
+    ('appointments', 'created_at'),
+    ('clinic_visits', 'visit_date'),
+    ('logbook_entries', 'COALESCE(check_out_time, check_in_time)'),
+    ('medicine_reservations', 'COALESCE(picked_up_at, reserved_at)'),
+    ('visit_feedback', 'submitted_at'),
+    ('symptom_screenings', 'created_at'),
+]
+
+
+def upgrade():
+    for table, source in TABLES:
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.add_column(sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True))
+            batch_op.create_index(batch_op.f(f'ix_{table}_updated_at'), ['updated_at'], unique=False)
+        op.execute(f'UPDATE {table} SET updated_at = COALESCE({source}, CURRENT_TIMESTAMP)')
+
+
+def downgrade():
+    for table, source in reversed(TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(batch_op.f(f'ix_{table}_updated_at'))
+            batch_op.drop_column('updated_at')
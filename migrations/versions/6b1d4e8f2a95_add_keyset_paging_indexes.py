@@ -0,0 +1,38 @@
+"""Add (date, id) indexes for keyset-paged search
+
+Revision ID: 6b1d4e8f2a95
+Revises: c3e81f4a9d27
+Create Date: 2026-10-19 18:12:07.413920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6b1d4e8f2a95'
+down_revision = 'c3e81f4a9d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.create_index('ix_appointments_appointment_date_id', ['appointment_date', 'id'], unique=False)
+
+    with op.batch_alter_table('clinic_visits', schema=None) as batch_op:
+        batch_op.create_index('ix_clinic_visits_visit_date_id', ['visit_date', 'id'], unique=False)
+
+    with op.batch_alter_table('medicine_reservations', schema=None) as batch_op:
+        batch_op.create_index('ix_medicine_reservations_reserved_at_id', ['reserved_at', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('medicine_reservations', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicine_reservations_reserved_at_id')
+
+    with op.batch_alter_table('clinic_visits', schema=None) as batch_op:
+        batch_op.drop_index('ix_clinic_visits_visit_date_id')
+
+    with op.batch_alter_table('appointments', schema=None) as batch_op:
+        batch_op.drop_index('ix_appointments_appointment_date_id')
@@ -0,0 +1,247 @@
+"""Add medicine catalog and link batches, reservations and ledger to it
+
+Revision ID: 7f2c9a4e6b18
+Revises: 5b9d3e7a2c41
+Create Date: 2026-10-20 00:41:17.304529
+
+Existing names are grouped into catalog medicines the way medicine_catalog
+matches them: same normalized spelling, or same base name, dosage form and
+strengths. Nothing is merged on similarity alone ("Ampicillin" is not a typo
+of "Amoxicillin"); near-matches are only logged, and the catalog page lists
+them for staff to merge. Batches, reservations, ledger rows
+and stock levels are moved to each medicine's canonical spelling. Run
+``python rebuild_search_index.py inventory`` afterwards to refresh the
+search titles. The downgrade drops the catalog but keeps the merged names.
+"""
+import difflib
+import logging
+import re
+import unicodedata
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7f2c9a4e6b18'
+down_revision = '5b9d3e7a2c41'
+branch_labels = None
+depends_on = None
+
+# Frozen copy of medicine_catalog's matching rules as of this revision
+STRENGTH = re.compile(r'^\d+(\.\d+)?(mg|g|mcg|ug|ml|l|iu|%)(/\d*(\.\d+)?(mg|g|ml|l)?)?$')
+DOSAGE_FORMS = {
+    'tab': 'tablet', 'tabs': 'tablet', 'tablet': 'tablet', 'tablets': 'tablet',
+    'cap': 'capsule', 'caps': 'capsule', 'capsule': 'capsule', 'capsules': 'capsule',
+    'syr': 'syrup', 'syrup': 'syrup', 'susp': 'suspension', 'suspension': 'suspension',
+    'drops': 'drops', 'cream': 'cream', 'ointment': 'ointment', 'oint': 'ointment', 'gel': 'gel',
+    'inhaler': 'inhaler', 'neb': 'nebule', 'sachet': 'sachet', 'amp': 'ampule', 'ampule': 'ampule',
+    'vial': 'vial', 'inj': 'injection', 'injection': 'injection', 'solution': 'solution',
+    'soln': 'solution', 'lozenge': 'lozenge', 'lozenges': 'lozenge',
+}
+NEAR_MATCH_CUTOFF = 0.85  # Reported for review only, never merged
+
+log = logging.getLogger('alembic.runtime.migration')
+
+
+def _normalize(name):
+    text = unicodedata.normalize('NFKD', str(name or '')).encode('ascii', 'ignore').decode().lower()
+    text = re.sub(r'(\d)\s+(mg|g|mcg|ug|ml|l|iu|%)\b', r'\1\2', text)
+    text = re.sub(r'[^a-z0-9.%/]+', ' ', text)
+    return ' '.join(text.split())
+
+
+def _strengths(normalized):
+    return frozenset(token for token in normalized.split() if STRENGTH.match(token))
+
+
+def _base(normalized):
+    tokens = [t for t in normalized.split() if not STRENGTH.match(t) and t not in DOSAGE_FORMS]
+    return ' '.join(tokens) or normalized
+
+
+def _identity(normalized):
+    """Base name, dosage forms and strengths: spellings group only when all three agree."""
+    forms = frozenset(DOSAGE_FORMS[t] for t in normalized.split() if t in DOSAGE_FORMS)
+    return _base(normalized), forms, _strengths(normalized)
+
+
+def _group(weights):
+    """[(display spelling, {normalized spellings}, {raw spellings})] for {raw spelling: weight}."""
+    by_identity = defaultdict(lambda: (Counter(), set()))
+    for spelling, weight in weights.items():
+        normalized = _normalize(spelling)
+        if normalized:
+            spellings, normalized_set = by_identity[_identity(normalized)]
+            spellings[spelling] += weight
+            normalized_set.add(normalized)
+
+    groups = []
+    for _, (spellings, normalized) in sorted(by_identity.items(), key=lambda item: sorted(item[1][1])):
+        display = max(spellings, key=lambda s: (spellings[s], len(s), s))
+        groups.append((' '.join(display.split())[:120], normalized, set(spellings)))
+    _log_near_matches(groups)
+    return groups
+
+
+def _log_near_matches(groups):
+    """Log entries that may be the same medicine, for staff to merge on the catalog page if they are."""
+    by_base = defaultdict(list)
+    for display, normalized, _ in groups:
+        by_base[_base(_normalize(display))].append(display)
+    for base, displays in sorted(by_base.items()):
+        if len(displays) > 1:
+            log.info('Medicine catalog: kept apart (different form or strength): %s', ', '.join(sorted(displays)))
+    bases = sorted(by_base)
+    for index, base in enumerate(bases):
+        for close in difflib.get_close_matches(base, bases[index + 1:], n=3, cutoff=NEAR_MATCH_CUTOFF):
+            log.info('Medicine catalog: similar names kept apart, merge on the catalog page if they are the same: %s / %s',
+                     ', '.join(sorted(by_base[base])), ', '.join(sorted(by_base[close])))
+
+
+def upgrade():
+    medicines = op.create_table('medicines',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.Column('normalized_name', sa.String(length=120), nullable=False),
+    sa.Column('base_name', sa.String(length=120), nullable=False),
+    sa.Column('generic_id', sa.Integer(), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['generic_id'], ['medicines.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name'),
+    sa.UniqueConstraint('normalized_name')
+    )
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicines_base_name'), ['base_name'], unique=False)
+        batch_op.create_index(batch_op.f('ix_medicines_generic_id'), ['generic_id'], unique=False)
+
+    medicine_aliases = op.create_table('medicine_aliases',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('alias', sa.String(length=120), nullable=False),
+    sa.Column('medicine_id', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['medicine_id'], ['medicines.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('alias')
+    )
+    with op.batch_alter_table('medicine_aliases', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_medicine_aliases_medicine_id'), ['medicine_id'], unique=False)
+
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('medicine_id', sa.Integer(),
+                                      sa.ForeignKey('medicines.id', name='fk_inventory_medicine_id'), nullable=True))
+        batch_op.create_index(batch_op.f('ix_inventory_medicine_id'), ['medicine_id'], unique=False)
+    with op.batch_alter_table('medicine_reservations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('medicine_id', sa.Integer(),
+                                      sa.ForeignKey('medicines.id', name='fk_medicine_reservations_medicine_id'),
+                                      nullable=True))
+        batch_op.drop_index('ix_medicine_reservations_medicine_status')
+        batch_op.create_index('ix_medicine_reservations_medicine_status', ['medicine_id', 'status'], unique=False)
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('medicine_id', sa.Integer(),
+                                      sa.ForeignKey('medicines.id', name='fk_stock_movements_medicine_id'),
+                                      nullable=True))
+        batch_op.create_index(batch_op.f('ix_stock_movements_medicine_id'), ['medicine_id'], unique=False)
+
+    _backfill(medicines, medicine_aliases)
+
+
+def _backfill(medicines, medicine_aliases):
+    bind = op.get_bind()
+    inventory = sa.table('inventory',
+        sa.column('id', sa.Integer), sa.column('name', sa.String), sa.column('batch_number', sa.String),
+        sa.column('category', sa.String), sa.column('medicine_id', sa.Integer))
+    reservations = sa.table('medicine_reservations',
+        sa.column('medicine_name', sa.String), sa.column('medicine_id', sa.Integer))
+    movements = sa.table('stock_movements',
+        sa.column('medicine_name', sa.String), sa.column('medicine_id', sa.Integer))
+    levels = sa.table('stock_levels',
+        sa.column('medicine_name', sa.String), sa.column('on_hand', sa.Integer),
+        sa.column('updated_at', sa.DateTime(timezone=True)))
+    reorder_points = sa.table('reorder_points', sa.column('medicine_name', sa.String))
+
+    batches = bind.execute(sa.select(
+        inventory.c.id, inventory.c.name, inventory.c.batch_number, inventory.c.category
+    ).order_by(inventory.c.id)).all()
+    # Batches decide the display spelling; names only ever reserved count by reservations
+    weights = Counter(name for _, name, _, category in batches if category == 'Medicine')
+    for name, count in bind.execute(
+        sa.select(reservations.c.medicine_name, sa.func.count()).group_by(reservations.c.medicine_name)
+    ):
+        if name not in weights:
+            weights[name] = count
+    if not weights:
+        return
+
+    now = datetime.now(timezone.utc)
+    canonical = {}  # raw spelling -> (medicine id, display)
+    for display, normalized, spellings in _group(weights):
+        medicine_id = bind.execute(medicines.insert().values(
+            name=display, normalized_name=_normalize(display), base_name=_base(_normalize(display)),
+            created_at=now
+        ).returning(medicines.c.id)).scalar_one()
+        bind.execute(medicine_aliases.insert(), [
+            {'alias': alias, 'medicine_id': medicine_id, 'created_at': now} for alias in sorted(normalized)
+        ])
+        for spelling in spellings:
+            canonical[spelling] = (medicine_id, display)
+
+    # Batches: renaming may collide with a batch already under the canonical name
+    taken = {(name, batch_number) for _, name, batch_number, _ in batches}
+    for batch_id, name, batch_number, category in batches:
+        if category != 'Medicine' or name not in canonical:
+            continue
+        medicine_id, display = canonical[name]
+        values = {'medicine_id': medicine_id}
+        if display != name:
+            taken.discard((name, batch_number))
+            if (display, batch_number) in taken:
+                batch_number = f'{batch_number}-{batch_id}'
+            values.update(name=display, batch_number=batch_number)
+            taken.add((display, batch_number))
+        bind.execute(inventory.update().where(inventory.c.id == batch_id).values(**values))
+
+    for spelling, (medicine_id, display) in canonical.items():
+        bind.execute(reservations.update().where(reservations.c.medicine_name == spelling).values(
+            medicine_id=medicine_id, medicine_name=display))
+        bind.execute(movements.update().where(movements.c.medicine_name == spelling).values(
+            medicine_id=medicine_id, medicine_name=display))
+
+    # Fold the on-hand totals of merged spellings into the canonical row
+    on_hand = dict(bind.execute(sa.select(levels.c.medicine_name, levels.c.on_hand)).all())
+    merged = defaultdict(int)
+    for spelling, (_, display) in canonical.items():
+        if spelling != display and spelling in on_hand:
+            merged[display] += on_hand[spelling]
+            bind.execute(levels.delete().where(levels.c.medicine_name == spelling))
+            # Forecasts of the merged spellings are recomputed by the nightly refresh
+            bind.execute(reorder_points.delete().where(reorder_points.c.medicine_name == spelling))
+    for display, units in merged.items():
+        if display in on_hand:
+            bind.execute(levels.update().where(levels.c.medicine_name == display).values(
+                on_hand=levels.c.on_hand + units, updated_at=now))
+        else:
+            bind.execute(levels.insert().values(medicine_name=display, on_hand=units, updated_at=now))
+
+
+def downgrade():
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stock_movements_medicine_id'))
+        batch_op.drop_column('medicine_id')
+    with op.batch_alter_table('medicine_reservations', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicine_reservations_medicine_status')
+        batch_op.create_index('ix_medicine_reservations_medicine_status', ['medicine_name', 'status'], unique=False)
+        batch_op.drop_column('medicine_id')
+    with op.batch_alter_table('inventory', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_inventory_medicine_id'))
+        batch_op.drop_column('medicine_id')
+    with op.batch_alter_table('medicine_aliases', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_medicine_aliases_medicine_id'))
+    op.drop_table('medicine_aliases')
+    with op.batch_alter_table('medicines', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_medicines_generic_id'))
+        batch_op.drop_index(batch_op.f('ix_medicines_base_name'))
+    op.drop_table('medicines')
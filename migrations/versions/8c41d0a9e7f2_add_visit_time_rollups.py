@@ -0,0 +1,43 @@
+"""Add visit time rollups and queue served_at
+
+Revision ID: 8c41d0a9e7f2
+Revises: 3b9f2c7d41e8
+Create Date: 2026-10-19 11:40:02.194771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c41d0a9e7f2'
+down_revision = '3b9f2c7d41e8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('queues', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('served_at', sa.DateTime(timezone=True), nullable=True))
+
+    op.create_table('visit_time_rollups',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('day', sa.Date(), nullable=False),
+    sa.Column('hour', sa.Integer(), nullable=False),
+    sa.Column('service_type', sa.String(length=100), nullable=False),
+    sa.Column('wait_count', sa.Integer(), nullable=False),
+    sa.Column('wait_sketch', sa.Text(), nullable=True),
+    sa.Column('service_count', sa.Integer(), nullable=False),
+    sa.Column('service_sketch', sa.Text(), nullable=True),
+    sa.Column('patients_hll', sa.Text(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('day', 'hour', 'service_type', name='unique_visit_time_bucket')
+    )
+    # Existing history is folded in by rebuild_visit_metrics.py
+
+
+def downgrade():
+    op.drop_table('visit_time_rollups')
+    with op.batch_alter_table('queues', schema=None) as batch_op:
+        batch_op.drop_column('served_at')
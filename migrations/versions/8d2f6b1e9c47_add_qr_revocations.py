@@ -0,0 +1,38 @@
+"""Add revocation list for signed check-in QR tokens
+
+Revision ID: 8d2f6b1e9c47
+Revises: 7f2c9a4e6b18
+Create Date: 2026-10-20 02:16:48.519203
+
+No backfill: signed tokens are only issued from this revision on, and never
+for bookings that are already cancelled.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8d2f6b1e9c47'
+down_revision = '7f2c9a4e6b18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('qr_revocations',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('kind', sa.String(length=1), nullable=False),
+    sa.Column('object_id', sa.Integer(), nullable=False),
+    sa.Column('revoked_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('kind', 'object_id', name='uq_qr_revocations_kind_object')
+    )
+    with op.batch_alter_table('qr_revocations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_qr_revocations_expires_at'), ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('qr_revocations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_qr_revocations_expires_at'))
+    op.drop_table('qr_revocations')
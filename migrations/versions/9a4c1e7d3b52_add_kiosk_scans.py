@@ -0,0 +1,36 @@
+"""Add kiosk scan log for idempotent kiosk check-ins
+
+Revision ID: 9a4c1e7d3b52
+Revises: 8d2f6b1e9c47
+Create Date: 2026-10-20 09:41:12.306518
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a4c1e7d3b52'
+down_revision = '8d2f6b1e9c47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('kiosk_scans',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('scan_id', sa.String(length=64), nullable=False),
+    sa.Column('logbook_entry_id', sa.Integer(), nullable=True),
+    sa.Column('outcome', sa.String(length=20), nullable=False),
+    sa.Column('scanned_at', sa.DateTime(timezone=True), nullable=False),
+    sa.Column('received_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('kiosk_user_id', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['kiosk_user_id'], ['users.id'], ),
+    sa.ForeignKeyConstraint(['logbook_entry_id'], ['logbook_entries.id'], ondelete='SET NULL'),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('scan_id')
+    )
+
+
+def downgrade():
+    op.drop_table('kiosk_scans')
@@ -0,0 +1,85 @@
+"""Add medicine stock ledger and on-hand levels
+
+Revision ID: 9e4a7c1b3d58
+Revises: 6b1d4e8f2a95
+Create Date: 2026-10-19 19:03:44.518203
+
+"""
+from collections import defaultdict
+from datetime import datetime, timezone
+from zoneinfo import ZoneInfo
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4a7c1b3d58'
+down_revision = '6b1d4e8f2a95'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    stock_movements = op.create_table('stock_movements',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_name', sa.String(length=120), nullable=False),
+    sa.Column('inventory_id', sa.Integer(), nullable=True),
+    sa.Column('batch_number', sa.String(length=64), nullable=True),
+    sa.Column('kind', sa.String(length=20), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('balance_after', sa.Integer(), nullable=True),
+    sa.Column('reference', sa.String(length=64), nullable=True),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('note', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('created_day', sa.Date(), nullable=True),
+    sa.ForeignKeyConstraint(['inventory_id'], ['inventory.id'], ondelete='SET NULL'),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stock_movements_medicine_name'), ['medicine_name'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_movements_inventory_id'), ['inventory_id'], unique=False)
+        batch_op.create_index(batch_op.f('ix_stock_movements_created_at'), ['created_at'], unique=False)
+        batch_op.create_index('ix_stock_movements_kind_day', ['kind', 'created_day'], unique=False)
+
+    stock_levels = op.create_table('stock_levels',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_name', sa.String(length=120), nullable=False),
+    sa.Column('on_hand', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('medicine_name')
+    )
+
+    # Opening balance: one adjustment per batch currently in stock
+    now = datetime.now(timezone.utc)
+    today = now.astimezone(ZoneInfo('Asia/Manila')).date()
+    batches = op.get_bind().execute(sa.text(
+        'SELECT id, name, batch_number, quantity FROM inventory WHERE quantity <> 0 ORDER BY name, id'
+    )).all()
+    totals = defaultdict(int)
+    movements = []
+    for batch_id, name, batch_number, quantity in batches:
+        totals[name] += quantity
+        movements.append({
+            'medicine_name': name, 'inventory_id': batch_id, 'batch_number': batch_number,
+            'kind': 'adjust', 'quantity': quantity, 'balance_after': totals[name],
+            'note': 'Opening balance', 'created_at': now, 'created_day': today,
+        })
+    if movements:
+        op.bulk_insert(stock_movements, movements)
+        op.bulk_insert(stock_levels, [
+            {'medicine_name': name, 'on_hand': total, 'updated_at': now} for name, total in totals.items()
+        ])
+
+
+def downgrade():
+    op.drop_table('stock_levels')
+    with op.batch_alter_table('stock_movements', schema=None) as batch_op:
+        batch_op.drop_index('ix_stock_movements_kind_day')
+        batch_op.drop_index(batch_op.f('ix_stock_movements_created_at'))
+        batch_op.drop_index(batch_op.f('ix_stock_movements_inventory_id'))
+        batch_op.drop_index(batch_op.f('ix_stock_movements_medicine_name'))
+    op.drop_table('stock_movements')
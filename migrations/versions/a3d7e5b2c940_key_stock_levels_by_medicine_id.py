@@ -0,0 +1,57 @@
+"""Key stock levels by catalog medicine id
+
+Revision ID: a3d7e5b2c940
+Revises: f4a9c2e7b1d8
+Create Date: 2026-10-21 09:12:45.118302
+
+Levels are rebuilt from the batches, which the ledger keeps them equal to.
+Equipment (no catalog entry) no longer has a level.
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3d7e5b2c940'
+down_revision = 'f4a9c2e7b1d8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_table('stock_levels')
+    stock_levels = op.create_table('stock_levels',
+    sa.Column('medicine_id', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('on_hand', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['medicine_id'], ['medicines.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('medicine_id')
+    )
+    now = datetime.now(timezone.utc)
+    totals = op.get_bind().execute(sa.text(
+        'SELECT medicine_id, SUM(quantity) FROM inventory WHERE medicine_id IS NOT NULL GROUP BY medicine_id'
+    )).all()
+    if totals:
+        op.bulk_insert(stock_levels, [
+            {'medicine_id': medicine_id, 'on_hand': int(total or 0), 'updated_at': now} for medicine_id, total in totals
+        ])
+
+
+def downgrade():
+    op.drop_table('stock_levels')
+    stock_levels = op.create_table('stock_levels',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_name', sa.String(length=120), nullable=False),
+    sa.Column('on_hand', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('medicine_name')
+    )
+    now = datetime.now(timezone.utc)
+    totals = op.get_bind().execute(sa.text('SELECT name, SUM(quantity) FROM inventory GROUP BY name')).all()
+    if totals:
+        op.bulk_insert(stock_levels, [
+            {'medicine_name': name, 'on_hand': int(total or 0), 'updated_at': now} for name, total in totals
+        ])
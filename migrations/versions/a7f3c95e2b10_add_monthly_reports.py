@@ -0,0 +1,36 @@
+"""Add monthly report artifacts
+
+Revision ID: a7f3c95e2b10
+Revises: 5d2e8a1f9c03
+Create Date: 2026-10-19 14:22:09.417552
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7f3c95e2b10'
+down_revision = '5d2e8a1f9c03'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('monthly_reports',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.Date(), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('stats_json', sa.Text(), nullable=True),
+    sa.Column('pdf_data', sa.LargeBinary(), nullable=True),
+    sa.Column('pdf_sha256', sa.String(length=64), nullable=True),
+    sa.Column('error', sa.Text(), nullable=True),
+    sa.Column('started_at', sa.DateTime(timezone=True), nullable=True),
+    sa.Column('generated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('month')
+    )
+
+
+def downgrade():
+    op.drop_table('monthly_reports')
@@ -0,0 +1,45 @@
+"""Add certificate number sequence and bulk batch id
+
+Revision ID: b6e1d8a3f5c2
+Revises: 9a4c1e7d3b52
+Create Date: 2026-10-20 11:05:37.842190
+
+Seeds each year's sequence from the highest HC-<year>-<number> already issued.
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6e1d8a3f5c2'
+down_revision = '9a4c1e7d3b52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('certificate_sequences',
+    sa.Column('year', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('last_number', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('year')
+    )
+    with op.batch_alter_table('health_certificates', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('batch_id', sa.String(length=32), nullable=True))
+        batch_op.create_index(batch_op.f('ix_health_certificates_batch_id'), ['batch_id'], unique=False)
+
+    highest = {}
+    for (number,) in op.get_bind().execute(sa.text('SELECT certificate_number FROM health_certificates')):
+        parts = (number or '').split('-')
+        if len(parts) == 3 and parts[0] == 'HC' and parts[1].isdigit() and parts[2].isdigit():
+            year = int(parts[1])
+            highest[year] = max(highest.get(year, 0), int(parts[2]))
+    if highest:
+        sequences = sa.table('certificate_sequences', sa.column('year', sa.Integer), sa.column('last_number', sa.Integer))
+        op.bulk_insert(sequences, [{'year': year, 'last_number': number} for year, number in sorted(highest.items())])
+
+
+def downgrade():
+    with op.batch_alter_table('health_certificates', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_health_certificates_batch_id'))
+        batch_op.drop_column('batch_id')
+    op.drop_table('certificate_sequences')
@@ -0,0 +1,66 @@
+"""Add full-text search documents
+
+Revision ID: c3e81f4a9d27
+Revises: a7f3c95e2b10
+Create Date: 2026-10-19 15:48:36.201944
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e81f4a9d27'
+down_revision = 'a7f3c95e2b10'
+branch_labels = None
+depends_on = None
+
+# Must match models_extended.SEARCH_TSVECTOR_SQL for the planner to use the index
+TSVECTOR_SQL = (
+    "setweight(to_tsvector('simple', title), 'A') || "
+    "setweight(to_tsvector('simple', body), 'B')"
+)
+
+FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5("
+    "title, body, content='search_documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_documents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+]
+
+
+def upgrade():
+    op.create_table('search_documents',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('entity_type', sa.String(length=20), nullable=False),
+    sa.Column('entity_id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.Text(), nullable=False),
+    sa.Column('body', sa.Text(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('entity_type', 'entity_id', name='unique_search_document')
+    )
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute(f'CREATE INDEX ix_search_documents_tsv ON search_documents USING gin (({TSVECTOR_SQL}))')
+    elif dialect == 'sqlite':
+        for statement in FTS_DDL:
+            op.execute(statement)
+    # Documents are filled by rebuild_search_index.py
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX IF EXISTS ix_search_documents_tsv')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE IF EXISTS search_documents_fts')
+    op.drop_table('search_documents')
@@ -0,0 +1,35 @@
+"""Add per-medicine reorder points
+
+Revision ID: d71f5a3c9b20
+Revises: 4c8e2b7a1f63
+Create Date: 2026-10-19 20:58:12.340771
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd71f5a3c9b20'
+down_revision = '4c8e2b7a1f63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('reorder_points',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('medicine_name', sa.String(length=120), nullable=False),
+    sa.Column('daily_demand', sa.Float(), nullable=False),
+    sa.Column('demand_std', sa.Float(), nullable=False),
+    sa.Column('lead_time_days', sa.Integer(), nullable=False),
+    sa.Column('reorder_point', sa.Integer(), nullable=False),
+    sa.Column('computed_day', sa.Date(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('medicine_name')
+    )
+
+
+def downgrade():
+    op.drop_table('reorder_points')
@@ -0,0 +1,52 @@
+"""Add stock hold expiry to medicine reservations
+
+Revision ID: e28b6d4f0a17
+Revises: d71f5a3c9b20
+Create Date: 2026-10-19 21:41:05.918254
+
+"""
+from datetime import datetime, timedelta, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e28b6d4f0a17'
+down_revision = 'd71f5a3c9b20'
+branch_labels = None
+depends_on = None
+
+HOLD = timedelta(hours=48)
+
+
+def upgrade():
+    with op.batch_alter_table('medicine_reservations', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('hold_expires_at', sa.DateTime(timezone=True), nullable=True))
+        batch_op.create_index('ix_medicine_reservations_status_hold', ['status', 'hold_expires_at'], unique=False)
+        batch_op.create_index('ix_medicine_reservations_medicine_status', ['medicine_name', 'status'], unique=False)
+
+    # Open reservations get the standard hold from when they were made; ones
+    # that have long lapsed are expired quietly rather than notified
+    now = datetime.now(timezone.utc)
+    reservations = sa.table('medicine_reservations',
+        sa.column('id', sa.Integer), sa.column('status', sa.String),
+        sa.column('reserved_at', sa.DateTime(timezone=True)), sa.column('hold_expires_at', sa.DateTime(timezone=True)))
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(reservations.c.id, reservations.c.reserved_at).where(reservations.c.status == 'Reserved')
+    ).all()
+    for reservation_id, reserved_at in rows:
+        if reserved_at.tzinfo is None:
+            reserved_at = reserved_at.replace(tzinfo=timezone.utc)
+        expires = reserved_at + HOLD
+        bind.execute(reservations.update().where(reservations.c.id == reservation_id).values(
+            hold_expires_at=expires, status='Reserved' if expires > now else 'Expired'
+        ))
+
+
+def downgrade():
+    with op.batch_alter_table('medicine_reservations', schema=None) as batch_op:
+        batch_op.drop_index('ix_medicine_reservations_medicine_status')
+        batch_op.drop_index('ix_medicine_reservations_status_hold')
+        batch_op.drop_column('hold_expires_at')
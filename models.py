@@ -1,9 +1,82 @@
 from datetime import datetime, timezone, date, timedelta
+from zoneinfo import ZoneInfo
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+import sqlalchemy as sa
+from sqlalchemy import inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 
 db = SQLAlchemy()
 
+# Clinic calendar days are Philippine days, not UTC days
+CLINIC_TZ = ZoneInfo('Asia/Manila')
+
+
+def local_date(dt):
+    """Return the Asia/Manila calendar day of a timestamp (naive = UTC)."""
+    if dt is None:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(CLINIC_TZ).date()
+
+
+def local_today():
+    """Return today's date in the clinic's timezone."""
+    return datetime.now(CLINIC_TZ).date()
+
+
+def track_local_day(model, source, target):
+    """Keep ``model.target`` equal to the local day of ``model.source`` on insert and update."""
+    def _sync(mapper, connection, instance):
+        value = getattr(instance, source)
+        if value is None:
+            # Column defaults are applied after this hook; mirror them here
+            value = datetime.now(timezone.utc)
+            setattr(instance, source, value)
+        setattr(instance, target, local_date(value))
+
+    db.event.listen(model, 'before_insert', _sync)
+    db.event.listen(model, 'before_update', _sync)
+
+
+def value_before_flush(instance, attr):
+    """Value of ``attr`` before this flush's changes (for after_update/after_delete hooks)."""
+    history = inspect(instance).attrs[attr].history
+    return history.deleted[0] if history.deleted else getattr(instance, attr)
+
+
+def dialect_insert(bind):
+    """The INSERT construct with ON CONFLICT for ``bind``'s database, or None where it has none."""
+    return {'postgresql': pg_insert, 'sqlite': sqlite_insert}.get(bind.dialect.name)
+
+
+def upsert(session, model, keys, values, changes, returning=None):
+    """
+    Insert ``keys`` + ``values`` into ``model``, or apply ``changes`` to the
+    row with those keys if it exists; one atomic statement where the database
+    has ON CONFLICT. Returns the ``returning`` column of the row, if given.
+
+        upsert(session, StockLevel, {'medicine_id': 7}, {'on_hand': 5}, {'on_hand': StockLevel.on_hand + 5})
+    """
+    insert = dialect_insert(session.get_bind())
+    if insert is not None:
+        statement = insert(model).values(**keys, **values).on_conflict_do_update(
+            index_elements=list(keys), set_=changes
+        )
+        if returning is None:
+            session.execute(statement)
+            return None
+        return session.execute(statement.returning(returning)).scalar_one()
+
+    match = [getattr(model, key) == value for key, value in keys.items()]
+    if not session.execute(sa.update(model).where(*match).values(**changes)).rowcount:
+        session.execute(sa.insert(model).values(**keys, **values))
+    if returning is not None:
+        return session.execute(select(returning).where(*match)).scalar_one()
+    return None
+
 
 # ──────────────────────────────────────────────
 #  User / Auth
@@ -95,6 +168,7 @@ class ClinicVisit(db.Model):
         db.DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
     )
+    visit_day = db.Column(db.Date, index=True)  # Local (Asia/Manila) day of visit_date
     chief_complaint = db.Column(db.Text, nullable=False)
     diagnosis = db.Column(db.Text)
     treatment = db.Column(db.Text)
@@ -103,6 +177,12 @@ class ClinicVisit(db.Model):
         db.String(20),
         default='pending',  # pending | in_progress | completed
     )
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True
+    )
 
     # Relationships
     attending_nurse = db.relationship('User', foreign_keys=[attending_nurse_id])
@@ -110,6 +190,10 @@ class ClinicVisit(db.Model):
         'MedicationLog', backref='visit', lazy='dynamic', cascade='all, delete-orphan'
     )
 
+    __table_args__ = (
+        db.Index('ix_clinic_visits_visit_date_id', 'visit_date', 'id'),  # Keyset paging
+    )
+
     def __repr__(self):
         return f'<ClinicVisit #{self.id} – {self.status}>'
 
@@ -157,6 +241,47 @@ class MedicationLog(db.Model):
         return f'<MedicationLog visit={self.visit_id} med={self.medication_id}>'
 
 
+# ──────────────────────────────────────────────
+#  Medicine Catalog
+# ──────────────────────────────────────────────
+class Medicine(db.Model):
+    """Canonical medicine; batches, reservations and ledger rows point here.
+
+    Names are matched through ``medicine_catalog``: every spelling seen
+    (including the canonical one) is a MedicineAlias, so "Paracetamol 500mg
+    Tab" and "paracetamol 500 mg tablet" resolve to the same row. Brands point at their
+    generic through ``generic_id``.
+    """
+    __tablename__ = 'medicines'
+
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), unique=True, nullable=False)  # Display spelling
+    normalized_name = db.Column(db.String(120), unique=True, nullable=False)
+    base_name = db.Column(db.String(120), nullable=False, index=True)  # Without strength / dosage form
+    generic_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='SET NULL'), index=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    generic = db.relationship('Medicine', remote_side=[id], backref='brands')
+    aliases = db.relationship('MedicineAlias', backref='medicine', cascade='all, delete-orphan',
+                              order_by='MedicineAlias.alias')
+
+    def __repr__(self):
+        return f'<Medicine {self.name}>'
+
+
+class MedicineAlias(db.Model):
+    """A normalized spelling that resolves to a catalog medicine."""
+    __tablename__ = 'medicine_aliases'
+
+    id = db.Column(db.Integer, primary_key=True)
+    alias = db.Column(db.String(120), unique=True, nullable=False)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='CASCADE'), nullable=False, index=True)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+
+    def __repr__(self):
+        return f'<MedicineAlias {self.alias} -> {self.medicine_id}>'
+
+
 # ──────────────────────────────────────────────
 #  Inventory (FIFO Logic)
 # ──────────────────────────────────────────────
@@ -165,6 +290,8 @@ class Inventory(db.Model):
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(120), nullable=False, index=True)
+    # Catalog entry of medicine batches (NULL for equipment); set by medicine_catalog
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id'), index=True)
     batch_number = db.Column(db.String(64), nullable=False)
     expiry_date = db.Column(db.Date, nullable=False)
     quantity = db.Column(db.Integer, nullable=False, default=0)
@@ -177,6 +304,15 @@ class Inventory(db.Model):
         db.DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
     )
+    # expired | 7d | 30d | 90d for medicine in stock, else NULL; kept by expiry_index
+    expiry_bucket = db.Column(db.String(10))
+
+    medicine = db.relationship('Medicine', backref='batches')
+
+    __table_args__ = (
+        db.Index('ix_inventory_expiry_bucket', 'expiry_bucket', 'expiry_date', 'id'),
+        db.UniqueConstraint('name', 'batch_number', name='uq_inventory_name_batch'),  # Import upserts
+    )
 
     def is_expiring_soon(self):
         """Returns True if the expiry date is within 30 days."""
@@ -215,10 +351,20 @@ class Appointment(db.Model):
         db.DateTime(timezone=True),
         default=lambda: datetime.now(timezone.utc),
     )
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True
+    )
 
     # Relationships
     student = db.relationship('User', backref='appointments')
 
+    __table_args__ = (
+        db.Index('ix_appointments_appointment_date_id', 'appointment_date', 'id'),  # Keyset paging
+    )
+
     def has_conflict(self, other_appointment):
         """Check if this appointment conflicts with another appointment."""
         if self.appointment_date != other_appointment.appointment_date:
@@ -254,6 +400,8 @@ class Queue(db.Model):
         nullable=False,
         index=True
     )
+    arrival_day = db.Column(db.Date, index=True)  # Local (Asia/Manila) day of arrival_time
+    served_at = db.Column(db.DateTime(timezone=True))  # When the patient was called
     status = db.Column(
         db.String(20),
         nullable=False,
@@ -279,13 +427,39 @@ class MedicineReservation(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     student_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     medicine_name = db.Column(db.String(128), nullable=False)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id'))  # Set by medicine_catalog
     quantity = db.Column(db.Integer, default=1, nullable=False)
     status = db.Column(db.String(20), default='Reserved', nullable=False)
     reserved_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), nullable=False)
+    reserved_day = db.Column(db.Date, index=True)  # Local (Asia/Manila) day of reserved_at
     picked_up_at = db.Column(db.DateTime(timezone=True))
+    hold_expires_at = db.Column(db.DateTime(timezone=True))  # Stock is held for pickup until then
     notes = db.Column(db.Text)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True
+    )
 
     student = db.relationship('User', backref='medicine_reservations')
+    medicine = db.relationship('Medicine')
+
+    __table_args__ = (
+        db.Index('ix_medicine_reservations_reserved_at_id', 'reserved_at', 'id'),  # Keyset paging
+        db.Index('ix_medicine_reservations_status_hold', 'status', 'hold_expires_at'),  # Expiry sweep
+        db.Index('ix_medicine_reservations_medicine_status', 'medicine_id', 'status'),  # Held units
+    )
+
+    @property
+    def hold_expires_local(self):
+        """hold_expires_at in clinic time (SQLite hands back naive UTC)."""
+        if self.hold_expires_at is None:
+            return None
+        value = self.hold_expires_at
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value.astimezone(CLINIC_TZ)
 
     def __repr__(self):
         return f'<MedicineReservation {self.medicine_name} - {self.student_id}>'
@@ -334,10 +508,17 @@ class LogbookEntry(db.Model):
         default=lambda: datetime.now(timezone.utc),
         nullable=False
     )
+    check_in_day = db.Column(db.Date, index=True)  # Local (Asia/Manila) day of check_in_time
     check_out_time = db.Column(db.DateTime(timezone=True))
     attending_staff_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     notes = db.Column(db.Text)
     status = db.Column(db.String(20), default='Checked In', nullable=False)  # Checked In, Completed, Left
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True
+    )
 
     # Relationships
     student = db.relationship('User', foreign_keys=[student_id], backref='logbook_entries')
@@ -346,3 +527,12 @@ class LogbookEntry(db.Model):
 
     def __repr__(self):
         return f'<LogbookEntry {self.student_name} - {self.purpose} at {self.check_in_time}>'
+
+
+# ──────────────────────────────────────────────
+#  Local-day bucket maintenance
+# ──────────────────────────────────────────────
+track_local_day(ClinicVisit, 'visit_date', 'visit_day')
+track_local_day(Queue, 'arrival_time', 'arrival_day')
+track_local_day(MedicineReservation, 'reserved_at', 'reserved_day')
+track_local_day(LogbookEntry, 'check_in_time', 'check_in_day')
@@ -3,7 +3,7 @@ Extended models for ISUFST CareHub - Essential Features Only.
 Keeps only high-impact features: QR codes, feedback, certificates, symptom screening.
 """
 from datetime import datetime, timezone, date, timedelta, time
-from models import db
+from models import db, track_local_day
 from sqlalchemy import CheckConstraint, UniqueConstraint
 from enum import Enum
 
@@ -103,6 +103,13 @@ class VisitFeedback(db.Model):
     comments = db.Column(db.Text)
     is_anonymous = db.Column(db.Boolean, default=False)
     submitted_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    submitted_day = db.Column(db.Date, index=True)  # Local (Asia/Manila) day of submitted_at
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True
+    )
 
     # Relationships
     visit = db.relationship('ClinicVisit', backref=db.backref('feedback', uselist=False))
@@ -116,6 +123,9 @@ class VisitFeedback(db.Model):
         return f'<VisitFeedback visit={self.visit_id} rating={self.rating}>'
 
 
+track_local_day(VisitFeedback, 'submitted_at', 'submitted_day')
+
+
 # ──────────────────────────────────────────────
 #  Health Certificate Generation
 # ──────────────────────────────────────────────
@@ -133,6 +143,7 @@ class HealthCertificate(db.Model):
     valid_until = db.Column(db.Date)
     pdf_path = db.Column(db.String(500))  # Path to generated PDF
     digital_signature = db.Column(db.Text)
+    batch_id = db.Column(db.String(32), index=True)  # Set when issued through bulk issuance
 
     # Relationships
     student = db.relationship('User', foreign_keys=[student_id], backref='health_certificates')
@@ -142,6 +153,17 @@ class HealthCertificate(db.Model):
         return f'<HealthCertificate #{self.certificate_number}>'
 
 
+class CertificateSequence(db.Model):
+    """Last certificate number handed out per year (HC-<year>-<number>)."""
+    __tablename__ = 'certificate_sequences'
+
+    year = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    last_number = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<CertificateSequence {self.year}: {self.last_number}>'
+
+
 # ──────────────────────────────────────────────
 #  Symptom Pre-Screening
 # ──────────────────────────────────────────────
@@ -157,6 +179,12 @@ class SymptomScreening(db.Model):
     ai_suggestions = db.Column(db.Text)
     created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     linked_appointment_id = db.Column(db.Integer, db.ForeignKey('appointments.id'))
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+        index=True
+    )
 
     # Relationships
     student = db.relationship('User', backref='symptom_screenings')
@@ -164,3 +192,287 @@ class SymptomScreening(db.Model):
 
     def __repr__(self):
         return f'<SymptomScreening student={self.student_id} severity={self.severity_level}>'
+
+
+# ──────────────────────────────────────────────
+#  Wait / Service Time Rollups
+# ──────────────────────────────────────────────
+class VisitTimeRollup(db.Model):
+    """Hourly wait-time and service-time sketches per local day and service.
+
+    Sketch columns hold serialized ``sketches.QuantileSketch`` /
+    ``sketches.DistinctCounter`` state; rows are updated as visits complete and
+    merged at read time for any date range.
+    """
+    __tablename__ = 'visit_time_rollups'
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)  # Local (Asia/Manila) day
+    hour = db.Column(db.Integer, nullable=False)  # Local hour, 0-23
+    service_type = db.Column(db.String(100), nullable=False)  # Appointment service_type, or 'Walk-in'
+    wait_count = db.Column(db.Integer, default=0, nullable=False)
+    wait_sketch = db.Column(db.Text)  # Minutes from queue arrival to being called
+    service_count = db.Column(db.Integer, default=0, nullable=False)
+    service_sketch = db.Column(db.Text)  # Minutes from logbook check-in to check-out
+    patients_hll = db.Column(db.Text)  # Distinct students served
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (
+        UniqueConstraint('day', 'hour', 'service_type', name='unique_visit_time_bucket'),
+    )
+
+    def __repr__(self):
+        return f'<VisitTimeRollup {self.day} {self.hour:02d}h {self.service_type}>'
+
+
+# ──────────────────────────────────────────────
+#  Monthly Report Artifacts
+# ──────────────────────────────────────────────
+class MonthlyReport(db.Model):
+    """Rendered monthly clinic report PDF, generated once per closed month."""
+    __tablename__ = 'monthly_reports'
+
+    id = db.Column(db.Integer, primary_key=True)
+    month = db.Column(db.Date, unique=True, nullable=False)  # First day of the (local) month
+    status = db.Column(db.String(20), default='rendering', nullable=False)  # rendering | ready | failed
+    stats_json = db.Column(db.Text)  # Figures the PDF was rendered from
+    pdf_data = db.Column(db.LargeBinary)
+    pdf_sha256 = db.Column(db.String(64))
+    error = db.Column(db.Text)
+    started_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    generated_at = db.Column(db.DateTime(timezone=True))
+
+    def __repr__(self):
+        return f'<MonthlyReport {self.month:%Y-%m} {self.status}>'
+
+
+# ──────────────────────────────────────────────
+#  Full-Text Search Documents
+# ──────────────────────────────────────────────
+class SearchDocument(db.Model):
+    """Normalized searchable text for one patient, visit or inventory item.
+
+    Kept in sync on write by ``search_index``. The text index itself is
+    dialect-specific: a weighted tsvector GIN expression index on Postgres,
+    an FTS5 external-content table on SQLite (both created below).
+    """
+    __tablename__ = 'search_documents'
+
+    id = db.Column(db.Integer, primary_key=True)
+    entity_type = db.Column(db.String(20), nullable=False)  # patient | visit | inventory
+    entity_id = db.Column(db.Integer, nullable=False)
+    title = db.Column(db.Text, nullable=False, default='')  # Names; ranked above body matches
+    body = db.Column(db.Text, nullable=False, default='')
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    __table_args__ = (
+        UniqueConstraint('entity_type', 'entity_id', name='unique_search_document'),
+    )
+
+    def __repr__(self):
+        return f'<SearchDocument {self.entity_type}#{self.entity_id}>'
+
+
+SEARCH_TSVECTOR_SQL = (
+    "setweight(to_tsvector('simple', title), 'A') || "
+    "setweight(to_tsvector('simple', body), 'B')"
+)
+
+SEARCH_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS search_documents_fts USING fts5("
+    "title, body, content='search_documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER IF NOT EXISTS search_documents_au AFTER UPDATE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, title, body) "
+    "VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO search_documents_fts(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+]
+
+for _statement in SEARCH_FTS_DDL:
+    db.event.listen(SearchDocument.__table__, 'after_create', db.DDL(_statement).execute_if(dialect='sqlite'))
+db.event.listen(SearchDocument.__table__, 'after_create', db.DDL(
+    f'CREATE INDEX IF NOT EXISTS ix_search_documents_tsv ON search_documents USING gin (({SEARCH_TSVECTOR_SQL}))'
+).execute_if(dialect='postgresql'))
+db.event.listen(SearchDocument.__table__, 'before_drop', db.DDL(
+    'DROP TABLE IF EXISTS search_documents_fts'
+).execute_if(dialect='sqlite'))
+
+
+# ──────────────────────────────────────────────
+#  Medicine Stock Ledger
+# ──────────────────────────────────────────────
+class StockMovement(db.Model):
+    """Append-only stock ledger: one row per change to a batch's quantity.
+
+    Written by ``stock_ledger`` from Inventory inserts, updates and deletes;
+    never updated or deleted afterwards.
+    """
+    __tablename__ = 'stock_movements'
+
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_name = db.Column(db.String(120), nullable=False, index=True)
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id'), index=True)  # NULL for equipment
+    inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id', ondelete='SET NULL'), index=True)
+    batch_number = db.Column(db.String(64))
+    kind = db.Column(db.String(20), nullable=False)  # receipt | dispense | adjust | expire
+    quantity = db.Column(db.Integer, nullable=False)  # Signed change in units
+    balance_after = db.Column(db.Integer)  # Medicine on-hand right after this movement; NULL for equipment
+    reference = db.Column(db.String(64))  # What caused it, e.g. "reservation:12"
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+    note = db.Column(db.String(255))
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), index=True)
+    created_day = db.Column(db.Date)  # Local (Asia/Manila) day of created_at
+
+    __table_args__ = (
+        db.Index('ix_stock_movements_kind_day', 'kind', 'created_day'),
+    )
+
+    def __repr__(self):
+        return f'<StockMovement {self.kind} {self.medicine_name} {self.quantity:+d}>'
+
+
+class StockLevel(db.Model):
+    """Per-medicine on-hand total across batches, kept in step with the ledger (catalog medicines only)."""
+    __tablename__ = 'stock_levels'
+
+    medicine_id = db.Column(db.Integer, db.ForeignKey('medicines.id', ondelete='CASCADE'),
+                            primary_key=True, autoincrement=False)
+    on_hand = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f'<StockLevel medicine={self.medicine_id} on_hand={self.on_hand}>'
+
+
+# ──────────────────────────────────────────────
+#  Expiry Buckets
+# ──────────────────────────────────────────────
+class ExpiryBucketCount(db.Model):
+    """Batches and units of in-stock medicine per expiry bucket, kept by ``expiry_index``."""
+    __tablename__ = 'expiry_bucket_counts'
+
+    bucket = db.Column(db.String(10), primary_key=True)  # expired | 7d | 30d | 90d
+    batches = db.Column(db.Integer, nullable=False, default=0)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    as_of = db.Column(db.Date)  # Local day the buckets were last rolled
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f'<ExpiryBucketCount {self.bucket} batches={self.batches} units={self.units}>'
+
+
+# ──────────────────────────────────────────────
+#  Reorder Points
+# ──────────────────────────────────────────────
+class ReorderPoint(db.Model):
+    """Per-medicine demand forecast and reorder point, refreshed by ``reorder``."""
+    __tablename__ = 'reorder_points'
+
+    id = db.Column(db.Integer, primary_key=True)
+    medicine_name = db.Column(db.String(120), unique=True, nullable=False)
+    daily_demand = db.Column(db.Float, nullable=False, default=0.0)  # Forecast units per day
+    demand_std = db.Column(db.Float, nullable=False, default=0.0)  # Day-to-day spread of demand
+    lead_time_days = db.Column(db.Integer, nullable=False)
+    reorder_point = db.Column(db.Integer, nullable=False)  # Reorder when usable stock falls to this
+    computed_day = db.Column(db.Date)  # Local day of the last refresh
+    updated_at = db.Column(
+        db.DateTime(timezone=True),
+        default=lambda: datetime.now(timezone.utc),
+        onupdate=lambda: datetime.now(timezone.utc),
+    )
+
+    def __repr__(self):
+        return f'<ReorderPoint {self.medicine_name} at {self.reorder_point}>'
+
+
+# ──────────────────────────────────────────────
+#  QR Token Revocations
+# ──────────────────────────────────────────────
+class QRRevocation(db.Model):
+    """A booking whose signed check-in QR must no longer verify (see ``qr_tokens``)."""
+    __tablename__ = 'qr_revocations'
+
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(1), nullable=False)  # qr_tokens.APPOINTMENT or RESERVATION
+    object_id = db.Column(db.Integer, nullable=False)
+    revoked_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    # Once every token that could have been issued before revocation has expired, the row can go
+    expires_at = db.Column(db.DateTime(timezone=True), nullable=False, index=True)
+
+    __table_args__ = (
+        UniqueConstraint('kind', 'object_id', name='uq_qr_revocations_kind_object'),
+    )
+
+    def __repr__(self):
+        return f'<QRRevocation {self.kind}{self.object_id}>'
+
+
+# ──────────────────────────────────────────────
+#  Kiosk Check-In
+# ──────────────────────────────────────────────
+class KioskScan(db.Model):
+    """A kiosk scan that was applied, keyed by the kiosk's own scan id so re-uploads are no-ops."""
+    __tablename__ = 'kiosk_scans'
+
+    id = db.Column(db.Integer, primary_key=True)
+    scan_id = db.Column(db.String(64), unique=True, nullable=False)  # Generated on the kiosk
+    logbook_entry_id = db.Column(db.Integer, db.ForeignKey('logbook_entries.id', ondelete='SET NULL'))
+    outcome = db.Column(db.String(20), nullable=False)  # checked_in | duplicate
+    scanned_at = db.Column(db.DateTime(timezone=True), nullable=False)
+    received_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    kiosk_user_id = db.Column(db.Integer, db.ForeignKey('users.id'))
+
+    def __repr__(self):
+        return f'<KioskScan {self.scan_id} {self.outcome}>'
+
+
+# ──────────────────────────────────────────────
+#  Notification Outbox
+# ──────────────────────────────────────────────
+class OutboxMessage(db.Model):
+    """An email or SMS committed with the change that caused it, delivered later by ``notification_outbox``."""
+    __tablename__ = 'notification_outbox'
+
+    id = db.Column(db.Integer, primary_key=True)
+    channel = db.Column(db.String(10), nullable=False)  # email | sms
+    recipient = db.Column(db.String(255), nullable=False)  # Email address or phone number
+    subject = db.Column(db.String(255))
+    body_html = db.Column(db.Text)
+    body_text = db.Column(db.Text)  # SMS message, or the email's plain-text part
+    status = db.Column(db.String(10), nullable=False, default='pending')  # pending | sending | sent | failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime(timezone=True), nullable=False,
+                                default=lambda: datetime.now(timezone.utc))
+    claimed_at = db.Column(db.DateTime(timezone=True))
+    claimed_by = db.Column(db.String(64))  # Worker holding the message while it is 'sending'
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    sent_at = db.Column(db.DateTime(timezone=True))
+
+    __table_args__ = (
+        db.Index('ix_notification_outbox_status_next_attempt', 'status', 'next_attempt_at'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxMessage {self.id} {self.channel} {self.status}>'
@@ -0,0 +1,379 @@
+"""
+Monthly Clinic Report for ISUFST CareHub.
+
+Figures for a closed month are gathered from the rollup tables and indexed
+local-day columns, rendered to PDF with reportlab in a separate worker
+process, and stored as a MonthlyReport row. Once a month is rendered its
+PDF is served as-is and never recomputed.
+"""
+import atexit
+import hashlib
+import io
+import json
+import multiprocessing
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, time, timedelta, timezone
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+
+from models import db, Appointment, ClinicVisit, CLINIC_TZ, local_today
+from models_extended import MonthlyReport, SymptomScreening, VisitFeedback
+
+# A 'rendering' claim older than this is assumed to belong to a dead worker
+STALE_AFTER = timedelta(minutes=10)
+
+_render_pool = None
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix='monthly-report')
+_pool_lock = threading.Lock()
+
+
+# ──────────────────────────────────────────────
+#  Months
+# ──────────────────────────────────────────────
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def month_end(day):
+    """Last day of the month containing ``day``."""
+    following = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return following - timedelta(days=1)
+
+
+def previous_month(today=None):
+    today = today or local_today()
+    return month_start(month_start(today) - timedelta(days=1))
+
+
+def parse_month(value):
+    """'YYYY-MM' -> first day of that month."""
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def is_closed(month):
+    """Only finished months are reported on; their figures no longer change."""
+    return month_end(month) < local_today()
+
+
+# ──────────────────────────────────────────────
+#  Figures
+# ──────────────────────────────────────────────
+
+def gather_stats(month):
+    """Collect the figures for one month as a JSON-serializable dict."""
+    from outbreak import symptoms_from_screening
+    from visit_metrics import summarize, describe
+
+    start, end = month_start(month), month_end(month)
+
+    appointment_rows = db.session.query(
+        Appointment.service_type, Appointment.status, func.count(Appointment.id)
+    ).filter(
+        Appointment.appointment_date >= start,
+        Appointment.appointment_date <= end
+    ).group_by(Appointment.service_type, Appointment.status).all()
+    by_status = Counter()
+    by_service = Counter()
+    for service, status, count in appointment_rows:
+        by_status[status] += count
+        by_service[service or 'Unknown'] += count
+
+    visits_by_day = dict(db.session.query(
+        ClinicVisit.visit_day, func.count(ClinicVisit.id)
+    ).filter(
+        ClinicVisit.visit_day >= start,
+        ClinicVisit.visit_day <= end
+    ).group_by(ClinicVisit.visit_day).all())
+
+    avg_rating, feedback_count = db.session.query(
+        func.avg(VisitFeedback.rating), func.count(VisitFeedback.id)
+    ).filter(
+        VisitFeedback.submitted_day >= start,
+        VisitFeedback.submitted_day <= end
+    ).one()
+
+    symptoms = Counter()
+    screenings = db.session.query(SymptomScreening.symptoms_json).filter(
+        SymptomScreening.created_at >= datetime.combine(start, time.min, tzinfo=CLINIC_TZ),
+        SymptomScreening.created_at < datetime.combine(end + timedelta(days=1), time.min, tzinfo=CLINIC_TZ)
+    )
+    for (symptoms_json,) in screenings.yield_per(1000):
+        symptoms.update(symptoms_from_screening(symptoms_json))
+
+    # Wait / service times come from the hourly sketch rollups
+    overall = describe(summarize(start, end)[None])
+    timing_by_day = summarize(start, end, group_by='day')
+    timing_by_service = summarize(start, end, group_by='service_type')
+
+    daily = []
+    current = start
+    while current <= end:
+        timing = describe(timing_by_day[current]) if current in timing_by_day else {}
+        daily.append({
+            'day': current.isoformat(),
+            'visits': visits_by_day.get(current, 0),
+            'wait_p50': timing.get('wait_p50'),
+            'wait_p90': timing.get('wait_p90'),
+        })
+        current += timedelta(days=1)
+
+    return {
+        'month': start.strftime('%Y-%m'),
+        'label': start.strftime('%B %Y'),
+        'generated_at': datetime.now(timezone.utc).isoformat(),
+        'totals': {
+            'appointments': sum(by_status.values()),
+            'completed': by_status.get('Completed', 0),
+            'cancelled': by_status.get('Cancelled', 0),
+            'no_shows': by_status.get('No Show', 0),
+            'visits': sum(visits_by_day.values()),
+            'feedback_count': feedback_count,
+            'avg_rating': round(float(avg_rating), 2) if avg_rating else None,
+            **overall,
+        },
+        'daily': daily,
+        'appointments_by_service': by_service.most_common(),
+        'services': [
+            {'service_type': service, **describe(group)}
+            for service, group in sorted(timing_by_service.items())
+        ],
+        'top_symptoms': symptoms.most_common(10),
+    }
+
+
+# ──────────────────────────────────────────────
+#  PDF Rendering (runs in the worker process)
+# ──────────────────────────────────────────────
+
+def _fmt(value, suffix=''):
+    return '—' if value is None else f'{value}{suffix}'
+
+
+def render_pdf(stats):
+    """Render a stats dict from gather_stats() to PDF bytes."""
+    from reportlab.graphics.charts.barcharts import VerticalBarChart
+    from reportlab.graphics.charts.linecharts import HorizontalLineChart
+    from reportlab.graphics.shapes import Drawing, String
+    from reportlab.lib import colors
+    from reportlab.lib.enums import TA_CENTER
+    from reportlab.lib.pagesizes import letter
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+    from reportlab.lib.units import inch
+    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=0.5*inch, bottomMargin=0.5*inch,
+                            title=f'Clinic Report – {stats["label"]}')
+    styles = getSampleStyleSheet()
+    title_style = ParagraphStyle(
+        'ReportTitle', parent=styles['Heading1'], fontSize=18, alignment=TA_CENTER,
+        textColor=colors.HexColor('#1e40af'), fontName='Helvetica-Bold', spaceAfter=4
+    )
+    subtitle_style = ParagraphStyle(
+        'ReportSubtitle', parent=styles['Normal'], fontSize=10, alignment=TA_CENTER,
+        textColor=colors.HexColor('#64748b'), spaceAfter=12
+    )
+    heading_style = ParagraphStyle(
+        'ReportHeading', parent=styles['Heading2'], fontSize=12, fontName='Helvetica-Bold',
+        textColor=colors.HexColor('#1e293b'), spaceBefore=10, spaceAfter=6
+    )
+    table_style = TableStyle([
+        ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor('#1e40af')),
+        ('TEXTCOLOR', (0, 0), (-1, 0), colors.white),
+        ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
+        ('FONTSIZE', (0, 0), (-1, -1), 9),
+        ('GRID', (0, 0), (-1, -1), 0.5, colors.HexColor('#cbd5e1')),
+        ('ROWBACKGROUNDS', (0, 1), (-1, -1), [colors.white, colors.HexColor('#f1f5f9')]),
+        ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+    ])
+
+    elements = [
+        Paragraph('ISUFST CareHub – Monthly Clinic Report', title_style),
+        Paragraph(f'{stats["label"]} · generated {stats["generated_at"][:10]}', subtitle_style),
+    ]
+
+    totals = stats['totals']
+    elements.append(Paragraph('Summary', heading_style))
+    summary = Table([
+        ['Metric', 'Value', 'Metric', 'Value'],
+        ['Appointments', totals['appointments'], 'Clinic visits', totals['visits']],
+        ['Completed', totals['completed'], 'Distinct patients', totals['distinct_patients']],
+        ['Cancelled', totals['cancelled'], 'No-shows', totals['no_shows']],
+        ['Wait p50 / p90 (min)', f"{_fmt(totals['wait_p50'])} / {_fmt(totals['wait_p90'])}",
+         'Service p50 / p90 (min)', f"{_fmt(totals['service_p50'])} / {_fmt(totals['service_p90'])}"],
+        ['Feedback received', totals['feedback_count'], 'Average rating', _fmt(totals['avg_rating'], ' / 5')],
+    ], colWidths=[1.9*inch, 1.4*inch, 1.9*inch, 1.4*inch])
+    summary.setStyle(table_style)
+    elements.append(summary)
+
+    daily = stats['daily']
+    day_labels = [d['day'][8:] for d in daily]
+
+    elements.append(Paragraph('Clinic Visits per Day', heading_style))
+    drawing = Drawing(500, 170)
+    bars = VerticalBarChart()
+    bars.x, bars.y, bars.width, bars.height = 35, 25, 450, 130
+    bars.data = [[d['visits'] for d in daily]]
+    bars.categoryAxis.categoryNames = day_labels
+    bars.categoryAxis.labels.fontSize = 6
+    bars.valueAxis.valueMin = 0
+    bars.valueAxis.labels.fontSize = 7
+    bars.bars[0].fillColor = colors.HexColor('#3b82f6')
+    drawing.add(bars)
+    elements.append(drawing)
+
+    if any(d['wait_p50'] is not None for d in daily):
+        elements.append(Paragraph('Queue Wait Time per Day (minutes)', heading_style))
+        drawing = Drawing(500, 170)
+        lines = HorizontalLineChart()
+        lines.x, lines.y, lines.width, lines.height = 35, 25, 450, 130
+        lines.data = [
+            [d['wait_p50'] or 0 for d in daily],
+            [d['wait_p90'] or 0 for d in daily],
+        ]
+        lines.categoryAxis.categoryNames = day_labels
+        lines.categoryAxis.labels.fontSize = 6
+        lines.valueAxis.valueMin = 0
+        lines.valueAxis.labels.fontSize = 7
+        lines.lines[0].strokeColor = colors.HexColor('#10b981')
+        lines.lines[1].strokeColor = colors.HexColor('#f59e0b')
+        drawing.add(lines)
+        drawing.add(String(380, 160, 'p50', fillColor=colors.HexColor('#10b981'), fontSize=8))
+        drawing.add(String(410, 160, 'p90', fillColor=colors.HexColor('#f59e0b'), fontSize=8))
+        elements.append(drawing)
+
+    if stats['services']:
+        elements.append(Paragraph('Wait & Service Times by Service', heading_style))
+        rows = [['Service', 'Waits', 'Wait p50', 'Wait p90', 'Visits', 'Service p50', 'Service p90', 'Patients']]
+        for s in stats['services']:
+            rows.append([
+                s['service_type'], s['wait_count'], _fmt(s['wait_p50']), _fmt(s['wait_p90']),
+                s['service_count'], _fmt(s['service_p50']), _fmt(s['service_p90']), s['distinct_patients'],
+            ])
+        table = Table(rows, repeatRows=1)
+        table.setStyle(table_style)
+        elements.append(table)
+
+    if stats['appointments_by_service']:
+        elements.append(Paragraph('Appointments by Service', heading_style))
+        table = Table([['Service', 'Appointments']] + [list(r) for r in stats['appointments_by_service']],
+                      colWidths=[3*inch, 1.5*inch])
+        table.setStyle(table_style)
+        elements.append(table)
+
+    if stats['top_symptoms']:
+        elements.append(Paragraph('Most Reported Symptoms (pre-screening)', heading_style))
+        table = Table([['Symptom', 'Reports']] + [[s.title(), n] for s, n in stats['top_symptoms']],
+                      colWidths=[3*inch, 1.5*inch])
+        table.setStyle(table_style)
+        elements.append(table)
+
+    elements.append(Spacer(1, 0.2*inch))
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+def _get_render_pool():
+    """Single spawned worker process; reportlab never runs in a web worker."""
+    global _render_pool
+    with _pool_lock:
+        if _render_pool is None:
+            _render_pool = ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn'))
+            atexit.register(_render_pool.shutdown, wait=False)
+        return _render_pool
+
+
+# ──────────────────────────────────────────────
+#  Build / Store
+# ──────────────────────────────────────────────
+
+def _claim(month):
+    """
+    Mark ``month`` as rendering. Returns the report row if this process now
+    owns the render, or None if it is already ready or being rendered.
+    """
+    report = MonthlyReport.query.filter_by(month=month).first()
+    now = datetime.now(timezone.utc)
+    if report is None:
+        report = MonthlyReport(month=month, status='rendering', started_at=now)
+        db.session.add(report)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()  # Another worker claimed it first
+            return None
+        return report
+
+    if report.status == 'ready':
+        return None
+    started = report.started_at
+    if started is not None and started.tzinfo is None:
+        started = started.replace(tzinfo=timezone.utc)
+    if report.status == 'rendering' and started and now - started < STALE_AFTER:
+        return None
+
+    # Failed or abandoned: take it over, guarding against a concurrent takeover
+    claimed = MonthlyReport.query.filter_by(id=report.id, status=report.status, started_at=report.started_at).update(
+        {'status': 'rendering', 'started_at': now, 'error': None}, synchronize_session=False
+    )
+    db.session.commit()
+    if not claimed:
+        return None
+    db.session.refresh(report)
+    return report
+
+
+def build_report(month):
+    """Gather, render (in the worker process) and store one month. Call with an app context."""
+    report = _claim(month)
+    if report is None:
+        return MonthlyReport.query.filter_by(month=month).first()
+    try:
+        stats = gather_stats(month)
+        pdf = _get_render_pool().submit(render_pdf, stats).result()
+    except Exception as e:
+        db.session.rollback()
+        report.status = 'failed'
+        report.error = str(e)[:2000]
+        db.session.commit()
+        print(f'[REPORT] Monthly report {month:%Y-%m} failed: {e}')
+        return report
+
+    report.stats_json = json.dumps(stats)
+    report.pdf_data = pdf
+    report.pdf_sha256 = hashlib.sha256(pdf).hexdigest()
+    report.generated_at = datetime.now(timezone.utc)
+    report.status = 'ready'
+    db.session.commit()
+    print(f'[REPORT] Monthly report {month:%Y-%m} ready ({len(pdf) // 1024} KB)')
+    return report
+
+
+def request_report(app, month):
+    """
+    Return the stored report for ``month``, scheduling a background build if
+    there is none yet. Never renders on the calling thread.
+    """
+    report = MonthlyReport.query.filter_by(month=month).first()
+    if report is not None and report.status == 'ready':
+        return report
+
+    def _run():
+        with app.app_context():
+            try:
+                build_report(month)
+            finally:
+                db.session.remove()
+
+    _dispatcher.submit(_run)
+    return report
+
+
+def render_previous_month(app):
+    """Scheduled job: render last month's report once it has closed."""
+    with app.app_context():
+        build_report(previous_month())
@@ -0,0 +1,248 @@
+"""
+Notification outbox for ISUFST CareHub.
+
+Emails and SMS are not sent while a request or job waits: ``enqueue_email``
+and ``enqueue_sms`` add an OutboxMessage to the caller's session, so the
+message commits (or rolls back) together with the change it announces and
+the request only pays for the INSERT. Background worker threads then claim
+pending messages in batches and deliver them:
+
+    claim      pending rows due now are marked 'sending' by one worker
+               (FOR UPDATE SKIP LOCKED on PostgreSQL, so several processes
+               can share the table; the database write lock on SQLite)
+    deliver    outside any transaction, through notification_service
+    finish     sent, or back to pending with exponential backoff and jitter,
+               or failed after MAX_ATTEMPTS / an error that will not pass
+
+Workers run only in the web server process (``create_app(serve=True)``);
+scripts that build the app to do one job and exit only enqueue, so they
+never hold a claimed batch when they stop. A commit that enqueued messages
+wakes this process's workers at once; otherwise they poll every
+POLL_SECONDS. A claim left 'sending' longer than CLAIM_TIMEOUT (a worker
+died mid-batch) is picked up again.
+"""
+import atexit
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+
+from models import db
+from models_extended import OutboxMessage
+from utils import sqlite_write_lock
+
+EMAIL = 'email'
+SMS = 'sms'
+
+PENDING = 'pending'
+SENDING = 'sending'
+SENT = 'sent'
+FAILED = 'failed'
+
+DEFAULT_WORKERS = 2
+BATCH_SIZE = 20
+POLL_SECONDS = 30
+MAX_ATTEMPTS = 8
+BASE_BACKOFF = timedelta(seconds=30)    # Doubles per attempt: 30 s, 1 min, 2 min, ...
+MAX_BACKOFF = timedelta(hours=2)
+CLAIM_TIMEOUT = timedelta(minutes=10)   # Well above a batch of SMTP and 10 s SMS timeouts
+KEEP_SENT_DAYS = 30
+KEEP_FAILED_DAYS = 90
+
+_wake = threading.Event()
+_stopping = threading.Event()
+_workers = []
+
+
+# ──────────────────────────────────────────────
+#  Enqueue
+# ──────────────────────────────────────────────
+
+def _enqueue(session, **values):
+    session = session or db.session
+    message = OutboxMessage(status=PENDING, attempts=0, next_attempt_at=datetime.now(timezone.utc), **values)
+    session.add(message)
+    session.info['notification_outbox_enqueued'] = True
+    return message
+
+
+def enqueue_email(to_email, subject, body_html, body_text=None, session=None):
+    """Add an email to the outbox; it is sent after the caller commits."""
+    return _enqueue(session, channel=EMAIL, recipient=to_email, subject=subject,
+                    body_html=body_html, body_text=body_text)
+
+
+def enqueue_sms(phone_number, message, session=None):
+    """Add an SMS to the outbox; it is sent after the caller commits."""
+    return _enqueue(session, channel=SMS, recipient=phone_number, body_text=message)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _wake_workers(session):
+    if session.info.pop('notification_outbox_enqueued', None):
+        _wake.set()
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_enqueued(session):
+    session.info.pop('notification_outbox_enqueued', None)
+
+
+# ──────────────────────────────────────────────
+#  Delivery
+# ──────────────────────────────────────────────
+
+def backoff(attempts):
+    """Delay before the next try after ``attempts`` failed ones (jittered so retries spread out)."""
+    delay = min(BASE_BACKOFF * 2 ** (attempts - 1), MAX_BACKOFF).total_seconds()
+    return timedelta(seconds=random.uniform(delay / 2, delay))
+
+
+def claim_batch(worker, limit=BATCH_SIZE, now=None):
+    """
+    Mark up to ``limit`` due messages as being sent by ``worker`` and commit;
+    returns them as (id, channel, recipient, subject, body_html, body_text, attempts).
+    """
+    now = now or datetime.now(timezone.utc)
+    due = sa.or_(
+        sa.and_(OutboxMessage.status == PENDING, OutboxMessage.next_attempt_at <= now),
+        sa.and_(OutboxMessage.status == SENDING, OutboxMessage.claimed_at <= now - CLAIM_TIMEOUT),
+    )
+    query = sa.select(OutboxMessage.id).where(due).order_by(OutboxMessage.next_attempt_at, OutboxMessage.id).limit(limit)
+    if not sqlite_write_lock():
+        query = query.with_for_update(skip_locked=True)
+    ids = db.session.execute(query).scalars().all()
+    if not ids:
+        db.session.commit()
+        return []
+
+    db.session.execute(
+        sa.update(OutboxMessage).where(OutboxMessage.id.in_(ids))
+        .values(status=SENDING, claimed_at=now, claimed_by=worker, attempts=OutboxMessage.attempts + 1)
+        .execution_options(synchronize_session=False)
+    )
+    claimed = db.session.execute(
+        sa.select(OutboxMessage.id, OutboxMessage.channel, OutboxMessage.recipient, OutboxMessage.subject,
+                  OutboxMessage.body_html, OutboxMessage.body_text, OutboxMessage.attempts)
+        .where(OutboxMessage.id.in_(ids)).order_by(OutboxMessage.id)
+    ).all()
+    db.session.commit()
+    return claimed
+
+
+def _deliver(channel, recipient, subject, body_html, body_text):
+    from notification_service import DeliveryError, deliver_email, deliver_sms
+    if channel == EMAIL:
+        deliver_email(recipient, subject, body_html, body_text)
+    elif channel == SMS:
+        deliver_sms(recipient, body_text)
+    else:
+        raise DeliveryError(f'Unknown channel {channel!r}', retry=False)
+
+
+def _finish(worker, sent, failures, now):
+    """Record a batch's outcome, for messages this worker still holds."""
+    held = sa.and_(OutboxMessage.status == SENDING, OutboxMessage.claimed_by == worker)
+    if sent:
+        db.session.execute(
+            sa.update(OutboxMessage).where(OutboxMessage.id.in_(sent), held)
+            .values(status=SENT, sent_at=now, claimed_at=None, claimed_by=None, last_error=None)
+            .execution_options(synchronize_session=False)
+        )
+    for message_id, attempts, retry, error in failures:
+        values = {'claimed_at': None, 'claimed_by': None, 'last_error': error[:2000]}
+        if retry and attempts < MAX_ATTEMPTS:
+            values.update(status=PENDING, next_attempt_at=now + backoff(attempts))
+        else:
+            values.update(status=FAILED)
+        db.session.execute(
+            sa.update(OutboxMessage).where(OutboxMessage.id == message_id, held)
+            .values(**values).execution_options(synchronize_session=False)
+        )
+    db.session.commit()
+
+
+def deliver_batch(worker, limit=BATCH_SIZE):
+    """Claim and deliver one batch; returns (sent, retrying or failed) counts."""
+    from notification_service import DeliveryError
+    sent, failures = [], []
+    for message_id, channel, recipient, subject, body_html, body_text, attempts in claim_batch(worker, limit):
+        try:
+            _deliver(channel, recipient, subject, body_html, body_text)
+        except DeliveryError as e:
+            failures.append((message_id, attempts, e.retry, str(e)))
+        except Exception as e:
+            failures.append((message_id, attempts, True, f'{type(e).__name__}: {e}'))
+        else:
+            sent.append(message_id)
+    if sent or failures:
+        _finish(worker, sent, failures, datetime.now(timezone.utc))
+    return len(sent), len(failures)
+
+
+# ──────────────────────────────────────────────
+#  Workers
+# ──────────────────────────────────────────────
+
+def _run(app, worker):
+    with app.app_context():
+        while not _stopping.is_set():
+            # Cleared before claiming, so a commit during the batch is not missed
+            _wake.clear()
+            try:
+                sent, failed = deliver_batch(worker)
+            except Exception as e:
+                db.session.rollback()
+                print(f'[OUTBOX] {worker} could not process a batch: {str(e).splitlines()[0]}')
+                sent = failed = 0
+            if failed:
+                print(f'[OUTBOX] {worker}: {sent} sent, {failed} not delivered')
+            if sent + failed < BATCH_SIZE:
+                _wake.wait(POLL_SECONDS)
+
+
+def _stop():
+    _stopping.set()
+    _wake.set()
+
+
+def init_outbox(app):
+    """Start the delivery workers (NOTIFICATION_WORKERS threads; 0 leaves the outbox to other processes)."""
+    if _workers:
+        return
+    count = int(app.config.get('NOTIFICATION_WORKERS', os.environ.get('NOTIFICATION_WORKERS', DEFAULT_WORKERS)))
+    prefix = f'{socket.gethostname()}:{os.getpid()}'[:56]
+    for number in range(count):
+        thread = threading.Thread(target=_run, args=(app, f'{prefix}:{number}'),
+                                  name=f'notification-outbox-{number}', daemon=True)
+        thread.start()
+        _workers.append(thread)
+    if _workers:
+        atexit.register(_stop)
+        print(f'[OUTBOX] Started {count} delivery workers')
+
+
+# ──────────────────────────────────────────────
+#  Maintenance
+# ──────────────────────────────────────────────
+
+def prune(now=None):
+    """Delete sent messages after KEEP_SENT_DAYS and failed ones after KEEP_FAILED_DAYS; returns how many."""
+    now = now or datetime.now(timezone.utc)
+    removed = db.session.execute(sa.delete(OutboxMessage).where(sa.or_(
+        sa.and_(OutboxMessage.status == SENT, OutboxMessage.sent_at <= now - timedelta(days=KEEP_SENT_DAYS)),
+        sa.and_(OutboxMessage.status == FAILED, OutboxMessage.created_at <= now - timedelta(days=KEEP_FAILED_DAYS)),
+    ))).rowcount
+    db.session.commit()
+    return removed
+
+
+def prune_job(app):
+    """Scheduler entry point for ``prune``."""
+    with app.app_context():
+        removed = prune()
+        if removed:
+            print(f'[SCHEDULER] Pruned {removed} delivered or failed outbox messages')
@@ -1,13 +1,19 @@
 """
 Notification Service for ISUFST CareHub.
 Handles email, SMS, and in-app notifications.
+
+The notify_* helpers only add rows to the session: in-app notifications
+and outbox messages are committed with the caller's transaction, and the
+emails and SMS are delivered afterwards by ``notification_outbox``.
 """
 import os
+import smtplib
 import requests
 from datetime import datetime, timezone
-from flask import current_app
 from flask_mail import Mail, Message as EmailMessage
+from markupsafe import escape
 from models import db, Notification
+import notification_outbox
 
 
 # Initialize Flask-Mail (configured in app.py)
@@ -15,7 +21,7 @@ mail = Mail()
 
 
 def create_notification(user_id, type, title, message, link=None):
-    """Create an in-app notification."""
+    """Add an in-app notification; it is committed with the caller's transaction."""
     notification = Notification(
         user_id=user_id,
         type=type,
@@ -24,37 +30,43 @@ def create_notification(user_id, type, title, message, link=None):
         link=link
     )
     db.session.add(notification)
-    db.session.commit()
     return notification
 
 
-def send_email(to_email, subject, body_html, body_text=None):
-    """Send email notification using Flask-Mail."""
+class DeliveryError(Exception):
+    """An email or SMS could not be delivered; ``retry`` says whether trying again may help."""
+
+    def __init__(self, message, retry=True):
+        super().__init__(message)
+        self.retry = retry
+
+
+def deliver_email(to_email, subject, body_html, body_text=None):
+    """Send an email now through Flask-Mail; raises DeliveryError."""
+    msg = EmailMessage(
+        subject=subject,
+        recipients=[to_email],
+        html=body_html,
+        body=body_text or body_html
+    )
     try:
-        msg = EmailMessage(
-            subject=subject,
-            recipients=[to_email],
-            html=body_html,
-            body=body_text or body_html
-        )
         mail.send(msg)
-        return True
+    except smtplib.SMTPRecipientsRefused as e:
+        raise DeliveryError(f'Recipient refused: {e}', retry=False)
     except Exception as e:
-        current_app.logger.error(f"Email send failed: {str(e)}")
-        return False
+        raise DeliveryError(f'Email send failed: {e}')
 
 
-def send_sms(phone_number, message):
+def deliver_sms(phone_number, message):
     """
-    Send SMS via Semaphore API (Philippine SMS provider).
+    Send an SMS now via Semaphore API (Philippine SMS provider); raises DeliveryError.
     
     Configure in .env:
         SEMAPHORE_API_KEY=your_api_key
     """
     api_key = os.environ.get('SEMAPHORE_API_KEY')
     if not api_key:
-        current_app.logger.warning("SEMAPHORE_API_KEY not configured")
-        return False
+        raise DeliveryError('SEMAPHORE_API_KEY not configured', retry=False)
     
     # Format phone number (should be 63XXXXXXXXXX for PH)
     if phone_number.startswith('0'):
@@ -71,15 +83,40 @@ def send_sms(phone_number, message):
             },
             timeout=10
         )
-        
-        if response.status_code == 200:
-            return True
-        else:
-            current_app.logger.error(f"SMS send failed: {response.text}")
-            return False
     except Exception as e:
-        current_app.logger.error(f"SMS exception: {str(e)}")
-        return False
+        raise DeliveryError(f'SMS exception: {e}')
+    
+    if response.status_code != 200:
+        # Rate limits and server errors pass; a rejected request will be rejected again
+        retry = response.status_code == 429 or response.status_code >= 500
+        raise DeliveryError(f'SMS send failed ({response.status_code}): {response.text[:500]}', retry=retry)
+
+
+def send_email(to_email, subject, body_html, body_text=None):
+    """Email via the outbox: delivered in the background after the caller commits."""
+    notification_outbox.enqueue_email(to_email, subject, body_html, body_text)
+    return True
+
+
+def send_sms(phone_number, message):
+    """SMS via the outbox: delivered in the background after the caller commits."""
+    notification_outbox.enqueue_sms(phone_number, message)
+    return True
+
+
+def email_user(user, subject, message):
+    """Email ``message`` to a user in the standard layout (via the outbox)."""
+    body = f"""
+    <html>
+        <body style="font-family: Arial, sans-serif;">
+            <h2>{escape(subject)}</h2>
+            <p>Dear {escape(user.first_name)},</p>
+            <p>{escape(message)}</p>
+            <p><strong>ISUFST CareHub</strong></p>
+        </body>
+    </html>
+    """
+    send_email(user.email, f'{subject} - ISUFST CareHub', body, f'{message}\n\nISUFST CareHub')
 
 
 # ──────────────────────────────────────────────
@@ -267,8 +304,35 @@ def notify_expiring_medicines(admin_users, expiring_items):
         send_email(admin.email, 'Medicine Expiry Alert - Action Required', email_body)
 
 
-def init_notification_service(app):
-    """Initialize notification service with Flask app."""
+# ──────────────────────────────────────────────
+#  Public Health Alerts
+# ──────────────────────────────────────────────
+
+def notify_symptom_cluster(staff_users, alert, title=None, session=None):
+    """
+    Alert staff that a symptom is clustering above its baseline.
+
+    Only adds in-app notifications to ``session`` (no commit), so it can be
+    called from inside a flush and lands in the same transaction.
+    """
+    session = session or db.session
+    title = title or f'Possible {alert["symptom"].title()} cluster'
+    message = (
+        f'{alert["observed"]} cases of {alert["symptom"]} in the last {alert["window_days"]} days '
+        f'(usually about {alert["expected"]:g}). Consider checking for a campus outbreak.'
+    )
+    for staff in staff_users:
+        session.add(Notification(
+            user_id=staff.id,
+            type='symptom_cluster',
+            title=title,
+            message=message,
+            link='/analytics'
+        ))
+
+
+def init_notification_service(app, start_workers=False):
+    """Initialize notification service with Flask app; ``start_workers`` also starts outbox delivery."""
     mail.init_app(app)
     
     # Configure Flask-Mail
@@ -278,3 +342,6 @@ def init_notification_service(app):
     app.config.setdefault('MAIL_USERNAME', os.environ.get('MAIL_USERNAME'))
     app.config.setdefault('MAIL_PASSWORD', os.environ.get('MAIL_PASSWORD'))
     app.config.setdefault('MAIL_DEFAULT_SENDER', os.environ.get('MAIL_DEFAULT_SENDER', 'noreply@isufst.edu.ph'))
+    
+    if start_workers:
+        notification_outbox.init_outbox(app)
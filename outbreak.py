@@ -0,0 +1,305 @@
+"""
+Outbreak / Symptom-Cluster Detection for ISUFST CareHub.
+Streams symptom screenings and clinic visits into per-symptom sliding-window
+counts and alerts staff when a symptom clusters well above its baseline.
+"""
+import json
+import re
+import threading
+from collections import Counter, deque
+from datetime import datetime, time, timedelta
+
+from sqlalchemy.orm import object_session
+
+from models import db, ClinicVisit, Notification, User, CLINIC_TZ, local_date, local_today
+from models_extended import SymptomScreening
+
+
+# Defaults, overridable through app.config
+DEFAULTS = {
+    'OUTBREAK_WINDOW_DAYS': 3,       # Recent window that is tested for a cluster
+    'OUTBREAK_BASELINE_DAYS': 28,    # Days before the window used as the baseline
+    'OUTBREAK_MIN_CASES': 5,         # Never alert below this many cases in the window
+    'OUTBREAK_THRESHOLD_RATIO': 3.0,  # Window must exceed baseline expectation by this factor
+}
+
+ALERT_TYPE = 'symptom_cluster'
+
+
+# ──────────────────────────────────────────────
+#  Symptom Extraction
+# ──────────────────────────────────────────────
+
+def _symptom_vocabulary():
+    """Known symptom names, taken from the screening checklist."""
+    from symptom_screening import SYMPTOM_CATEGORIES
+    names = {s.lower() for group in SYMPTOM_CATEGORIES.values() for s in group}
+    names.update({'fever', 'cough', 'rash', 'dengue', 'flu'})
+    return sorted(names)
+
+
+_complaint_pattern = None
+
+
+def symptoms_from_complaint(text):
+    """Extract known symptom names from a free-text chief complaint."""
+    global _complaint_pattern
+    if not text:
+        return set()
+    if _complaint_pattern is None:
+        # Longest first so 'joint pain' wins over 'pain'-style overlaps
+        names = sorted(_symptom_vocabulary(), key=len, reverse=True)
+        _complaint_pattern = re.compile(r'\b(' + '|'.join(re.escape(n) for n in names) + r')\b')
+    return set(_complaint_pattern.findall(text.lower()))
+
+
+def symptoms_from_screening(symptoms_json):
+    """Parse the JSON symptom list stored on a screening."""
+    try:
+        symptoms = json.loads(symptoms_json or '[]')
+    except ValueError:
+        return set()
+    return {str(s).strip().lower() for s in symptoms if str(s).strip()}
+
+
+# ──────────────────────────────────────────────
+#  Sliding-Window Detector
+# ──────────────────────────────────────────────
+
+class SymptomClusterDetector:
+    """
+    Incremental per-symptom sliding-window counter.
+
+    Keeps one Counter per local day for the last ``window_days + baseline_days``
+    days, plus running totals for the window and the baseline. Recording a case
+    is O(number of symptoms); advancing a day only touches the symptoms of the
+    day that moves from the window into the baseline and the day that drops out.
+    """
+
+    def __init__(self, window_days=3, baseline_days=28, min_cases=5, threshold_ratio=3.0):
+        self.window_days = window_days
+        self.baseline_days = baseline_days
+        self.min_cases = min_cases
+        self.threshold_ratio = threshold_ratio
+
+        self._days = deque()  # Counters, oldest first; the last one is self._current_day
+        self._current_day = None
+        self._window = Counter()
+        self._baseline = Counter()
+        self._last_alert = {}  # symptom -> day of last alert
+        self._lock = threading.Lock()
+
+    @property
+    def span(self):
+        return self.window_days + self.baseline_days
+
+    def _advance_to(self, day):
+        """Roll the ring forward so that ``day`` is the newest bucket."""
+        if self._current_day is None:
+            self._days.append(Counter())
+            self._current_day = day
+            return
+        steps = (day - self._current_day).days
+        if steps >= self.span:
+            # Everything has aged out; the days in the gap had no cases, so
+            # the history is a full span of empty days, not a fresh start
+            self._days = deque(Counter() for _ in range(self.span))
+            self._window.clear()
+            self._baseline.clear()
+            self._current_day = day
+            return
+        for _ in range(steps):
+            self._days.append(Counter())
+            # Day leaving the window joins the baseline
+            if len(self._days) > self.window_days:
+                leaving = self._days[-self.window_days - 1]
+                self._window.subtract(leaving)
+                self._baseline.update(leaving)
+            # Day leaving the baseline is forgotten
+            if len(self._days) > self.span:
+                expired = self._days.popleft()
+                self._baseline.subtract(expired)
+        self._current_day = day
+        self._window = +self._window
+        self._baseline = +self._baseline
+
+    def start_at(self, day):
+        """Begin the history at ``day`` (days with no cases count as zero)."""
+        with self._lock:
+            if self._current_day is None:
+                self._advance_to(day)
+
+    def record(self, symptoms, day):
+        """
+        Count one case of each symptom on ``day``.
+
+        Returns a list of alert dicts for symptoms that crossed the threshold.
+        """
+        if not symptoms or day is None:
+            return []
+        with self._lock:
+            if self._current_day is None or day > self._current_day:
+                self._advance_to(day)
+            age = (self._current_day - day).days
+            if age >= self.span:
+                return []  # Too old to matter
+
+            bucket = self._days[-1 - age] if age < len(self._days) else None
+            if bucket is None:
+                # Backfilled day older than anything seen so far
+                while len(self._days) <= age:
+                    self._days.appendleft(Counter())
+                bucket = self._days[-1 - age]
+            in_window = age < self.window_days
+
+            alerts = []
+            for symptom in symptoms:
+                bucket[symptom] += 1
+                if in_window:
+                    self._window[symptom] += 1
+                    alert = self._check(symptom)
+                    if alert:
+                        alerts.append(alert)
+                else:
+                    self._baseline[symptom] += 1
+            return alerts
+
+    def expected(self, symptom):
+        """Baseline expectation of cases for one window."""
+        return self._baseline[symptom] / self.baseline_days * self.window_days
+
+    def _check(self, symptom):
+        if len(self._days) < self.span:
+            return None  # Not enough history for a baseline yet
+        observed = self._window[symptom]
+        expected = self.expected(symptom)
+        if observed < max(self.min_cases, self.threshold_ratio * expected):
+            return None
+        last = self._last_alert.get(symptom)
+        if last is not None and (self._current_day - last).days < self.window_days:
+            return None  # Already alerted for this cluster
+        self._last_alert[symptom] = self._current_day
+        return {
+            'symptom': symptom,
+            'observed': observed,
+            'expected': round(expected, 2),
+            'window_days': self.window_days,
+            'day': self._current_day,
+        }
+
+    def snapshot(self, limit=10):
+        """Current window counts vs. baseline expectation, highest first."""
+        with self._lock:
+            rows = [{
+                'symptom': symptom,
+                'observed': count,
+                'expected': round(self.expected(symptom), 2),
+            } for symptom, count in self._window.most_common(limit)]
+        return {
+            'as_of': self._current_day.isoformat() if self._current_day else None,
+            'window_days': self.window_days,
+            'baseline_days': self.baseline_days,
+            'symptoms': rows,
+        }
+
+
+detector = SymptomClusterDetector()
+
+
+# ──────────────────────────────────────────────
+#  Insert Hooks
+# ──────────────────────────────────────────────
+
+def _queue_alerts(instance, alerts):
+    """Park alerts on the session; they are written after the flush."""
+    session = object_session(instance)
+    if alerts and session is not None:
+        session.info.setdefault('outbreak_alerts', []).extend(alerts)
+
+
+@db.event.listens_for(SymptomScreening, 'after_insert')
+def _screening_inserted(mapper, connection, screening):
+    day = local_date(screening.created_at) or local_today()
+    _queue_alerts(screening, detector.record(symptoms_from_screening(screening.symptoms_json), day))
+
+
+@db.event.listens_for(ClinicVisit, 'after_insert')
+def _visit_inserted(mapper, connection, visit):
+    day = visit.visit_day or local_date(visit.visit_date) or local_today()
+    _queue_alerts(visit, detector.record(symptoms_from_complaint(visit.chief_complaint), day))
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def _raise_alerts(session, flush_context):
+    """Write staff notifications for new clusters in the same transaction."""
+    alerts = session.info.pop('outbreak_alerts', None)
+    if not alerts:
+        return
+    from notification_service import notify_symptom_cluster
+
+    for alert in alerts:
+        # Another worker process may already have raised this cluster
+        since = datetime.combine(alert['day'] - timedelta(days=alert['window_days']), time.min, tzinfo=CLINIC_TZ)
+        title = f'Possible {alert["symptom"].title()} cluster'
+        already = session.query(Notification.id).filter(
+            Notification.type == ALERT_TYPE,
+            Notification.title == title,
+            Notification.created_at >= since
+        ).first()
+        if already:
+            continue
+        staff = session.query(User).filter(
+            User.role.in_(['admin', 'nurse', 'doctor']),
+            User.is_active == True
+        ).all()
+        notify_symptom_cluster(staff, alert, title=title, session=session)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_alerts(session):
+    session.info.pop('outbreak_alerts', None)
+
+
+# ──────────────────────────────────────────────
+#  Startup
+# ──────────────────────────────────────────────
+
+def warm_up(target=None):
+    """Load the last window + baseline days of cases into the detector once."""
+    target = target or detector
+    since = local_today() - timedelta(days=target.span - 1)
+    target.start_at(since)
+
+    screenings = db.session.query(
+        SymptomScreening.created_at, SymptomScreening.symptoms_json
+    ).filter(SymptomScreening.created_at >= since).order_by(SymptomScreening.created_at)
+    for created_at, symptoms_json in screenings.yield_per(1000):
+        target.record(symptoms_from_screening(symptoms_json), local_date(created_at))
+
+    visits = db.session.query(
+        ClinicVisit.visit_day, ClinicVisit.chief_complaint
+    ).filter(ClinicVisit.visit_day >= since).order_by(ClinicVisit.visit_day)
+    for visit_day, complaint in visits.yield_per(1000):
+        target.record(symptoms_from_complaint(complaint), visit_day)
+
+    # History is not news; only alert on clusters formed after startup
+    target._last_alert = {s: target._current_day for s in target._window}
+    return target
+
+
+def init_outbreak_detector(app):
+    """Configure thresholds from app.config and warm the detector from the DB."""
+    for key, value in DEFAULTS.items():
+        app.config.setdefault(key, value)
+    detector.window_days = app.config['OUTBREAK_WINDOW_DAYS']
+    detector.baseline_days = app.config['OUTBREAK_BASELINE_DAYS']
+    detector.min_cases = app.config['OUTBREAK_MIN_CASES']
+    detector.threshold_ratio = app.config['OUTBREAK_THRESHOLD_RATIO']
+
+    with app.app_context():
+        try:
+            warm_up()
+        except Exception as e:
+            # Tables may not exist yet (fresh install before migrations)
+            db.session.rollback()
+            app.logger.warning(f'Outbreak detector warm-up skipped: {e}')
@@ -0,0 +1,198 @@
+"""
+Rendered QR image cache for ISUFST CareHub.
+
+Check-in QR codes are re-rendered every time a student opens an appointment
+or reservation, although the payload rarely changes. Rendered images are kept
+in a size-bounded in-process LRU, keyed by (payload hash, box size, logo),
+with an optional directory on disk as a second tier shared by all worker
+processes. Hit, miss and eviction counters are kept for both tiers.
+
+Configuration (read by ``init_qr_cache``):
+    QR_CACHE_BYTES       memory budget in bytes (default 8 MiB, 0 disables)
+    QR_CACHE_DIR         directory for the disk tier (default: no disk tier)
+    QR_CACHE_DISK_BYTES  disk budget in bytes (default 64 MiB)
+"""
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_DISK_BYTES = 64 * 1024 * 1024
+DISK_LOW_WATER = 0.8  # Prune the disk tier to this share of its budget, so pruning is rare
+
+
+def key(data, size, logo=None, fmt='png'):
+    """
+    Cache key for ``data`` rendered as ``fmt`` at box ``size`` with the logo
+    fingerprinted ``logo`` (None: no logo). Doubles as the disk file name.
+    """
+    digest = hashlib.sha256(data.encode() if isinstance(data, str) else data).hexdigest()
+    return f'{digest}-{size}-{logo or "plain"}.{fmt}'
+
+
+class QRImageCache:
+    """LRU of rendered images (bytes) bounded by total size, with an optional disk tier."""
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, max_disk_bytes=DEFAULT_DISK_BYTES):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> bytes, least recently used first
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.disk_bytes = 0
+        self.hits = self.disk_hits = self.misses = 0
+        self.evictions = self.disk_evictions = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def __len__(self):
+        return len(self._entries)
+
+    # ── Memory Tier ──
+
+    def _remember(self, key, value):
+        """Insert under the lock, evicting least recently used entries to fit."""
+        if len(value) > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.bytes -= len(old)
+        self._entries[key] = value
+        self.bytes += len(value)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    # ── Disk Tier ──
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _disk_files(self):
+        """[(path, size, mtime)] of the disk tier's files."""
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.tmp') and entry.is_file():
+                    stat = entry.stat()
+                    files.append((entry.path, stat.st_size, stat.st_mtime))
+        return files
+
+    def _read_disk(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as fh:
+                value = fh.read()
+            os.utime(path)  # Recently used: prune it last
+            return value
+        except OSError:
+            return None
+
+    def _write_disk(self, key, value):
+        try:
+            # Write then rename, so another process never reads half a file
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fh:
+                fh.write(value)
+            os.replace(temp_path, self._path(key))
+        except OSError as e:
+            print(f'Warning: Could not write QR cache file: {e}')
+            return
+        with self._lock:
+            self.disk_bytes += len(value)
+            over = self.disk_bytes > self.max_disk_bytes
+        if over:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Delete the least recently used files until the tier is back under its low-water mark."""
+        files = sorted(self._disk_files(), key=lambda f: f[2])
+        total = sum(size for _, size, _ in files)
+        target = self.max_disk_bytes * DISK_LOW_WATER
+        removed = 0
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue  # Another process pruned it first
+            total -= size
+            removed += 1
+        with self._lock:
+            self.disk_bytes = total
+            self.disk_evictions += removed
+
+    # ── Public API ──
+
+    def get(self, key):
+        """Cached bytes for ``key`` or None, promoting disk hits into memory."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.directory:
+            value = self._read_disk(key)
+            if value is not None:
+                with self._lock:
+                    self.disk_hits += 1
+                    self._remember(key, value)
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._remember(key, value)
+        if self.directory:
+            self._write_disk(key, value)
+
+    def get_or_render(self, key, render):
+        """Cached bytes for ``key``, calling ``render()`` and caching its result on a miss."""
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 3) if lookups else None,
+                'evictions': self.evictions,
+                'disk_bytes': self.disk_bytes if self.directory else None,
+                'disk_evictions': self.disk_evictions,
+            }
+
+
+cache = QRImageCache()
+
+
+def init_qr_cache(app):
+    """Size the process-wide cache (and disk tier) from the app config."""
+    global cache
+    cache = QRImageCache(
+        max_bytes=int(app.config.get('QR_CACHE_BYTES', DEFAULT_MAX_BYTES)),
+        directory=app.config.get('QR_CACHE_DIR') or None,
+        max_disk_bytes=int(app.config.get('QR_CACHE_DISK_BYTES', DEFAULT_DISK_BYTES)),
+    )
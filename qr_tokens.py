@@ -0,0 +1,289 @@
+"""
+Signed check-in QR tokens for ISUFST CareHub.
+
+A check-in QR carries only (kind, booking id, expiry day) and a truncated
+HMAC-SHA256 over them, packed into 20 bytes and base32-encoded so the code
+stays in the QR alphanumeric mode:
+
+    CHA<32 chars>   appointment check-in
+    CHR<32 chars>   medicine reservation pickup
+    CHC<32 chars>   health certificate verification
+
+A scan is checked by signature, expiry and an in-memory revocation set
+alone; only the check-in or pickup that follows touches the database.
+``verify`` needs nothing but the keys and a revocation set, so an offline
+kiosk holding a copy of the keys can run it too.
+
+Keys come from QR_SIGNING_KEYS ("kid:secret,kid:secret", kid 0-255). The
+first key signs and every listed key verifies, so a retired key keeps its
+tokens valid until they expire. Without it, key 0 is derived from
+SECRET_KEY. Cancelling a booking, or letting a reservation's hold lapse,
+records a QRRevocation.
+"""
+import base64
+import hashlib
+import hmac
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import date, datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import inspect
+
+from models import db, Appointment, MedicineReservation, CLINIC_TZ, local_today, upsert
+from models_extended import QRRevocation
+
+APPOINTMENT = 'A'
+RESERVATION = 'R'
+CERTIFICATE = 'C'
+KINDS = (APPOINTMENT, RESERVATION, CERTIFICATE)
+PREFIX = 'CH'
+VERSION = 1
+VALID_DAYS = 31    # Tokens expire at the start of the local day this far out: always >= 30 days
+MAC_BYTES = 11     # 88-bit tag; the whole token is 20 bytes, 32 base32 characters
+SYNC_SECONDS = 30  # Catch up on revocations made by other worker processes
+
+_BODY = struct.Struct('>BBcIH')  # version, key id, kind, booking id, expiry as a day number
+_EPOCH = date(1970, 1, 1)
+_TOKEN_LENGTH = len(PREFIX) + 1 + 32
+
+Claims = namedtuple('Claims', 'kind object_id expires_on key_id')
+
+
+class InvalidToken(ValueError):
+    """A scanned code that is not a valid, current check-in token; the message says why."""
+
+
+# ──────────────────────────────────────────────
+#  Keys
+# ──────────────────────────────────────────────
+
+def parse_keys(spec):
+    """{key id: secret bytes} from "kid:secret,kid:secret", in order (first signs)."""
+    keys = {}
+    for part in (spec or '').split(','):
+        if not part.strip():
+            continue
+        key_id, _, secret = part.strip().partition(':')
+        if not key_id.isdigit() or not 0 <= int(key_id) <= 255 or not secret:
+            raise ValueError(f'Invalid QR signing key entry: {part.strip()[:8]}...')
+        keys[int(key_id)] = secret.encode()
+    return keys
+
+
+def signing_keys():
+    """The app's QR signing keys, current one first."""
+    keys = parse_keys(current_app.config.get('QR_SIGNING_KEYS'))
+    if not keys:
+        secret = current_app.config['SECRET_KEY']
+        keys = {0: hmac.new(secret.encode(), b'carehub-qr-token', hashlib.sha256).digest()}
+    return keys
+
+
+# ──────────────────────────────────────────────
+#  Encoding
+# ──────────────────────────────────────────────
+
+def _mac(secret, body):
+    return hmac.new(secret, body, hashlib.sha256).digest()[:MAC_BYTES]
+
+
+def encode(kind, object_id, expires_on, key_id, secret):
+    """Token text for booking ``object_id`` of ``kind``, valid until the start of ``expires_on``."""
+    if kind not in KINDS:
+        raise ValueError(f'Unknown QR token kind: {kind}')
+    body = _BODY.pack(VERSION, key_id, kind.encode(), object_id, (expires_on - _EPOCH).days)
+    return PREFIX + kind + base64.b32encode(body + _mac(secret, body)).decode()
+
+
+def decode(text):
+    """(Claims, signed body, tag) without checking the signature; raises InvalidToken."""
+    text = (text or '').strip().upper()
+    if len(text) != _TOKEN_LENGTH or not text.startswith(PREFIX):
+        raise InvalidToken('Not a CareHub check-in code')
+    try:
+        raw = base64.b32decode(text[len(PREFIX) + 1:])
+    except ValueError:
+        raise InvalidToken('Not a CareHub check-in code')
+    body, tag = raw[:_BODY.size], raw[_BODY.size:]
+    version, key_id, kind, object_id, day = _BODY.unpack(body)
+    kind = kind.decode('ascii', 'replace')
+    if version != VERSION or kind not in KINDS or kind != text[len(PREFIX)]:
+        raise InvalidToken('Unsupported check-in code')
+    return Claims(kind, object_id, _EPOCH + timedelta(days=day), key_id), body, tag
+
+
+def is_token(text):
+    """Whether ``text`` looks like a signed token (rather than a legacy JSON payload)."""
+    return (text or '').strip().upper().startswith(PREFIX) and len(text.strip()) == _TOKEN_LENGTH
+
+
+def authenticate(text, keys):
+    """Claims of a token signed with one of ``keys``, whatever its expiry; else raise InvalidToken."""
+    claims, body, tag = decode(text)
+    secret = keys.get(claims.key_id)
+    if secret is None:
+        raise InvalidToken('QR code was signed with a retired key')
+    if not hmac.compare_digest(tag, _mac(secret, body)):
+        raise InvalidToken('Invalid QR code signature')
+    return claims
+
+
+def verify(text, keys, revoked=frozenset(), today=None):
+    """
+    Claims of a valid token, else raise InvalidToken. Needs no database:
+    ``keys`` is {key id: secret}, ``revoked`` a set of (kind, object id).
+    """
+    claims = authenticate(text, keys)
+    if (today or local_today()) >= claims.expires_on:
+        raise InvalidToken(f'QR code expired on {claims.expires_on.strftime("%B %d, %Y")}')
+    if (claims.kind, claims.object_id) in revoked:
+        raise InvalidToken('This booking was cancelled')
+    return claims
+
+
+def issue(kind, object_id, expires_on=None):
+    """Signed token for a booking (or certificate) with the app's current key."""
+    key_id, secret = next(iter(signing_keys().items()))
+    return encode(kind, object_id, expires_on or local_today() + timedelta(days=VALID_DAYS), key_id, secret)
+
+
+def check(text, kind=None, today=None):
+    """``verify`` with the app's keys and revocations; ``kind`` also requires that kind."""
+    claims = verify(text, signing_keys(), revoked(), today)
+    if kind is not None and claims.kind != kind:
+        raise InvalidToken('This QR code is for a different kind of booking')
+    return claims
+
+
+# ──────────────────────────────────────────────
+#  Revocations
+# ──────────────────────────────────────────────
+
+_lock = threading.Lock()
+_revoked = frozenset()
+_synced_at = None
+
+
+def _revocation_expiry():
+    """When every token issued up to today has expired."""
+    day = local_today() + timedelta(days=VALID_DAYS + 1)
+    return datetime.combine(day, datetime.min.time(), tzinfo=CLINIC_TZ).astimezone(timezone.utc)
+
+
+def reload():
+    """Load the live revocations from the database into the process-wide set."""
+    global _revoked, _synced_at
+    now = datetime.now(timezone.utc)
+    with db.engine.connect() as connection:
+        rows = connection.execute(
+            sa.select(QRRevocation.kind, QRRevocation.object_id).where(QRRevocation.expires_at > now)
+        ).all()
+    with _lock:
+        _revoked = frozenset((kind, object_id) for kind, object_id in rows)
+        _synced_at = time.monotonic()
+
+
+def revoked():
+    """Set of revoked (kind, object id), reloaded at most every SYNC_SECONDS."""
+    if _synced_at is None or time.monotonic() - _synced_at > SYNC_SECONDS:
+        reload()
+    return _revoked
+
+
+def revocation_snapshot():
+    """Revoked bookings as token-style strings ('A12', 'R7') for offline kiosks."""
+    return sorted(f'{kind}{object_id}' for kind, object_id in revoked())
+
+
+def _changed_status(instance):
+    """(old, new) status if it changed in this flush, old being None when it was not loaded."""
+    history = inspect(instance).attrs.status.history
+    if not history.added:
+        return None
+    return (history.deleted[0] if history.deleted else None), history.added[0]
+
+
+def _mark(instance, kind, revoke_statuses):
+    change = _changed_status(instance)
+    if change is None:
+        return
+    old, new = change
+    if new in revoke_statuses:
+        action = True
+    elif old in revoke_statuses:
+        action = False  # Reinstated by staff
+    else:
+        return
+    inspect(instance).session.info.setdefault('qr_revocations', {})[(kind, instance.id)] = action
+
+
+@db.event.listens_for(Appointment, 'after_update')
+def _appointment_changed(mapper, connection, appointment):
+    _mark(appointment, APPOINTMENT, ('Cancelled',))
+
+
+@db.event.listens_for(MedicineReservation, 'after_update')
+def _reservation_changed(mapper, connection, reservation):
+    _mark(reservation, RESERVATION, ('Cancelled', 'Expired'))
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def _apply_revocations(session, flush_context):
+    changes = session.info.pop('qr_revocations', None)
+    if changes:
+        apply_revocations(session, changes)
+
+
+def apply_revocations(session, changes):
+    """Record {(kind, object id): revoke?} (for status writes that bypass the ORM); published on commit."""
+    now = datetime.now(timezone.utc)
+    expires_at = _revocation_expiry()
+    for (kind, object_id), revoke in sorted(changes.items()):
+        if revoke:
+            stamp = {'revoked_at': now, 'expires_at': expires_at}
+            upsert(session, QRRevocation, {'kind': kind, 'object_id': object_id}, stamp, stamp)
+        else:
+            session.execute(sa.delete(QRRevocation).where(
+                (QRRevocation.kind == kind) & (QRRevocation.object_id == object_id)
+            ))
+    session.info.setdefault('qr_revocations_committed', {}).update(changes)
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _publish_revocations(session):
+    """This process sees its own revocations at once; others within SYNC_SECONDS."""
+    global _revoked
+    changes = session.info.pop('qr_revocations_committed', None)
+    if not changes or _synced_at is None:
+        return
+    with _lock:
+        current = set(_revoked)
+        for key, revoke in changes.items():
+            (current.add if revoke else current.discard)(key)
+        _revoked = frozenset(current)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_revocations(session):
+    session.info.pop('qr_revocations', None)
+    session.info.pop('qr_revocations_committed', None)
+
+
+def prune(now=None):
+    """Delete revocations whose tokens have all expired; returns how many."""
+    now = now or datetime.now(timezone.utc)
+    removed = db.session.execute(sa.delete(QRRevocation).where(QRRevocation.expires_at <= now)).rowcount
+    db.session.commit()
+    return removed
+
+
+def prune_job(app):
+    """Scheduler entry point for ``prune``."""
+    with app.app_context():
+        removed = prune()
+        if removed:
+            print(f'[SCHEDULER] Pruned {removed} expired QR revocations')
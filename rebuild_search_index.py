@@ -0,0 +1,26 @@
+"""
+Rebuild the full-text search documents for patients, visits and inventory.
+
+Run once after the search index migration, or any time to repair the index.
+
+Usage:
+    python rebuild_search_index.py [patient|visit|inventory ...]
+"""
+import sys
+
+from app import create_app
+from search_index import rebuild_index, PATIENT, VISIT, INVENTORY
+
+
+def main():
+    entity_types = sys.argv[1:] or (PATIENT, VISIT, INVENTORY)
+    app = create_app()
+    with app.app_context():
+        counts = rebuild_index(entity_types)
+    for entity_type, count in counts.items():
+        print(f'  {entity_type:<10} {count:>8} documents')
+    print('✅ Search index rebuilt')
+
+
+if __name__ == '__main__':
+    main()
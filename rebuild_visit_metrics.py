@@ -0,0 +1,23 @@
+"""
+Backfill wait/service time rollups from existing queue and logbook history.
+
+Usage:
+    python rebuild_visit_metrics.py [YYYY-MM-DD]
+"""
+import sys
+from datetime import datetime
+
+from app import create_app
+from visit_metrics import rebuild_rollups
+
+
+def main():
+    since = datetime.strptime(sys.argv[1], '%Y-%m-%d').date() if len(sys.argv) > 1 else None
+    app = create_app()
+    with app.app_context():
+        count = rebuild_rollups(since)
+        print(f'✅ Folded {count} completed waits/visits into visit_time_rollups')
+
+
+if __name__ == '__main__':
+    main()
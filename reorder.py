@@ -0,0 +1,199 @@
+"""
+Reorder-point forecasting for ISUFST CareHub.
+
+Daily demand per medicine (units dispensed, from the stock ledger, plus
+units held by open student reservations) is smoothed with 7- and 28-day rolling
+averages; the reorder point covers the supplier lead time at the forecast
+rate plus safety stock for day-to-day swings:
+
+    reorder_point = demand * lead_time + z * std * sqrt(lead_time)
+
+Forecasts live in ReorderPoint and are refreshed nightly by the scheduler.
+Stock is compared against them live, so "days of stock remaining" and low
+stock flags follow every dispense.
+"""
+import math
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import func, select
+
+from models import db, Inventory, Medicine, MedicineReservation, local_today
+from models_extended import StockMovement, ReorderPoint
+import expiry_index
+import stock_ledger
+
+LOOKBACK_DAYS = 56
+SHORT_WINDOW = 7
+LONG_WINDOW = 28
+SERVICE_FACTOR = 1.65  # Safety stock for ~95% of lead-time demand
+DEFAULT_LEAD_TIME_DAYS = 7
+# Medicines with no demand history keep the old flat threshold
+DEFAULT_REORDER_POINT = 10
+
+
+def lead_time_days():
+    return int(current_app.config.get('REORDER_LEAD_TIME_DAYS', DEFAULT_LEAD_TIME_DAYS))
+
+
+# ──────────────────────────────────────────────
+#  Demand History
+# ──────────────────────────────────────────────
+
+def daily_demand(start, end, names=None):
+    """{medicine_name: [units on start, start + 1 day, ..., end]}."""
+    length = (end - start).days + 1
+    series = {}
+
+    dispensed = select(
+        StockMovement.medicine_id, StockMovement.created_day, func.sum(-StockMovement.quantity)
+    ).where(
+        StockMovement.kind == stock_ledger.DISPENSE,
+        StockMovement.created_day.between(start, end)
+    ).group_by(StockMovement.medicine_id, StockMovement.created_day)
+    reserved = select(
+        MedicineReservation.medicine_id, MedicineReservation.reserved_day, func.sum(MedicineReservation.quantity)
+    ).where(
+        # Picked-up reservations are already in the ledger as dispenses
+        MedicineReservation.status == 'Reserved',
+        MedicineReservation.reserved_day.between(start, end)
+    ).group_by(MedicineReservation.medicine_id, MedicineReservation.reserved_day)
+    if names is not None:
+        ids = select(Medicine.id).where(Medicine.name.in_(list(names)))
+        dispensed = dispensed.where(StockMovement.medicine_id.in_(ids))
+        reserved = reserved.where(MedicineReservation.medicine_id.in_(ids))
+
+    for query in (dispensed, reserved):
+        for medicine_id, day, units in db.session.execute(query):
+            series.setdefault(medicine_id, [0] * length)[(day - start).days] += int(units or 0)
+    labels = dict(db.session.execute(select(Medicine.id, Medicine.name).where(Medicine.id.in_(list(series)))).all())
+    return {labels[medicine_id]: values for medicine_id, values in series.items() if medicine_id in labels}
+
+
+def rolling_means(values, window):
+    """Trailing ``window``-day means of ``values`` (prefix sums, one pass)."""
+    prefix = [0]
+    for value in values:
+        prefix.append(prefix[-1] + value)
+    return [
+        (prefix[i + 1] - prefix[max(0, i + 1 - window)]) / min(window, i + 1)
+        for i in range(len(values))
+    ]
+
+
+def forecast(values, lead_time):
+    """(daily demand, demand std, reorder point) from a daily demand series, oldest first."""
+    short = rolling_means(values, SHORT_WINDOW)[-1]
+    long = rolling_means(values, LONG_WINDOW)[-1]
+    # Follow a rising week quickly, but don't drop the forecast for one quiet week
+    demand = max(short, long)
+    recent = values[-LONG_WINDOW:]
+    mean = sum(recent) / len(recent)
+    std = math.sqrt(sum((v - mean) ** 2 for v in recent) / len(recent))
+    point = math.ceil(demand * lead_time + SERVICE_FACTOR * std * math.sqrt(lead_time))
+    return demand, std, point
+
+
+# ──────────────────────────────────────────────
+#  Refresh
+# ──────────────────────────────────────────────
+
+def refresh(today=None, names=None):
+    """
+    Recompute reorder points from the last LOOKBACK_DAYS complete days.
+
+    Only medicines with demand in the window, or whose stored forecast is
+    not yet zero, are recomputed - the rest cannot have changed. Returns the
+    number of medicines refreshed.
+    """
+    today = today or local_today()
+    names = None if names is None else list(names)
+    end = today - timedelta(days=1)
+    start = end - timedelta(days=LOOKBACK_DAYS - 1)
+    lead_time = lead_time_days()
+    session = db.session
+
+    series = daily_demand(start, end, names)
+    existing = {
+        row.medicine_name: row for row in ReorderPoint.query.filter(
+            ReorderPoint.medicine_name.in_(names) if names is not None
+            else sa.or_(ReorderPoint.daily_demand > 0, ReorderPoint.lead_time_days != lead_time,
+                        ReorderPoint.medicine_name.in_(list(series)))
+        )
+    }
+    now = datetime.now(timezone.utc)
+    empty = [0] * LOOKBACK_DAYS
+    for name in sorted(set(series) | set(existing)):
+        demand, std, point = forecast(series.get(name, empty), lead_time)
+        row = existing.get(name)
+        if row is None:
+            row = ReorderPoint(medicine_name=name)
+            session.add(row)
+        row.daily_demand, row.demand_std = demand, std
+        row.lead_time_days, row.reorder_point = lead_time, point
+        row.computed_day = today
+        row.updated_at = now
+    session.commit()
+    return len(set(series) | set(existing))
+
+
+def refresh_job(app):
+    """Scheduler entry point for ``refresh``."""
+    with app.app_context():
+        count = refresh()
+        print(f'[SCHEDULER] Refreshed reorder points for {count} medicines')
+
+
+# ──────────────────────────────────────────────
+#  Reads
+# ──────────────────────────────────────────────
+
+def stock_status(names=None):
+    """
+    {medicine_name: {'on_hand', 'daily_demand', 'reorder_point',
+    'days_remaining', 'low'}} for ``names`` or every item with a batch in
+    inventory (empty batches included, removed items not).
+
+    ``on_hand`` counts unexpired units only; ``days_remaining`` is None when
+    there is no demand to run it down.
+    """
+    names = None if names is None else list(names)
+    levels = stock_ledger.on_hand_by_medicine(names)
+    stocked = db.session.query(Inventory.name).distinct()
+    expired = db.session.query(Inventory.name, func.sum(Inventory.quantity)).filter(
+        Inventory.expiry_bucket == expiry_index.EXPIRED
+    )
+    # Equipment has no catalog entry, so no stock level: add up its batches
+    equipment = db.session.query(Inventory.name, func.sum(Inventory.quantity)).filter(Inventory.medicine_id.is_(None))
+    points = ReorderPoint.query
+    if names is not None:
+        stocked = stocked.filter(Inventory.name.in_(names))
+        expired = expired.filter(Inventory.name.in_(names))
+        equipment = equipment.filter(Inventory.name.in_(names))
+        points = points.filter(ReorderPoint.medicine_name.in_(names))
+    stocked = {name for name, in stocked}
+    expired = dict(expired.group_by(Inventory.name).all())
+    levels.update((name, int(units or 0)) for name, units in equipment.group_by(Inventory.name))
+    points = {row.medicine_name: row for row in points}
+
+    status = {}
+    for name in stocked:
+        total = levels.get(name, 0)
+        usable = max(total - int(expired.get(name) or 0), 0)
+        row = points.get(name)
+        demand = row.daily_demand if row else 0.0
+        point = row.reorder_point if row and demand > 0 else DEFAULT_REORDER_POINT
+        status[name] = {
+            'on_hand': usable,
+            'daily_demand': round(demand, 2),
+            'reorder_point': point,
+            'days_remaining': round(usable / demand, 1) if demand > 0 else None,
+            'low': usable <= point,
+        }
+    return status
+
+
+def low_stock_names():
+    """Medicines whose usable stock is at or below their reorder point."""
+    return sorted(name for name, entry in stock_status().items() if entry['low'])
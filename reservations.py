@@ -2,25 +2,40 @@
 Medicine reservation blueprint for ISUFST CareHub.
 Handles public medicine viewing and reservation system.
 """
-from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify
+from flask import Blueprint, render_template, request, redirect, url_for, flash, jsonify, session, make_response
 from flask_login import login_required, current_user
+from flask_wtf.csrf import generate_csrf
 from datetime import datetime, timezone, timedelta
-from models import db, Inventory, MedicineReservation
+import json
+from models import db, Medicine, MedicineReservation
 from models_extended import MedicineReservationExtended
-from advanced_utils import generate_reservation_qr, generate_qr_code
+from advanced_utils import generate_reservation_qr, reservation_qr_payload, qr_image_key, qr_image_response
+import medicine_listing
+import qr_tokens
+import stock_holds
 
 reservations = Blueprint('reservations', __name__, url_prefix='/reservations')
 
 
 @reservations.route('/medicines')
 def view_medicines():
-    """Public page showing available medicines."""
-    medicines = Inventory.query.filter(
-        Inventory.category == 'Medicine',
-        Inventory.quantity > 0
-    ).order_by(Inventory.name.asc()).all()
-    
-    return render_template('medicines.html', medicines=medicines)
+    """Public page showing available medicines, one card per catalog medicine."""
+    listing = medicine_listing.current()
+    if '_flashes' in session:
+        # One-off messages: never cache or revalidate this rendering
+        return render_template('medicines.html', medicines=listing.rows)
+
+    generate_csrf()  # The page embeds a token for this session; make sure it exists
+    viewer = ()
+    if current_user.is_authenticated:
+        viewer = (current_user.id, current_user.role, current_user.first_name, current_user.last_name,
+                  current_user.email, current_user.profile_image_url)
+    etag = medicine_listing.page_etag(listing, session.get('csrf_token'), *viewer)
+    if request.if_none_match.contains(etag):
+        response = make_response('', 304)
+    else:
+        response = make_response(render_template('medicines.html', medicines=listing.rows))
+    return medicine_listing.revalidate(response, etag)
 
 
 @reservations.route('/reserve/<int:medicine_id>', methods=['POST'])
@@ -31,28 +46,22 @@ def reserve_medicine(medicine_id):
         flash('Only students can reserve medicines.', 'error')
         return redirect(url_for('reservations.view_medicines'))
     
-    medicine = Inventory.query.get_or_404(medicine_id)
-    
-    if medicine.quantity <= 0:
-        flash('This medicine is currently out of stock.', 'error')
+    medicine = db.session.get(Medicine, medicine_id)
+    if medicine is None:
+        flash('This medicine is no longer listed.', 'error')
         return redirect(url_for('reservations.view_medicines'))
     
     quantity = int(request.form.get('quantity', 1))
-    
-    if quantity > medicine.quantity:
-        flash(f'Only {medicine.quantity} units available.', 'error')
+    if quantity <= 0:
+        flash('Please choose at least one unit.', 'error')
         return redirect(url_for('reservations.view_medicines'))
     
-    # Create reservation
-    reservation = MedicineReservation(
-        student_id=current_user.id,
-        medicine_name=medicine.name,
-        quantity=quantity,
-        status='Reserved'
-    )
-    db.session.add(reservation)
-
-    db.session.flush()  # Get reservation.id without committing
+    # Hold the stock for pickup (fails if other holds already promised it)
+    medicine_name = medicine.name
+    reservation, available = stock_holds.place_hold(current_user.id, medicine_name, quantity)
+    if reservation is None:
+        flash(f'Only {available} units available.', 'error')
+        return redirect(url_for('reservations.view_medicines'))
 
     # Generate QR code for reservation check-in
     _, qr_token = generate_reservation_qr(reservation.id)
@@ -62,9 +71,10 @@ def reserve_medicine(medicine_id):
     )
     db.session.add(reservation_ext)
 
+    hold_until = reservation.hold_expires_local.strftime('%B %d at %I:%M %p')
     db.session.commit()
     
-    flash(f'Successfully reserved {quantity} unit(s) of {medicine.name}. You can pick it up anytime during clinic hours!', 'success')
+    flash(f'Successfully reserved {quantity} unit(s) of {medicine_name}. Please pick it up by {hold_until}.', 'success')
     return redirect(url_for('reservations.my_reservations'))
 
 
@@ -84,33 +94,34 @@ def my_reservations():
     return render_template('my_reservations.html', reservations=reservations)
 
 
-@reservations.route('/api/get-qr/<int:reservation_id>')
-@login_required
-def get_reservation_qr(reservation_id):
-    """Get QR code image for a medicine reservation."""
-    import json
-
+def _reservation_qr_data(reservation_id):
+    """(pickup QR payload, None) for a reservation the user may see, or (None, error response)."""
     reservation = MedicineReservation.query.get_or_404(reservation_id)
 
     # Verify access - student can only view their own
     if current_user.role == 'student' and reservation.student_id != current_user.id:
-        return jsonify({'error': 'Unauthorized'}), 403
+        return None, (jsonify({'error': 'Unauthorized'}), 403)
 
-    ext = MedicineReservationExtended.query.filter_by(reservation_id=reservation_id).first()
-    if not ext or not ext.qr_code:
-        return jsonify({'error': 'QR code not available'}), 404
+    # Never sign for a cancelled hold: its revocation only outlives tokens issued before it
+    if reservation.status in ('Cancelled', 'Expired'):
+        return None, (jsonify({'error': 'QR code not available'}), 404)
 
-    qr_data = json.dumps({
-        'type': 'medicine_reservation',
-        'reservation_id': reservation_id,
-        'token': ext.qr_code,
-        'expires': (datetime.now() + timedelta(days=30)).isoformat()
-    })
+    return reservation_qr_payload(reservation_id), None
 
-    qr_image = generate_qr_code(qr_data, add_logo=False)
+
+@reservations.route('/api/get-qr/<int:reservation_id>')
+@login_required
+def get_reservation_qr(reservation_id):
+    """Get QR code image URLs for a medicine reservation."""
+    qr_data, error = _reservation_qr_data(reservation_id)
+    if error:
+        return error
+    reservation = MedicineReservation.query.get(reservation_id)
+    key = qr_image_key(qr_data)
 
     return jsonify({
-        'qr_image': qr_image,
+        'qr_url': url_for('reservations.qr_image', reservation_id=reservation_id, key=key, fmt='png'),
+        'qr_svg_url': url_for('reservations.qr_image', reservation_id=reservation_id, key=key, fmt='svg'),
         'reservation': {
             'id': reservation.id,
             'medicine_name': reservation.medicine_name,
@@ -121,6 +132,20 @@ def get_reservation_qr(reservation_id):
     })
 
 
+@reservations.route('/api/qr/<int:reservation_id>/<key>.<any(png, svg):fmt>')
+@login_required
+def qr_image(reservation_id, key, fmt):
+    """Pickup QR image; the URL changes with the payload, so it is cached as immutable."""
+    qr_data, error = _reservation_qr_data(reservation_id)
+    if error:
+        return error
+    current_key = qr_image_key(qr_data)
+    if key != current_key:
+        # Token or expiry moved on since the URL was handed out
+        return redirect(url_for('reservations.qr_image', reservation_id=reservation_id, key=current_key, fmt=fmt))
+    return qr_image_response(qr_data, fmt)
+
+
 @reservations.route('/<int:reservation_id>/cancel', methods=['POST'])
 @login_required
 def cancel_reservation(reservation_id):
@@ -179,35 +204,67 @@ def admin_mark_picked_up(reservation_id):
     """Admin route to mark reservation as picked up."""
     reservation = MedicineReservation.query.get_or_404(reservation_id)
     
-    if reservation.status == 'Reserved':
-        reservation.status = 'Picked Up'
-        db.session.commit()
-        
-        # Send notification to student
-        from notifications import create_notification
-        create_notification(
-            user_id=reservation.student_id,
-            notif_type='reservation_update',
-            title='Medicine Picked Up ✅',
-            message=f'Your reservation for {reservation.medicine_name} ({reservation.quantity} unit(s)) has been marked as picked up.',
-            link='/reservations/my'
-        )
-        
+    if reservation.status != 'Reserved':
+        flash('Cannot update status.', 'error')
+        return redirect(url_for('reservations.admin_list'))
+    
+    # Staged before the dispense so the notice commits with it (and is rolled back if it fails)
+    from notification_service import create_notification, email_user
+    title = 'Medicine Picked Up ✅'
+    message = f'Your reservation for {reservation.medicine_name} ({reservation.quantity} unit(s)) has been marked as picked up.'
+    create_notification(
+        user_id=reservation.student_id,
+        type='reservation_update',
+        title=title,
+        message=message,
+        link='/reservations/my'
+    )
+    email_user(reservation.student, title, message)
+    
+    # Dispense the held units
+    result = stock_holds.fulfil(reservation, user_id=current_user.id)
+    if result['success']:
         flash(f'Marked as picked up.', 'success')
     else:
-        flash('Cannot update status.', 'error')
+        db.session.rollback()  # Drop the staged notice
+        flash(f'Cannot mark as picked up: {result["message"]}', 'error')
     
     return redirect(url_for('reservations.admin_list'))
 
 
+def _legacy_qr_reservation(qr_data_json):
+    """
+    (reservation id, None) for a JSON pickup QR issued before signed tokens,
+    checked against the extension row's token; or (None, error response).
+    """
+    try:
+        qr_data = json.loads(qr_data_json)
+    except json.JSONDecodeError as e:
+        return None, (jsonify({'error': f'Invalid JSON in QR data: {str(e)}'}), 400)
+
+    if 'expires' not in qr_data or 'reservation_id' not in qr_data or 'token' not in qr_data:
+        return None, (jsonify({'error': 'QR code missing required fields'}), 400)
+
+    expires = datetime.fromisoformat(qr_data['expires'])
+    if expires.tzinfo:
+        expires = expires.replace(tzinfo=None)
+    if datetime.now() > expires:
+        return None, (jsonify({'error': f'QR code expired on {expires.strftime("%B %d, %Y at %I:%M %p")}'}), 400)
+
+    ext = MedicineReservationExtended.query.filter_by(reservation_id=qr_data['reservation_id']).first()
+    if not ext or not ext.qr_code:
+        return None, (jsonify({'error': 'Reservation has no QR code generated'}), 400)
+    if ext.qr_code != qr_data['token']:
+        return None, (jsonify({'error': 'Invalid QR code token (does not match)'}), 400)
+    return qr_data['reservation_id'], None
+
+
 @reservations.route('/api/verify-qr', methods=['POST'])
 @login_required
 @require_staff
 def verify_reservation_qr():
     """Verify QR code for medicine reservation check-in."""
     try:
-        import json as json_module
-
         data = request.get_json(force=True, silent=True)
         if not data:
             return jsonify({'error': 'No JSON data received'}), 400
@@ -216,35 +273,26 @@ def verify_reservation_qr():
         if not qr_data_json:
             return jsonify({'error': 'QR data required'}), 400
 
-        try:
-            qr_data = json_module.loads(qr_data_json)
-        except json_module.JSONDecodeError as e:
-            return jsonify({'error': f'Invalid JSON in QR data: {str(e)}'}), 400
-
-        if 'expires' not in qr_data or 'reservation_id' not in qr_data or 'token' not in qr_data:
-            return jsonify({'error': 'QR code missing required fields'}), 400
+        if qr_tokens.is_token(qr_data_json):
+            # Signed token: verified without touching the database
+            try:
+                reservation_id = qr_tokens.check(qr_data_json, qr_tokens.RESERVATION).object_id
+            except qr_tokens.InvalidToken as e:
+                return jsonify({'error': str(e)}), 400
+        else:
+            reservation_id, error = _legacy_qr_reservation(qr_data_json)
+            if error:
+                return error
 
-        expires = datetime.fromisoformat(qr_data['expires'])
-        if expires.tzinfo:
-            expires = expires.replace(tzinfo=None)
-
-        now = datetime.now()
-        if now > expires:
-            return jsonify({'error': f'QR code expired on {expires.strftime("%B %d, %Y at %I:%M %p")}'}), 400
-
-        reservation_id = qr_data['reservation_id']
         reservation = MedicineReservation.query.get(reservation_id)
         if not reservation:
             return jsonify({'error': f'Reservation #{reservation_id} not found'}), 404
 
-        if reservation.status != 'Reserved':
-            return jsonify({'error': f'Reservation status is {reservation.status}'}), 400
-
-        ext = MedicineReservationExtended.query.filter_by(reservation_id=reservation_id).first()
-        if not ext or not ext.qr_code:
-            return jsonify({'error': 'Reservation has no QR code generated'}), 400
-        if ext.qr_code != qr_data['token']:
-            return jsonify({'error': 'Invalid QR code token (does not match)'}), 400
+        # Scanning the QR at the counter is the pickup: dispense the held units
+        result = stock_holds.fulfil(reservation, user_id=current_user.id)
+        if not result['success']:
+            db.session.rollback()
+            return jsonify({'error': f'Could not dispense reservation: {result["message"]}'}), 409
 
         student = reservation.student
         return jsonify({
@@ -262,7 +310,8 @@ def verify_reservation_qr():
                 'quantity': reservation.quantity,
                 'status': reservation.status,
                 'reserved_at': reservation.reserved_at.strftime('%B %d, %Y')
-            }
+            },
+            'allocations': result['allocations']
         })
     except Exception as e:
         import traceback
@@ -3,11 +3,16 @@ Scheduled Tasks for ISUFST CareHub.
 Automated jobs for reminders, expiry alerts, and maintenance.
 """
 from apscheduler.schedulers.background import BackgroundScheduler
-from models import db, User, Appointment, Inventory
+from models import db, User, Appointment
 from models_extended import AppointmentExtended
 from notification_service import notify_appointment_reminder, notify_expiring_medicines
 from datetime import datetime, date, timedelta
 from flask import current_app
+import expiry_index
+import notification_outbox
+import reorder
+import qr_tokens
+import stock_holds
 
 
 scheduler = BackgroundScheduler()
@@ -38,15 +43,10 @@ def send_appointment_reminders():
 def check_expiring_medicines():
     """Weekly check for expiring medicines and alert admins."""
     with current_app.app_context():
-        # Get medicines expiring in next 30 days
-        expiry_threshold = date.today() + timedelta(days=30)
-        
-        expiring = Inventory.query.filter(
-            Inventory.category == 'Medicine',
-            Inventory.expiry_date <= expiry_threshold,
-            Inventory.expiry_date >= date.today(),
-            Inventory.quantity > 0
-        ).all()
+        # Medicines expiring in the next 30 days, straight from the expiry buckets
+        if not expiry_index.batch_count(expiry_index.EXPIRING_SOON):
+            return
+        expiring = expiry_index.batches(expiry_index.EXPIRING_SOON, limit=None)
         
         if expiring:
             # Get all admins
@@ -56,6 +56,7 @@ def check_expiring_medicines():
             ).all()
             
             notify_expiring_medicines(admins, expiring)
+            db.session.commit()
             print(f'[SCHEDULER] Alerted {len(admins)} admins about {len(expiring)} expiring medicines')
 
 
@@ -102,6 +103,64 @@ def init_scheduler(app):
         replace_existing=True
     )
     
+    # Daily expiry bucket roll, just after local midnight
+    scheduler.add_job(
+        func=expiry_index.roll_job,
+        args=[app],
+        trigger='cron',
+        hour=0,
+        minute=5,
+        timezone='Asia/Manila',
+        id='expiry_roll',
+        replace_existing=True
+    )
+    
+    # Nightly reorder point refresh from the previous day's demand
+    scheduler.add_job(
+        func=reorder.refresh_job,
+        args=[app],
+        trigger='cron',
+        hour=0,
+        minute=20,
+        timezone='Asia/Manila',
+        id='reorder_refresh',
+        replace_existing=True
+    )
+    
+    # Release medicine holds that were not picked up in time
+    scheduler.add_job(
+        func=stock_holds.sweep_job,
+        args=[app],
+        trigger='interval',
+        minutes=5,
+        id='reservation_hold_sweep',
+        replace_existing=True
+    )
+    
+    # Forget QR revocations once every token they covered has expired
+    scheduler.add_job(
+        func=qr_tokens.prune_job,
+        args=[app],
+        trigger='cron',
+        hour=0,
+        minute=40,
+        timezone='Asia/Manila',
+        id='qr_revocation_prune',
+        replace_existing=True
+    )
+    
+    # Forget delivered notification emails and SMS after a while
+    scheduler.add_job(
+        func=notification_outbox.prune_job,
+        args=[app],
+        trigger='cron',
+        hour=0,
+        minute=50,
+        timezone='Asia/Manila',
+        id='notification_outbox_prune',
+        replace_existing=True
+    )
+    
     # Daily no-show check at midnight
     scheduler.add_job(
         func=auto_cancel_no_shows,
@@ -112,6 +171,20 @@ def init_scheduler(app):
         replace_existing=True
     )
     
+    # Monthly clinic report for the month that just closed (1st, 1:30 AM)
+    from monthly_report import render_previous_month
+    scheduler.add_job(
+        func=render_previous_month,
+        args=[app],
+        trigger='cron',
+        day=1,
+        hour=1,
+        minute=30,
+        timezone='Asia/Manila',
+        id='monthly_report',
+        replace_existing=True
+    )
+    
     scheduler.start()
     print('[SCHEDULER] Background scheduler started')
     
@@ -2,15 +2,133 @@
 Search & Filtering System for ISUFST CareHub.
 Provides full-text search across patients, appointments, inventory, and records.
 """
-from flask import Blueprint, render_template, request, jsonify
+from flask import Blueprint, render_template, request, jsonify, current_app, url_for, copy_current_request_context
 from flask_login import login_required
 from rbac import require_staff
 from models import db, User, Appointment, ClinicVisit, Inventory, MedicineReservation
-from sqlalchemy import or_, and_, func
-from datetime import datetime
+from models_extended import HealthCertificate
+from sqlalchemy import or_, and_, func, extract, text, tuple_
+from sqlalchemy.orm import joinedload
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime
+import base64
+import json
+import expiry_index
+import reorder
+import search_index
+from student_directory import search_students as search_students_index
 
 search = Blueprint('search', __name__, url_prefix='/search')
 
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+# ──────────────────────────────────────────────
+#  Faceted Pages
+# ──────────────────────────────────────────────
+
+def _encode_cursor(sort_value, row_id):
+    raw = json.dumps([sort_value.isoformat(), row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def _decode_cursor(cursor, sort_column):
+    """(sort value, id) from a cursor; ValueError if it was tampered with."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        sort_value, row_id = json.loads(raw)
+        parse = datetime.fromisoformat if isinstance(sort_column.type, db.DateTime) else date.fromisoformat
+        return parse(sort_value), int(row_id)
+    except (TypeError, ValueError, json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise ValueError('Invalid cursor') from e
+
+
+def _month_range(month):
+    try:
+        first = datetime.strptime(month, '%Y-%m').date()
+    except ValueError:
+        raise ValueError('Month must be YYYY-MM') from None
+    following = date(first.year + first.month // 12, first.month % 12 + 1, 1)
+    return first, following
+
+
+def _faceted_page(query, sort_column, id_column, day_column, facets, selected, options=()):
+    """
+    One page of ``query`` in (sort_column, id) descending order, plus facet counts.
+
+    ``facets`` maps facet names to columns (``month`` is derived from
+    ``day_column``); ``selected`` holds the facet values picked by the user.
+    Paging seeks past the cursor on the (sort_column, id) index, so page 200
+    costs the same as page 1. Counts come from one GROUP BY over every facet
+    at once and are only computed for the first page. Each facet is counted
+    with the other facets' selections applied but not its own, so the UI can
+    still offer the alternatives ("Completed (412) · Cancelled (37)").
+    """
+    limit = min(request.args.get('limit', PAGE_SIZE, type=int) or PAGE_SIZE, MAX_PAGE_SIZE)
+    cursor = request.args.get('cursor')
+    selected = {name: value for name, value in selected.items() if value}
+
+    conditions = []
+    for name, value in selected.items():
+        if name == 'month':
+            first, following = _month_range(value)
+            conditions += [day_column >= first, day_column < following]
+        else:
+            conditions.append(facets[name] == value)
+
+    page = query.options(*options).filter(*conditions)
+    if cursor:
+        sort_value, row_id = _decode_cursor(cursor, sort_column)
+        page = page.filter(tuple_(sort_column, id_column) < tuple_(sort_value, row_id))
+    rows = page.order_by(sort_column.desc(), id_column.desc()).limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+
+    result = {
+        'rows': rows,
+        'next_cursor': _encode_cursor(getattr(rows[-1], sort_column.key), rows[-1].id) if has_more else None,
+    }
+    if not cursor:
+        result['total'], result['facets'] = _facet_counts(query, day_column, facets, selected)
+    return result
+
+
+def _facet_counts(query, day_column, facets, selected):
+    names = list(facets) + ['month']
+    year, month = extract('year', day_column), extract('month', day_column)
+    grouped = query.order_by(None).with_entities(
+        *facets.values(), year, month, func.count()
+    ).group_by(*facets.values(), year, month)
+
+    counts = {name: {} for name in names}
+    total = 0
+    for row in grouped:
+        values = dict(zip(facets, row[:len(facets)]))
+        values['month'] = f'{int(row[-3]):04d}-{int(row[-2]):02d}' if row[-3] is not None else None
+        count = row[-1]
+        misses = [name for name in names if name in selected and values[name] != selected[name]]
+        if not misses:
+            total += count
+        for name in names:
+            # Count towards a facet if only that facet's own selection rules the row out
+            if values[name] is not None and (not misses or misses == [name]):
+                counts[name][values[name]] = counts[name].get(values[name], 0) + count
+    return total, {
+        name: dict(sorted(values.items(), reverse=(name == 'month')))
+        for name, values in counts.items()
+    }
+
+
+def _patient_filter(query, student_column, patient_name):
+    """Restrict to patients matching ``patient_name``; None if it has no searchable words."""
+    patients = search_index.matching_ids(search_index.PATIENT, patient_name)
+    return None if patients is None else query.filter(student_column.in_(patients))
+
+
+def _empty_page():
+    return jsonify({'results': [], 'next_cursor': None, 'total': 0, 'facets': {}})
+
 
 @search.route('/')
 @login_required
@@ -25,69 +143,71 @@ def index():
 @require_staff
 def search_patients():
     """Search patients by name, email, student ID."""
-    query_text = request.args.get('q', '').strip()
+    # The search page sends separate name / email / student_id fields
+    query_text = ' '.join(
+        request.args.get(key, '') for key in ('q', 'name', 'email', 'student_id')
+    ).strip()
     
     if len(query_text) < 2:
         return jsonify([])
     
-    # Search across multiple fields
-    results = User.query.join(User.student_profile).filter(
-        User.role == 'student',
-        or_(
-            func.lower(User.first_name).contains(query_text.lower()),
-            func.lower(User.last_name).contains(query_text.lower()),
-            func.lower(User.email).contains(query_text.lower()),
-            func.lower(User.student_profile.student_id_number).contains(query_text.lower())
-        )
-    ).limit(20).all()
+    results = search_students_index(query_text, limit=20)
     
     return jsonify([{
-        'id': user.id,
-        'name': f'{user.first_name} {user.last_name}',
-        'email': user.email,
-        'student_id': user.student_profile.student_id_number if user.student_profile else None,
-        'course': user.student_profile.course if user.student_profile else None
-    } for user in results])
+        'id': student['id'],
+        'name': student['name'],
+        'first_name': student['first_name'],
+        'last_name': student['last_name'],
+        'email': student['email'],
+        'role': 'student',
+        'student_id': student['student_id'],
+        'course': student['course']
+    } for student in results])
 
 
 @search.route('/api/appointments')
 @login_required
 @require_staff
 def search_appointments():
-    """Search appointments with filters."""
+    """Search appointments with filters, paged by cursor, with status / service / month counts."""
     # Filters
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
-    status = request.args.get('status')
-    service_type = request.args.get('service_type')
     patient_name = request.args.get('patient_name', '').strip()
     
-    query = Appointment.query.join(Appointment.student)
+    query = Appointment.query
     
     # Apply filters
-    if date_from:
-        query = query.filter(Appointment.appointment_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
-    
-    if date_to:
-        query = query.filter(Appointment.appointment_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
-    
-    if status:
-        query = query.filter(Appointment.status == status)
-    
-    if service_type:
-        query = query.filter(Appointment.service_type == service_type)
+    try:
+        if date_from:
+            query = query.filter(Appointment.appointment_date >= datetime.strptime(date_from, '%Y-%m-%d').date())
+        
+        if date_to:
+            query = query.filter(Appointment.appointment_date <= datetime.strptime(date_to, '%Y-%m-%d').date())
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
     
     if patient_name:
-        query = query.filter(
-            or_(
-                func.lower(User.first_name).contains(patient_name.lower()),
-                func.lower(User.last_name).contains(patient_name.lower())
-            )
+        query = _patient_filter(query, Appointment.student_id, patient_name)
+        if query is None:
+            return _empty_page()
+    
+    try:
+        page = _faceted_page(
+            query,
+            Appointment.appointment_date, Appointment.id, Appointment.appointment_date,
+            facets={'status': Appointment.status, 'service_type': Appointment.service_type},
+            selected={
+                'status': request.args.get('status'),
+                'service_type': request.args.get('service_type'),
+                'month': request.args.get('month'),
+            },
+            options=[joinedload(Appointment.student)]
         )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    appointments = query.order_by(Appointment.appointment_date.desc()).limit(50).all()
-    
-    return jsonify([{
+    page['results'] = [{
         'id': appt.id,
         'patient': f'{appt.student.first_name} {appt.student.last_name}',
         'patient_id': appt.student_id,
@@ -95,7 +215,8 @@ def search_appointments():
         'appointment_date': appt.appointment_date.isoformat(),
         'start_time': appt.start_time.strftime('%H:%M'),
         'status': appt.status
-    } for appt in appointments])
+    } for appt in page.pop('rows')]
+    return jsonify(page)
 
 
 @search.route('/api/inventory')
@@ -103,49 +224,50 @@ def search_appointments():
 @require_staff
 def search_inventory():
     """Search inventory items."""
-    query_text = request.args.get('q', '').strip()
+    query_text = (request.args.get('q') or request.args.get('medicine_name', '')).strip()
     category = request.args.get('category')
     low_stock_only = request.args.get('low_stock') == 'true'
     expiring_soon = request.args.get('expiring') == 'true'
+    expiry_bucket = request.args.get('expiry_bucket')
     
     query = Inventory.query
+    ranked = search_index.match(search_index.INVENTORY, query_text)
     
     # Text search
-    if query_text:
-        query = query.filter(
-            or_(
-                func.lower(Inventory.name).contains(query_text.lower()),
-                func.lower(Inventory.batch_number).contains(query_text.lower())
-            )
-        )
+    if ranked is not None:
+        ranked = ranked.subquery()
+        query = query.join(ranked, ranked.c.entity_id == Inventory.id)
     
     # Category filter
     if category:
         query = query.filter(Inventory.category == category)
     
-    # Low stock filter
+    # Low stock filter (at or below the medicine's reorder point)
     if low_stock_only:
-        query = query.filter(Inventory.quantity < 10)
+        query = query.filter(Inventory.name.in_(reorder.low_stock_names()))
     
-    # Expiring soon filter
+    # Expiry filters (precomputed buckets, see expiry_index)
     if expiring_soon:
-        from datetime import date, timedelta
-        expiry_threshold = date.today() + timedelta(days=30)
-        query = query.filter(
-            Inventory.expiry_date <= expiry_threshold,
-            Inventory.expiry_date >= date.today()
-        )
+        query = query.filter(Inventory.expiry_bucket.in_(expiry_index.EXPIRING_SOON))
+    if expiry_bucket in expiry_index.BUCKETS:
+        query = query.filter(Inventory.expiry_bucket == expiry_bucket)
     
-    items = query.order_by(Inventory.name).limit(50).all()
+    if ranked is not None:
+        query = query.order_by(ranked.c.rank.desc(), Inventory.name)
+    else:
+        query = query.order_by(Inventory.name)
+    items = query.limit(50).all()
     
     return jsonify([{
         'id': item.id,
         'name': item.name,
+        'medicine_name': item.name,
         'batch_number': item.batch_number,
         'quantity': item.quantity,
         'category': item.category,
         'expiry_date': item.expiry_date.isoformat() if item.expiry_date else None,
-        'is_expiring': item.is_expiring_soon()
+        'is_expiring': item.expiry_bucket in expiry_index.EXPIRING_SOON,
+        'expiry_bucket': item.expiry_bucket
     } for item in items])
 
 
@@ -153,132 +275,262 @@ def search_inventory():
 @login_required
 @require_staff
 def search_visits():
-    """Search clinic visits."""
+    """Search clinic visits, paged by cursor, with status / month counts."""
     patient_name = request.args.get('patient_name', '').strip()
     date_from = request.args.get('date_from')
     date_to = request.args.get('date_to')
     diagnosis = request.args.get('diagnosis', '').strip()
     
-    query = ClinicVisit.query.join(ClinicVisit.patient)
+    query = ClinicVisit.query
     
-    # Patient name filter
+    # Patient name filter, matched against patient documents
     if patient_name:
-        query = query.filter(
-            or_(
-                func.lower(User.first_name).contains(patient_name.lower()),
-                func.lower(User.last_name).contains(patient_name.lower())
-            )
-        )
-    
-    # Date range filter
-    if date_from:
-        query = query.filter(func.date(ClinicVisit.visit_date) >= datetime.strptime(date_from, '%Y-%m-%d').date())
-    
-    if date_to:
-        query = query.filter(func.date(ClinicVisit.visit_date) <= datetime.strptime(date_to, '%Y-%m-%d').date())
+        query = _patient_filter(query, ClinicVisit.student_id, patient_name)
+        if query is None:
+            return _empty_page()
     
-    # Diagnosis filter
+    # Diagnosis / complaint text, matched against the visit's document.
+    # Pages are date ordered, so the text match only filters.
     if diagnosis:
-        query = query.filter(func.lower(ClinicVisit.diagnosis).contains(diagnosis.lower()))
+        visits = search_index.matching_ids(search_index.VISIT, diagnosis)
+        if visits is None:
+            return _empty_page()
+        query = query.filter(ClinicVisit.id.in_(visits))
     
-    visits = query.order_by(ClinicVisit.visit_date.desc()).limit(50).all()
+    # Date range filter
+    try:
+        if date_from:
+            query = query.filter(ClinicVisit.visit_day >= datetime.strptime(date_from, '%Y-%m-%d').date())
+        
+        if date_to:
+            query = query.filter(ClinicVisit.visit_day <= datetime.strptime(date_to, '%Y-%m-%d').date())
+    except ValueError:
+        return jsonify({'error': 'Dates must be YYYY-MM-DD'}), 400
+    
+    try:
+        page = _faceted_page(
+            query,
+            ClinicVisit.visit_date, ClinicVisit.id, ClinicVisit.visit_day,
+            facets={'status': ClinicVisit.status},
+            selected={'status': request.args.get('status'), 'month': request.args.get('month')},
+            options=[joinedload(ClinicVisit.patient)]
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([{
+    page['results'] = [{
         'id': visit.id,
         'patient': f'{visit.patient.first_name} {visit.patient.last_name}',
         'visit_date': visit.visit_date.isoformat(),
         'chief_complaint': visit.chief_complaint,
         'diagnosis': visit.diagnosis,
         'status': visit.status
-    } for visit in visits])
+    } for visit in page.pop('rows')]
+    return jsonify(page)
 
 
 @search.route('/api/reservations')
 @login_required
 @require_staff
 def search_reservations():
-    """Search medicine reservations."""
-    status = request.args.get('status')
+    """Search medicine reservations, paged by cursor, with status / month counts."""
     patient_name = request.args.get('patient_name', '').strip()
     medicine = request.args.get('medicine', '').strip()
     
-    query = MedicineReservation.query.join(MedicineReservation.student)
-    
-    # Status filter
-    if status:
-        query = query.filter(MedicineReservation.status == status)
+    query = MedicineReservation.query
     
     # Patient filter
     if patient_name:
-        query = query.filter(
-            or_(
-                func.lower(User.first_name).contains(patient_name.lower()),
-                func.lower(User.last_name).contains(patient_name.lower())
-            )
-        )
+        query = _patient_filter(query, MedicineReservation.student_id, patient_name)
+        if query is None:
+            return _empty_page()
     
     # Medicine filter
     if medicine:
         query = query.filter(func.lower(MedicineReservation.medicine_name).contains(medicine.lower()))
     
-    reservations = query.order_by(MedicineReservation.reserved_at.desc()).limit(50).all()
+    try:
+        page = _faceted_page(
+            query,
+            MedicineReservation.reserved_at, MedicineReservation.id, MedicineReservation.reserved_day,
+            facets={'status': MedicineReservation.status},
+            selected={'status': request.args.get('status'), 'month': request.args.get('month')},
+            options=[joinedload(MedicineReservation.student)]
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify([{
+    page['results'] = [{
         'id': res.id,
         'patient': f'{res.student.first_name} {res.student.last_name}',
         'medicine': res.medicine_name,
         'quantity': res.quantity,
         'status': res.status,
         'reserved_at': res.reserved_at.isoformat()
-    } for res in reservations])
+    } for res in page.pop('rows')]
+    return jsonify(page)
+
+
+# ──────────────────────────────────────────────
+#  Global Search
+# ──────────────────────────────────────────────
+
+GLOBAL_LIMIT = 5
+GLOBAL_BUDGET_SECONDS = 0.8  # Per entity; slower entities are left out of the response
+
+# Entity queries run side by side, each on its own session (and so its own
+# pooled connection). Sized for a few overlapping dropdown requests.
+_global_pool = ThreadPoolExecutor(max_workers=12, thread_name_prefix='global-search')
+
+
+def _global_patients(query_text):
+    return [{
+        'type': 'patient',
+        'id': s['id'],
+        'title': s['name'],
+        'first_name': s['first_name'],
+        'last_name': s['last_name'],
+        'email': s['email'],
+        'subtitle': s['student_id'],
+        'url': url_for('auth.edit_user', user_id=s['id'])
+    } for s in search_students_index(query_text, limit=GLOBAL_LIMIT)]
+
+
+def _global_appointments(query_text):
+    patients = search_index.matching_ids(search_index.PATIENT, query_text, limit=20)
+    appointments = Appointment.query.options(joinedload(Appointment.student)).filter(or_(
+        Appointment.student_id.in_(patients),
+        func.lower(Appointment.service_type).startswith(query_text.lower(), autoescape=True)
+    )).order_by(Appointment.appointment_date.desc(), Appointment.id.desc()).limit(GLOBAL_LIMIT).all()
+    return [{
+        'type': 'appointment',
+        'id': a.id,
+        'title': f'{a.student.first_name} {a.student.last_name}',
+        'subtitle': f'{a.service_type} · {a.appointment_date.isoformat()} · {a.status}',
+        'service_type': a.service_type,
+        'appointment_date': a.appointment_date.isoformat(),
+        'status': a.status,
+        'url': url_for('appointments.admin_list')
+    } for a in appointments]
+
+
+def _global_visits(query_text):
+    ranked = search_index.match(search_index.VISIT, query_text, limit=GLOBAL_LIMIT).subquery()
+    visits = ClinicVisit.query.join(ranked, ranked.c.entity_id == ClinicVisit.id).options(
+        joinedload(ClinicVisit.patient)
+    ).order_by(ranked.c.rank.desc(), ClinicVisit.visit_date.desc()).limit(GLOBAL_LIMIT).all()
+    return [{
+        'type': 'visit',
+        'id': v.id,
+        'title': f'{v.patient.first_name} {v.patient.last_name}' if v.patient else 'Clinic visit',
+        'subtitle': v.diagnosis or v.chief_complaint,
+        'url': url_for('auth.edit_user', user_id=v.student_id)
+    } for v in visits]
+
+
+def _global_inventory(query_text):
+    ranked = search_index.match(search_index.INVENTORY, query_text, limit=GLOBAL_LIMIT).subquery()
+    inventory = Inventory.query.join(ranked, ranked.c.entity_id == Inventory.id).order_by(
+        ranked.c.rank.desc(), Inventory.name
+    ).limit(GLOBAL_LIMIT).all()
+    return [{
+        'type': 'medicine',
+        'id': item.id,
+        'title': item.name,
+        'subtitle': f'{item.quantity} in stock',
+        'medicine_name': item.name,
+        'quantity': item.quantity,
+        'url': url_for('inventory.list_inventory')
+    } for item in inventory]
+
+
+def _global_reservations(query_text):
+    patients = search_index.matching_ids(search_index.PATIENT, query_text, limit=20)
+    reservations = MedicineReservation.query.options(joinedload(MedicineReservation.student)).filter(or_(
+        MedicineReservation.student_id.in_(patients),
+        func.lower(MedicineReservation.medicine_name).contains(query_text.lower(), autoescape=True)
+    )).order_by(MedicineReservation.reserved_at.desc(), MedicineReservation.id.desc()).limit(GLOBAL_LIMIT).all()
+    return [{
+        'type': 'reservation',
+        'id': r.id,
+        'title': r.medicine_name,
+        'subtitle': f'{r.student.first_name} {r.student.last_name} · {r.quantity} · {r.status}',
+        'url': url_for('reservations.admin_list')
+    } for r in reservations]
+
+
+def _global_certificates(query_text):
+    patients = search_index.matching_ids(search_index.PATIENT, query_text, limit=20)
+    certificates = HealthCertificate.query.options(joinedload(HealthCertificate.student)).filter(or_(
+        HealthCertificate.student_id.in_(patients),
+        func.upper(HealthCertificate.certificate_number).startswith(query_text.upper(), autoescape=True)
+    )).order_by(HealthCertificate.issued_at.desc(), HealthCertificate.id.desc()).limit(GLOBAL_LIMIT).all()
+    return [{
+        'type': 'certificate',
+        'id': c.id,
+        'title': c.certificate_number,
+        'subtitle': f'{c.student.first_name} {c.student.last_name} · {c.purpose or "Health certificate"}',
+        'url': url_for('certificates.view_certificate', cert_id=c.id)
+    } for c in certificates]
+
+
+GLOBAL_ENTITIES = {
+    'patients': _global_patients,
+    'appointments': _global_appointments,
+    'visits': _global_visits,
+    'inventory': _global_inventory,
+    'reservations': _global_reservations,
+    'certificates': _global_certificates,
+}
+
+
+def _run_entity_search(app, search_fn, query_text, budget):
+    with app.app_context():
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                # Give up server-side too, instead of holding the connection
+                db.session.execute(text(f'SET LOCAL statement_timeout = {int(budget * 1000)}'))
+            return search_fn(query_text)
+        finally:
+            db.session.remove()
 
 
 @search.route('/api/global')
 @login_required
 @require_staff
 def global_search():
-    """Global search across all entities."""
+    """
+    Global search across all entities.
+
+    Entities are queried concurrently; any that miss the time budget (or
+    fail) come back empty and are listed under ``partial``.
+    """
     query_text = request.args.get('q', '').strip()
     
-    if len(query_text) < 3:
+    if len(query_text) < 3 or not search_index.query_terms(query_text):
         return jsonify({'results': []})
     
-    results = {
-        'patients': [],
-        'appointments': [],
-        'inventory': [],
-        'visits': []
+    app = current_app._get_current_object()
+    budget = app.config.get('GLOBAL_SEARCH_BUDGET', GLOBAL_BUDGET_SECONDS)
+    # Each search runs with a copy of this request, so it can build its urls with url_for
+    futures = {
+        _global_pool.submit(copy_current_request_context(_run_entity_search), app, search_fn, query_text, budget): name
+        for name, search_fn in GLOBAL_ENTITIES.items()
     }
-    
-    # Search patients
-    patients = User.query.join(User.student_profile).filter(
-        User.role == 'student',
-        or_(
-            func.lower(User.first_name).contains(query_text.lower()),
-            func.lower(User.last_name).contains(query_text.lower()),
-            func.lower(User.student_profile.student_id_number).contains(query_text.lower())
-        )
-    ).limit(5).all()
-    
-    results['patients'] = [{
-        'type': 'patient',
-        'id': u.id,
-        'title': f'{u.first_name} {u.last_name}',
-        'subtitle': u.student_profile.student_id_number if u.student_profile else None,
-        'url': f'/admin/user/{u.id}'
-    } for u in patients]
-    
-    # Search inventory
-    inventory = Inventory.query.filter(
-        func.lower(Inventory.name).contains(query_text.lower())
-    ).limit(5).all()
-    
-    results['inventory'] = [{
-        'type': 'medicine',
-        'id': item.id,
-        'title': item.name,
-        'subtitle': f'{item.quantity} in stock',
-        'url': f'/inventory'
-    } for item in inventory]
-    
+    # Every entity started at the same time, so one shared deadline is each one's budget
+    done, not_done = wait(futures, timeout=budget)
+    
+    results = {name: [] for name in GLOBAL_ENTITIES}
+    partial = sorted(futures[future] for future in not_done)
+    for future in done:
+        name = futures[future]
+        try:
+            results[name] = future.result()
+        except Exception as e:
+            app.logger.warning(f'Global search for {name} failed: {e}')
+            partial.append(name)
+    for future in not_done:
+        future.cancel()  # Not started yet (pool busy): skip it entirely
+    
+    results['partial'] = sorted(partial)
     return jsonify(results)
@@ -0,0 +1,274 @@
+"""
+Full-text search index for ISUFST CareHub.
+
+Patients, clinic visits and inventory items are flattened into
+SearchDocument rows (normalized title + body text) whenever they are written.
+Matching uses a weighted tsvector GIN index on Postgres and FTS5 on SQLite;
+all query terms must match (as prefixes) and results are ranked, with name /
+title hits above body hits.
+"""
+import re
+import unicodedata
+from collections import defaultdict
+
+import sqlalchemy as sa
+from sqlalchemy import func, inspect, select
+
+from models import db, User, StudentProfile, ClinicVisit, Inventory
+from models_extended import SearchDocument, SEARCH_TSVECTOR_SQL
+
+PATIENT = 'patient'
+VISIT = 'visit'
+INVENTORY = 'inventory'
+
+MAX_TERMS = 8
+BATCH_SIZE = 2000
+
+_WORD = re.compile(r'[^\W_]+', re.UNICODE)
+
+
+def _fold(text):
+    """Lowercase and strip accents ('María' -> 'maria')."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+
+
+def normalize(*parts):
+    """Folded words only, so every dialect tokenizes documents and queries alike."""
+    return ' '.join(_WORD.findall(_fold(' '.join(str(p) for p in parts if p))))
+
+
+def query_terms(text):
+    """Distinct search words from user input, in order."""
+    terms = []
+    for word in _WORD.findall(_fold(text or '')):
+        if word not in terms:
+            terms.append(word)
+    return terms[:MAX_TERMS]
+
+
+# ──────────────────────────────────────────────
+#  Documents
+# ──────────────────────────────────────────────
+
+def patient_document(first_name, last_name, email, student_number, course):
+    return (
+        normalize(first_name, last_name),
+        normalize(
+            email,
+            student_number,
+            # '2021-0001' should also match '20210001'
+            re.sub(r'\W', '', student_number or ''),
+            course,
+        ),
+    )
+
+
+def visit_document(diagnosis, chief_complaint, treatment, notes):
+    # Clinical text only: names live in patient documents, so a common name
+    # never has to be ranked across every visit that patient made
+    return normalize(diagnosis), normalize(chief_complaint, treatment, notes)
+
+
+def inventory_document(name, batch_number, category):
+    return normalize(name), normalize(batch_number, category)
+
+
+def _load_documents(session, entity_type, ids):
+    """{entity_id: (title, body)} for the entities that still exist and are searchable."""
+    if entity_type == PATIENT:
+        rows = session.execute(
+            select(User.id, User.first_name, User.last_name, User.email,
+                   StudentProfile.student_id_number, StudentProfile.course)
+            .outerjoin(StudentProfile, StudentProfile.user_id == User.id)
+            .where(User.id.in_(ids), User.role == 'student')
+        )
+        builder = patient_document
+    elif entity_type == VISIT:
+        rows = session.execute(
+            select(ClinicVisit.id, ClinicVisit.diagnosis, ClinicVisit.chief_complaint,
+                   ClinicVisit.treatment, ClinicVisit.notes)
+            .where(ClinicVisit.id.in_(ids))
+        )
+        builder = visit_document
+    else:
+        rows = session.execute(
+            select(Inventory.id, Inventory.name, Inventory.batch_number, Inventory.category)
+            .where(Inventory.id.in_(ids))
+        )
+        builder = inventory_document
+    return {row[0]: builder(*row[1:]) for row in rows}
+
+
+def reindex(session, entity_type, ids):
+    """Bring the documents of ``ids`` in line with their entities (insert, update or delete)."""
+    ids = sorted(set(ids))
+    for start in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[start:start + BATCH_SIZE]
+        documents = _load_documents(session, entity_type, chunk)
+        existing = {
+            doc.entity_id: doc for doc in session.execute(
+                select(SearchDocument).where(
+                    SearchDocument.entity_type == entity_type,
+                    SearchDocument.entity_id.in_(chunk)
+                )
+            ).scalars()
+        }
+        for entity_id in chunk:
+            doc = existing.get(entity_id)
+            if entity_id not in documents:
+                if doc is not None:
+                    session.delete(doc)
+                continue
+            title, body = documents[entity_id]
+            if doc is None:
+                session.add(SearchDocument(entity_type=entity_type, entity_id=entity_id, title=title, body=body))
+            elif (doc.title, doc.body) != (title, body):
+                doc.title, doc.body = title, body
+
+
+# ──────────────────────────────────────────────
+#  Write Hooks
+# ──────────────────────────────────────────────
+
+def _mark(instance, entity_type, entity_id):
+    session = inspect(instance).session
+    if session is not None and entity_id is not None:
+        session.info.setdefault('search_dirty', defaultdict(set))[entity_type].add(entity_id)
+
+
+@db.event.listens_for(User, 'after_insert')
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _user_written(mapper, connection, user):
+    _mark(user, PATIENT, user.id)
+
+
+@db.event.listens_for(StudentProfile, 'after_insert')
+@db.event.listens_for(StudentProfile, 'after_update')
+@db.event.listens_for(StudentProfile, 'after_delete')
+def _profile_written(mapper, connection, profile):
+    _mark(profile, PATIENT, profile.user_id)
+
+
+@db.event.listens_for(ClinicVisit, 'after_insert')
+@db.event.listens_for(ClinicVisit, 'after_update')
+@db.event.listens_for(ClinicVisit, 'after_delete')
+def _visit_written(mapper, connection, visit):
+    _mark(visit, VISIT, visit.id)
+
+
+@db.event.listens_for(Inventory, 'after_insert')
+@db.event.listens_for(Inventory, 'after_update')
+@db.event.listens_for(Inventory, 'after_delete')
+def _inventory_written(mapper, connection, item):
+    _mark(item, INVENTORY, item.id)
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def _sync_documents(session, flush_context):
+    """Rewrite affected documents in the same transaction; the commit flushes them."""
+    dirty = session.info.pop('search_dirty', None)
+    if not dirty:
+        return
+    for entity_type, ids in dirty.items():
+        reindex(session, entity_type, ids)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_dirty(session):
+    session.info.pop('search_dirty', None)
+
+
+# ──────────────────────────────────────────────
+#  Matching
+# ──────────────────────────────────────────────
+
+def match(entity_type, text, limit=None):
+    """
+    Select of (entity_id, rank) for ``entity_type`` documents matching every
+    term of ``text`` as a prefix; higher rank is better. None if ``text`` has
+    no searchable words.
+
+    Use as a subquery: ``ranked = match(...).subquery()`` then join on
+    ``ranked.c.entity_id`` and order by ``ranked.c.rank.desc()``. Pass
+    ``limit`` when the caller applies no further filters, so only the top
+    hits are joined back to their entities.
+    """
+    terms = query_terms(text)
+    if not terms:
+        return None
+    query = _match(entity_type, terms)
+    if limit is not None:
+        query = query.order_by(sa.desc('rank')).limit(limit)
+    return query
+
+
+def matching_ids(entity_type, text, limit=None):
+    """Select of just the matching entity ids, for use in ``column.in_(...)``."""
+    query = match(entity_type, text, limit)
+    return None if query is None else select(query.subquery().c.entity_id)
+
+
+def _match(entity_type, terms):
+    dialect = db.session.get_bind().dialect.name
+
+    if dialect == 'postgresql':
+        vector = sa.literal_column(f'({SEARCH_TSVECTOR_SQL})')
+        tsquery = func.to_tsquery('simple', ' & '.join(f'{t}:*' for t in terms))
+        return select(
+            SearchDocument.entity_id,
+            func.ts_rank(vector, tsquery).label('rank')
+        ).where(
+            SearchDocument.entity_type == entity_type,
+            vector.op('@@')(tsquery)
+        )
+
+    if dialect == 'sqlite':
+        fts = sa.table('search_documents_fts', sa.column('rowid'))
+        fts_ref = sa.literal_column('search_documents_fts')
+        # bm25 is lower-is-better; title matches weigh 10x body matches
+        return select(
+            SearchDocument.entity_id,
+            (-func.bm25(fts_ref, 10.0, 1.0)).label('rank')
+        ).select_from(fts).join(
+            SearchDocument, SearchDocument.id == fts.c.rowid
+        ).where(
+            fts_ref.op('MATCH')(' AND '.join(f'"{t}"*' for t in terms)),
+            SearchDocument.entity_type == entity_type
+        )
+
+    # Other databases: unindexed fallback with a crude title-first rank
+    conditions = [(SearchDocument.title + ' ' + SearchDocument.body).contains(t) for t in terms]
+    title_hits = sum(sa.case((SearchDocument.title.contains(t), 1), else_=0) for t in terms)
+    return select(SearchDocument.entity_id, title_hits.label('rank')).where(
+        SearchDocument.entity_type == entity_type, *conditions
+    )
+
+
+# ──────────────────────────────────────────────
+#  Maintenance
+# ──────────────────────────────────────────────
+
+def rebuild_index(entity_types=(PATIENT, VISIT, INVENTORY)):
+    """Rebuild documents from scratch (initial backfill or repair). Returns counts per type."""
+    session = db.session
+    counts = {}
+    sources = {
+        PATIENT: select(User.id).where(User.role == 'student'),
+        VISIT: select(ClinicVisit.id),
+        INVENTORY: select(Inventory.id),
+    }
+    for entity_type in entity_types:
+        session.execute(sa.delete(SearchDocument).where(SearchDocument.entity_type == entity_type))
+        ids = sorted(session.execute(sources[entity_type]).scalars())
+        for start in range(0, len(ids), BATCH_SIZE):
+            chunk = ids[start:start + BATCH_SIZE]
+            documents = _load_documents(session, entity_type, chunk)
+            session.execute(sa.insert(SearchDocument), [
+                {'entity_type': entity_type, 'entity_id': entity_id, 'title': title, 'body': body}
+                for entity_id, (title, body) in documents.items()
+            ])
+        counts[entity_type] = len(ids)
+    session.commit()
+    return counts
@@ -0,0 +1,165 @@
+"""
+Mergeable streaming sketches for ISUFST CareHub analytics.
+
+QuantileSketch  - relative-error quantile sketch (DDSketch-style log buckets)
+DistinctCounter - HyperLogLog distinct counter
+
+Both serialize to compact strings for storage in rollup rows, and merging two
+sketches gives the same result as sketching the combined stream, so daily or
+hourly rollups can be combined for any date range without touching raw rows.
+"""
+import base64
+import hashlib
+import json
+import math
+
+
+# ──────────────────────────────────────────────
+#  Quantile Sketch
+# ──────────────────────────────────────────────
+
+class QuantileSketch:
+    """
+    Quantile sketch with bounded relative error.
+
+    Positive values are counted in logarithmic buckets of width ``gamma``, so
+    every reported quantile is within ``relative_accuracy`` of the true value.
+    Values <= 0 share a single zero bucket.
+    """
+
+    def __init__(self, relative_accuracy=0.02):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.bins = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value, weight=1):
+        """Add one observation."""
+        if value <= 0:
+            self.zero_count += weight
+        else:
+            key = math.ceil(math.log(value) / self._log_gamma)
+            self.bins[key] = self.bins.get(key, 0) + weight
+        self.count += weight
+        self.total += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other):
+        """Fold another sketch (same accuracy) into this one."""
+        if other.count == 0:
+            return self
+        if abs(other.gamma - self.gamma) > 1e-12:
+            raise ValueError('Cannot merge sketches with different accuracy')
+        for key, n in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + n
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        return self
+
+    def quantile(self, q):
+        """Approximate q-quantile (0 <= q <= 1), or None if empty."""
+        if self.count == 0:
+            return None
+        rank = q * (self.count - 1)
+        if rank < self.zero_count:
+            return 0.0
+        seen = self.zero_count
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen > rank:
+                # Bucket midpoint keeps the error within relative_accuracy
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def to_json(self):
+        return json.dumps({
+            'a': self.relative_accuracy,
+            'b': self.bins,
+            'z': self.zero_count,
+            'n': self.count,
+            's': self.total,
+            'lo': self.min,
+            'hi': self.max,
+        }, separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, raw):
+        if not raw:
+            return cls()
+        data = json.loads(raw)
+        sketch = cls(data.get('a', 0.02))
+        sketch.bins = {int(k): v for k, v in data.get('b', {}).items()}
+        sketch.zero_count = data.get('z', 0)
+        sketch.count = data.get('n', 0)
+        sketch.total = data.get('s', 0.0)
+        sketch.min = data.get('lo')
+        sketch.max = data.get('hi')
+        return sketch
+
+
+# ──────────────────────────────────────────────
+#  Distinct Counter
+# ──────────────────────────────────────────────
+
+class DistinctCounter:
+    """
+    HyperLogLog distinct counter.
+
+    With the default precision of 10 (1024 one-byte registers) the standard
+    error is about 3%; small cardinalities use linear counting and are exact
+    in practice.
+    """
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+
+    def add(self, item):
+        digest = hashlib.blake2b(str(item).encode(), digest_size=8).digest()
+        h = int.from_bytes(digest, 'big')
+        index = h >> (64 - self.precision)
+        rest = h & ((1 << (64 - self.precision)) - 1)
+        rank = (64 - self.precision) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError('Cannot merge counters with different precision')
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def estimate(self):
+        alpha = 0.7213 / (1 + 1.079 / self.m)
+        raw = alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if raw <= 2.5 * self.m and zeros:
+            return round(self.m * math.log(self.m / zeros))
+        return round(raw)
+
+    def to_text(self):
+        return f'{self.precision}:' + base64.b64encode(bytes(self.registers)).decode()
+
+    @classmethod
+    def from_text(cls, raw):
+        if not raw:
+            return cls()
+        precision, encoded = raw.split(':', 1)
+        counter = cls(int(precision))
+        counter.registers = bytearray(base64.b64decode(encoded))
+        return counter
@@ -0,0 +1,271 @@
+"""
+Columnar analytics snapshot for ISUFST CareHub.
+
+Writes a compressed, date-partitioned Parquet copy of the clinic's activity
+tables so research / ad-hoc analysis can run off the production database:
+
+    <out>/<table>/day=YYYY-MM-DD/data.parquet
+
+Exports are incremental. Each table keeps a watermark (the newest
+``updated_at`` exported) in ``<out>/_watermarks.json``; later runs only read
+rows changed since then and rewrite the partitions those rows fall in. Rows
+deleted from the database are not tracked - run with ``--full`` now and then
+to rebuild from scratch.
+
+Usage:
+    python snapshot_export.py [--full] [--out DIR] [table ...]
+
+Requires pyarrow.
+"""
+import argparse
+import json
+import os
+import shutil
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+from models import db, Appointment, ClinicVisit, LogbookEntry, MedicineReservation, local_date
+from models_extended import VisitFeedback, SymptomScreening
+
+# table name -> (model, column whose local day is the partition key)
+EXPORTS = {
+    'appointments': (Appointment, 'appointment_date'),
+    'clinic_visits': (ClinicVisit, 'visit_day'),
+    'logbook_entries': (LogbookEntry, 'check_in_day'),
+    'medicine_reservations': (MedicineReservation, 'reserved_day'),
+    'visit_feedback': (VisitFeedback, 'submitted_day'),
+    'symptom_screenings': (SymptomScreening, 'created_at'),
+}
+
+WATERMARK_FILE = '_watermarks.json'
+INDEX_FILE = '_index.parquet'  # id -> partition, so moved rows leave their old partition
+BATCH_SIZE = 5000
+# Re-read a little before the watermark to pick up transactions that
+# committed late with an older updated_at; re-exported rows simply replace
+# themselves.
+OVERLAP = timedelta(minutes=5)
+
+
+def _arrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.parquet
+    except ImportError:
+        raise RuntimeError('pyarrow is required for snapshot exports (pip install pyarrow)')
+    return pyarrow
+
+
+# ──────────────────────────────────────────────
+#  Schema / Values
+# ──────────────────────────────────────────────
+
+def _arrow_schema(model):
+    """Arrow schema mirroring the model's table columns."""
+    pa = _arrow()
+    fields = []
+    for column in model.__table__.columns:
+        type_name = type(column.type).__name__
+        if type_name == 'Integer':
+            arrow_type = pa.int64()
+        elif type_name == 'Boolean':
+            arrow_type = pa.bool_()
+        elif type_name in ('Float', 'Numeric'):
+            arrow_type = pa.float64()
+        elif type_name == 'Date':
+            arrow_type = pa.date32()
+        elif type_name == 'DateTime':
+            arrow_type = pa.timestamp('us', tz='UTC')
+        elif type_name == 'Time':
+            arrow_type = pa.time64('us')
+        else:
+            arrow_type = pa.string()
+        fields.append(pa.field(column.name, arrow_type))
+    return pa.schema(fields)
+
+
+def _utc(value):
+    # SQLite hands back naive datetimes; they are stored as UTC
+    if isinstance(value, datetime) and value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def _partition_of(value):
+    if isinstance(value, datetime):
+        value = local_date(value)
+    return value.isoformat() if isinstance(value, date) else 'unknown'
+
+
+def _conform(table, schema):
+    """Align a previously written table with the current schema (added/dropped columns)."""
+    pa = _arrow()
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, type=field.type))
+    return pa.Table.from_arrays(columns, schema=schema)
+
+
+# ──────────────────────────────────────────────
+#  Partition Files
+# ──────────────────────────────────────────────
+
+def _write_atomic(table, path):
+    pq = _arrow().parquet
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + '.tmp'
+    pq.write_table(table, tmp, compression='zstd')
+    os.replace(tmp, path)
+
+
+def _partition_path(table_dir, partition):
+    return os.path.join(table_dir, f'day={partition}', 'data.parquet')
+
+
+def _rewrite_partition(table_dir, partition, schema, rows=None, drop_ids=()):
+    """Replace ``drop_ids`` and ``rows`` in one partition file."""
+    pa = _arrow()
+    path = _partition_path(table_dir, partition)
+    parts = []
+    if os.path.exists(path):
+        existing = _conform(pa.parquet.read_table(path), schema)
+        replaced = set(drop_ids) | {row['id'] for row in rows or ()}
+        if replaced:
+            keep = pa.compute.invert(pa.compute.is_in(existing['id'], value_set=pa.array(sorted(replaced), pa.int64())))
+            existing = existing.filter(keep)
+        parts.append(existing)
+    if rows:
+        parts.append(pa.Table.from_pylist(rows, schema=schema))
+    merged = pa.concat_tables(parts) if parts else None
+
+    if merged is None or merged.num_rows == 0:
+        if os.path.exists(path):
+            shutil.rmtree(os.path.dirname(path))
+        return 0
+    merged = merged.sort_by('id')
+    _write_atomic(merged, path)
+    return merged.num_rows
+
+
+def _load_index(table_dir):
+    pa = _arrow()
+    path = os.path.join(table_dir, INDEX_FILE)
+    if not os.path.exists(path):
+        return {}
+    index = pa.parquet.read_table(path)
+    return dict(zip(index['id'].to_pylist(), index['partition'].to_pylist()))
+
+
+def _save_index(table_dir, index):
+    pa = _arrow()
+    ids = sorted(index)
+    table = pa.table({
+        'id': pa.array(ids, pa.int64()),
+        'partition': pa.array([index[i] for i in ids], pa.string()),
+    })
+    _write_atomic(table, os.path.join(table_dir, INDEX_FILE))
+
+
+# ──────────────────────────────────────────────
+#  Export
+# ──────────────────────────────────────────────
+
+def export_table(name, out_dir, since=None):
+    """
+    Export rows of one table changed since ``since`` (all rows if None).
+
+    Returns (rows exported, partitions rewritten, new watermark).
+    """
+    model, partition_column = EXPORTS[name]
+    schema = _arrow_schema(model)
+    table_dir = os.path.join(out_dir, name)
+    if since is None and os.path.isdir(table_dir):
+        shutil.rmtree(table_dir)
+    index = _load_index(table_dir)
+
+    query = select(model.__table__).order_by(model.__table__.c.id)
+    if since is not None:
+        query = query.where(model.__table__.c.updated_at >= since - OVERLAP)
+
+    changed = defaultdict(list)  # partition -> rows
+    moved_out = defaultdict(set)  # old partition -> ids that now live elsewhere
+    watermark = since
+    exported = 0
+    result = db.session.execute(query.execution_options(yield_per=BATCH_SIZE))
+    for row in result.mappings():
+        record = {key: _utc(value) for key, value in row.items()}
+        partition = _partition_of(record[partition_column])
+        previous = index.get(record['id'])
+        if previous is not None and previous != partition:
+            moved_out[previous].add(record['id'])
+        index[record['id']] = partition
+        changed[partition].append(record)
+        exported += 1
+        updated = record.get('updated_at')
+        if updated is not None and (watermark is None or updated > watermark):
+            watermark = updated
+
+    for partition in set(changed) | set(moved_out):
+        _rewrite_partition(table_dir, partition, schema, changed.get(partition), moved_out.get(partition, ()))
+    if exported:
+        _save_index(table_dir, index)
+    return exported, len(set(changed) | set(moved_out)), watermark
+
+
+def _read_watermarks(out_dir):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {name: datetime.fromisoformat(value) for name, value in json.load(f).items()}
+
+
+def _write_watermarks(out_dir, watermarks):
+    path = os.path.join(out_dir, WATERMARK_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({name: value.isoformat() for name, value in watermarks.items() if value}, f, indent=2)
+    os.replace(tmp, path)
+
+
+def export_snapshot(out_dir, tables=None, full=False):
+    """Incrementally export ``tables`` (default: all) into ``out_dir``."""
+    _arrow()
+    os.makedirs(out_dir, exist_ok=True)
+    watermarks = {} if full else _read_watermarks(out_dir)
+    summary = {}
+    for name in tables or EXPORTS:
+        if name not in EXPORTS:
+            raise ValueError(f'Unknown table: {name}')
+        rows, partitions, watermark = export_table(name, out_dir, watermarks.get(name))
+        watermarks[name] = watermark
+        # Save after every table so a failure part-way keeps finished work
+        _write_watermarks(out_dir, watermarks)
+        summary[name] = {'rows': rows, 'partitions': partitions}
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export a Parquet analytics snapshot.')
+    parser.add_argument('tables', nargs='*', help=f'Tables to export (default: {", ".join(EXPORTS)})')
+    parser.add_argument('--out', help='Output directory (default: SNAPSHOT_DIR or instance/snapshots)')
+    parser.add_argument('--full', action='store_true', help='Ignore watermarks and rebuild from scratch')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    out_dir = args.out or app.config.get('SNAPSHOT_DIR') or os.path.join(app.instance_path, 'snapshots')
+    with app.app_context():
+        summary = export_snapshot(out_dir, args.tables, full=args.full)
+    for name, stats in summary.items():
+        print(f"  {name:<22} {stats['rows']:>7} rows  {stats['partitions']:>4} partitions")
+    print(f'✅ Snapshot written to {out_dir}')
+
+
+if __name__ == '__main__':
+    main()
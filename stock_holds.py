@@ -0,0 +1,192 @@
+"""
+Time-limited stock holds for medicine reservations.
+
+A Reserved reservation holds its units until ``hold_expires_at``. Holds are
+placed under the same batch locks as dispensing, so two students cannot
+both be promised the last units: available-to-promise is unexpired stock
+minus the units of live holds, and walk-in dispensing cannot take held
+units either. Lapsed holds stop counting the moment they
+expire; a sweep over the (status, hold_expires_at) index marks them Expired
+and tells the student. Picking a reservation up dispenses its units.
+"""
+from datetime import datetime, timedelta, timezone
+
+import sqlalchemy as sa
+from flask import current_app
+from sqlalchemy import func
+
+from models import db, Inventory, MedicineReservation, Notification, local_today
+import medicine_catalog
+import qr_tokens
+from utils import dispense_prescription, lock_batches
+
+RESERVED = 'Reserved'
+PICKED_UP = 'Picked Up'
+EXPIRED = 'Expired'
+CANCELLED = 'Cancelled'
+
+DEFAULT_HOLD_HOURS = 48
+SWEEP_BATCH = 500
+
+
+def hold_duration():
+    return timedelta(hours=int(current_app.config.get('RESERVATION_HOLD_HOURS', DEFAULT_HOLD_HOURS)))
+
+
+def held_units(medicine_ids, now=None, exclude=None):
+    """{medicine id: units held by live reservations}, leaving out reservation ``exclude``."""
+    now = now or datetime.now(timezone.utc)
+    query = db.session.query(MedicineReservation.medicine_id, func.sum(MedicineReservation.quantity)).filter(
+        MedicineReservation.medicine_id.in_(list(medicine_ids)),
+        MedicineReservation.status == RESERVED,
+        MedicineReservation.hold_expires_at > now
+    )
+    if exclude is not None:
+        query = query.filter(MedicineReservation.id != exclude)
+    return {medicine_id: int(units) for medicine_id, units in query.group_by(MedicineReservation.medicine_id)}
+
+
+def _held_units(medicine_id, now):
+    return held_units([medicine_id], now).get(medicine_id, 0)
+
+
+def available_to_promise(medicine_name, now=None):
+    """Unexpired units of ``medicine_name`` not held by live reservations (unlocked read)."""
+    now = now or datetime.now(timezone.utc)
+    found = medicine_catalog.lookup([medicine_name]).get(medicine_name)
+    if found is None:
+        return 0
+    stock = db.session.query(func.coalesce(func.sum(Inventory.quantity), 0)).filter(
+        Inventory.medicine_id == found[0],
+        Inventory.quantity > 0,
+        Inventory.expiry_date >= local_today()
+    ).scalar()
+    return max(stock - _held_units(found[0], now), 0)
+
+
+def place_hold(student_id, medicine_name, quantity):
+    """
+    Reserve ``quantity`` units for a student if they can be promised.
+
+    Returns (reservation, available). The reservation is flushed but not
+    committed - the caller commits, which releases the batch locks - or is
+    None when only ``available`` units could be promised (the transaction is
+    rolled back then).
+    """
+    if quantity <= 0:
+        raise ValueError('Quantity must be positive')
+    now = datetime.now(timezone.utc)
+    found = medicine_catalog.lookup([medicine_name]).get(medicine_name)
+    if found is None:
+        db.session.rollback()
+        return None, 0
+    medicine_id, canonical_name = found
+    # Same locks as dispensing: nobody can take or promise this stock until we commit
+    stock = sum(batch.quantity for batch in lock_batches([medicine_id]))
+    available = max(stock - _held_units(medicine_id, now), 0)
+    if quantity > available:
+        db.session.rollback()
+        return None, available
+
+    reservation = MedicineReservation(
+        student_id=student_id,
+        medicine_id=medicine_id,
+        medicine_name=canonical_name,
+        quantity=quantity,
+        status=RESERVED,
+        hold_expires_at=now + hold_duration()
+    )
+    db.session.add(reservation)
+    db.session.flush()
+    return reservation, available - quantity
+
+
+def fulfil(reservation, user_id=None):
+    """
+    Turn a reservation's hold into a dispense when it is picked up.
+
+    Claims the reservation with a conditional update so it is only ever
+    dispensed once, then dispenses FIFO in the same transaction. Returns the
+    ``dispense_prescription`` result. On success the session is committed
+    (with anything the caller staged); on failure the claim is undone in its
+    savepoint and the caller ends the transaction.
+    """
+    now = datetime.now(timezone.utc)
+    savepoint = db.session.begin_nested()
+    claimed = db.session.execute(
+        sa.update(MedicineReservation).where(
+            MedicineReservation.id == reservation.id,
+            MedicineReservation.status == RESERVED
+        ).values(status=PICKED_UP, picked_up_at=now, updated_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if not claimed:
+        savepoint.rollback()
+        return {'success': False, 'allocations': [], 'shortages': [],
+                'message': f'Reservation is {reservation.status}, not {RESERVED}'}
+
+    result = dispense_prescription(
+        [(reservation.medicine_name, reservation.quantity)],
+        reference=f'reservation:{reservation.id}',
+        user_id=user_id,
+        reservation_id=reservation.id
+    )
+    if not result['success']:
+        savepoint.rollback()
+    db.session.refresh(reservation)
+    return result
+
+
+# ──────────────────────────────────────────────
+#  Expiry Sweep
+# ──────────────────────────────────────────────
+
+def release_expired(now=None):
+    """
+    Mark lapsed holds Expired, revoke their pickup QR codes and notify their
+    students. Reads only the lapsed rows off the (status, hold_expires_at)
+    index, in batches. Returns the number released.
+    """
+    now = now or datetime.now(timezone.utc)
+    released = 0
+    while True:
+        ids = db.session.execute(
+            sa.select(MedicineReservation.id).where(
+                MedicineReservation.status == RESERVED,
+                MedicineReservation.hold_expires_at <= now
+            ).order_by(MedicineReservation.hold_expires_at).limit(SWEEP_BATCH)
+        ).scalars().all()
+        if not ids:
+            return released
+        # Re-check the status in the update: a pickup may have claimed a row since
+        lapsed = db.session.execute(
+            sa.update(MedicineReservation).where(
+                MedicineReservation.id.in_(ids),
+                MedicineReservation.status == RESERVED
+            ).values(status=EXPIRED, updated_at=now)
+            .returning(MedicineReservation.id, MedicineReservation.student_id,
+                       MedicineReservation.medicine_name, MedicineReservation.quantity)
+            .execution_options(synchronize_session=False)
+        ).all()
+        # The bulk update skips the mapper hook that revokes on Expired
+        qr_tokens.apply_revocations(db.session, {(qr_tokens.RESERVATION, row.id): True for row in lapsed})
+        for _, student_id, medicine_name, quantity in lapsed:
+            db.session.add(Notification(
+                user_id=student_id,
+                type='reservation_update',
+                title='Reservation Expired',
+                message=f'Your reservation for {medicine_name} ({quantity} unit(s)) was not picked up '
+                        f'in time and has been released. You can reserve it again.',
+                link='/reservations/my',
+                is_read=False
+            ))
+        db.session.commit()
+        released += len(lapsed)
+
+
+def sweep_job(app):
+    """Scheduler entry point for ``release_expired``."""
+    with app.app_context():
+        released = release_expired()
+        if released:
+            print(f'[SCHEDULER] Released {released} expired medicine holds')
@@ -0,0 +1,199 @@
+"""
+Medicine stock ledger for ISUFST CareHub.
+
+Every change to a batch's Inventory.quantity is appended to StockMovement and
+folded into the medicine's StockLevel row (keyed by catalog medicine id) in
+the same transaction, so "how many paracetamol do we have" is a one-row read and consumption analytics
+work from real dispensing. Movements are captured from Inventory writes, so
+no code path can change stock without a ledger entry; wrap writes in
+``movement(...)`` to say what they were (unlabelled changes are adjustments).
+"""
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import sqlalchemy as sa
+from sqlalchemy import func, inspect, select
+
+from models import db, Inventory, Medicine, local_date, local_today, upsert, value_before_flush as _before
+from models_extended import StockMovement, StockLevel
+import medicine_catalog  # noqa: F401  (links batches to the catalog before they are recorded)
+
+RECEIPT = 'receipt'
+DISPENSE = 'dispense'
+ADJUST = 'adjust'
+EXPIRE = 'expire'
+KINDS = (RECEIPT, DISPENSE, ADJUST, EXPIRE)
+
+
+@contextmanager
+def movement(kind=None, reference=None, user_id=None, note=None):
+    """
+    Label the stock changes made inside this block::
+
+        with stock_ledger.movement(DISPENSE, reference=f'visit:{visit.id}', user_id=current_user.id):
+            batch.quantity -= 2
+
+    Without ``kind``, changes keep their default kind (receipt for new
+    batches, expire for expired stock, otherwise adjust). Changes are
+    captured when they are flushed, so the block flushes on exit.
+    """
+    if kind is not None and kind not in KINDS:
+        raise ValueError(f'Unknown stock movement kind: {kind}')
+    session = db.session
+    previous = session.info.get('stock_label')
+    session.info['stock_label'] = {'kind': kind, 'reference': reference, 'user_id': user_id, 'note': note}
+    try:
+        yield
+        session.flush()
+    finally:
+        if previous is None:
+            session.info.pop('stock_label', None)
+        else:
+            session.info['stock_label'] = previous
+
+
+# ──────────────────────────────────────────────
+#  Movement Capture
+# ──────────────────────────────────────────────
+
+def _record(batch, medicine_name, medicine_id, quantity, default_kind, deleted=False):
+    session = inspect(batch).session
+    if session is None or not quantity:
+        return
+    label = session.info.get('stock_label') or {}
+    session.info.setdefault('stock_movements', []).append(dict(
+        kind=label.get('kind') or default_kind,
+        reference=label.get('reference'),
+        user_id=label.get('user_id'),
+        note=label.get('note'),
+        medicine_name=medicine_name,
+        medicine_id=medicine_id,
+        inventory_id=None if deleted else batch.id,  # A deleted batch's row is already gone
+        batch_number=batch.batch_number,
+        quantity=quantity,
+    ))
+
+
+def _is_expired(batch):
+    return batch.expiry_date is not None and batch.expiry_date < local_today()
+
+
+# Load the old values when these are assigned, so updates always see a delta
+@db.event.listens_for(Inventory.quantity, 'set', active_history=True)
+@db.event.listens_for(Inventory.name, 'set', active_history=True)
+@db.event.listens_for(Inventory.medicine_id, 'set', active_history=True)
+def _keep_history(target, value, oldvalue, initiator):
+    pass
+
+
+@db.event.listens_for(Inventory, 'after_insert')
+def _batch_received(mapper, connection, batch):
+    _record(batch, batch.name, batch.medicine_id, batch.quantity or 0, RECEIPT)
+
+
+@db.event.listens_for(Inventory, 'after_update')
+def _batch_changed(mapper, connection, batch):
+    old_name, old_quantity = _before(batch, 'name'), _before(batch, 'quantity') or 0
+    old_medicine_id = _before(batch, 'medicine_id')
+    quantity = batch.quantity or 0
+    if old_name != batch.name or old_medicine_id != batch.medicine_id:
+        # Renamed or relinked: the stock moves from one medicine's total to the other's
+        _record(batch, old_name, old_medicine_id, -old_quantity, ADJUST)
+        _record(batch, batch.name, batch.medicine_id, quantity, ADJUST)
+    elif quantity != old_quantity:
+        _record(batch, batch.name, batch.medicine_id, quantity - old_quantity,
+                EXPIRE if quantity < old_quantity and _is_expired(batch) else ADJUST)
+
+
+@db.event.listens_for(Inventory, 'after_delete')
+def _batch_removed(mapper, connection, batch):
+    _record(batch, _before(batch, 'name'), _before(batch, 'medicine_id'), -(_before(batch, 'quantity') or 0),
+            EXPIRE if _is_expired(batch) else ADJUST, deleted=True)
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def _apply_movements(session, flush_context):
+    movements = session.info.pop('stock_movements', None)
+    if movements:
+        apply_movements(session, movements)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_movements(session):
+    session.info.pop('stock_movements', None)
+
+
+# ──────────────────────────────────────────────
+#  Ledger Maintenance
+# ──────────────────────────────────────────────
+
+def _bump_level(session, medicine_id, delta):
+    """Add ``delta`` to a medicine's on-hand total atomically; returns the new total."""
+    now = datetime.now(timezone.utc)
+    return upsert(session, StockLevel, {'medicine_id': medicine_id}, {'on_hand': delta, 'updated_at': now},
+                  {'on_hand': StockLevel.on_hand + delta, 'updated_at': now}, returning=StockLevel.on_hand)
+
+
+def apply_movements(session, movements):
+    """Append ``movements`` to the ledger and fold the medicines' ones into their on-hand totals."""
+    now = datetime.now(timezone.utc)
+    by_medicine = {}
+    rows = []
+    for entry in movements:
+        if entry['medicine_id'] is None:
+            # Equipment has no catalog entry and no level
+            rows.append(dict(entry, balance_after=None, created_at=now, created_day=local_date(now)))
+        else:
+            by_medicine.setdefault(entry['medicine_id'], []).append(entry)
+    # Medicines in a fixed order so concurrent writers lock levels alike; one
+    # bump per medicine, with each movement's balance counted up to the total
+    for medicine_id in sorted(by_medicine):
+        entries = by_medicine[medicine_id]
+        total = _bump_level(session, medicine_id, sum(entry['quantity'] for entry in entries))
+        balance = total - sum(entry['quantity'] for entry in entries)
+        for entry in entries:
+            balance += entry['quantity']
+            rows.append(dict(entry, balance_after=balance, created_at=now, created_day=local_date(now)))
+    session.execute(sa.insert(StockMovement), rows)
+
+
+# ──────────────────────────────────────────────
+#  Reads
+# ──────────────────────────────────────────────
+
+def on_hand(medicine_id):
+    """Units of a catalog medicine in stock across all batches."""
+    return db.session.query(StockLevel.on_hand).filter_by(medicine_id=medicine_id).scalar() or 0
+
+
+def on_hand_by_medicine(names=None):
+    """{canonical medicine name: on-hand units}, for ``names`` or every medicine."""
+    query = db.session.query(Medicine.name, StockLevel.on_hand).join(Medicine, Medicine.id == StockLevel.medicine_id)
+    if names is not None:
+        query = query.filter(Medicine.name.in_(list(names)))
+    return dict(query.all())
+
+
+def consumption(start, end=None, limit=None):
+    """
+    Units dispensed per medicine between local days ``start`` and ``end``
+    (inclusive), most used first: [(medicine_name, units, dispenses)].
+    """
+    units = func.sum(-StockMovement.quantity).label('units')
+    totals = select(
+        StockMovement.medicine_id, units, func.count(StockMovement.id).label('dispenses')
+    ).where(
+        StockMovement.kind == DISPENSE,
+        StockMovement.created_day >= start
+    )
+    if end is not None:
+        totals = totals.where(StockMovement.created_day <= end)
+    # Group on the catalog key, then join the (few) winners for their names
+    totals = totals.group_by(StockMovement.medicine_id).order_by(units.desc())
+    if limit:
+        totals = totals.limit(limit)
+    totals = totals.subquery()
+    query = db.session.query(Medicine.name, totals.c.units, totals.c.dispenses).join(
+        totals, totals.c.medicine_id == Medicine.id
+    ).order_by(totals.c.units.desc(), Medicine.name)
+    return [(name, int(total), count) for name, total, count in query]
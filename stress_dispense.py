@@ -0,0 +1,155 @@
+"""
+Concurrency stress test for prescription dispensing.
+
+Seeds a few medicines in several batches (plus an expired batch that must
+never be touched), then has many workers dispense random multi-item
+prescriptions at once until stock runs out. Afterwards it checks that:
+
+  - no batch went negative and expired stock was not dispensed,
+  - every unit is accounted for (initial = dispensed + remaining),
+  - the stock ledger's on-hand totals and movements agree with the batches.
+
+Runs against a throwaway SQLite database by default; pass a database URL to
+stress Postgres instead (its inventory tables are cleared first).
+
+Usage:
+    python stress_dispense.py [workers] [prescriptions_per_worker] [database_url]
+                                                          (default 16 60)
+"""
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from datetime import timedelta
+
+from flask import Flask
+from sqlalchemy import func
+
+from models import db, Inventory, local_today
+from models_extended import StockMovement, StockLevel
+import stock_ledger
+from utils import dispense_prescription
+
+MEDICINES = ['Paracetamol', 'Amoxicillin', 'Mefenamic Acid', 'Cetirizine', 'Loperamide']
+BATCHES_PER_MEDICINE = 4
+UNITS_PER_BATCH = 150
+EXPIRED_UNITS = 500
+
+
+def seed(rng):
+    today = local_today()
+    db.session.query(StockMovement).delete()
+    db.session.query(StockLevel).delete()
+    db.session.query(Inventory).delete()
+    for name in MEDICINES:
+        for n in range(BATCHES_PER_MEDICINE):
+            db.session.add(Inventory(
+                name=name, batch_number=f'{name[:3].upper()}-{n + 1:03d}', category='Medicine',
+                quantity=UNITS_PER_BATCH, expiry_date=today + timedelta(days=rng.randint(30, 720))
+            ))
+        db.session.add(Inventory(
+            name=name, batch_number=f'{name[:3].upper()}-EXP', category='Medicine',
+            quantity=EXPIRED_UNITS, expiry_date=today - timedelta(days=1)
+        ))
+    db.session.commit()
+
+
+def worker(app, seed_value, prescriptions, dispensed, stats, lock):
+    rng = random.Random(seed_value)
+    for _ in range(prescriptions):
+        items = [(name, rng.randint(1, 25)) for name in rng.sample(MEDICINES, rng.randint(1, 3))]
+        with app.app_context():
+            result = dispense_prescription(items, reference='stress')
+        with lock:
+            if result['success']:
+                stats['filled'] += 1
+                for allocation in result['allocations']:
+                    dispensed[allocation['medicine_name']] += allocation['quantity']
+                    if sum(b['quantity_dispensed'] for b in allocation['batches']) != allocation['quantity']:
+                        stats['bad_plans'] += 1
+            else:
+                stats['short'] += 1
+
+
+def verify(dispensed):
+    failures = []
+    today = local_today()
+    batches = Inventory.query.all()
+    negative = [b for b in batches if b.quantity < 0]
+    if negative:
+        failures.append(f'{len(negative)} batches went negative: {negative[:5]}')
+    touched = [b for b in batches if b.expiry_date < today and b.quantity != EXPIRED_UNITS]
+    if touched:
+        failures.append(f'expired batches were dispensed from: {touched}')
+
+    remaining = Counter()
+    for batch in batches:
+        remaining[batch.name] += batch.quantity
+    levels = stock_ledger.on_hand_by_medicine()
+    ledger = dict(db.session.query(StockMovement.medicine_name, func.sum(StockMovement.quantity))
+                  .group_by(StockMovement.medicine_name).all())
+    ledger_dispensed = dict(db.session.query(StockMovement.medicine_name, func.sum(-StockMovement.quantity))
+                            .filter(StockMovement.kind == stock_ledger.DISPENSE)
+                            .group_by(StockMovement.medicine_name).all())
+    initial = BATCHES_PER_MEDICINE * UNITS_PER_BATCH + EXPIRED_UNITS
+    for name in MEDICINES:
+        if initial - dispensed[name] != remaining[name]:
+            failures.append(f'{name}: {initial} - {dispensed[name]} dispensed != {remaining[name]} remaining')
+        if levels.get(name) != remaining[name] or ledger.get(name) != remaining[name]:
+            failures.append(f'{name}: level {levels.get(name)} / ledger {ledger.get(name)} != batches {remaining[name]}')
+        if (ledger_dispensed.get(name) or 0) != dispensed[name]:
+            failures.append(f'{name}: ledger dispensed {ledger_dispensed.get(name)} != {dispensed[name]}')
+    return remaining, failures
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    prescriptions = int(sys.argv[2]) if len(sys.argv) > 2 else 60
+    url = sys.argv[3] if len(sys.argv) > 3 else f"sqlite:///{os.path.join(tempfile.mkdtemp(), 'stress_dispense.db')}"
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = url
+    if url.startswith('sqlite'):
+        # Writers queue on the database lock; give them room to wait
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 60}}
+    else:
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'pool_size': workers, 'max_overflow': 0}
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        seed(random.Random(7))
+
+    dispensed, stats, lock = Counter(), Counter(), threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(app, n, prescriptions, dispensed, stats, lock))
+        for n in range(workers)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    with app.app_context():
+        remaining, failures = verify(dispensed)
+    if stats['bad_plans']:
+        failures.append(f"{stats['bad_plans']} allocation plans did not add up")
+
+    total = workers * prescriptions
+    print(f'{workers} workers x {prescriptions} prescriptions on {url.split(":")[0]} in {elapsed:.2f}s '
+          f'({total / elapsed:.0f}/s): {stats["filled"]} filled, {stats["short"]} short of stock')
+    for name in MEDICINES:
+        print(f'  {name:<16} dispensed {dispensed[name]:>5}  remaining {remaining[name]:>5}')
+    if failures:
+        for failure in failures:
+            print(f'❌ {failure}')
+        sys.exit(1)
+    print('✅ Stock never went negative; batches, levels and ledger agree')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,459 @@
+"""
+In-process student autocomplete index for ISUFST CareHub.
+
+Student names, email local parts and student ID numbers are tokenized into
+an in-memory index (length-bucketed sorted vocabulary for prefix lookups,
+cached student sets for short prefixes, a trie of name tokens for typo
+tolerance) that is loaded at startup and updated after every commit that
+touches a student. Lookups never hit the database.
+"""
+import bisect
+import heapq
+import re
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from itertools import chain
+
+from sqlalchemy import inspect, select, update
+
+from models import db, User, StudentProfile
+from search_index import normalize, query_terms
+
+SYNC_SECONDS = 30  # Catch up on edits made by other worker processes
+CACHED_PREFIX = 3  # Prefixes up to this long cover thousands of tokens; keep their students
+
+# '2023-01' is typed as one student number, indexed compacted as '202301...'
+_DIGIT_GAP = re.compile(r'(?<=\d)[\s./-]+(?=\d)')
+
+
+def _allowed_typos(term):
+    if len(term) < 4 or not term.isalpha():
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+def _prefix_quality(term, token):
+    return 1.0 if len(token) == len(term) else 0.8 + 0.15 * len(term) / len(token)
+
+
+def student_tokens(first_name, last_name, email, student_number):
+    """(name tokens, all tokens) for one student."""
+    local_part = (email or '').split('@')[0]
+    compact = ''.join(ch for ch in (student_number or '') if ch.isalnum())
+    names = tuple(dict.fromkeys(normalize(first_name, last_name).split()))
+    others = normalize(local_part, student_number, compact).split()
+    return names, tuple(dict.fromkeys(names + tuple(others)))
+
+
+# ──────────────────────────────────────────────
+#  Index
+# ──────────────────────────────────────────────
+
+class StudentDirectory:
+    """
+    Top-k student lookup by name, email or student number.
+
+    Every query term must match some token of a student as a prefix. Only
+    when that finds fewer than ``limit`` students is the query retried with
+    typo tolerance on name tokens (one edit from four letters, then two from
+    eight; the first letter is taken as typed). Students are ranked by summed
+    match quality: exact > prefix > typo.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.loaded = False
+        self.synced_at = None
+        self._reset()
+
+    def _reset(self):
+        self.students = {}                   # id -> display fields
+        self._tokens = {}                    # id -> (name tokens, all tokens)
+        self._postings = defaultdict(set)    # token -> student ids
+        self._by_length = defaultdict(list)  # token length -> sorted distinct tokens
+        self._name_counts = Counter()        # name token -> students having it
+        self._names = []                     # sorted distinct alphabetic name tokens
+        self._name_trie = {}                 # letter -> subtrie; '' marks a whole name token
+        self._prefix_students = {}           # short prefix -> student ids, filled on first use
+
+    def __len__(self):
+        return len(self.students)
+
+    @property
+    def vocabulary_size(self):
+        return len(self._postings)
+
+    # ── Maintenance ──
+
+    def _add_token(self, token, student_id):
+        postings = self._postings[token]
+        if not postings:
+            bisect.insort(self._by_length[len(token)], token)
+        postings.add(student_id)
+
+    def _remove_token(self, token, student_id):
+        postings = self._postings.get(token)
+        if postings is None:
+            return
+        postings.discard(student_id)
+        if not postings:
+            del self._postings[token]
+            bucket = self._by_length[len(token)]
+            index = bisect.bisect_left(bucket, token)
+            if index < len(bucket) and bucket[index] == token:
+                del bucket[index]
+
+    def _add_name(self, token):
+        self._name_counts[token] += 1
+        if self._name_counts[token] == 1 and token.isalpha():
+            bisect.insort(self._names, token)
+            node = self._name_trie
+            for letter in token:
+                node = node.setdefault(letter, {})
+            node[''] = True
+
+    def _remove_name(self, token):
+        self._name_counts[token] -= 1
+        if self._name_counts[token] <= 0:
+            del self._name_counts[token]
+            if token.isalpha():
+                del self._names[bisect.bisect_left(self._names, token)]
+                path = [self._name_trie]
+                for letter in token:
+                    path.append(path[-1][letter])
+                del path[-1]['']
+                # Prune branches left without names
+                for letter, parent, node in zip(reversed(token), reversed(path[:-1]), reversed(path[1:])):
+                    if node:
+                        break
+                    del parent[letter]
+
+    def put(self, student):
+        """Add or replace one student (dict with id, first_name, last_name, email, student_id, course, year_level)."""
+        names, tokens = student_tokens(student['first_name'], student['last_name'], student['email'], student['student_id'])
+        with self._lock:
+            self._discard(student['id'])
+            self.students[student['id']] = student
+            self._tokens[student['id']] = (names, tokens)
+            for token in tokens:
+                self._add_token(token, student['id'])
+            for token in names:
+                self._add_name(token)
+            for prefix in self._cached_prefixes(tokens):
+                self._prefix_students[prefix].add(student['id'])
+
+    def _discard(self, student_id):
+        names, tokens = self._tokens.pop(student_id, ((), ()))
+        for prefix in self._cached_prefixes(tokens):
+            self._prefix_students[prefix].discard(student_id)
+        for token in tokens:
+            self._remove_token(token, student_id)
+        for token in names:
+            self._remove_name(token)
+        self.students.pop(student_id, None)
+
+    def discard(self, student_id):
+        with self._lock:
+            self._discard(student_id)
+
+    def _cached_prefixes(self, tokens):
+        if not self._prefix_students:
+            return set()
+        return {token[:n] for token in tokens for n in range(1, CACHED_PREFIX + 1)} & self._prefix_students.keys()
+
+    # ── Lookup ──
+
+    def _prefix_buckets(self, term):
+        """(quality, tokens) runs of tokens starting with ``term``, best first, generated lazily."""
+        longest = max(self._by_length, default=0)
+        for length in range(len(term), longest + 1):
+            bucket = self._by_length.get(length)
+            if not bucket:
+                continue
+            start = bisect.bisect_left(bucket, term)
+            end = bisect.bisect_left(bucket, term + '\uffff', start)
+            if start < end:
+                yield _prefix_quality(term, bucket[start]), bucket[start:end]
+
+    def _prefix_matches(self, term):
+        """(token, quality) for tokens starting with ``term``, best first."""
+        for quality, tokens in self._prefix_buckets(term):
+            for token in tokens:
+                yield token, quality
+
+    def _typo_matches(self, term, typos):
+        """(token, quality) for name tokens within ``typos`` edits of ``term``, best first."""
+        # Walk the trie below the first letter with one row of the
+        # optimal-string-alignment table (adjacent swaps count once) per
+        # node, leaving branches whose row is already above ``typos``. Only
+        # the band of cells within ``typos`` of the diagonal can be that low;
+        # the rest are held at ``typos + 1``. A word within ``typos`` is a
+        # typo of the whole token; a node len(term) deep within ``typos`` is
+        # a typo while still typing, so every name below it matches.
+        size = len(term)
+        over = typos + 1
+        found = {}
+        stack = [(self._name_trie.get(term[0]), term[0], [min(j, over) for j in range(size + 1)], None)]
+        while stack:
+            node, prefix, previous, previous2 = stack.pop()
+            if node is None:
+                continue
+            depth = len(prefix)
+            letter = prefix[-1]
+            before = prefix[-2] if depth > 1 else None
+            row = [min(depth, over)] + [over] * size
+            lowest = row[0]
+            for j in range(max(1, depth - typos), min(size, depth + typos) + 1):
+                cost = previous[j - 1] + (term[j - 1] != letter)
+                if previous[j] + 1 < cost:
+                    cost = previous[j] + 1
+                if row[j - 1] + 1 < cost:
+                    cost = row[j - 1] + 1
+                if j > 1 and term[j - 1] == before and term[j - 2] == letter and previous2[j - 2] + 1 < cost:
+                    cost = previous2[j - 2] + 1
+                row[j] = cost
+                if cost < lowest:
+                    lowest = cost
+            if lowest > typos:
+                continue
+            distance = row[size]
+            if '' in node and distance <= typos:
+                found[prefix] = max(found.get(prefix, 0.0), 0.7 - 0.15 * (distance - 1))
+            if depth == size and distance <= typos:
+                start = bisect.bisect_left(self._names, prefix)
+                end = bisect.bisect_left(self._names, prefix + '\uffff', start)
+                for token in self._names[start:end]:
+                    found[token] = max(found.get(token, 0.0), 0.55 - 0.15 * (distance - 1))
+            if depth < size + typos:
+                stack.extend((child, prefix + key, row, previous) for key, child in node.items() if key)
+        matches = [(token, quality) for token, quality in found.items() if not token.startswith(term)]
+        matches.sort(key=lambda match: -match[1])
+        return matches
+
+    def _prefix_students_for(self, term):
+        """Students with a token starting with ``term``."""
+        students = self._prefix_students.get(term)
+        if students is None:
+            students = set().union(*chain.from_iterable(
+                map(self._postings.__getitem__, tokens) for _, tokens in self._prefix_buckets(term)
+            ))
+            if len(term) <= CACHED_PREFIX:
+                self._prefix_students[term] = students
+        return students
+
+    @staticmethod
+    def _term_quality(term, names, tokens, misspellings):
+        """Best quality with which one student's tokens match ``term``; ``misspellings`` maps typo tokens to quality."""
+        best = 0.0
+        for token in tokens:
+            if token.startswith(term):
+                best = max(best, _prefix_quality(term, token))
+        if misspellings and not best:
+            best = max(misspellings.get(t, 0.0) for t in names) if names else 0.0
+        return best
+
+    def _rank(self, terms, limit, fuzzy):
+        """Top-k heap of (score, -id); ``fuzzy`` maps terms to the typos allowed for them."""
+        # The longest term is usually the most selective: drive from it and
+        # check the others per student
+        driver, others = terms[0], terms[1:]
+        if not fuzzy.get(driver) and next(self._prefix_buckets(driver), None) is None:
+            return []
+        candidates = self._prefix_matches(driver)
+        if fuzzy.get(driver):
+            candidates = heapq.merge(
+                candidates, self._typo_matches(driver, fuzzy[driver]), key=lambda match: -match[1]
+            )
+        others_best = 0.0  # Upper bound on what the other terms can add
+        required = []      # Students able to match each other term
+        misspellings = {}  # Other term -> {typo token: quality}
+        for term in others:
+            buckets = list(self._prefix_buckets(term))
+            students = self._prefix_students_for(term) if buckets else set()
+            typos = dict(self._typo_matches(term, fuzzy[term])) if fuzzy.get(term) else {}
+            if typos:
+                misspellings[term] = typos
+                students = students.union(*map(self._postings.__getitem__, typos))
+            if not students:
+                return []
+            others_best += buckets[0][0] if buckets else max(typos.values())
+            required.append(students)
+        # Intersecting with the smallest sets first skips most per-student checks
+        required.sort(key=len)
+
+        best = []
+        seen = set()
+        for token, quality in candidates:
+            if len(best) == limit and quality + others_best <= best[0][0]:
+                break  # No remaining student can beat the current top-k
+            pool = self._postings[token]
+            for students in required:
+                pool = pool & students
+            for student_id in pool:
+                if len(best) == limit and quality + others_best <= best[0][0]:
+                    break
+                if student_id in seen:
+                    continue
+                seen.add(student_id)
+                names, tokens = self._tokens[student_id]
+                score = quality
+                for term in others:
+                    term_quality = self._term_quality(term, names, tokens, misspellings.get(term))
+                    if not term_quality:
+                        break
+                    score += term_quality
+                else:
+                    entry = (score, -student_id)
+                    if len(best) < limit:
+                        heapq.heappush(best, entry)
+                    elif entry > best[0]:
+                        heapq.heapreplace(best, entry)
+        return best
+
+    def search(self, text, limit=10):
+        """Best ``limit`` students for ``text``, best first."""
+        terms = sorted(query_terms(_DIGIT_GAP.sub('', text or '')), key=len, reverse=True)
+        if not terms:
+            return []
+        with self._lock:
+            best = self._rank(terms, limit, {})
+            # Typos are a fallback for short result lists. Words that prefix
+            # nothing in the index are the likely misspellings; only if every
+            # word is known are all of them allowed to be wrong.
+            unknown = [t for t in terms if next(self._prefix_buckets(t), None) is None] if len(best) < limit else []
+            tried = {}
+            for typos in (1, 2):
+                if len(best) >= limit:
+                    break
+                fuzzy = {t: min(typos, _allowed_typos(t)) for t in unknown or terms if _allowed_typos(t)}
+                if fuzzy and fuzzy != tried:
+                    best = self._rank(terms, limit, fuzzy)
+                    tried = fuzzy
+            ranked = sorted(best, reverse=True)
+            return [dict(self.students[-neg_id], score=round(score, 3)) for score, neg_id in ranked]
+
+    # ── Database ──
+
+    @staticmethod
+    def _query():
+        return select(
+            User.id, User.first_name, User.last_name, User.email,
+            StudentProfile.student_id_number, StudentProfile.course, StudentProfile.year_level
+        ).outerjoin(StudentProfile, StudentProfile.user_id == User.id).where(User.role == 'student')
+
+    @staticmethod
+    def _row_to_student(row):
+        return {
+            'id': row.id,
+            'first_name': row.first_name,
+            'last_name': row.last_name,
+            'name': f'{row.first_name} {row.last_name}',
+            'email': row.email,
+            'student_id': row.student_id_number,
+            'course': row.course,
+            'year_level': row.year_level,
+        }
+
+    def load(self, connection):
+        """(Re)build the whole index from the database."""
+        started = time.time()
+        rows = connection.execute(self._query()).all()
+        with self._lock:
+            self._reset()
+            for row in rows:
+                self.put(self._row_to_student(row))
+            self.loaded = True
+            self.synced_at = started
+
+    def refresh(self, connection, user_ids):
+        """Re-read the given users; anyone no longer a student is dropped."""
+        user_ids = list(user_ids)
+        rows = {row.id: row for row in connection.execute(self._query().where(User.id.in_(user_ids)))}
+        with self._lock:
+            for user_id in user_ids:
+                if user_id in rows:
+                    self.put(self._row_to_student(rows[user_id]))
+                else:
+                    self.discard(user_id)
+
+    def sync(self, connection):
+        """Pick up students changed by other processes since the last sync (profile writes bump the user row)."""
+        started = time.time()
+        since = self.synced_at - 5  # Margin for clock skew / in-flight commits
+        changed = connection.execute(
+            select(User.id).where(User.updated_at >= datetime.fromtimestamp(since, timezone.utc))
+        ).scalars().all()
+        if changed:
+            self.refresh(connection, changed)
+        self.synced_at = started
+
+
+directory = StudentDirectory()
+
+
+def search_students(text, limit=10):
+    """Shared autocomplete entry point; loads or catches up the index as needed."""
+    now = time.time()
+    if not directory.loaded or now - directory.synced_at > SYNC_SECONDS:
+        with db.engine.connect() as connection:
+            if not directory.loaded:
+                directory.load(connection)
+            else:
+                directory.sync(connection)
+    return directory.search(text, limit)
+
+
+# ──────────────────────────────────────────────
+#  Write Hooks
+# ──────────────────────────────────────────────
+
+def _mark(instance, user_id):
+    session = inspect(instance).session
+    if session is not None and user_id is not None:
+        session.info.setdefault('directory_dirty', set()).add(user_id)
+
+
+@db.event.listens_for(User, 'after_insert')
+@db.event.listens_for(User, 'after_update')
+@db.event.listens_for(User, 'after_delete')
+def _user_written(mapper, connection, user):
+    _mark(user, user.id)
+
+
+@db.event.listens_for(StudentProfile, 'after_insert')
+@db.event.listens_for(StudentProfile, 'after_update')
+@db.event.listens_for(StudentProfile, 'after_delete')
+def _profile_written(mapper, connection, profile):
+    _mark(profile, profile.user_id)
+    # Other processes only poll users.updated_at (see StudentDirectory.sync)
+    connection.execute(
+        update(User.__table__).where(User.__table__.c.id == profile.user_id)
+        .values(updated_at=datetime.now(timezone.utc))
+    )
+
+
+@db.event.listens_for(db.session, 'after_commit')
+def _apply_changes(session):
+    """Only committed data reaches the index."""
+    dirty = session.info.pop('directory_dirty', None)
+    if dirty and directory.loaded:
+        with db.engine.connect() as connection:
+            directory.refresh(connection, dirty)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_changes(session):
+    session.info.pop('directory_dirty', None)
+
+
+def init_student_directory(app):
+    """Load the index once at startup."""
+    with app.app_context():
+        try:
+            with db.engine.connect() as connection:
+                directory.load(connection)
+        except Exception as e:
+            # Tables may not exist yet (fresh install before migrations)
+            app.logger.warning(f'Student directory load skipped: {e}')
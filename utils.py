@@ -2,7 +2,10 @@
 Utility functions for ISUFST CareHub clinic business logic.
 """
 from datetime import date, time
-from models import db, Appointment, Inventory, Queue
+from sqlalchemy import text
+from models import db, Appointment, Inventory, Queue, local_today
+import medicine_catalog
+import stock_ledger
 
 
 # ──────────────────────────────────────────────
@@ -42,13 +45,152 @@ def check_availability(appointment_date, start_time, end_time, service_type='Den
 # ──────────────────────────────────────────────
 #  FIFO Dispensing
 # ──────────────────────────────────────────────
-def dispense_medicine(medicine_name, quantity_needed):
+def sqlite_write_lock(session=None):
+    """
+    On SQLite, take the database write lock now; returns whether it did.
+
+    SQLite has no row locks, so a no-op write takes the (database-wide) write
+    lock up front instead: writers queue behind each other and nobody can
+    change what is read next before the commit. Other databases return False
+    and the caller locks the rows it reads with FOR UPDATE.
+    """
+    session = session or db.session
+    if session.get_bind().dialect.name != 'sqlite':
+        return False
+    session.execute(text('UPDATE inventory SET id = id WHERE 0'))
+    return True
+
+
+def lock_batches(medicine_ids):
+    """
+    Dispensable batches of the catalog medicines ``medicine_ids``, oldest
+    expiry first, locked until the transaction ends (FOR UPDATE, or the
+    SQLite write lock).
+    """
+    query = Inventory.query.filter(
+        Inventory.medicine_id.in_(list(medicine_ids)),
+        Inventory.quantity > 0,
+        Inventory.expiry_date >= local_today()  # Expired stock is never dispensed
+    ).order_by(Inventory.medicine_id, Inventory.expiry_date.asc(), Inventory.id)
+
+    if not sqlite_write_lock():
+        # Same order for every writer, so overlapping prescriptions cannot deadlock
+        query = query.with_for_update()
+    # Overwrite anything the session loaded before the lock was held
+    return query.populate_existing().all()
+
+
+def dispense_prescription(items, reference=None, user_id=None, reservation_id=None):
+    """
+    Dispense every medicine of a prescription FIFO (oldest batches first) in
+    one transaction - either all of it is dispensed or none of it.
+
+    The dispense runs in a savepoint. On success the whole session is
+    committed, including changes the caller staged first (so a notice
+    commits with the dispense). On a shortage only the savepoint is rolled
+    back: the caller's pending changes are kept, and the caller must commit
+    or roll back to end the transaction and release the batch locks.
+
+    Args:
+        items: (medicine_name, quantity) pairs; names are matched through the
+            medicine catalog, and names of the same medicine are added up
+        reference (str): What the dispense is for, e.g. 'visit:12' (stock ledger)
+        user_id (int): Staff member dispensing (stock ledger)
+        reservation_id (int): Reservation being picked up. Units held by
+            other live reservations are never dispensed; this one's are
+
+    Returns:
+        dict: {
+            'success': bool,
+            'allocations': list of {'medicine_name', 'quantity', 'batches'}
+                where batches is a list of dict with batch details,
+            'shortages': list of {'medicine_name', 'needed', 'available'}
+                (available: unexpired units not held for reservations),
+            'message': str
+        }
+    """
+    requested = {}
+    for medicine_name, quantity in items:
+        if quantity <= 0:
+            raise ValueError(f'Quantity for "{medicine_name}" must be positive')
+        requested[medicine_name] = requested.get(medicine_name, 0) + quantity
+    if not requested:
+        raise ValueError('Prescription has no items')
+
+    catalog = medicine_catalog.lookup(requested)
+    needed, names, shortages = {}, {}, []
+    for medicine_name, quantity in requested.items():
+        if medicine_name not in catalog:
+            shortages.append({'medicine_name': medicine_name, 'needed': quantity, 'available': 0})
+            continue
+        medicine_id, names[medicine_id] = catalog[medicine_name]
+        needed[medicine_id] = needed.get(medicine_id, 0) + quantity
+
+    savepoint = db.session.begin_nested()
+    batches_by_medicine = {}
+    for batch in lock_batches(sorted(needed)):
+        batches_by_medicine.setdefault(batch.medicine_id, []).append(batch)
+    # Read under the batch locks, which place_hold takes too
+    from stock_holds import held_units
+    held = held_units(needed, exclude=reservation_id)
+
+    for medicine_id, quantity in needed.items():
+        stock = sum(batch.quantity for batch in batches_by_medicine.get(medicine_id, []))
+        available = max(stock - held.get(medicine_id, 0), 0)
+        if available < quantity:
+            shortages.append({'medicine_name': names[medicine_id], 'needed': quantity, 'available': available})
+    if shortages:
+        # Nothing was dispensed; leave the rest of the session to the caller
+        savepoint.rollback()
+        return {
+            'success': False,
+            'allocations': [],
+            'shortages': shortages,
+            'message': 'Insufficient stock: ' + ', '.join(
+                f"{s['medicine_name']} (needed {s['needed']}, available {s['available']})" for s in shortages
+            )
+        }
+
+    allocations = []
+    with stock_ledger.movement(stock_ledger.DISPENSE, reference=reference, user_id=user_id):
+        for medicine_id, quantity in needed.items():
+            remaining_needed = quantity
+            batches_used = []
+            for batch in batches_by_medicine[medicine_id]:
+                if remaining_needed <= 0:
+                    break
+                quantity_from_batch = min(batch.quantity, remaining_needed)
+                batch.quantity -= quantity_from_batch
+                remaining_needed -= quantity_from_batch
+                batches_used.append({
+                    'inventory_id': batch.id,
+                    'batch_number': batch.batch_number,
+                    'expiry_date': batch.expiry_date.isoformat(),
+                    'quantity_dispensed': quantity_from_batch,
+                    'remaining_in_batch': batch.quantity
+                })
+            allocations.append({'medicine_name': names[medicine_id], 'quantity': quantity, 'batches': batches_used})
+
+    savepoint.commit()
+    db.session.commit()
+
+    return {
+        'success': True,
+        'allocations': allocations,
+        'shortages': [],
+        'message': f'Dispensed {len(allocations)} medicine(s)'
+    }
+
+
+def dispense_medicine(medicine_name, quantity_needed, reference=None, user_id=None):
     """
     Dispense medicine using FIFO logic (oldest batches first).
     
     Args:
         medicine_name (str): Name of the medicine to dispense
         quantity_needed (int): Quantity to dispense
+        reference (str): What the dispense is for, e.g. 'visit:12' (stock ledger)
+        user_id (int): Staff member dispensing (stock ledger)
     
     Returns:
         dict: {
@@ -58,62 +200,20 @@ def dispense_medicine(medicine_name, quantity_needed):
             'message': str
         }
     """
-    # Query inventory for this medicine, sorted by expiry_date (FIFO)
-    batches = Inventory.query.filter(
-        Inventory.name == medicine_name,
-        Inventory.category == 'Medicine',
-        Inventory.quantity > 0
-    ).order_by(Inventory.expiry_date.asc()).all()
-    
-    if not batches:
-        return {
-            'success': False,
-            'dispensed': 0,
-            'batches_used': [],
-            'message': f'Medicine "{medicine_name}" not found in inventory'
-        }
-    
-    # Calculate total available quantity
-    total_available = sum(batch.quantity for batch in batches)
-    
-    if total_available < quantity_needed:
-        return {
-            'success': False,
-            'dispensed': 0,
-            'batches_used': [],
-            'message': f'Insufficient quantity. Needed: {quantity_needed}, Available: {total_available}'
-        }
-    
-    # Dispense across batches using FIFO
-    remaining_needed = quantity_needed
-    batches_used = []
-    
-    for batch in batches:
-        if remaining_needed <= 0:
-            break
-        
-        # Determine how much to take from this batch
-        quantity_from_batch = min(batch.quantity, remaining_needed)
-        
-        # Deduct from inventory
-        batch.quantity -= quantity_from_batch
-        remaining_needed -= quantity_from_batch
-        
-        # Record batch usage
-        batches_used.append({
-            'batch_number': batch.batch_number,
-            'expiry_date': batch.expiry_date.isoformat(),
-            'quantity_dispensed': quantity_from_batch,
-            'remaining_in_batch': batch.quantity
-        })
-    
-    # Commit changes to database
-    db.session.commit()
-    
+    result = dispense_prescription([(medicine_name, quantity_needed)], reference=reference, user_id=user_id)
+
+    if not result['success']:
+        available = result['shortages'][0]['available']
+        if not available:
+            message = f'Medicine "{medicine_name}" not found in inventory'
+        else:
+            message = f'Insufficient quantity. Needed: {quantity_needed}, Available: {available}'
+        return {'success': False, 'dispensed': 0, 'batches_used': [], 'message': message}
+
     return {
         'success': True,
         'dispensed': quantity_needed,
-        'batches_used': batches_used,
+        'batches_used': result['allocations'][0]['batches'],
         'message': f'Successfully dispensed {quantity_needed} units of {medicine_name}'
     }
 
@@ -0,0 +1,243 @@
+"""
+Wait-time and service-time rollups for ISUFST CareHub.
+
+Completed queue calls and logbook check-outs are folded into hourly
+VisitTimeRollup rows (quantile sketches + distinct-patient counters) in the
+same transaction. Both kinds are keyed by the service of the appointment
+behind the visit ('Walk-in' without one), never by the free-text logbook
+purpose, so a service's waits and service times share one row. Analytics
+merge those rows for any date range instead of scanning the queue and
+logbook tables.
+"""
+from collections import defaultdict
+from datetime import timezone
+
+from sqlalchemy import inspect
+
+from models import db, Appointment, Queue, LogbookEntry, CLINIC_TZ, dialect_insert
+from models_extended import AppointmentExtended, VisitTimeRollup
+from sketches import QuantileSketch, DistinctCounter
+
+WALK_IN = 'Walk-in'
+
+
+def _local(dt):
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(CLINIC_TZ)
+
+
+def _minutes(start, end):
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    return max((end - start).total_seconds() / 60.0, 0.0)
+
+
+def _newly_set(obj, attr):
+    """True if ``attr`` went from empty to a value in this flush."""
+    history = inspect(obj).attrs[attr].history
+    return bool(history.added) and history.added[0] is not None and not any(history.deleted)
+
+
+# ──────────────────────────────────────────────
+#  Observation Capture
+# ──────────────────────────────────────────────
+
+def _pending(session):
+    return session.info.setdefault('visit_metrics', [])
+
+
+@db.event.listens_for(Queue, 'after_update')
+def _queue_called(mapper, connection, entry):
+    if entry.served_at is None or entry.arrival_time is None or not _newly_set(entry, 'served_at'):
+        return
+    session = inspect(entry).session
+    if session is not None:
+        _pending(session).append(('wait', entry.id, entry.arrival_time, entry.served_at, None))
+
+
+@db.event.listens_for(LogbookEntry, 'after_update')
+def _logbook_checked_out(mapper, connection, entry):
+    if entry.check_out_time is None or entry.check_in_time is None or not _newly_set(entry, 'check_out_time'):
+        return
+    session = inspect(entry).session
+    if session is not None:
+        _pending(session).append(
+            ('service', entry.appointment_id, entry.check_in_time, entry.check_out_time, entry.student_id)
+        )
+
+
+@db.event.listens_for(db.session, 'after_flush_postexec')
+def _apply_observations(session, flush_context):
+    observations = session.info.pop('visit_metrics', None)
+    if observations:
+        apply_observations(session, observations)
+
+
+@db.event.listens_for(db.session, 'after_rollback')
+def _drop_observations(session):
+    session.info.pop('visit_metrics', None)
+
+
+# ──────────────────────────────────────────────
+#  Rollup Maintenance
+# ──────────────────────────────────────────────
+
+def _queue_service_type(session, queue_id):
+    """Service of the appointment linked to a queue entry, else walk-in."""
+    service = session.query(Appointment.service_type).join(
+        AppointmentExtended, AppointmentExtended.appointment_id == Appointment.id
+    ).filter(AppointmentExtended.queue_id == queue_id).scalar()
+    return service or WALK_IN
+
+
+def _appointment_service_type(session, appointment_id):
+    """Service of a logbook entry's appointment, else walk-in."""
+    if appointment_id is None:
+        return WALK_IN
+    service = session.query(Appointment.service_type).filter(Appointment.id == appointment_id).scalar()
+    return service or WALK_IN
+
+
+def _locked_bucket(session, day, hour, service_type):
+    """Fetch (creating if needed) the rollup row for a bucket, row-locked."""
+    keys = {'day': day, 'hour': hour, 'service_type': service_type}
+    insert = dialect_insert(session.get_bind())
+    if insert is not None:
+        session.execute(
+            insert(VisitTimeRollup)
+            .values(wait_count=0, service_count=0, **keys)
+            .on_conflict_do_nothing(index_elements=['day', 'hour', 'service_type'])
+        )
+    row = session.query(VisitTimeRollup).filter_by(**keys).with_for_update().populate_existing().first()
+    if row is None:
+        row = VisitTimeRollup(wait_count=0, service_count=0, **keys)
+        session.add(row)
+    return row
+
+
+def apply_observations(session, observations):
+    """
+    Fold (kind, key, start, end, student_id) observations into rollup rows;
+    ``key`` is the queue id of a wait and the appointment id (or None) of a
+    service time.
+    """
+    buckets = defaultdict(lambda: {'wait': [], 'service': [], 'patients': []})
+    service_types = {}
+    for kind, key, start, end, student_id in observations:
+        if (kind, key) not in service_types:
+            lookup = _queue_service_type if kind == 'wait' else _appointment_service_type
+            service_types[kind, key] = lookup(session, key)
+        service_type = service_types[kind, key]
+        local = _local(start)
+        bucket = buckets[(local.date(), local.hour, service_type)]
+        bucket[kind].append(_minutes(start, end))
+        if student_id is not None:
+            bucket['patients'].append(student_id)
+
+    for (day, hour, service_type), values in buckets.items():
+        row = _locked_bucket(session, day, hour, service_type)
+        if values['wait']:
+            sketch = QuantileSketch.from_json(row.wait_sketch)
+            for minutes in values['wait']:
+                sketch.add(minutes)
+            row.wait_sketch = sketch.to_json()
+            row.wait_count = sketch.count
+        if values['service']:
+            sketch = QuantileSketch.from_json(row.service_sketch)
+            for minutes in values['service']:
+                sketch.add(minutes)
+            row.service_sketch = sketch.to_json()
+            row.service_count = sketch.count
+        if values['patients']:
+            counter = DistinctCounter.from_text(row.patients_hll)
+            for student_id in values['patients']:
+                counter.add(student_id)
+            row.patients_hll = counter.to_text()
+
+
+def rebuild_rollups(since=None):
+    """
+    Recompute rollups from the raw queue and logbook tables.
+
+    One-off backfill for history recorded before rollups existed; normal
+    operation keeps rollups current incrementally.
+    """
+    session = db.session
+    query = session.query(VisitTimeRollup)
+    if since:
+        query = query.filter(VisitTimeRollup.day >= since)
+    query.delete(synchronize_session=False)
+
+    waits = session.query(Queue.id, Queue.arrival_time, Queue.served_at).filter(
+        Queue.served_at.isnot(None)
+    )
+    visits = session.query(
+        LogbookEntry.appointment_id, LogbookEntry.check_in_time, LogbookEntry.check_out_time, LogbookEntry.student_id
+    ).filter(LogbookEntry.check_out_time.isnot(None))
+    if since:
+        waits = waits.filter(Queue.arrival_day >= since)
+        visits = visits.filter(LogbookEntry.check_in_day >= since)
+
+    observations = [('wait', qid, arrived, served, None) for qid, arrived, served in waits.yield_per(1000)]
+    observations += [
+        ('service', appointment_id, check_in, check_out, student_id)
+        for appointment_id, check_in, check_out, student_id in visits.yield_per(1000)
+    ]
+    apply_observations(session, observations)
+    session.commit()
+    return len(observations)
+
+
+# ──────────────────────────────────────────────
+#  Range Queries
+# ──────────────────────────────────────────────
+
+def summarize(start, end, group_by=None, service_type=None):
+    """
+    Merge rollups between ``start`` and ``end`` (local days, inclusive).
+
+    group_by: None | 'day' | 'hour' | 'service_type'
+    Returns {group_key: {'wait': QuantileSketch, 'service': QuantileSketch,
+    'patients': DistinctCounter}}; the key is None when group_by is None.
+    """
+    query = VisitTimeRollup.query.filter(
+        VisitTimeRollup.day >= start,
+        VisitTimeRollup.day <= end
+    )
+    if service_type:
+        query = query.filter(VisitTimeRollup.service_type == service_type)
+
+    groups = defaultdict(lambda: {
+        'wait': QuantileSketch(),
+        'service': QuantileSketch(),
+        'patients': DistinctCounter(),
+    })
+    for row in query:
+        group = groups[getattr(row, group_by) if group_by else None]
+        if row.wait_sketch:
+            group['wait'].merge(QuantileSketch.from_json(row.wait_sketch))
+        if row.service_sketch:
+            group['service'].merge(QuantileSketch.from_json(row.service_sketch))
+        if row.patients_hll:
+            group['patients'].merge(DistinctCounter.from_text(row.patients_hll))
+    return groups
+
+
+def describe(group):
+    """JSON-friendly p50/p90 summary of one merged group."""
+    def _q(sketch, q):
+        value = sketch.quantile(q)
+        return round(value, 1) if value is not None else None
+
+    return {
+        'wait_p50': _q(group['wait'], 0.5),
+        'wait_p90': _q(group['wait'], 0.9),
+        'wait_count': group['wait'].count,
+        'service_p50': _q(group['service'], 0.5),
+        'service_p90': _q(group['service'], 0.9),
+        'service_count': group['service'].count,
+        'distinct_patients': group['patients'].estimate(),
+    }